@@ -107,6 +107,10 @@ nag_suppressions = [
             'id': 'AwsSolutions-ECS4',
             'reason': 'The ECS Cluster has CloudWatch Container Insights disabled. This decision is left to customers',
         },
+        {
+            'id': 'AwsSolutions-ECS2',
+            'reason': 'The loader container environment only holds non secret settings like the job ledger table name and the checkpoint switch'
+        },
         {
             'id': 'AwsSolutions-SF2',
             'reason': 'The Step Function does not have X-Ray tracing enabled. This decision is left to customers'
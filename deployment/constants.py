@@ -16,5 +16,15 @@ assets_dir = f"{os.path.dirname(os.path.abspath(__file__))}/../assets"
 sol_id = "SO9463"
 stack_desc = f"Guidance for Implementing Google Privacy Sandbox Key/Value Service on AWS ({sol_id})"
 papi_repo_url = "https://github.com/privacysandbox/protected-auction-key-value-service"
+# mutable image tags, pointers the build moves to the newest content addressed tag after a push
+# content addressed tags are tools-<upstream commit>, awscli-/python-/slim-<upstream commit>-<hash>
+tools_cntr_tag = "tools_binaries_docker_image"
 awscli_cntr_tag = "papi-datacli-with-awscli"
-python_cntr_tag = "papi-datacli-with-python"
\ No newline at end of file
+python_cntr_tag = "papi-datacli-with-python"
+python_slim_cntr_tag = "papi-datacli-with-python-slim"
+content_tag_prefixes = ["tools-", "awscli-", "python-", "slim-"]
+# content addressed images kept per prefix, older ones are expired by the ECR lifecycle policy
+content_tag_keep_count = 10
+# bazel disk cache and toolchain images of the data cli build, kept in the input bucket
+build_cache_prefix = "build-cache"
+build_cache_expiry_days = 30
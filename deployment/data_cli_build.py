@@ -38,6 +38,7 @@ class dataCliBuild(Stack):
         self.s3_url = s3_bucket_url
         # print(self.s3_url)
         self.s3_bucket_arn = s3_bucket_arn
+        self.build_cache_url = f"{self.s3_url}/{constants.build_cache_prefix}"
         # create cloudwatch log group
         self.log_group = logs.LogGroup(self, f"{constants.app_prefix}-data-cli-build-log-group",
                                             log_group_name=f"{constants.app_prefix}-data-cli-build-log-group",
@@ -63,6 +64,11 @@ class dataCliBuild(Stack):
                                         # on destroy the images are not removed by cfn. Either retain the repo
                                         # or delete the images manually
                                         removal_policy=RemovalPolicy.RETAIN_ON_UPDATE_OR_DELETE)
+        # every build of a new upstream commit or Dockerfile change pushes a new content addressed tag
+        for prefix in constants.content_tag_prefixes:
+            self.ecr_repo.add_lifecycle_rule(description=f"keep the last {constants.content_tag_keep_count} {prefix} images",
+                                             tag_prefix_list=[prefix],
+                                             max_image_count=constants.content_tag_keep_count)
         CfnOutput(self, "ecr_repo_url", value=self.ecr_repo.repository_uri)
 
     # create an ec2 instance that can download the repo and run build commands
@@ -144,6 +150,8 @@ class dataCliBuild(Stack):
                                                                 "DocumentName": "AWS-RunShellScript",
                                                                 "Parameters": {
                                                                     "commands": [f"aws s3 cp {self.s3_url}/papi-data-cli-build.sh /home/ec2-user/data-cli/", 
+                                                                                 f"aws s3 cp {self.s3_url}/papi-build-cache.sh /home/ec2-user/data-cli/",
+                                                                                 f"aws s3 cp {self.s3_url}/papi-image-tags.sh /home/ec2-user/data-cli/",
                                                                                  f"aws s3 cp {self.s3_url}/papi-delta-gen.sh /home/ec2-user/data-cli/",
                                                                                  f"aws s3 cp {self.s3_url}/datacli-w-awscli-docker/Dockerfile /home/ec2-user/data-cli/", 
                                                                                  f"aws s3 cp {self.s3_url}/datacli-w-awscli-docker/papi-delta-filegen-s3.sh /home/ec2-user/data-cli/",
@@ -176,7 +184,7 @@ class dataCliBuild(Stack):
                                                                 "InstanceIds": [self.build_instance.instance_id],
                                                                 "DocumentName": "AWS-RunShellScript",
                                                                 "Parameters": {
-                                                                    "commands": [f"/home/ec2-user/data-cli/papi-data-cli-build.sh {constants.acc} {constants.region}"]
+                                                                    "commands": [f"/home/ec2-user/data-cli/papi-data-cli-build.sh {constants.acc} {constants.region} {self.build_cache_url}"]
                                                                 }
                                                             },
                                                             iam_resources=[f"arn:aws:ssm:{constants.region}::document/AWS-RunShellScript", self.build_instance_arn],
@@ -297,6 +305,12 @@ class dataCliBuild(Stack):
                                                 effect=iam.Effect.ALLOW,
                                                 actions=["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
                                                 resources= s3_res_list
+                                            ),
+                                            # checks whether the content addressed tag of an image is already pushed
+                                            iam.PolicyStatement(
+                                                effect=iam.Effect.ALLOW,
+                                                actions=["ecr:DescribeImages"],
+                                                resources=[self.ecr_repo.repository_arn]
                                             )])
         # iam role
         self.image_builder_role = iam.Role(self, f"{constants.app_prefix}-data-cli-build-role",
@@ -316,7 +330,7 @@ class dataCliBuild(Stack):
         self.component_data_cli_build = imagebuilder.CfnComponent(self, f"{constants.app_prefix}-data-cli-build-cmp",
                                                                 name=f"{constants.app_prefix}-data-cli-build-cmp",
                                                                 platform="Linux",
-                                                                version="1.0.0",
+                                                                version="1.0.2",
                                                                 description="Automates the build of data cli container image",
                                                                 supported_os_versions=["Ubuntu 20","Ubuntu 22"],
                                                                 uri=f"{self.s3_url}/imagebuilder/{constants.app_prefix}-data-cli-build-cmp.yml"
@@ -328,7 +342,7 @@ class dataCliBuild(Stack):
         self.component_aws_data_cli_build = imagebuilder.CfnComponent(self, f"{constants.app_prefix}-aws-data-cli-build-cmp",
                                                                 name=f"{constants.app_prefix}-aws-data-cli-build-cmp",
                                                                 platform="Linux",
-                                                                version="1.0.0",
+                                                                version="1.0.2",
                                                                 description="Automates the build of aws + data cli container image",
                                                                 supported_os_versions=["Ubuntu 20","Ubuntu 22"],
                                                                 uri=f"{self.s3_url}/imagebuilder/{constants.app_prefix}-aws-data-cli-build-cmp.yml"
@@ -336,7 +350,7 @@ class dataCliBuild(Stack):
         self.component_python_data_cli_build = imagebuilder.CfnComponent(self, f"{constants.app_prefix}-python-data-cli-build-cmp",
                                                                 name=f"{constants.app_prefix}-python-data-cli-build-cmp",
                                                                 platform="Linux",
-                                                                version="1.0.0",
+                                                                version="1.0.4",
                                                                 description="Automates the build of Python sdk + data cli container image",
                                                                 supported_os_versions=["Ubuntu 20","Ubuntu 22"],
                                                                 uri=f"{self.s3_url}/imagebuilder/{constants.app_prefix}-python-data-cli-build-cmp.yml"
@@ -374,7 +388,7 @@ class dataCliBuild(Stack):
         self.data_cli_image_recipe = imagebuilder.CfnImageRecipe(self, f"{constants.app_prefix}-data-cli-build-recipe",
                                                         name=f"{constants.app_prefix}-data-cli-build-recipe",
                                                         parent_image=f"arn:aws:imagebuilder:{constants.region}:aws:image/ubuntu-server-22-lts-arm64/x.x.x",
-                                                        version="1.0.0",
+                                                        version="1.0.4",
                                                         components=[{"componentArn": aws_cli_cmp_arn},
                                                                     {"componentArn": dcr_cmp_arn},
                                                                     # dynamically pass the s3 urls when recipe is created
@@ -383,7 +397,13 @@ class dataCliBuild(Stack):
                                                                                     {"name":"awsAccountID",
                                                                                     "value":[constants.acc]},
                                                                                     {"name":"awsRegion",
-                                                                                    "value":[constants.region]}
+                                                                                    "value":[constants.region]},
+                                                                                    {"name":"s3UrlBuildCache",
+                                                                                    "value":[self.build_cache_url]},
+                                                                                    {"name":"s3UrlBuildCacheScript",
+                                                                                    "value":[f"{self.s3_url}/papi-build-cache.sh"]},
+                                                                                    {"name":"s3UrlImageTagsScript",
+                                                                                    "value":[f"{self.s3_url}/papi-image-tags.sh"]}
                                                                                 ]},
                                                                     {"componentArn": self.component_aws_data_cli_build.attr_arn,
                                                                         "parameters":[{"name":"s3UrlDockerFile",
@@ -398,8 +418,12 @@ class dataCliBuild(Stack):
                                                                     {"componentArn": self.component_python_data_cli_build.attr_arn,
                                                                         "parameters":[{"name":"s3UrlDockerFile",
                                                                                     "value":[f"{self.s3_url}/datacli-w-python-docker/Dockerfile"]},
+                                                                                    {"name":"s3UrlSlimDockerFile",
+                                                                                    "value":[f"{self.s3_url}/datacli-w-python-docker/Dockerfile.slim"]},
                                                                                     {"name":"s3UrlEntryPointScript",
                                                                                     "value":[f"{self.s3_url}/datacli-w-python-docker/papi-delta-filegen-s3.py"]},
+                                                                                    {"name":"s3UrlSourceDir",
+                                                                                    "value":[f"{self.s3_url}/datacli-w-python-docker/"]},
                                                                                     {"name":"s3UrlRequirements",
                                                                                     "value":[f"{self.s3_url}/datacli-w-python-docker/requirements.txt"]},
                                                                                     {"name":"awsAccountID",
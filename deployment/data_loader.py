@@ -23,6 +23,8 @@ from aws_cdk import (
     aws_events_targets as targets,
     aws_sqs as sqs,
     aws_s3 as s3,
+    aws_dynamodb as dynamodb,
+    aws_cloudwatch as cloudwatch,
 )
 from aws_solutions_constructs.aws_s3_lambda import S3ToLambda
 from aws_solutions_constructs.aws_lambda_stepfunctions import LambdaToStepfunctions
@@ -53,6 +55,60 @@ class dataLoader(Stack):
             self.input_key = "input"
         # print(f"output key: {self.output_key}")
 
+        # python loader image, "python-slim" selects the startup optimized variant built from Dockerfile.slim
+        loader_image = self.node.try_get_context("loader-image") or "python"
+        if loader_image not in ("python", "python-slim"):
+            raise ValueError("Invalid loader-image, use python or python-slim")
+        self.python_image_tag = constants.python_slim_cntr_tag if loader_image == "python-slim" else constants.python_cntr_tag
+
+        # "spot" runs the ECS loader tasks on Fargate Spot with checkpointing, interrupted tasks are restarted and resume
+        self.loader_capacity = self.node.try_get_context("loader-capacity") or "on-demand"
+        if self.loader_capacity not in ("on-demand", "spot"):
+            raise ValueError("Invalid loader-capacity, use on-demand or spot")
+
+        # "hashed" writes the loader output under hashed staging prefixes first and then copies it to output-key in order
+        self.output_layout = self.node.try_get_context("loader-output-layout") or "direct"
+        if self.output_layout not in ("direct", "hashed"):
+            raise ValueError("Invalid loader-output-layout, use direct or hashed")
+
+        # "xray" sends the loader trace from the S3 event to the published output to AWS X-Ray
+        self.loader_tracing = self.node.try_get_context("loader-tracing") or "off"
+        if self.loader_tracing not in ("off", "xray"):
+            raise ValueError("Invalid loader-tracing, use off or xray")
+        # alarm when the p90 time from an S3 upload to its published DELTA file is above this many seconds
+        self.freshness_slo_seconds = int(self.node.try_get_context("loader-freshness-slo-seconds") or 0)
+
+        # run the expiry sweep every this many minutes, it publishes DELETE mutations for keys whose expiry column passed
+        self.expiry_sweep_minutes = int(self.node.try_get_context("loader-expiry-sweep-minutes") or 0)
+
+        # DynamoDB table papi-ddb-source.py reloads in full, by hand or every loader-source-reload-hours hours
+        self.source_table = self.node.try_get_context("loader-source-table") or ""
+        self.source_reload_hours = int(self.node.try_get_context("loader-source-reload-hours") or 0)
+        if self.source_reload_hours and not self.source_table:
+            raise ValueError("Invalid loader-source-reload-hours, it needs loader-source-table")
+
+        # dynamodb:<stream arn> or kinesis:<stream name>, a service runs papi-cdc-consumer.py to publish its changes as DELTA files
+        self.cdc_stream = self.node.try_get_context("loader-cdc-stream") or ""
+        if self.cdc_stream and self.cdc_stream.partition(":")[0] not in ("dynamodb", "kinesis"):
+            raise ValueError("Invalid loader-cdc-stream, use dynamodb:<stream arn> or kinesis:<stream name>")
+
+        # {region: bucket}, the loader copies every published DELTA file to these buckets and keeps a per region pointer
+        self.replica_buckets = self.node.try_get_context("loader-replica-buckets") or {}
+        if not isinstance(self.replica_buckets, dict) or \
+                not all(isinstance(v, str) and v and "=" not in v and "," not in v for v in self.replica_buckets.values()):
+            raise ValueError("Invalid loader-replica-buckets, use {\"<region>\": \"<bucket>\"}")
+
+        # priority lanes, input prefixes with their own task size started by a dispatcher under global caps, see create_dispatcher
+        self.lanes = self.get_lanes(self.node.try_get_context("loader-lanes") or [])
+        self.max_loader_tasks = int(self.node.try_get_context("loader-max-tasks") or 20)
+        self.max_starts_per_minute = int(self.node.try_get_context("loader-max-starts-per-minute") or 60)
+        # "apply" lets the dispatcher start tasks with the task size and settings papi-loader-tune.py recommends for the input size
+        self.loader_tuning = self.node.try_get_context("loader-tuning") or "off"
+        if self.loader_tuning not in ("off", "apply"):
+            raise ValueError("Invalid loader-tuning, use off or apply")
+        if self.loader_tuning == "apply" and not self.lanes:
+            raise ValueError("Invalid loader-tuning, apply needs loader-lanes, the EventBridge rule starts tasks without the dispatcher")
+
         self.s3_bucket_url = f"s3://{self.inp_bucket_name}"
         # this is default values, actual file name will be picked up from the s3 object create event
         self.s3_object_url = f"{self.s3_bucket_url}/{self.input_key}/data.csv"
@@ -75,6 +131,35 @@ class dataLoader(Stack):
         else:
             raise ValueError("Invalid compute type")
     
+    def get_lanes(self, lanes: list) -> list:
+        """
+        Validates the loader-lanes context and returns the lanes in priority order, lower priority value first
+        """
+        lane_keys = {"name", "prefix", "priority", "cpu", "memory", "max-tasks"}
+        parsed = []
+        for lane in lanes:
+            if not isinstance(lane, dict) or set(lane) - lane_keys or not lane.get("name") or not lane.get("prefix"):
+                raise ValueError(f"Invalid loader-lanes entry {lane}, give name and prefix and optionally priority, cpu, memory, max-tasks")
+            if not lane["name"].isalnum() or len(lane["name"]) > 16:
+                raise ValueError(f"Invalid loader-lanes name {lane['name']}, use up to 16 letters and digits")
+            parsed.append({
+                "name": lane["name"],
+                "prefix": lane["prefix"],
+                "priority": int(lane.get("priority", len(parsed))),
+                "cpu": int(lane.get("cpu", 1024)),
+                "memory": int(lane.get("memory", 2048)),
+                "max_tasks": int(lane.get("max-tasks", 0)),
+            })
+        names = [lane["name"] for lane in parsed]
+        if len(set(names)) != len(names):
+            raise ValueError("Invalid loader-lanes, lane names must be unique")
+        # an object under two lane prefixes would be converted twice
+        for lane in parsed:
+            for other in parsed:
+                if lane is not other and other["prefix"].startswith(lane["prefix"]):
+                    raise ValueError(f"Invalid loader-lanes, prefix {other['prefix']} is under {lane['prefix']}")
+        return sorted(parsed, key=lambda lane: lane["priority"])
+
     def create_all_compute_options(self) -> None:
         """
         Creates all compute options for data cli
@@ -120,6 +205,17 @@ class dataLoader(Stack):
             )
         # Deny non SSL traffic
         self.dead_letter_queue.add_to_resource_policy(self.get_deny_non_ssl_policy(self.dead_letter_queue.queue_arn))
+        if self.expiry_sweep_minutes:
+            self.create_expiry_sweep()
+        if self.source_table:
+            self.create_source_reload()
+        if self.cdc_stream:
+            self.create_cdc_consumer()
+        if self.lanes:
+            self.create_dispatcher()
+            if self.loader_capacity == "spot":
+                self.create_spot_resume()
+            return
         # assumes that the files will have .csv extension
         event_pattern_detail = {
                             "bucket": {
@@ -143,6 +239,8 @@ class dataLoader(Stack):
                                     task_definition=self.python_task_definition, 
                                     launch_type=ecs.LaunchType.FARGATE,
                                     dead_letter_queue=self.dead_letter_queue,
+                                    subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
+                                    security_groups=[self.loader_security_group],
                                     container_overrides=[targets.ContainerOverride(
                                         # change here to switch between awscli and python
                                         container_name=f"{constants.app_prefix}-python-cnt",
@@ -152,22 +250,310 @@ class dataLoader(Stack):
                                             {"name": "INP_KEY", "value": events.EventField.from_path("$.detail.object.key")},
                                             {"name": "OUT_BUCKET", "value": self.output_bucket_name},
                                             {"name": "OUT_KEY", "value": self.output_key},
+                                            # trace id and data freshness of the run start from the event
+                                            {"name": "EVENT_TIME", "value": events.EventField.time},
+                                            {"name": "EVENT_ID", "value": events.EventField.event_id},
                                             ],
                                         )],
                                     )
                                 )
         
+        if self.loader_capacity == "spot":
+            # the EcsTask target has no capacity provider strategy, it replaces the launch type on the L1 target
+            cfn_rule = self.eb_rule.node.default_child
+            cfn_rule.add_property_override("Targets.0.EcsParameters.CapacityProviderStrategy",
+                                           [{"CapacityProvider": "FARGATE_SPOT", "Weight": 1}])
+            cfn_rule.add_property_deletion_override("Targets.0.EcsParameters.LaunchType")
+            self.create_spot_resume()
+
         CfnOutput(self, "Event_Bridge_Rule", value=self.eb_rule.rule_arn)
 
+    def create_expiry_sweep(self) -> None:
+        """
+        Runs papi-expiry-sweep.py with the loader image on a schedule, see source/datacli-w-python-docker/expiry.py
+        """
+        # the sweep deletes the pending expiry entries it merged in to the index
+        self.python_task_definition.add_to_task_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["s3:DeleteObject"],
+            resources=[f"arn:aws:s3:::{self.output_bucket_name}/expiry/pending/*"],
+        ))
+        rule = events.Rule(self, f"{constants.app_prefix}-expiry-sweep-schedule",
+                           schedule=events.Schedule.rate(Duration.minutes(self.expiry_sweep_minutes)),
+                           targets=[targets.EcsTask(cluster=self.cluster,
+                                                    task_definition=self.python_task_definition,
+                                                    launch_type=ecs.LaunchType.FARGATE,
+                                                    dead_letter_queue=self.dead_letter_queue,
+                                                    subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
+                                                    security_groups=[self.loader_security_group],
+                                                    container_overrides=[targets.ContainerOverride(
+                                                        container_name=f"{constants.app_prefix}-python-cnt",
+                                                        command=["/app/papi-expiry-sweep.py"],
+                                                        environment=[
+                                                            {"name": "OUT_BUCKET", "value": self.output_bucket_name},
+                                                            {"name": "OUT_KEY", "value": self.output_key},
+                                                        ],
+                                                    )],
+                                                    )],
+                           )
+        CfnOutput(self, "Expiry_Sweep_Rule", value=rule.rule_arn)
+
+    def create_source_reload(self) -> None:
+        """
+        Lets the loader task scan loader-source-table with papi-ddb-source.py, see source/datacli-w-python-docker/ddb_source.py
+        """
+        self.python_task_definition.add_to_task_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["dynamodb:Scan", "dynamodb:DescribeTable"],
+            resources=[f"arn:aws:dynamodb:{constants.region}:{constants.acc}:table/{self.source_table}"],
+        ))
+        if not self.source_reload_hours:
+            return
+        rule = events.Rule(self, f"{constants.app_prefix}-source-reload-schedule",
+                           schedule=events.Schedule.rate(Duration.hours(self.source_reload_hours)),
+                           targets=[targets.EcsTask(cluster=self.cluster,
+                                                    task_definition=self.python_task_definition,
+                                                    launch_type=ecs.LaunchType.FARGATE,
+                                                    dead_letter_queue=self.dead_letter_queue,
+                                                    subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
+                                                    security_groups=[self.loader_security_group],
+                                                    container_overrides=[targets.ContainerOverride(
+                                                        container_name=f"{constants.app_prefix}-python-cnt",
+                                                        command=["/app/papi-ddb-source.py"],
+                                                        environment=[
+                                                            {"name": "OUT_BUCKET", "value": self.output_bucket_name},
+                                                            {"name": "OUT_KEY", "value": self.output_key},
+                                                        ],
+                                                    )],
+                                                    )],
+                           )
+        CfnOutput(self, "Source_Reload_Rule", value=rule.rule_arn)
+
+    def create_cdc_consumer(self) -> None:
+        """
+        Runs papi-cdc-consumer.py as a service of one task, see source/datacli-w-python-docker/cdc_source.py
+        """
+        kind, _, name = self.cdc_stream.partition(":")
+        task_definition = self.create_python_container("cdc", command=["/app/papi-cdc-consumer.py"],
+                                                       environment={"CDC_STREAM": self.cdc_stream,
+                                                                    "OUT_BUCKET": self.output_bucket_name,
+                                                                    "OUT_KEY": self.output_key})
+        if kind == "dynamodb":
+            actions = ["dynamodb:DescribeStream", "dynamodb:GetShardIterator", "dynamodb:GetRecords"]
+            resources = [name]
+        else:
+            actions = ["kinesis:DescribeStream", "kinesis:DescribeStreamSummary", "kinesis:ListShards",
+                       "kinesis:GetShardIterator", "kinesis:GetRecords"]
+            resources = [f"arn:aws:kinesis:{constants.region}:{constants.acc}:stream/{name}"]
+        task_definition.add_to_task_role_policy(iam.PolicyStatement(effect=iam.Effect.ALLOW, actions=actions, resources=resources))
+        # one consumer at a time owns the checkpoint, a deployment stops the old task before it starts the new one
+        service = ecs.FargateService(self, f"{constants.app_prefix}-cdc-svc",
+                                     cluster=self.cluster,
+                                     task_definition=task_definition,
+                                     desired_count=1,
+                                     min_healthy_percent=0,
+                                     max_healthy_percent=100,
+                                     vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
+                                     security_groups=[self.loader_security_group],
+                                     )
+        CfnOutput(self, "CDC_Consumer_Service", value=service.service_name)
+
+    def create_dispatcher(self) -> None:
+        """
+        Routes the prefix of every loader lane to its own SQS queue, a dispatcher function starts the loader tasks
+        from the queues in priority order, within loader-max-tasks running tasks and loader-max-starts-per-minute
+        """
+        lanes_env = []
+        for lane in self.lanes:
+            queue = sqs.Queue(self, f"{constants.app_prefix}-lane-{lane['name']}-queue",
+                              queue_name=f"{constants.app_prefix}-lane-{lane['name']}-queue",
+                              retention_period=Duration.days(4),
+                              # a message whose task did not start is retried after this
+                              visibility_timeout=Duration.seconds(60),
+                              encryption=sqs.QueueEncryption.SQS_MANAGED,
+                              dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=self.dead_letter_queue),
+                              )
+            queue.add_to_resource_policy(self.get_deny_non_ssl_policy(queue.queue_arn))
+            events.Rule(self, f"{constants.app_prefix}-lane-{lane['name']}-rule",
+                        rule_name=f"{constants.app_prefix}-lane-{lane['name']}-rule",
+                        event_pattern=events.EventPattern(
+                            source=["aws.s3"],
+                            detail_type=["Object Created"],
+                            detail={
+                                "bucket": {"name": [self.inp_bucket_name]},
+                                "object": {"key": [{"wildcard": f"{lane['prefix']}*.csv"}]},
+                            },
+                        ),
+                        targets=[targets.SqsQueue(queue, dead_letter_queue=self.dead_letter_queue)],
+                        )
+            task_definition = self.lane_task_definitions[lane["name"]]
+            lanes_env.append({"name": lane["name"], "queue_url": queue.queue_url, "max_tasks": lane["max_tasks"],
+                              "task_definition": task_definition.task_definition_arn, "family": task_definition.family})
+            lane["queue"] = queue
+
+        # task starts per minute window, shared by the invocations of the dispatcher
+        self.dispatch_table = dynamodb.Table(self, f"{constants.app_prefix}-loader-dispatch",
+                                             partition_key=dynamodb.Attribute(name="window", type=dynamodb.AttributeType.STRING),
+                                             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                             point_in_time_recovery=True,
+                                             time_to_live_attribute="expires_at",
+                                             removal_policy=RemovalPolicy.DESTROY,
+                                             )
+        subnets = self.vpc.select_subnets(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS).subnet_ids
+        self.dispatch_function = _lambda.Function(self, f"{constants.app_prefix}-loader-dispatch-fn",
+                                                  runtime=_lambda.Runtime.PYTHON_3_11,
+                                                  handler="index.lambda_handler",
+                                                  code=_lambda.Code.from_asset("source/_lambda_dispatch", exclude=["papi-*"]),
+                                                  timeout=Duration.seconds(75),
+                                                  # one dispatcher at a time, an overlapping scheduled run is dropped
+                                                  reserved_concurrent_executions=1,
+                                                  retry_attempts=0,
+                                                  environment={
+                                                      "CLUSTER_ARN": self.cluster.cluster_arn,
+                                                      "SUBNETS": ",".join(subnets),
+                                                      "SECURITY_GROUPS": self.loader_security_group.security_group_id,
+                                                      "CONTAINER_NAME": f"{constants.app_prefix}-python-cnt",
+                                                      "OUT_BUCKET": self.output_bucket_name,
+                                                      "OUT_KEY": self.output_key,
+                                                      "LANES": self.to_json_string(lanes_env),
+                                                      "MAX_TASKS": str(self.max_loader_tasks),
+                                                      "MAX_STARTS_PER_MINUTE": str(self.max_starts_per_minute),
+                                                      "DISPATCH_TABLE": self.dispatch_table.table_name,
+                                                      "CAPACITY_PROVIDER": "FARGATE_SPOT" if self.loader_capacity == "spot" else "FARGATE",
+                                                      **({"TUNING_BUCKET": self.output_bucket_name, "TUNING_KEY": "tuning/recommendations.json"}
+                                                         if self.loader_tuning == "apply" else {}),
+                                                  },
+                                                  )
+        self.dispatch_table.grant_read_write_data(self.dispatch_function)
+        if self.loader_tuning == "apply":
+            self.dispatch_function.add_to_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:GetObject"],
+                resources=[f"arn:aws:s3:::{self.output_bucket_name}/tuning/recommendations.json"],
+            ))
+        task_definitions = list(self.lane_task_definitions.values())
+        for lane in self.lanes:
+            lane["queue"].grant_consume_messages(self.dispatch_function)
+        self.dispatch_function.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ecs:RunTask"],
+            resources=[f"arn:aws:ecs:{self.region}:{self.account}:task-definition/{task_definition.family}:*"
+                       for task_definition in task_definitions],
+            conditions={"ArnEquals": {"ecs:cluster": self.cluster.cluster_arn}},
+        ))
+        self.dispatch_function.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ecs:ListTasks"],
+            resources=["*"],
+            conditions={"ArnEquals": {"ecs:cluster": self.cluster.cluster_arn}},
+        ))
+        self.dispatch_function.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["iam:PassRole"],
+            resources=[role.role_arn for task_definition in task_definitions
+                       for role in (task_definition.task_role, task_definition.execution_role)],
+        ))
+        events.Rule(self, f"{constants.app_prefix}-loader-dispatch-schedule",
+                    schedule=events.Schedule.rate(Duration.minutes(1)),
+                    targets=[targets.LambdaFunction(self.dispatch_function, retry_attempts=0)],
+                    )
+        CfnOutput(self, "Loader_Dispatcher", value=self.dispatch_function.function_name)
+
+    def create_spot_resume(self) -> None:
+        """
+        Restarts loader tasks stopped by a Spot interruption, the new task resumes from the checkpoint
+        """
+        subnets = self.vpc.select_subnets(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS).subnet_ids
+        task_definitions = [self.python_task_definition, *self.lane_task_definitions.values()]
+        self.resume_function = _lambda.Function(self, f"{constants.app_prefix}-loader-resume-fn",
+                                                runtime=_lambda.Runtime.PYTHON_3_11,
+                                                handler="index.lambda_handler",
+                                                code=_lambda.Code.from_asset("source/_lambda_resume"),
+                                                timeout=Duration.seconds(30),
+                                                environment={
+                                                    "CLUSTER_ARN": self.cluster.cluster_arn,
+                                                    "SUBNETS": ",".join(subnets),
+                                                    "SECURITY_GROUPS": self.loader_security_group.security_group_id,
+                                                    "CONTAINER_NAME": f"{constants.app_prefix}-python-cnt",
+                                                },
+                                                )
+        self.resume_function.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ecs:RunTask"],
+            resources=[f"arn:aws:ecs:{self.region}:{self.account}:task-definition/{task_definition.family}:*"
+                       for task_definition in task_definitions],
+            conditions={"ArnEquals": {"ecs:cluster": self.cluster.cluster_arn}},
+        ))
+        self.resume_function.add_to_role_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["iam:PassRole"],
+            resources=[role.role_arn for task_definition in task_definitions
+                       for role in (task_definition.task_role, task_definition.execution_role)],
+        ))
+        events.Rule(self, f"{constants.app_prefix}-loader-spot-stop-rule",
+                    event_pattern=events.EventPattern(
+                        source=["aws.ecs"],
+                        detail_type=["ECS Task State Change"],
+                        detail={
+                            "clusterArn": [self.cluster.cluster_arn],
+                            "group": [f"family:{task_definition.family}" for task_definition in task_definitions],
+                            "lastStatus": ["STOPPED"],
+                            "stopCode": ["SpotInterruption"],
+                        },
+                    ),
+                    targets=[targets.LambdaFunction(self.resume_function, dead_letter_queue=self.dead_letter_queue)],
+                    )
+
     def create_ecs_compute(self) -> None:
         # log driver
         self.data_loader_log_group = logs.LogGroup(self, f"{constants.app_prefix}-data-loader-ecs-lg",removal_policy=RemovalPolicy.DESTROY, log_group_name=f"{constants.app_prefix}-data-loader-ecs-lg")
         self.data_loader_log_driver = ecs.AwsLogDriver(stream_prefix=f"{constants.app_prefix}-data-loader-ecs-ld", log_group=self.data_loader_log_group)
 
         self.cluster = ecs.Cluster(self, "cluster", vpc=self.vpc)
+        # job ledger, the python loader claims each input object version here so duplicate S3 events exit early
+        self.job_ledger_table = dynamodb.Table(self, f"{constants.app_prefix}-loader-jobs",
+                                               table_name=f"{constants.app_prefix}-loader-jobs",
+                                               partition_key=dynamodb.Attribute(name="job_id", type=dynamodb.AttributeType.STRING),
+                                               billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                               point_in_time_recovery=True,
+                                               time_to_live_attribute="expires_at",
+                                               removal_policy=RemovalPolicy.DESTROY,
+                                               )
+        CfnOutput(self, "Job_Ledger_Table", value=self.job_ledger_table.table_name)
+        self.create_freshness_metric()
+        # loader tasks only make outbound calls to S3 and ECR
+        self.loader_security_group = ec2.SecurityGroup(self, f"{constants.app_prefix}-loader-sg", vpc=self.vpc,
+                                                       description="data loader ECS tasks", allow_all_outbound=True)
+        if self.loader_capacity == "spot":
+            self.cluster.enable_fargate_capacity_providers()
         self.create_awscli_container()
         self.create_python_container()
+        self.lane_task_definitions = {lane["name"]: self.create_python_container(lane["name"], lane["cpu"], lane["memory"])
+                                      for lane in self.lanes}
     
+    def create_freshness_metric(self) -> None:
+        # the python loader logs {"FreshnessSeconds": ...} when the output of an S3 event is published, see tracing.py
+        metric_filter = logs.MetricFilter(self, f"{constants.app_prefix}-loader-freshness-mf",
+                                          log_group=self.data_loader_log_group,
+                                          filter_pattern=logs.FilterPattern.exists("$.FreshnessSeconds"),
+                                          metric_namespace=f"{constants.app_prefix}-loader",
+                                          metric_name="FreshnessSeconds",
+                                          metric_value="$.FreshnessSeconds",
+                                          unit=cloudwatch.Unit.SECONDS,
+                                          )
+        if self.freshness_slo_seconds:
+            alarm = cloudwatch.Alarm(self, f"{constants.app_prefix}-loader-freshness-alarm",
+                                     metric=metric_filter.metric(statistic="p90", period=Duration.minutes(5)),
+                                     threshold=self.freshness_slo_seconds,
+                                     evaluation_periods=3,
+                                     datapoints_to_alarm=2,
+                                     comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                                     # no uploads is no breach
+                                     treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                                     alarm_description=f"p90 upload to published DELTA file above {self.freshness_slo_seconds}s",
+                                     )
+            CfnOutput(self, "Loader_Freshness_Alarm", value=alarm.alarm_name)
+
     def create_awscli_container(self):
         # create ecs container definition, task definition and cluster
         self.awscli_task_definition = ecs.FargateTaskDefinition(self, f"{constants.app_prefix}-awscli-tsk-def",
@@ -205,16 +591,20 @@ class dataLoader(Stack):
                                                               container_name=f"{constants.app_prefix}-awscli-cnt"
                                                             )
     
-    def create_python_container(self):
+    def create_python_container(self, lane: str = "", cpu: int = 1024, memory: int = 2048,
+                                command: list = None, environment: dict = None) -> ecs.FargateTaskDefinition:
         # create ecs container definition, task definition and cluster
-        self.python_task_definition = ecs.FargateTaskDefinition(self, f"{constants.app_prefix}-python-tsk-def",
-                                                    cpu=1024,
-                                                    memory_limit_mib=2048,
+        # a lane gets its own task definition with the lane task size, see create_dispatcher
+        # a service gets its own task definition with its command and environment, see create_cdc_consumer
+        name = f"python-{lane}" if lane else "python"
+        task_definition = ecs.FargateTaskDefinition(self, f"{constants.app_prefix}-{name}-tsk-def",
+                                                    cpu=cpu,
+                                                    memory_limit_mib=memory,
                                                     runtime_platform=ecs.RuntimePlatform(
                                                         cpu_architecture=ecs.CpuArchitecture.ARM64,
                                                         operating_system_family=ecs.OperatingSystemFamily.LINUX
                                                     ),
-                                                    family=f"{constants.app_prefix}-python-tsk-def-family"
+                                                    family=f"{constants.app_prefix}-{name}-tsk-def-family"
                                                     )
         # give S3 bucket read and write access to execution role policy
         # NOTE: Below construct will include the task definition version on the role.
@@ -223,25 +613,69 @@ class dataLoader(Stack):
                        f"arn:aws:s3:::{self.inp_bucket_name}/*",
                        f"arn:aws:s3:::{self.output_bucket_name}",
                        f"arn:aws:s3:::{self.output_bucket_name}/*"]
-        self.python_task_definition.add_to_execution_role_policy(iam.PolicyStatement(
+        task_definition.add_to_execution_role_policy(iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
             actions=["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
             resources= s3_res_list
         ))
-        self.python_task_definition.add_to_task_role_policy(iam.PolicyStatement(
+        task_definition.add_to_task_role_policy(iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
             actions=["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
             resources=s3_res_list
         ))
-        self.python_container_definition = ecs.ContainerDefinition(self, f"{constants.app_prefix}-python-cnt-def",
-                                                              image=ecs.ContainerImage.from_ecr_repository(repository=self.ecr_repo, tag=constants.python_cntr_tag),
-                                                              task_definition=self.python_task_definition,
-                                                              cpu=1024,
-                                                              memory_limit_mib=2048,
+        self.job_ledger_table.grant_read_write_data(task_definition.task_role)
+        spot = self.loader_capacity == "spot"
+        hashed = self.output_layout == "hashed"
+        xray = self.loader_tracing == "xray"
+        if spot or hashed:
+            # checkpoint object cleanup, multipart uploads resumed or discarded by the loader and published staging objects
+            task_definition.add_to_task_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:DeleteObject", "s3:AbortMultipartUpload", "s3:ListMultipartUploadParts"],
+                resources=s3_res_list
+            ))
+        if self.replica_buckets:
+            # copies of the DELTA files and the pointer object, read back before it is advanced
+            task_definition.add_to_task_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
+                resources=[arn for bucket in self.replica_buckets.values()
+                           for arn in (f"arn:aws:s3:::{bucket}", f"arn:aws:s3:::{bucket}/*")]
+            ))
+        if xray:
+            task_definition.add_to_task_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["xray:PutTraceSegments"],
+                resources=["*"]
+            ))
+        container_definition = ecs.ContainerDefinition(self, f"{constants.app_prefix}-{name}-cnt-def",
+                                                              image=ecs.ContainerImage.from_ecr_repository(repository=self.ecr_repo, tag=self.python_image_tag),
+                                                              task_definition=task_definition,
+                                                              cpu=cpu,
+                                                              memory_limit_mib=memory,
                                                               logging=self.data_loader_log_driver,
-                                                              container_name=f"{constants.app_prefix}-python-cnt"
+                                                              container_name=f"{constants.app_prefix}-python-cnt",
+                                                              environment={"LEDGER_TABLE": self.job_ledger_table.table_name,
+                                                                           # recorded in the job history for papi-loader-tune.py
+                                                                           "TASK_CPU": str(cpu),
+                                                                           "TASK_MEMORY": str(memory),
+                                                                           **({"CHECKPOINT": "1"} if spot else {}),
+                                                                           **({"OUTPUT_LAYOUT": "hashed"} if hashed else {}),
+                                                                           **({"TRACE_EXPORTER": "xray"} if xray else {}),
+                                                                           **({"SOURCE_TABLE": self.source_table} if self.source_table else {}),
+                                                                           **({"REPLICA_BUCKETS": ",".join(f"{region}={bucket}" for region, bucket
+                                                                                                           in sorted(self.replica_buckets.items()))}
+                                                                              if self.replica_buckets else {}),
+                                                                           **(environment or {})},
+                                                              command=command,
+                                                              # Spot gives 2 minutes between SIGTERM and the stop, a service publishes its buffer in that time
+                                                              stop_timeout=Duration.seconds(120) if spot or command else None,
                                                             )
-    
+        if not lane:
+            self.python_task_definition = task_definition
+            self.python_container_definition = container_definition
+        return task_definition
+
     def create_ecs_sm_def(self) -> None:
     # stepfunction task to run ECS task
     # creating a function to keep it flexible to go back and forth between ecs and ec2 based compute
@@ -11,7 +11,8 @@ from aws_cdk import (
     aws_s3 as s3,
     aws_s3_deployment as s3_deployment,
     RemovalPolicy,
-    CfnOutput
+    CfnOutput,
+    Duration
 )
 
 from constructs import Construct
@@ -41,14 +42,19 @@ class s3Buckets(Stack):
                                          enforce_ssl=True, auto_delete_objects=True, 
                                          removal_policy=RemovalPolicy.DESTROY,
                                          server_access_logs_bucket=access_log_bucket,
-                                         event_bridge_enabled=True)
+                                         event_bridge_enabled=True,
+                                         # a cache tarball is written per upstream commit, latest.tar.gz is rewritten by every build
+                                         lifecycle_rules=[s3.LifecycleRule(prefix=f"{constants.build_cache_prefix}/",
+                                                                           expiration=Duration.days(constants.build_cache_expiry_days))])
         
         # upload source code to the data bucket from source dir
         s3_deployment.BucketDeployment(self, f"{input_bucket_pfx}-source-deployment",
                                                                       destination_bucket=self.input_bucket,
                                                                       # destination_key_prefix="source",
                                                                       sources=[s3_deployment.Source.asset(constants.source_dir), 
-                                                                               s3_deployment.Source.asset(constants.assets_dir)])
+                                                                               s3_deployment.Source.asset(constants.assets_dir)],
+                                                                      # keep the build cache across deployments
+                                                                      exclude=[f"{constants.build_cache_prefix}/*"])
 
         # build output-bucket resource based on inputs
         if self.node.try_get_context('output-bucket-name'):
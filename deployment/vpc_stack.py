@@ -15,6 +15,9 @@ from aws_cdk import (
 from constructs import Construct
 from deployment import constants
 
+# high-throughput profile: every AZ takes a /20 private and a /24 public subnet of the 10.0.0.0/16 VPC
+MAX_AZS_RANGE = range(2, 7)
+
 class vpcStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -25,12 +28,25 @@ class vpcStack(Stack):
             self.vpc = ec2.Vpc.from_lookup(self, f"{constants.app_prefix}-vpc", vpc_id=vpc_id)
         else:
         # Create VPC
+            # standard profile: 2 AZs sharing one NAT gateway
+            # high-throughput profile: one NAT gateway per AZ, more AZs and larger private subnets for big loader fan-outs
+            profile = self.node.try_get_context("vpc-profile") or "standard"
+            max_azs_context = self.node.try_get_context("vpc-max-azs")
+            if profile == "standard":
+                if max_azs_context is not None:
+                    raise ValueError("Invalid vpc-max-azs, it is only used with vpc-profile high-throughput")
+                max_azs, nat_gateways, private_cidr_mask = 2, 1, 24
+            elif profile == "high-throughput":
+                max_azs = self.get_max_azs(max_azs_context)
+                nat_gateways, private_cidr_mask = max_azs, 20
+            else:
+                raise ValueError("Invalid vpc profile")
             self.vpc = ec2.Vpc(
                 self,
                 f"{constants.app_prefix}-vpc",
                 ip_addresses=ec2.IpAddresses.cidr("10.0.0.0/16"),
-                max_azs=2,
-                nat_gateways=1,
+                max_azs=max_azs,
+                nat_gateways=nat_gateways,
                 subnet_configuration=[
                     ec2.SubnetConfiguration(
                         subnet_type=ec2.SubnetType.PUBLIC,
@@ -40,7 +56,7 @@ class vpcStack(Stack):
                         ec2.SubnetConfiguration(
                             subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS,
                             name=f"{constants.app_prefix}-Private-subnet",
-                            cidr_mask=24
+                            cidr_mask=private_cidr_mask
                             )],
                 vpc_name=f"{constants.app_prefix}-vpc"
                 )
@@ -82,4 +98,42 @@ class vpcStack(Stack):
                 service=ec2.InterfaceVpcEndpointAwsService.STEP_FUNCTIONS,
                 subnets=subnet_sel
             )
-        CfnOutput(self, "vpc_id", value=self.vpc.vpc_id)
\ No newline at end of file
+            if profile == "high-throughput":
+                self.add_loader_endpoints(subnet_sel)
+        CfnOutput(self, "vpc_id", value=self.vpc.vpc_id)
+
+    def get_max_azs(self, value) -> int:
+        # -c vpc-max-azs=3 comes as a string, cdk.json as a number
+        if value is None:
+            return 3
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int) or value not in MAX_AZS_RANGE:
+            raise ValueError(f"Invalid vpc-max-azs {value!r}, use an integer from {MAX_AZS_RANGE.start} to {MAX_AZS_RANGE.stop - 1}")
+        return value
+
+    def add_loader_endpoints(self, subnet_sel: ec2.SubnetSelection) -> None:
+        """
+        Adds the remaining endpoints used by loader tasks, so image pulls, log shipping and ECS calls
+        stay in the AZ of the task instead of going through the NAT gateways
+        ECS agent and telemetry endpoints are left out, only EC2 container instances call them, not Fargate tasks
+        """
+        # image manifests and auth tokens come from the ECR API, layers from ECR_DOCKER and S3
+        interface_services = {
+            "ecr-api": ec2.InterfaceVpcEndpointAwsService.ECR,
+            "logs": ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_LOGS,
+            "ecs": ec2.InterfaceVpcEndpointAwsService.ECS,
+            "sts": ec2.InterfaceVpcEndpointAwsService.STS,
+        }
+        for name, service in interface_services.items():
+            self.vpc.add_interface_endpoint(
+                id=f"{constants.app_prefix}-{name}-vpc-endpoint",
+                service=service,
+                subnets=subnet_sel
+            )
+        # gateway endpoints have no hourly cost
+        self.vpc.add_gateway_endpoint(
+            id=f"{constants.app_prefix}-dynamodb-vpc-endpoint",
+            service=ec2.GatewayVpcEndpointAwsService.DYNAMODB,
+            subnets=[subnet_sel]
+        )
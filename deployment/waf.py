@@ -6,12 +6,21 @@
 # specific language governing permissions and limitations under the License.
 
 # This creates a AWS WAFv2 ACL resource with managed rules 
+# Rate based rules are read from the waf-rate-limits cdk context, see README.md for the format
 from aws_cdk import (
     Stack,
     aws_wafv2 as wafv2,
 )
 from constructs import Construct
 
+# used when waf-rate-limits is not in the cdk context
+DEFAULT_RATE_LIMITS = [{"name": "LimitRequests100", "limit": 100, "aggregate": "ip"}]
+EVALUATION_WINDOWS = [60, 120, 300, 600]
+# WAFv2 rate based statement limits
+MIN_RATE_LIMIT = 10
+MAX_RATE_LIMIT = 2_000_000
+# rate rules take the priorities between GeoMatch (0) and the managed rule groups (10+)
+MAX_RATE_LIMIT_RULES = 9
 
 class Waf(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -126,22 +135,7 @@ class Waf(Stack):
         )
         rules.append(rule_geo_match)
 
-        rule_limit_requests_100 = wafv2.CfnWebACL.RuleProperty(
-            name="LimitRequests100",
-            priority=1,
-            action=wafv2.CfnWebACL.RuleActionProperty(block={}),
-            statement=wafv2.CfnWebACL.StatementProperty(
-                rate_based_statement=wafv2.CfnWebACL.RateBasedStatementProperty(
-                    limit=100, aggregate_key_type="IP"
-                )
-            ),
-            visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
-                cloud_watch_metrics_enabled=True,
-                metric_name="LimitRequests100",
-                sampled_requests_enabled=True,
-            ),
-        )
-        rules.append(rule_limit_requests_100)
+        rules.extend(self.rate_limit_rules())
 
         rule_chrome_user_agent = wafv2.CfnWebACL.RuleProperty(
             name="ChromeUserAgent",
@@ -171,3 +165,140 @@ class Waf(Stack):
         rules.append(rule_chrome_user_agent)
 
         return rules
+
+    def rate_limit_rules(self) -> list:
+        """
+        Builds the rate based rules from the waf-rate-limits context
+        Callers in waf-rate-limit-allow-list are left out of every rule through the scope down statement
+        """
+        rate_limits = self.node.try_get_context("waf-rate-limits") or DEFAULT_RATE_LIMITS
+        if len(rate_limits) > MAX_RATE_LIMIT_RULES:
+            raise ValueError(f"At most {MAX_RATE_LIMIT_RULES} waf-rate-limits rules are supported")
+        allow_list = self.trusted_callers_statement(self.node.try_get_context("waf-rate-limit-allow-list") or {})
+
+        rules = list()
+        for priority, r in enumerate(rate_limits, start=1):
+            limit = r.get("limit")
+            if isinstance(limit, bool) or not isinstance(limit, int) or not MIN_RATE_LIMIT <= limit <= MAX_RATE_LIMIT:
+                raise ValueError(f"Invalid limit {limit!r} for rate limit {r.get('name')}, "
+                                 f"use an integer from {MIN_RATE_LIMIT} to {MAX_RATE_LIMIT}")
+            window = r.get("window")
+            if window is not None and window not in EVALUATION_WINDOWS:
+                raise ValueError(f"Invalid window {window} for rate limit {r['name']}, use one of {EVALUATION_WINDOWS}")
+            action = r.get("action", "block")
+            if action not in ("block", "count"):
+                raise ValueError(f"Invalid action {action} for rate limit {r['name']}, use block or count")
+            forwarded_ip_header = r.get("forwarded-ip-header", "X-Forwarded-For")
+            aggregate = r.get("aggregate", "ip")
+            custom_keys = None
+            if isinstance(aggregate, list):
+                aggregate_key_type = "CUSTOM_KEYS"
+                custom_keys = [self.rate_limit_custom_key(k) for k in aggregate]
+            elif aggregate in ("ip", "forwarded-ip", "constant"):
+                aggregate_key_type = aggregate.upper().replace("-", "_")
+            else:
+                raise ValueError(f"Invalid aggregate {aggregate} for rate limit {r['name']}")
+            uses_forwarded_ip = aggregate == "forwarded-ip" or (isinstance(aggregate, list) and "forwarded-ip" in aggregate)
+
+            scope_down = [s for s in [self.path_statement(r.get("paths", [])),
+                                      allow_list if r.get("exempt-allow-list", True) else None] if s]
+            if aggregate == "constant" and not scope_down:
+                raise ValueError(f"Rate limit {r['name']} aggregates on constant and needs paths to scope it down")
+            if len(scope_down) > 1:
+                scope_down_statement = wafv2.CfnWebACL.StatementProperty(
+                    and_statement=wafv2.CfnWebACL.AndStatementProperty(statements=scope_down))
+            else:
+                scope_down_statement = scope_down[0] if scope_down else None
+
+            rules.append(wafv2.CfnWebACL.RuleProperty(
+                name=r["name"],
+                priority=priority,
+                action=wafv2.CfnWebACL.RuleActionProperty(**{action: {}}),
+                statement=wafv2.CfnWebACL.StatementProperty(
+                    rate_based_statement=wafv2.CfnWebACL.RateBasedStatementProperty(
+                        limit=limit,
+                        aggregate_key_type=aggregate_key_type,
+                        custom_keys=custom_keys,
+                        evaluation_window_sec=window,
+                        forwarded_ip_config=wafv2.CfnWebACL.ForwardedIPConfigurationProperty(
+                            header_name=forwarded_ip_header, fallback_behavior=r.get("forwarded-ip-fallback", "NO_MATCH")
+                        ) if uses_forwarded_ip else None,
+                        scope_down_statement=scope_down_statement,
+                    )
+                ),
+                visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
+                    cloud_watch_metrics_enabled=True,
+                    metric_name=r["name"],
+                    sampled_requests_enabled=True,
+                ),
+            ))
+        return rules
+
+    def rate_limit_custom_key(self, key: str):
+        """
+        Maps ip, forwarded-ip, http-method, uri-path, header:<name> and query-arg:<name> to a custom aggregation key
+        """
+        no_transform = [wafv2.CfnWebACL.TextTransformationProperty(priority=0, type="NONE")]
+        kind, _, name = key.partition(":")
+        if kind == "ip":
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(ip={})
+        if kind == "forwarded-ip":
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(forwarded_ip={})
+        if kind == "http-method":
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(http_method={})
+        if kind == "uri-path":
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(
+                uri_path=wafv2.CfnWebACL.RateLimitUriPathProperty(text_transformations=no_transform))
+        if kind == "header" and name:
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(
+                header=wafv2.CfnWebACL.RateLimitHeaderProperty(name=name, text_transformations=no_transform))
+        if kind == "query-arg" and name:
+            return wafv2.CfnWebACL.RateBasedStatementCustomKeyProperty(
+                query_argument=wafv2.CfnWebACL.RateLimitQueryArgumentProperty(name=name, text_transformations=no_transform))
+        raise ValueError(f"Invalid rate limit aggregation key {key}")
+
+    def path_statement(self, paths: list):
+        """
+        Matches requests whose uri path starts with one of the paths, None when no paths are given
+        """
+        statements = [wafv2.CfnWebACL.StatementProperty(
+            byte_match_statement=wafv2.CfnWebACL.ByteMatchStatementProperty(
+                field_to_match=wafv2.CfnWebACL.FieldToMatchProperty(uri_path={}),
+                positional_constraint="STARTS_WITH",
+                search_string=path,
+                text_transformations=[wafv2.CfnWebACL.TextTransformationProperty(priority=0, type="NONE")],
+            )) for path in paths]
+        if len(statements) > 1:
+            return wafv2.CfnWebACL.StatementProperty(or_statement=wafv2.CfnWebACL.OrStatementProperty(statements=statements))
+        return statements[0] if statements else None
+
+    def trusted_callers_statement(self, allow_list: dict):
+        """
+        Creates the IP sets of the trusted callers and returns a statement matching everybody else
+        allow_list has ipv4 and ipv6 CIDR lists and an optional forwarded-ip-header to read the caller ip from
+        """
+        forwarded_ip_header = allow_list.get("forwarded-ip-header")
+        statements = list()
+        for version in ("ipv4", "ipv6"):
+            if not allow_list.get(version):
+                continue
+            ip_set = wafv2.CfnIPSet(
+                self,
+                f"TrustedCallers{version.upper()}",
+                addresses=allow_list[version],
+                ip_address_version=version.upper(),
+                scope="REGIONAL",
+                description="Callers exempt from the rate based rules",
+            )
+            statements.append(wafv2.CfnWebACL.StatementProperty(
+                ip_set_reference_statement=wafv2.CfnWebACL.IPSetReferenceStatementProperty(
+                    arn=ip_set.attr_arn,
+                    ip_set_forwarded_ip_config=wafv2.CfnWebACL.IPSetForwardedIPConfigurationProperty(
+                        header_name=forwarded_ip_header, fallback_behavior="NO_MATCH", position="FIRST"
+                    ) if forwarded_ip_header else None,
+                )))
+        if not statements:
+            return None
+        trusted = statements[0] if len(statements) == 1 else wafv2.CfnWebACL.StatementProperty(
+            or_statement=wafv2.CfnWebACL.OrStatementProperty(statements=statements))
+        return wafv2.CfnWebACL.StatementProperty(not_statement=wafv2.CfnWebACL.NotStatementProperty(statement=trusted))
@@ -0,0 +1,30 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Scheduling policy of the loader dispatcher, shared by the Lambda function and papi-dispatch-simulate.py
+# Lanes are served in priority order: a lane only gets the capacity the lanes before it left over.
+# All lanes together are capped at max_tasks running tasks and starts_left task starts in the current minute,
+# a lane with max_tasks set is also capped on its own so a bulk reload cannot take every slot.
+
+def minute_window(now: float) -> int:
+    return int(now // 60)
+
+def dispatch_round(lanes: list, running: dict, max_tasks: int, starts_left: int, take) -> dict:
+    """
+    Starts queued tasks lane by lane, take(lane, n) starts up to n tasks of the lane and returns how many it started
+    lanes are dicts with name and optional max_tasks, in priority order; running is the running task count per lane
+    """
+    budget = min(max_tasks - sum(running.values()), starts_left)
+    started = {}
+    for lane in lanes:
+        room = budget
+        if lane.get("max_tasks"):
+            room = min(room, lane["max_tasks"] - running.get(lane["name"], 0))
+        if room > 0:
+            started[lane["name"]] = take(lane, room)
+            budget -= started[lane["name"]]
+    return started
@@ -0,0 +1,139 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Loader dispatcher, starts the data loader tasks for the S3 events queued in the lane queues
+# Runs once a minute with reserved concurrency 1 and dispatches every DISPATCH_INTERVAL_SECONDS until
+# RUN_SECONDS have passed, so there is one dispatcher at a time and a new event waits a few seconds at most.
+# The task starts of the current minute are counted in DISPATCH_TABLE, they survive a cold start.
+# With TUNING_BUCKET and TUNING_KEY set, the task size and loader settings recommended by papi-loader-tune.py for
+# the input size band of the object override the ones of the lane task definition.
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from dispatch_policy import dispatch_round, minute_window
+
+ecs = boto3.client("ecs")
+sqs = boto3.client("sqs")
+s3 = boto3.client("s3")
+dynamodb = boto3.client("dynamodb")
+
+# [{"name", "queue_url", "task_definition", "family", "max_tasks"}] in priority order
+LANES = json.loads(os.environ.get("LANES", "[]"))
+MAX_TASKS = int(os.getenv("MAX_TASKS", "20"))
+MAX_STARTS_PER_MINUTE = int(os.getenv("MAX_STARTS_PER_MINUTE", "60"))
+DISPATCH_INTERVAL_SECONDS = int(os.getenv("DISPATCH_INTERVAL_SECONDS", "5"))
+RUN_SECONDS = int(os.getenv("RUN_SECONDS", "55"))
+STARTED_BY = "papi-dispatch"
+# recommendations per input size band, read once per invocation
+tuning = {"bands": []}
+
+def load_tuning() -> None:
+    if not os.getenv("TUNING_BUCKET"):
+        return
+    try:
+        body = s3.get_object(Bucket=os.environ["TUNING_BUCKET"], Key=os.environ["TUNING_KEY"])["Body"].read()
+        tuning["bands"] = json.loads(body)["bands"]
+    except (ClientError, ValueError, KeyError) as e:
+        # no recommendations yet, the lane task definitions are used as they are
+        print(f"tuning recommendations not read: {e}")
+        tuning["bands"] = []
+
+def tuned_overrides(size: int, env: list) -> dict:
+    """
+    RunTask overrides with the recommended task size and settings for an input of size bytes
+    """
+    container = {"name": os.environ["CONTAINER_NAME"], "environment": env}
+    for band in tuning["bands"]:
+        if band["max_mb"] is None or size < band["max_mb"] * 1e6:
+            cpu, memory = str(band["cpu"]), str(band["memory"])
+            # the loader records the task size it ran with in the job history
+            env.extend([{"name": "TASK_CPU", "value": cpu}, {"name": "TASK_MEMORY", "value": memory}])
+            env.extend({"name": name, "value": value} for name, value in band["environment"].items())
+            container.update(cpu=int(cpu), memory=int(memory))
+            return {"cpu": cpu, "memory": memory, "containerOverrides": [container]}
+    return {"containerOverrides": [container]}
+
+def running_tasks(family: str) -> int:
+    count = 0
+    for page in ecs.get_paginator("list_tasks").paginate(cluster=os.environ["CLUSTER_ARN"], family=family,
+                                                         desiredStatus="RUNNING"):
+        count += len(page["taskArns"])
+    return count
+
+def starts_this_minute(window: int) -> int:
+    item = dynamodb.get_item(TableName=os.environ["DISPATCH_TABLE"], Key={"window": {"S": str(window)}},
+                             ConsistentRead=True).get("Item")
+    return int(item["starts"]["N"]) if item else 0
+
+def record_starts(window: int, count: int) -> None:
+    dynamodb.update_item(TableName=os.environ["DISPATCH_TABLE"], Key={"window": {"S": str(window)}},
+                         UpdateExpression="ADD starts :n SET expires_at = :exp",
+                         ExpressionAttributeValues={":n": {"N": str(count)}, ":exp": {"N": str(window * 60 + 3600)}})
+
+def run_task(lane: dict, event: dict) -> bool:
+    bucket, key = event["detail"]["bucket"]["name"], event["detail"]["object"]["key"]
+    env = [{"name": "INP_BUCKET", "value": bucket}, {"name": "INP_KEY", "value": key},
+           {"name": "OUT_BUCKET", "value": os.environ["OUT_BUCKET"]}, {"name": "OUT_KEY", "value": os.environ["OUT_KEY"]},
+           # the loader traces the run and measures the data freshness from the event, the queue wait included
+           {"name": "EVENT_TIME", "value": event.get("time", "")}, {"name": "EVENT_ID", "value": event.get("id", "")}]
+    try:
+        resp = ecs.run_task(
+            cluster=os.environ["CLUSTER_ARN"],
+            taskDefinition=lane["task_definition"],
+            capacityProviderStrategy=[{"capacityProvider": os.getenv("CAPACITY_PROVIDER", "FARGATE"), "weight": 1}],
+            networkConfiguration={"awsvpcConfiguration": {
+                "subnets": os.environ["SUBNETS"].split(","),
+                "securityGroups": os.environ["SECURITY_GROUPS"].split(","),
+                "assignPublicIp": "DISABLED",
+            }},
+            overrides=tuned_overrides(event["detail"]["object"].get("size", 0), env),
+            startedBy=STARTED_BY,
+        )
+    except ClientError as e:
+        print(f"run_task for s3://{bucket}/{key} failed: {e}")
+        return False
+    if resp.get("failures"):
+        print(f"run_task for s3://{bucket}/{key} failed: {resp['failures']}")
+        return False
+    return True
+
+def take(lane: dict, n: int) -> int:
+    """
+    Starts up to n tasks for the messages queued in the lane, a message is deleted once its task started
+    """
+    started = 0
+    while started < n:
+        resp = sqs.receive_message(QueueUrl=lane["queue_url"], MaxNumberOfMessages=min(10, n - started), WaitTimeSeconds=0)
+        messages = resp.get("Messages", [])
+        if not messages:
+            break
+        for message in messages:
+            # a message whose task did not start becomes visible again after the queue visibility timeout
+            if run_task(lane, json.loads(message["Body"])):
+                sqs.delete_message(QueueUrl=lane["queue_url"], ReceiptHandle=message["ReceiptHandle"])
+                started += 1
+    return started
+
+def lambda_handler(event, context):
+    deadline = time.time() + RUN_SECONDS
+    load_tuning()
+    total = 0
+    while True:
+        window = minute_window(time.time())
+        running = {lane["name"]: running_tasks(lane["family"]) for lane in LANES}
+        started = dispatch_round(LANES, running, MAX_TASKS, MAX_STARTS_PER_MINUTE - starts_this_minute(window), take)
+        if sum(started.values()):
+            record_starts(window, sum(started.values()))
+            total += sum(started.values())
+            print(f"running {running}, started {started}")
+        if time.time() + DISPATCH_INTERVAL_SECONDS > deadline:
+            return {"started": total}
+        time.sleep(DISPATCH_INTERVAL_SECONDS)
@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Local simulation of the loader dispatcher with the scheduling policy of the Lambda function
+# Replays S3 event arrivals per lane, dispatches every --interval seconds like the dispatcher and reports per lane
+# how long files waited for a task, plus the peak running tasks and the most task starts in one minute.
+# --fifo puts every lane in one queue, which is how a single EventBridge rule with the same caps would behave.
+# The default scenario is a bulk reload of 600 files arriving in the first minute while an urgent file arrives
+# every 20 seconds, a scenario file has the same layout:
+#   {"lanes": [{"name": "urgent", "max_tasks": 0, "task_seconds": 30}, ...],
+#    "arrivals": [{"lane": "bulk", "start": 0, "end": 60, "count": 600}, ...]}
+# example: python papi-dispatch-simulate.py --max-tasks 20 --max-starts-per-minute 60
+import argparse
+import json
+import random
+import statistics
+from collections import deque
+
+from dispatch_policy import dispatch_round, minute_window
+
+DEFAULT_SCENARIO = {
+    "lanes": [
+        {"name": "urgent", "max_tasks": 0, "task_seconds": 30},
+        {"name": "bulk", "max_tasks": 15, "task_seconds": 180},
+    ],
+    "arrivals": [
+        {"lane": "bulk", "start": 0, "end": 60, "count": 600},
+        {"lane": "urgent", "start": 0, "end": 1800, "count": 90},
+    ],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="loader dispatch simulation")
+    parser.add_argument("--scenario", help="scenario json file, default a bulk reload next to urgent updates")
+    parser.add_argument("--max-tasks", type=int, default=20)
+    parser.add_argument("--max-starts-per-minute", type=int, default=60)
+    parser.add_argument("--interval", type=int, default=5, help="seconds between dispatch rounds")
+    parser.add_argument("--fifo", action="store_true", help="one queue for every lane")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def arrivals(scenario: dict) -> list:
+    events = []
+    for spec in scenario["arrivals"]:
+        step = (spec["end"] - spec["start"]) / spec["count"]
+        events.extend((spec["start"] + i * step, spec["lane"]) for i in range(spec["count"]))
+    return sorted(events)
+
+def simulate(scenario: dict, max_tasks: int, max_starts_per_minute: int, interval: int, fifo: bool, seed: int) -> dict:
+    rnd = random.Random(seed)
+    lanes = scenario["lanes"]
+    durations = {lane["name"]: lane["task_seconds"] for lane in lanes}
+    dispatch_lanes = [{"name": "fifo"}] if fifo else lanes
+    queues = {lane["name"]: deque() for lane in dispatch_lanes}
+    pending = deque(arrivals(scenario))
+    tasks = []  # (end time, dispatch lane)
+    waits = {lane["name"]: [] for lane in lanes}
+    starts = {}
+    peak = 0
+    now = 0.0
+
+    def take(lane: dict, n: int) -> int:
+        started = 0
+        while started < n and queues[lane["name"]]:
+            arrived, file_lane = queues[lane["name"]].popleft()
+            waits[file_lane].append(now - arrived)
+            # task run times vary by +-20%
+            tasks.append((now + durations[file_lane] * rnd.uniform(0.8, 1.2), lane["name"]))
+            started += 1
+        return started
+
+    while pending or any(queues.values()) or tasks:
+        while pending and pending[0][0] <= now:
+            arrived, lane = pending.popleft()
+            queues["fifo" if fifo else lane].append((arrived, lane))
+        tasks = [task for task in tasks if task[0] > now]
+        running = {lane["name"]: sum(1 for task in tasks if task[1] == lane["name"]) for lane in dispatch_lanes}
+        window = minute_window(now)
+        started = dispatch_round(dispatch_lanes, running, max_tasks, max_starts_per_minute - starts.get(window, 0), take)
+        starts[window] = starts.get(window, 0) + sum(started.values())
+        peak = max(peak, len(tasks))
+        now += interval
+    return {"waits": waits, "peak_running": peak, "max_starts_per_minute": max(starts.values()), "end": now}
+
+def report(result: dict) -> None:
+    print(f"{'lane':<10}{'files':>7}{'p50 wait s':>12}{'p95 wait s':>12}{'max wait s':>12}")
+    for lane, waits in result["waits"].items():
+        if not waits:
+            continue
+        waits = sorted(waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+        print(f"{lane:<10}{len(waits):>7}{statistics.median(waits):>12.0f}{p95:>12.0f}{waits[-1]:>12.0f}")
+    print(f"peak running tasks {result['peak_running']}, most starts in a minute {result['max_starts_per_minute']}, "
+          f"all done after {result['end'] / 60:.1f} min")
+
+def main() -> None:
+    args = parse_args()
+    scenario = DEFAULT_SCENARIO
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario = json.load(f)
+    report(simulate(scenario, args.max_tasks, args.max_starts_per_minute, args.interval, args.fifo, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Discrete event simulation of the event driven loading path for a burst of S3 uploads
+# Every S3 event starts one loader task, which waits for its start latency and then downloads, converts and
+# uploads its file. Task starts go through one of two paths:
+# - direct, the EventBridge rule calls RunTask for every event. A start above the launch rate (--launch-rate,
+#   --launch-burst) or the task quota (--task-quota) fails and EventBridge retries it with exponential backoff,
+#   events that are still not started after --max-event-age seconds go to the dead letter queue
+# - dispatcher, the events are queued and the dispatcher starts them every --interval seconds under the
+#   --max-tasks and --max-starts-per-minute caps, with the lanes of the scenario, see dispatch_policy.py
+# and every compute option has its own start latency, work speed and Spot interruptions. The report shows per path
+# and compute option the end to end latency percentiles from the event to the published output, the queueing
+# delay before the task start, the peak task count and the task hours.
+# The time per file is sampled from measured runs: --timings takes profile timeline.json files and trace files
+# (TRACE_EXPORTER=file), the s3-event spans of a trace are the measured start latency of --measured-compute.
+# A scenario file has the layout of DEFAULT_SCENARIO, keys that are left out keep their default.
+# example: python papi-loader-burst-simulate.py --files 5000 --over 60 --timings papi-trace.jsonl
+import argparse
+import heapq
+import json
+import math
+import random
+import statistics
+from collections import deque
+
+from dispatch_policy import dispatch_round, minute_window
+
+DEFAULT_SCENARIO = {
+    "lanes": [{"name": "default", "max_tasks": 0}],
+    # an upstream job drops 3000 files into the input bucket within a minute
+    "arrivals": [{"lane": "default", "start": 0, "end": 60, "count": 3000}],
+    # seconds from the first download byte to the published output of one file, replace with measured runs
+    "file_seconds": [35, 40, 45, 50, 55, 60, 70, 85, 110, 150],
+    # start latency from RunTask to the loader process start as p50 and p95 seconds, work_factor scales the
+    # file seconds, interruptions_per_hour and resume_seconds model Spot, see the loader-image and loader-capacity context
+    "compute": {
+        "fargate": {"start_p50": 45, "start_p95": 75},
+        "fargate-slim": {"start_p50": 30, "start_p95": 50},
+        "fargate-spot": {"start_p50": 50, "start_p95": 100, "interruptions_per_hour": 0.2, "resume_seconds": 60},
+    },
+}
+PATHS = ("direct", "dispatcher")
+# EventBridge retries failed target invocations with exponential backoff and jitter
+RETRY_BASE_SECONDS = 1
+RETRY_MAX_SECONDS = 300
+# work since the last checkpoint that a task interrupted by Spot has to do again
+CHECKPOINT_SECONDS = 30
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="loader burst simulation")
+    parser.add_argument("--scenario", help="scenario json file, default 3000 files within a minute")
+    parser.add_argument("--files", type=int, default=0, help="burst of this many files instead of the scenario arrivals")
+    parser.add_argument("--over", type=float, default=60, help="seconds the --files burst arrives over")
+    parser.add_argument("--timings", action="append", default=[],
+                        help="profile timeline.json or trace jsonl with measured runs, can be repeated")
+    parser.add_argument("--measured-compute", default="fargate", help="compute option the trace start latency was measured on")
+    parser.add_argument("--path", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--compute", nargs="+", help="compute options to compare, default every option of the scenario")
+    parser.add_argument("--max-tasks", type=int, default=20, help="dispatcher cap, loader-max-tasks")
+    parser.add_argument("--max-starts-per-minute", type=int, default=60, help="dispatcher cap, loader-max-starts-per-minute")
+    parser.add_argument("--interval", type=int, default=5, help="seconds between dispatch rounds")
+    parser.add_argument("--task-quota", type=int, default=500, help="tasks the Fargate vCPU quota of the account allows")
+    parser.add_argument("--launch-rate", type=float, default=20, help="task launches per second the account allows")
+    parser.add_argument("--launch-burst", type=int, default=100)
+    parser.add_argument("--max-event-age", type=int, default=86400, help="seconds EventBridge retries an event")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def load_scenario(path: str) -> dict:
+    scenario = dict(DEFAULT_SCENARIO)
+    if path:
+        with open(path) as f:
+            scenario.update(json.load(f))
+    return scenario
+
+def load_timings(paths: list) -> tuple:
+    """
+    Seconds per file and start latencies of measured runs, from profile timelines and trace files
+    """
+    file_seconds, start_seconds = [], []
+    for path in paths:
+        with open(path) as f:
+            text = f.read()
+        if path.endswith(".jsonl"):
+            spans = [json.loads(line) for line in text.splitlines() if line.strip()]
+            stages = [(span["attributes"].get("s3.key", ""), span["start"], span["end"]) for span in spans if span["parent_id"]]
+            start_seconds.extend(span["end"] - span["start"] for span in spans if span["name"] == "s3-event")
+        else:
+            stages = [(event["item"], event["start"], event["start"] + event["seconds"]) for event in json.loads(text)["events"]]
+        # stages of one file overlap, e.g. the verification runs during the upload, so a file takes first start to last end
+        items = {}
+        for item, start, end in stages:
+            first, last = items.get(item, (start, end))
+            items[item] = (min(first, start), max(last, end))
+        file_seconds.extend(end - start for start, end in items.values())
+    return file_seconds, start_seconds
+
+def arrivals(scenario: dict) -> list:
+    events = []
+    for spec in scenario["arrivals"]:
+        step = (spec["end"] - spec["start"]) / spec["count"]
+        events.extend((spec["start"] + i * step, spec.get("lane", "default")) for i in range(spec["count"]))
+    return sorted(events)
+
+class Simulation:
+    """
+    One path and compute option, events are (time, sequence, kind, data) in a heap
+    """
+
+    def __init__(self, scenario: dict, compute: dict, path: str, args, rnd: random.Random) -> None:
+        self.scenario = scenario
+        self.compute = compute
+        self.path = path
+        self.args = args
+        self.rnd = rnd
+        self.heap = []
+        self.sequence = 0
+        self.queues = {lane["name"]: deque() for lane in scenario["lanes"]}
+        self.running = {lane["name"]: 0 for lane in scenario["lanes"]}
+        self.starts = {}
+        self.tokens = float(args.launch_burst)
+        self.token_time = 0.0
+        self.peak = self.retries = self.interruptions = 0
+        self.task_seconds = 0.0
+        self.dropped = 0
+        self.latencies, self.waits = [], []
+        self.now = 0.0
+
+    def push(self, at: float, kind: str, data: dict) -> None:
+        self.sequence += 1
+        heapq.heappush(self.heap, (at, self.sequence, kind, data))
+
+    def start_latency(self) -> float:
+        if self.compute.get("start_seconds"):
+            return self.rnd.choice(self.compute["start_seconds"])
+        # log-normal through the p50 and p95
+        sigma = math.log(self.compute["start_p95"] / self.compute["start_p50"]) / 1.645
+        return self.rnd.lognormvariate(math.log(self.compute["start_p50"]), sigma)
+
+    def launch(self) -> bool:
+        # RunTask under the task quota and the launch rate token bucket
+        self.tokens = min(self.args.launch_burst, self.tokens + (self.now - self.token_time) * self.args.launch_rate)
+        self.token_time = self.now
+        if sum(self.running.values()) >= self.args.task_quota or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def start_task(self, file: dict) -> None:
+        if file.get("started") is None:
+            file["started"] = self.now
+            self.waits.append(self.now - file["arrived"])
+        self.running[file["lane"]] += 1
+        self.peak = max(self.peak, sum(self.running.values()))
+        window = minute_window(self.now)
+        self.starts[window] = self.starts.get(window, 0) + 1
+        end = self.now + self.start_latency() + file["work"]
+        rate = self.compute.get("interruptions_per_hour", 0)
+        if rate:
+            interrupted = self.now + self.rnd.expovariate(rate / 3600)
+            if interrupted < end:
+                self.push(interrupted, "interrupted", {"file": file, "task_start": self.now, "end": end})
+                return
+        self.push(end, "done", {"file": file, "task_start": self.now})
+
+    def take(self, lane: dict, n: int) -> int:
+        started = 0
+        while started < n and self.queues[lane["name"]]:
+            self.start_task(self.queues[lane["name"]].popleft())
+            started += 1
+        return started
+
+    def run(self) -> dict:
+        work = self.scenario["file_seconds"]
+        factor = self.compute.get("work_factor", 1.0)
+        for arrived, lane in arrivals(self.scenario):
+            file = {"arrived": arrived, "lane": lane, "work": self.rnd.choice(work) * factor, "attempt": 0}
+            self.push(arrived, "arrived", {"file": file})
+        if self.path == "dispatcher":
+            self.push(0.0, "dispatch", {})
+        while self.heap:
+            self.now, _, kind, data = heapq.heappop(self.heap)
+            file = data.get("file")
+            if kind == "arrived" and self.path == "dispatcher":
+                self.queues[file["lane"]].append(file)
+            elif kind in ("arrived", "retry"):
+                if self.launch():
+                    self.start_task(file)
+                elif self.now - file["arrived"] > self.args.max_event_age:
+                    self.dropped += 1
+                else:
+                    self.retries += 1
+                    file["attempt"] += 1
+                    backoff = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** file["attempt"])
+                    self.push(self.now + self.rnd.uniform(0, backoff), "retry", data)
+            elif kind == "dispatch":
+                started = dispatch_round(self.scenario["lanes"], self.running, self.args.max_tasks,
+                                         self.args.max_starts_per_minute - self.starts.get(minute_window(self.now), 0), self.take)
+                if any(self.queues.values()) or any(k != "dispatch" for _, _, k, _ in self.heap) or sum(started.values()):
+                    self.push(self.now + self.args.interval, "dispatch", {})
+            elif kind == "done":
+                self.running[file["lane"]] -= 1
+                self.task_seconds += self.now - data["task_start"]
+                self.latencies.append(self.now - file["arrived"])
+            elif kind == "interrupted":
+                # the resume function starts a new task outside the dispatcher caps, it redoes the work since the last checkpoint
+                self.running[file["lane"]] -= 1
+                self.task_seconds += self.now - data["task_start"]
+                self.interruptions += 1
+                file["work"] = min(file["work"], data["end"] - self.now + CHECKPOINT_SECONDS)
+                self.push(self.now + self.compute.get("resume_seconds", 0), "resume", data)
+            elif kind == "resume":
+                self.start_task(file)
+        return {"latencies": self.latencies, "waits": self.waits, "peak": self.peak, "retries": self.retries,
+                "dropped": self.dropped, "interruptions": self.interruptions, "task_hours": self.task_seconds / 3600,
+                "max_starts_per_minute": max(self.starts.values(), default=0), "end": self.now}
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+def report(results: list) -> None:
+    print(f"{'path':<12}{'compute':<14}{'files':>7}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'max s':>8}"
+          f"{'p95 wait s':>12}{'peak tasks':>12}{'starts/min':>12}{'task h':>8}{'done min':>10}")
+    for path, compute, result in results:
+        latencies = result["latencies"]
+        print(f"{path:<12}{compute:<14}{len(latencies):>7}{statistics.median(latencies) if latencies else 0:>8.0f}"
+              f"{percentile(latencies, 90):>8.0f}{percentile(latencies, 99):>8.0f}{max(latencies, default=0):>8.0f}"
+              f"{percentile(result['waits'], 95):>12.0f}{result['peak']:>12}{result['max_starts_per_minute']:>12}"
+              f"{result['task_hours']:>8.1f}{result['end'] / 60:>10.1f}")
+        notes = []
+        if result["retries"]:
+            notes.append(f"{result['retries']} RunTask retries")
+        if result["interruptions"]:
+            notes.append(f"{result['interruptions']} Spot interruptions")
+        if result["dropped"]:
+            notes.append(f"{result['dropped']} events to the dead letter queue")
+        if notes:
+            print(f"{'':<26}" + ", ".join(notes))
+
+def main() -> None:
+    args = parse_args()
+    scenario = load_scenario(args.scenario)
+    if args.files:
+        lane = scenario["lanes"][0]["name"]
+        scenario["arrivals"] = [{"lane": lane, "start": 0, "end": args.over, "count": args.files}]
+    compute = {name: dict(option) for name, option in scenario["compute"].items()}
+    if args.timings:
+        file_seconds, start_seconds = load_timings(args.timings)
+        if file_seconds:
+            scenario["file_seconds"] = file_seconds
+        if start_seconds and args.measured_compute in compute:
+            compute[args.measured_compute]["start_seconds"] = start_seconds
+        print(f"measured: {len(file_seconds)} files, p50 {percentile(file_seconds, 50):.1f}s; "
+              f"{len(start_seconds)} task starts, p50 {percentile(start_seconds, 50):.1f}s")
+    results = []
+    for path in args.path:
+        for name in args.compute or compute:
+            # the same seed per run, so the options are compared on the same file times
+            results.append((path, name, Simulation(scenario, compute[name], path, args, random.Random(args.seed)).run()))
+    report(results)
+
+if __name__ == "__main__":
+    main()
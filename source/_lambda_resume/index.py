@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Restarts a data loader task stopped by a Fargate Spot interruption, with the same task size and container overrides
+# The loader runs with CHECKPOINT=1, so the new task resumes from the checkpoint the stopped task saved.
+# RESUME_ATTEMPT in the container environment counts the restarts, after SPOT_ATTEMPTS restarts on Spot
+# the task is started on on-demand Fargate, after MAX_RESUME_ATTEMPTS it is left stopped.
+import os
+import boto3
+
+ecs = boto3.client("ecs")
+MAX_RESUME_ATTEMPTS = int(os.getenv("MAX_RESUME_ATTEMPTS", "5"))
+SPOT_ATTEMPTS = int(os.getenv("SPOT_ATTEMPTS", "3"))
+
+def next_overrides(overrides: dict, attempt: int) -> dict:
+    """
+    Copies the task size and container overrides of the stopped task with RESUME_ATTEMPT set to attempt
+    """
+    containers = []
+    for container in overrides.get("containerOverrides", []):
+        container = dict(container)
+        env = [e for e in container.get("environment", []) if e["name"] != "RESUME_ATTEMPT"]
+        if container["name"] == os.environ["CONTAINER_NAME"]:
+            env.append({"name": "RESUME_ATTEMPT", "value": str(attempt)})
+        container["environment"] = env
+        containers.append(container)
+    # a right-sized task has cpu and memory set for the task and its container, the container alone does not fit
+    # in the default task size
+    resumed = {name: overrides[name] for name in ("cpu", "memory") if overrides.get(name)}
+    resumed["containerOverrides"] = containers
+    return resumed
+
+def task_overrides(task: dict) -> dict:
+    """
+    Overrides of the stopped task, with the task size from the event when the overrides do not have it
+    """
+    size = {name: task[name] for name in ("cpu", "memory") if task.get(name)}
+    return {**size, **task.get("overrides", {})}
+
+def resume_attempt(overrides: dict) -> int:
+    for container in overrides.get("containerOverrides", []):
+        for e in container.get("environment", []):
+            if e["name"] == "RESUME_ATTEMPT":
+                return int(e["value"])
+    return 0
+
+def lambda_handler(event, context):
+    task = event["detail"]
+    attempt = resume_attempt(task.get("overrides", {})) + 1
+    if attempt > MAX_RESUME_ATTEMPTS:
+        print(f"task {task['taskArn']} interrupted {attempt - 1} times, not restarting it")
+        return {"started": None}
+    capacity_provider = "FARGATE_SPOT" if attempt <= SPOT_ATTEMPTS else "FARGATE"
+    resp = ecs.run_task(
+        cluster=os.environ["CLUSTER_ARN"],
+        taskDefinition=task["taskDefinitionArn"],
+        capacityProviderStrategy=[{"capacityProvider": capacity_provider, "weight": 1}],
+        networkConfiguration={"awsvpcConfiguration": {
+            "subnets": os.environ["SUBNETS"].split(","),
+            "securityGroups": os.environ["SECURITY_GROUPS"].split(","),
+            "assignPublicIp": "DISABLED",
+        }},
+        overrides=next_overrides(task_overrides(task), attempt),
+        startedBy="papi-loader-resume",
+    )
+    if resp.get("failures"):
+        raise RuntimeError(f"run_task failed: {resp['failures']}")
+    started = resp["tasks"][0]["taskArn"]
+    print(f"task {task['taskArn']} interrupted, resume attempt {attempt} on {capacity_provider}: {started}")
+    return {"started": started}
@@ -0,0 +1,245 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# asyncio core of the loader
+# Each input object goes through three stages: S3 download -> data cli conversion -> S3 upload.
+# Every stage has its own pool of workers and the stages are connected with bounded queues,
+# so downloads pause when conversions fall behind instead of filling the local disk.
+# boto3 is blocking, S3 calls run in worker threads. data cli runs as an asyncio subprocess.
+# With OUTPUT_LAYOUT=hashed the uploads stay under their staging keys and the files of the run are published together
+# in name order once the last upload is done, see s3_rate.
+import asyncio
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import delta_compression
+import delta_index
+import delta_verify
+import expiry
+import manifest
+import profiling
+import replication
+import s3_rate
+import startup
+from data_cli import format_data_cmd
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Job:
+    inp_bucket: str
+    inp_key: str
+    out_bucket: str
+    out_key: str
+    inpfile: str = ""
+    outfile: str = ""
+    bytes_in: int = 0
+    bytes_out: int = 0
+    error: str = ""
+    sidecar: dict = None
+    # entries of the expiry column, registered once the DELTA file is published
+    expiry_entries: str = None
+    timings: dict = field(default_factory=dict)
+    # (staging key, output key) of the objects of a staged job, published by publish_staged
+    moves: list = field(default_factory=list)
+    description: dict = None
+
+    @property
+    def ifname(self) -> str:
+        return self.inp_key.split("/")[-1]
+
+    @property
+    def output_key(self) -> str:
+        return f"{self.out_key}/{self.ifname}_DELTA"
+
+def download(s3, job: Job, work_dir: str) -> None:
+    # one folder per job so objects with the same file name under different prefixes do not collide
+    job_dir = os.path.join(work_dir, f"job-{id(job):x}")
+    os.makedirs(job_dir, exist_ok=True)
+    job.inpfile = os.path.join(job_dir, job.ifname)
+    job.outfile = f"{job.inpfile}_DELTA"
+    s3.download_file(job.inp_bucket, job.inp_key, job.inpfile, Callback=startup.first_byte)
+    job.bytes_in = os.path.getsize(job.inpfile)
+    job.expiry_entries = expiry.strip_column(job.inpfile)
+
+def upload(s3, job: Job, staged: bool = False) -> None:
+    """
+    Uploads and publishes the DELTA file of the job with its sidecar and expiry entries
+    staged uploads them to their staging keys only, publish_staged publishes them with the other jobs of the run
+    """
+    job.bytes_out = os.path.getsize(job.outfile)
+    # the sidecar already has the row counts of the input, the check then does not read the csv again
+    verification = delta_verify.start(job.outfile, job.inpfile, expected=job.sidecar, item=job.inp_key)
+    if staged:
+        stage(s3, job, verification)
+        return
+    s3_rate.upload_file(s3, job.outfile, job.out_bucket, job.output_key, verification, delta_compression.object_metadata())
+    # the sidecar goes up after the DELTA file so it never points at a missing object
+    if job.sidecar:
+        s3.put_object(Bucket=job.out_bucket, Key=delta_index.sidecar_key(job.output_key), Body=delta_index.dumps(job.sidecar))
+    if job.expiry_entries:
+        expiry.put_entries(s3, job.out_bucket, expiry.pending_key(job.output_key), job.expiry_entries)
+    manifest.record_file(s3, job.out_bucket, job.output_key, job.outfile, job.inpfile, job.sidecar)
+    replication.replicate(s3, job.out_bucket, published_keys(job.output_key, bool(job.sidecar)))
+
+def stage(s3, job: Job, verification) -> None:
+    job.moves = [(s3_rate.stage_file(s3, job.outfile, job.out_bucket, job.output_key, verification,
+                                     delta_compression.object_metadata()), job.output_key)]
+    if job.sidecar:
+        job.moves.append((delta_index.sidecar_key(s3_rate.staging_key(job.output_key)), delta_index.sidecar_key(job.output_key)))
+        s3.put_object(Bucket=job.out_bucket, Key=job.moves[-1][0], Body=delta_index.dumps(job.sidecar))
+    if job.expiry_entries:
+        job.moves.append((expiry.pending_key(s3_rate.staging_key(job.output_key)), expiry.pending_key(job.output_key)))
+        expiry.put_entries(s3, job.out_bucket, job.moves[-1][0], job.expiry_entries)
+    # the local files are gone by the time the run is published
+    job.description = manifest.describe(job.outfile, job.inpfile, job.sidecar) if manifest.ENABLED else None
+
+def publish_staged(s3, jobs: list) -> None:
+    """
+    Publishes the staged jobs in output key order, then records and replicates them
+    """
+    jobs = sorted(jobs, key=lambda job: job.output_key)
+    with profiling.stage("publish", jobs[0].inp_key):
+        for bucket in sorted({job.out_bucket for job in jobs}):
+            s3_rate.publish(s3, bucket, [move for job in jobs if job.out_bucket == bucket for move in job.moves])
+    for job in jobs:
+        if job.description:
+            manifest.record(s3, job.out_bucket, job.output_key, job.description)
+        replication.replicate(s3, job.out_bucket, published_keys(job.output_key, bool(job.sidecar)))
+
+def published_keys(delta_key: str, sidecar: bool) -> list:
+    return [delta_key, delta_index.sidecar_key(delta_key)] if sidecar else [delta_key]
+
+def index(job: Job) -> None:
+    job.sidecar = delta_index.build_sidecar(job.inpfile, source=f"s3://{job.inp_bucket}/{job.inp_key}")
+
+async def convert(job: Job) -> None:
+    cmd = profiling.wrap(format_data_cmd(job.inpfile, job.outfile), job.inp_key)
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    out, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"data cli exited with {proc.returncode}: {out.decode(errors='replace')}")
+    await asyncio.to_thread(delta_compression.recompress, job.outfile)
+    logger.debug(f"data cli output for {job.inp_key}: {out.decode(errors='replace')}")
+
+def cleanup(job: Job) -> None:
+    if job.inpfile:
+        shutil.rmtree(os.path.dirname(job.inpfile), ignore_errors=True)
+
+async def run_jobs(jobs: list, s3, work_dir: str, transfer_concurrency: int = 4,
+                   convert_concurrency: int = 0, queue_size: int = 2, sidecar: bool = True,
+                   on_done=None, stop_event=None) -> list:
+    """
+    Runs the jobs through download, convert and upload stages and returns them
+    Failed jobs have the error attribute set, the other jobs keep running
+    With sidecar set, the sidecar index is built from the csv while data cli converts it
+    on_done(job) is called in a worker thread after a job is published. Once stop_event is set no new
+    downloads start, the jobs in flight finish and the jobs not started get the error "interrupted"
+    With OUTPUT_LAYOUT=hashed the jobs are published together at the end, in output key order
+    """
+    staged = s3_rate.OUTPUT_LAYOUT == "hashed"
+    convert_concurrency = convert_concurrency or os.cpu_count() or 1
+    pending = asyncio.Queue()
+    for job in jobs:
+        pending.put_nowait(job)
+    # bounded queues give backpressure between stages
+    to_convert = asyncio.Queue(maxsize=queue_size)
+    to_upload = asyncio.Queue(maxsize=queue_size)
+
+    def fail(job: Job, stage: str, e: Exception) -> None:
+        job.error = f"{stage}: {e}"
+        logger.error(f"{job.inp_key} failed in {stage}: {e}")
+        cleanup(job)
+
+    async def timed(job: Job, stage: str, coro) -> None:
+        start = time.monotonic()
+        await coro
+        job.timings[stage] = time.monotonic() - start
+        profiling.record(stage, job.inp_key, time.time() - job.timings[stage], job.timings[stage])
+
+    async def download_worker() -> None:
+        while not pending.empty():
+            job = pending.get_nowait()
+            if stop_event is not None and stop_event.is_set():
+                job.error = "interrupted"
+                continue
+            try:
+                await timed(job, "download", asyncio.to_thread(download, s3, job, work_dir))
+            except Exception as e:
+                fail(job, "download", e)
+                continue
+            await to_convert.put(job)
+
+    async def convert_worker() -> None:
+        while (job := await to_convert.get()) is not None:
+            try:
+                if sidecar:
+                    await timed(job, "convert", asyncio.gather(convert(job), asyncio.to_thread(index, job)))
+                else:
+                    await timed(job, "convert", convert(job))
+            except Exception as e:
+                fail(job, "convert", e)
+                continue
+            await to_upload.put(job)
+
+    async def publish_run(done: list) -> None:
+        if not done:
+            return
+        try:
+            await asyncio.to_thread(publish_staged, s3, done)
+        except Exception as e:
+            for job in done:
+                job.error = f"publish: {e}"
+            logger.error(f"publishing {len(done)} files failed, they stay under their staging keys: {e}")
+            return
+        for job in done:
+            logger.info(f"uploaded s3://{job.out_bucket}/{job.output_key}")
+            if on_done:
+                await asyncio.to_thread(on_done, job)
+
+    async def upload_worker() -> None:
+        while (job := await to_upload.get()) is not None:
+            try:
+                await timed(job, "upload", asyncio.to_thread(upload, s3, job, staged))
+                # a staged job is published by publish_run
+                if not staged:
+                    logger.info(f"uploaded s3://{job.out_bucket}/{job.output_key}")
+                    if on_done:
+                        await asyncio.to_thread(on_done, job)
+            except Exception as e:
+                fail(job, "upload", e)
+                continue
+            cleanup(job)
+
+    downloaders = [asyncio.create_task(download_worker()) for _ in range(transfer_concurrency)]
+    converters = [asyncio.create_task(convert_worker()) for _ in range(convert_concurrency)]
+    uploaders = [asyncio.create_task(upload_worker()) for _ in range(transfer_concurrency)]
+    # drain the stages in order, a None tells a worker that its input is done
+    await asyncio.gather(*downloaders)
+    for _ in converters:
+        await to_convert.put(None)
+    await asyncio.gather(*converters)
+    for _ in uploaders:
+        await to_upload.put(None)
+    await asyncio.gather(*uploaders)
+    if staged:
+        await publish_run([job for job in jobs if job.moves and not job.error])
+    return jobs
+
+def run(jobs: list, s3, work_dir: str, transfer_concurrency: int = 4,
+        convert_concurrency: int = 0, queue_size: int = 2, sidecar: bool = True,
+        on_done=None, stop_event=None) -> list:
+    async def main() -> list:
+        # downloads and uploads each hold a thread while they run
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * transfer_concurrency))
+        return await run_jobs(jobs, s3, work_dir, transfer_concurrency, convert_concurrency, queue_size, sidecar,
+                              on_done, stop_event)
+    return asyncio.run(main())
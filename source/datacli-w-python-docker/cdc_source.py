@@ -0,0 +1,324 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Change data capture, DELTA files from a change stream instead of periodic exports
+# CDC_STREAM is dynamodb:<stream arn> (a DynamoDB stream with NEW_IMAGE or NEW_AND_OLD_IMAGES, items are mapped like
+# ddb_source.py, REMOVE is a DELETE), kinesis:<stream name> (json records with key, mutation_type, value, value_type and
+# optionally logical_commit_time) or fake:<json lines file> (FakeStream, in-process, for local runs).
+# The changes are buffered per key, the change with the latest logical_commit_time wins. The buffer is published as
+# <OUT_KEY>/DELTA_<time>_cdc.csv_DELTA once CDC_WINDOW_SECONDS (default 60) passed since its first change or
+# CDC_WINDOW_RECORDS (default 100000) changes were read, then the shard positions are saved to CDC_CHECKPOINT_KEY
+# (default cdc/checkpoint.json) in the output bucket. A stopped consumer replays the changes after the checkpoint,
+# so a change is published at least once.
+# logical_commit_time is the change time (ApproximateCreationDateTime, ApproximateArrivalTimestamp) in microseconds,
+# raised to one past the previous change of the shard when it is not later. The changes of a key are in one shard
+# lineage and a child shard is read after its parent with the parent's last time, so the changes of a key always get
+# increasing times, and the same times again when they are replayed. A logical_commit_time in a Kinesis record is used as is.
+import csv
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+import checkpoint
+import ddb_source
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = float(os.getenv("CDC_WINDOW_SECONDS", "60"))
+WINDOW_RECORDS = int(os.getenv("CDC_WINDOW_RECORDS", "100000"))
+CHECKPOINT_KEY = os.getenv("CDC_CHECKPOINT_KEY", "cdc/checkpoint.json")
+# seconds between polls of a stream without new changes, and between shard list refreshes
+POLL_SECONDS = float(os.getenv("CDC_POLL_SECONDS", "1"))
+SHARD_REFRESH_SECONDS = 60
+READ_LIMIT = 1000
+
+def change(sequence: str, key, mutation_type: str = "UPDATE", value: str = "", value_type: str = "string",
+           time_us: int = 0, lct: int = None) -> dict:
+    """
+    A change record as the streams return it, key None for a record that is skipped
+    """
+    return {"sequence": sequence, "key": key, "mutation_type": mutation_type, "value": value,
+            "value_type": value_type, "time_us": time_us, "lct": lct}
+
+class FakeStream:
+    """
+    In-process stream for local runs and tests, shards of changes added with put
+    """
+
+    def __init__(self) -> None:
+        self.shards = {}
+
+    def add_shard(self, shard_id: str, parent: str = None) -> None:
+        self.shards[shard_id] = {"parent": parent, "records": [], "closed": False}
+
+    def put(self, shard_id: str, key: str, mutation_type: str = "UPDATE", value: str = "", value_type: str = "string",
+            time_us: int = None, lct: int = None) -> None:
+        if shard_id not in self.shards:
+            self.add_shard(shard_id)
+        records = self.shards[shard_id]["records"]
+        records.append(change(f"{len(records) + 1:020d}", key, mutation_type, value, value_type,
+                              time_us if time_us is not None else int(time.time() * 1_000_000), lct))
+
+    def close_shard(self, shard_id: str) -> None:
+        self.shards[shard_id]["closed"] = True
+
+    @classmethod
+    def from_file(cls, path: str):
+        # one json object per line: shard, optional parent, and the arguments of put
+        stream = cls()
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                shard_id = record.pop("shard")
+                parent = record.pop("parent", None)
+                if shard_id not in stream.shards:
+                    stream.add_shard(shard_id, parent)
+                if record.pop("close", False):
+                    stream.close_shard(shard_id)
+                elif "key" in record:
+                    stream.put(shard_id, **record)
+        return stream
+
+    def list_shards(self) -> list:
+        return [(shard_id, shard["parent"]) for shard_id, shard in self.shards.items()]
+
+    def read(self, shard_id: str, after: str, limit: int) -> tuple:
+        shard = self.shards[shard_id]
+        start = int(after) if after else 0
+        records = shard["records"][start:start + limit]
+        return records, shard["closed"] and start + len(records) == len(shard["records"])
+
+class IteratorStream:
+    """
+    Shard iterators of a DynamoDB or Kinesis stream, kept between reads and renewed when they expire
+    """
+
+    def __init__(self) -> None:
+        self.iterators = {}
+
+    def read(self, shard_id: str, after: str, limit: int) -> tuple:
+        for _ in range(2):
+            iterator = self.iterators.get(shard_id)
+            if iterator is None:
+                iterator = self.shard_iterator(shard_id, after)
+            try:
+                resp = self.client.get_records(ShardIterator=iterator, Limit=limit)
+            except ClientError as e:
+                # an iterator expires 5 (Kinesis) or 15 (DynamoDB) minutes after it was returned
+                if e.response["Error"]["Code"] != "ExpiredIteratorException":
+                    raise
+                self.iterators.pop(shard_id, None)
+                continue
+            self.iterators[shard_id] = resp.get("NextShardIterator")
+            closed = self.iterators[shard_id] is None
+            if closed:
+                self.iterators.pop(shard_id)
+            return [self.to_change(record) for record in resp.get("Records", [])], closed
+        raise RuntimeError(f"shard iterator of {shard_id} keeps expiring")
+
+class DynamoDBStream(IteratorStream):
+
+    def __init__(self, arn: str) -> None:
+        import boto3
+        from boto3.dynamodb.types import TypeDeserializer
+        super().__init__()
+        self.arn = arn
+        self.client = boto3.client("dynamodbstreams")
+        self.deserializer = TypeDeserializer()
+
+    def list_shards(self) -> list:
+        shards, kwargs = [], {"StreamArn": self.arn}
+        while True:
+            description = self.client.describe_stream(**kwargs)["StreamDescription"]
+            shards.extend((shard["ShardId"], shard.get("ParentShardId")) for shard in description["Shards"])
+            if not description.get("LastEvaluatedShardId"):
+                return shards
+            kwargs["ExclusiveStartShardId"] = description["LastEvaluatedShardId"]
+
+    def shard_iterator(self, shard_id: str, after: str) -> str:
+        kwargs = {"ShardIteratorType": "AFTER_SEQUENCE_NUMBER", "SequenceNumber": after} if after else {"ShardIteratorType": "TRIM_HORIZON"}
+        return self.client.get_shard_iterator(StreamArn=self.arn, ShardId=shard_id, **kwargs)["ShardIterator"]
+
+    def to_change(self, record: dict) -> dict:
+        data = record["dynamodb"]
+        time_us = int(data["ApproximateCreationDateTime"].timestamp() * 1_000_000)
+        if record["eventName"] == "REMOVE":
+            key = data.get("Keys", {}).get(ddb_source.KEY_ATTRIBUTE)
+            return change(data["SequenceNumber"], str(self.deserializer.deserialize(key)) if key else None, "DELETE", time_us=time_us)
+        row = ddb_source.to_row(data.get("NewImage", {}), self.deserializer, time_us)
+        if row is None:
+            return change(data["SequenceNumber"], None)
+        # the commit time attribute of the item, when configured, is used as is
+        lct = row[2] if ddb_source.COMMIT_TIME_ATTRIBUTE in data.get("NewImage", {}) else None
+        return change(data["SequenceNumber"], row[0], "UPDATE", row[3], row[4], time_us, lct)
+
+class KinesisStream(IteratorStream):
+
+    def __init__(self, name: str) -> None:
+        import boto3
+        super().__init__()
+        self.name = name
+        self.client = boto3.client("kinesis")
+
+    def list_shards(self) -> list:
+        shards, kwargs = [], {"StreamName": self.name}
+        while True:
+            resp = self.client.list_shards(**kwargs)
+            shards.extend((shard["ShardId"], shard.get("ParentShardId")) for shard in resp["Shards"])
+            if not resp.get("NextToken"):
+                return shards
+            kwargs = {"NextToken": resp["NextToken"]}
+
+    def shard_iterator(self, shard_id: str, after: str) -> str:
+        kwargs = {"ShardIteratorType": "AFTER_SEQUENCE_NUMBER", "StartingSequenceNumber": after} if after else {"ShardIteratorType": "TRIM_HORIZON"}
+        return self.client.get_shard_iterator(StreamName=self.name, ShardId=shard_id, **kwargs)["ShardIterator"]
+
+    def to_change(self, record: dict) -> dict:
+        time_us = int(record["ApproximateArrivalTimestamp"].timestamp() * 1_000_000)
+        try:
+            data = json.loads(record["Data"])
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict) or "key" not in data:
+            logger.warning(f"skipped Kinesis record {record['SequenceNumber']}, it is not a json object with a key")
+            return change(record["SequenceNumber"], None)
+        lct = data.get("logical_commit_time")
+        return change(record["SequenceNumber"], str(data["key"]), str(data.get("mutation_type", "UPDATE")).upper(),
+                      str(data.get("value", "")), data.get("value_type", "string"), time_us, int(lct) if lct else None)
+
+def open_stream(spec: str):
+    kind, _, name = spec.partition(":")
+    if kind == "dynamodb":
+        return DynamoDBStream(name)
+    if kind == "kinesis":
+        return KinesisStream(name)
+    if kind == "fake":
+        return FakeStream.from_file(name)
+    raise ValueError(f"Invalid CDC_STREAM {spec!r}, use dynamodb:<stream arn>, kinesis:<stream name> or fake:<file>")
+
+class Consumer:
+    """
+    Reads the shards of a stream in to a per key buffer and publishes it a window at a time
+    """
+
+    def __init__(self, stream, s3, bucket: str, out_key: str, work_dir: str) -> None:
+        self.stream, self.s3, self.bucket, self.out_key, self.work_dir = stream, s3, bucket, out_key, work_dir
+        self.ckpt = checkpoint.Checkpoint.load(s3, bucket, CHECKPOINT_KEY) or \
+            checkpoint.Checkpoint(s3, bucket, CHECKPOINT_KEY, {"shards": {}, "last_name_time": 0})
+        # sequence: last change read, clock: last logical_commit_time given, closed: every change was read
+        self.shards = {shard_id: dict(shard) for shard_id, shard in self.ckpt.state["shards"].items()}
+        self.parents = {}
+        self.refreshed = 0.0
+        self.buffer = {}
+        self.records = 0
+        self.window_start = None
+
+    def refresh(self) -> None:
+        for shard_id, parent in self.stream.list_shards():
+            self.parents[shard_id] = parent
+            self.shards.setdefault(shard_id, {"sequence": None, "clock": 0, "closed": False})
+        self.refreshed = time.monotonic()
+
+    def readable(self, shard_id: str) -> bool:
+        shard = self.shards[shard_id]
+        if shard["closed"]:
+            return False
+        parent_id = self.parents.get(shard_id)
+        parent = self.shards.get(parent_id)
+        if parent is None:
+            return True
+        # a parent that is not done yet has older changes of the same keys, unless the stream trimmed it
+        if not parent["closed"] and parent_id in self.parents:
+            return False
+        shard["clock"] = max(shard["clock"], parent["clock"])
+        return True
+
+    def poll(self) -> int:
+        """
+        Reads the changes available in every readable shard, returns how many were read
+        """
+        if time.monotonic() - self.refreshed >= SHARD_REFRESH_SECONDS:
+            self.refresh()
+        count = 0
+        for shard_id in sorted(self.shards):
+            if shard_id not in self.parents or not self.readable(shard_id):
+                continue
+            shard = self.shards[shard_id]
+            # a window holds at most WINDOW_RECORDS changes
+            records, closed = self.stream.read(shard_id, shard["sequence"], max(1, min(READ_LIMIT, WINDOW_RECORDS - self.records)))
+            for record in records:
+                shard["sequence"] = record["sequence"]
+                if record["key"] is None:
+                    continue
+                lct = record["lct"]
+                if lct is None:
+                    lct = shard["clock"] = max(record["time_us"], shard["clock"] + 1)
+                current = self.buffer.get(record["key"])
+                if current is None or lct >= current[2]:
+                    self.buffer[record["key"]] = [record["key"], record["mutation_type"], lct, record["value"], record["value_type"]]
+                if self.window_start is None:
+                    self.window_start = time.monotonic()
+            count += len(records)
+            self.records += len(records)
+            if closed:
+                shard["closed"] = True
+            if self.due():
+                break
+        return count
+
+    def due(self) -> bool:
+        return self.records >= WINDOW_RECORDS or \
+            (self.window_start is not None and time.monotonic() - self.window_start >= WINDOW_SECONDS)
+
+    def flush(self) -> str:
+        """
+        Publishes the buffered changes and saves the shard positions, returns the DELTA key or None
+        """
+        delta_key = None
+        if self.buffer:
+            rows = sorted(self.buffer.values(), key=lambda row: (row[2], row[0]))
+            # names sort in publishing order, even when a window has no later change than the previous one
+            name_time = max(rows[-1][2], self.ckpt.state["last_name_time"] + 1)
+            delta_key = f"{self.out_key}/DELTA_{name_time:016d}_cdc.csv_DELTA"
+            csv_path = os.path.join(self.work_dir, os.path.basename(delta_key)[:-len("_DELTA")])
+            mutation_types = {}
+            with open(csv_path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(ddb_source.CSV_HEADER)
+                for row in rows:
+                    writer.writerow(row)
+                    mutation_types[row[1]] = mutation_types.get(row[1], 0) + 1
+            ddb_source.publish_csv(self.s3, self.bucket, csv_path, delta_key, self.work_dir,
+                                   {"row_count": len(rows), "mutation_types": mutation_types}, "cdc")
+            logger.info(f"{self.records} changes of {len(rows)} keys in {delta_key}")
+            self.ckpt.state["last_name_time"] = name_time
+        with self.ckpt.lock:
+            # closed shards whose parent is done and that are no longer listed have nothing left to resume
+            self.ckpt.state["shards"] = {shard_id: dict(shard) for shard_id, shard in self.shards.items()
+                                         if shard_id in self.parents or not shard["closed"]}
+        self.ckpt.save()
+        self.buffer, self.records, self.window_start = {}, 0, None
+        return delta_key
+
+    def run(self, stop, run_seconds: float = 0) -> None:
+        """
+        Polls until stop is set or run_seconds passed, the last window is published before it returns
+        """
+        started = time.monotonic()
+        self.refresh()
+        while not stop.is_set() and not (run_seconds and time.monotonic() - started >= run_seconds):
+            count = self.poll()
+            if self.due():
+                self.flush()
+            elif not count:
+                stop.wait(POLL_SECONDS)
+        self.flush()
@@ -0,0 +1,338 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Checkpoint and resume for long loader runs, so a task stopped by a Fargate Spot interruption
+# continues where it stopped instead of starting over
+# A large input csv is split in to shards, byte ranges aligned to line ends. Each shard is downloaded with a
+# ranged GET, converted to its own DELTA file <output>_NNNNN and uploaded, large shards with a multipart upload.
+# The checkpoint object in the input bucket keeps the shard plan, the finished shards and the upload id and
+# parts of in-progress multipart uploads. A resumed run skips finished shards and re-sends only the parts
+# whose md5 differs from the recorded one. Prefix runs record the finished input keys.
+# Shards finish in any order, so with more than one shard they are written to staging keys (see s3_rate.staging_key)
+# and published in shard order once all are done, a consumer never sees shard N+1 before shard N.
+# The shard split assumes that quoted values do not contain line breaks.
+# Expiry entries of a shard are written next to its staging key and published with it, see expiry.py.
+import base64
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import delta_compression
+import delta_index
+import delta_verify
+import expiry
+import manifest
+import profiling
+import s3_rate
+from data_cli import format_data_cmd
+
+logger = logging.getLogger(__name__)
+
+MIB = 1 << 20
+CHECKPOINT_PREFIX = os.getenv("CHECKPOINT_PREFIX", "checkpoints")
+# inputs larger than one shard are converted shard by shard
+SHARD_BYTES = int(os.getenv("SHARD_MB", "256")) * MIB
+# S3 parts must be at least 5 MiB, except the last one
+PART_BYTES = max(5, int(os.getenv("MULTIPART_PART_MB", "64"))) * MIB
+# bytes read past a nominal shard boundary to find the end of the line
+PROBE_BYTES = 64 * 1024
+
+# set by SIGTERM, Fargate sends it ahead of a Spot interruption
+stop = threading.Event()
+
+class Interrupted(Exception):
+    pass
+
+def install_sigterm_handler() -> None:
+    def handler(signum, frame) -> None:
+        logger.warning("SIGTERM received, finishing in-flight work and saving the checkpoint")
+        stop.set()
+    signal.signal(signal.SIGTERM, handler)
+
+def check_stop() -> None:
+    if stop.is_set():
+        raise Interrupted("stopped by SIGTERM")
+
+def checkpoint_key(inp_key: str) -> str:
+    return f"{CHECKPOINT_PREFIX}/{inp_key.rstrip('/')}.json"
+
+def shard_write_key(shard: dict) -> str:
+    # checkpoints written before the output layout was recorded upload straight to the output key
+    return shard.get("write_key", shard["key"])
+
+def is_missing(e: ClientError) -> bool:
+    return e.response["Error"]["Code"] in ("NoSuchKey", "404", "NoSuchUpload")
+
+class Checkpoint:
+    """
+    Progress of one loader run, saved as json to <bucket>/<key> after every change
+    """
+
+    def __init__(self, s3, bucket: str, key: str, state: dict) -> None:
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.state = state
+        self.lock = threading.Lock()
+        # saves from several workers go out one at a time, so an older snapshot never overwrites a newer one
+        self.save_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, s3, bucket: str, key: str):
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except ClientError as e:
+            if is_missing(e):
+                return None
+            raise
+        return cls(s3, bucket, key, json.loads(body))
+
+    def save(self) -> None:
+        with self.save_lock:
+            with self.lock:
+                body = json.dumps(self.state, separators=(",", ":")).encode()
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body)
+
+    def delete(self) -> None:
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key)
+
+    def abort_uploads(self) -> None:
+        """
+        Aborts the multipart uploads of a checkpoint that is discarded
+        """
+        for shard in self.state.get("shards", []):
+            if shard.get("upload_id") and not shard["done"]:
+                try:
+                    self.s3.abort_multipart_upload(Bucket=shard["bucket"], Key=shard_write_key(shard),
+                                                   UploadId=shard["upload_id"])
+                except ClientError as e:
+                    if not is_missing(e):
+                        raise
+
+def read_range(s3, bucket: str, key: str, start: int, end: int) -> bytes:
+    """
+    Bytes start..end-1 of the object
+    """
+    return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")["Body"].read()
+
+def plan_shards(s3, bucket: str, key: str, size: int, shard_bytes: int = SHARD_BYTES) -> tuple:
+    """
+    Returns (header line, [(start, end)]) with every shard ending after a line break
+    """
+    head = read_range(s3, bucket, key, 0, min(size, PROBE_BYTES))
+    if b"\n" not in head:
+        raise ValueError(f"no header line in the first {PROBE_BYTES} bytes of {key}")
+    header = head[:head.index(b"\n") + 1]
+    shards = []
+    start = len(header)
+    while start < size:
+        end = start + shard_bytes
+        while end < size:
+            probe = read_range(s3, bucket, key, end, min(size, end + PROBE_BYTES))
+            if b"\n" in probe:
+                end += probe.index(b"\n") + 1
+                break
+            end += len(probe)
+        end = min(end, size)
+        shards.append((start, end))
+        start = end
+    return header.decode(), shards
+
+def upload_resumable(s3, ckpt: Checkpoint, shard: dict, path: str, verification=None) -> None:
+    """
+    Uploads the shard output with a multipart upload recorded in the checkpoint
+    Parts already uploaded by an earlier run with the same md5 are not sent again
+    With a delta_verify.Verification the upload is only completed once it passed, and aborted when it failed
+    """
+    bucket, key = shard["bucket"], shard_write_key(shard)
+    uploaded = {}
+    if shard.get("upload_id"):
+        try:
+            listed = s3.list_parts(Bucket=bucket, Key=key, UploadId=shard["upload_id"]).get("Parts", [])
+            etags = {p["PartNumber"]: p["ETag"] for p in listed}
+            uploaded = {p["PartNumber"]: p for p in shard["parts"] if etags.get(p["PartNumber"]) == p["ETag"]}
+        except ClientError as e:
+            if not is_missing(e):
+                raise
+            shard["upload_id"] = ""
+    if not shard.get("upload_id"):
+        shard["upload_id"] = s3.create_multipart_upload(Bucket=bucket, Key=key,
+                                                        Metadata=delta_compression.object_metadata())["UploadId"]
+        shard["parts"] = []
+        ckpt.save()
+    reused = 0
+    with open(path, "rb") as f:
+        part_number = 1
+        while chunk := f.read(PART_BYTES):
+            check_stop()
+            md5 = hashlib.md5(chunk)
+            previous = uploaded.get(part_number)
+            if previous and previous["MD5"] == md5.hexdigest():
+                reused += 1
+            else:
+                resp = s3.upload_part(Bucket=bucket, Key=key, UploadId=shard["upload_id"], PartNumber=part_number,
+                                      Body=chunk, ContentMD5=base64.b64encode(md5.digest()).decode())
+                with ckpt.lock:
+                    shard["parts"] = [p for p in shard["parts"] if p["PartNumber"] != part_number]
+                    shard["parts"].append({"PartNumber": part_number, "ETag": resp["ETag"], "MD5": md5.hexdigest()})
+                ckpt.save()
+            part_number += 1
+    parts = sorted(({"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in shard["parts"] if p["PartNumber"] < part_number),
+                   key=lambda p: p["PartNumber"])
+    if verification:
+        try:
+            verification.result()
+        except delta_verify.VerificationError:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=shard["upload_id"])
+            with ckpt.lock:
+                shard["upload_id"], shard["parts"] = "", []
+            ckpt.save()
+            raise
+    s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=shard["upload_id"], MultipartUpload={"Parts": parts})
+    if reused:
+        logger.info(f"resumed upload of {key}: {reused} of {len(parts)} parts were already uploaded")
+
+def convert_shard(s3, ckpt: Checkpoint, shard: dict, work_dir: str, sidecar: bool) -> None:
+    check_stop()
+    state = ckpt.state
+    inp_bucket, inp_key = state["inp_bucket"], state["inp_key"]
+    shard_dir = os.path.join(work_dir, f"shard-{shard['index']:05d}")
+    os.makedirs(shard_dir, exist_ok=True)
+    csv_path = os.path.join(shard_dir, "input.csv")
+    delta_path = os.path.join(shard_dir, "output_DELTA")
+    item = f"{inp_key}#{shard['index']:05d}"
+    verification = None
+    entries = None
+    try:
+        with profiling.stage("download", item):
+            with open(csv_path, "wb") as f:
+                f.write(state["header"].encode())
+                start = shard["start"]
+                while start < shard["end"]:
+                    end = min(shard["end"], start + PART_BYTES)
+                    f.write(read_range(s3, inp_bucket, inp_key, start, end))
+                    start = end
+            entries = expiry.strip_column(csv_path)
+        check_stop()
+        with profiling.stage("convert", item):
+            out = subprocess.run(profiling.wrap(format_data_cmd(csv_path, delta_path), item),
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if out.returncode != 0:
+                raise RuntimeError(f"data cli exited with {out.returncode}: {out.stdout.decode(errors='replace')}")
+            delta_compression.recompress(delta_path)
+        verification = delta_verify.start(delta_path, csv_path, item=item)
+        with profiling.stage("upload", item):
+            if os.path.getsize(delta_path) > PART_BYTES:
+                upload_resumable(s3, ckpt, shard, delta_path, verification)
+            elif verification:
+                delta_verify.upload_verified(s3, delta_path, shard["bucket"], shard_write_key(shard), verification,
+                                             delta_compression.object_metadata())
+            else:
+                with open(delta_path, "rb") as f:
+                    body = f.read()
+                s3.put_object(Bucket=shard["bucket"], Key=shard_write_key(shard), Body=body,
+                              ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode(),
+                              Metadata=delta_compression.object_metadata())
+        # the sidecar goes up after the DELTA file so it never points at a missing object
+        index = None
+        if sidecar:
+            source = f"s3://{inp_bucket}/{inp_key}#bytes={shard['start']}-{shard['end'] - 1}"
+            with profiling.stage("index", item):
+                index = delta_index.build_sidecar(csv_path, source=source)
+                s3.put_object(Bucket=shard["bucket"], Key=delta_index.sidecar_key(shard_write_key(shard)),
+                              Body=delta_index.dumps(index))
+        if entries:
+            expiry.put_entries(s3, shard["bucket"], expiry.pending_key(shard_write_key(shard)), entries)
+        # recorded in the manifest once every shard is published, see run_sharded
+        description = manifest.describe(delta_path, csv_path, index) if manifest.ENABLED else None
+        with ckpt.lock:
+            shard["manifest"] = description
+            shard["done"] = True
+        ckpt.save()
+        logger.info(f"shard {shard['index']} done: s3://{shard['bucket']}/{shard['key']}")
+    finally:
+        if verification:
+            verification.wait()
+        for path in (csv_path, delta_path, entries):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+def run_sharded(s3, inp_bucket: str, inp_key: str, out_bucket: str, output_key: str, work_dir: str,
+                workers: int = 2, sidecar: bool = True, shard_bytes: int = SHARD_BYTES) -> list:
+    """
+    Converts one large input shard by shard, resuming from the checkpoint of an earlier run
+    Returns the output keys, raises Interrupted after SIGTERM once the checkpoint is saved
+    """
+    head = s3.head_object(Bucket=inp_bucket, Key=inp_key)
+    etag, size = head["ETag"], head["ContentLength"]
+    ckpt = Checkpoint.load(s3, inp_bucket, checkpoint_key(inp_key))
+    if ckpt and (ckpt.state.get("etag") != etag or ckpt.state.get("output_key") != output_key):
+        logger.info("input object or output changed since the checkpoint was written, starting over")
+        ckpt.abort_uploads()
+        ckpt = None
+    if ckpt:
+        done = sum(s["done"] for s in ckpt.state["shards"])
+        logger.info(f"resuming from checkpoint: {done} of {len(ckpt.state['shards'])} shards done")
+    else:
+        header, ranges = plan_shards(s3, inp_bucket, inp_key, size, shard_bytes)
+        stage = s3_rate.staging_key if len(ranges) > 1 else s3_rate.write_key
+        shards = [{"index": i, "start": start, "end": end, "bucket": out_bucket, "key": f"{output_key}_{i:05d}",
+                   "write_key": stage(f"{output_key}_{i:05d}"), "done": False, "upload_id": "", "parts": []}
+                  for i, (start, end) in enumerate(ranges)]
+        ckpt = Checkpoint(s3, inp_bucket, checkpoint_key(inp_key),
+                          {"inp_bucket": inp_bucket, "inp_key": inp_key, "etag": etag, "size": size, "header": header,
+                           "output_key": output_key, "shards": shards})
+        ckpt.save()
+        logger.info(f"{inp_key}: {size} bytes in {len(shards)} shards")
+    todo = [s for s in ckpt.state["shards"] if not s["done"]]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_shard, s3, ckpt, s, work_dir, sidecar) for s in todo]
+        errors = [e for e in (f.exception() for f in futures) if e is not None]
+    ckpt.save()
+    if errors:
+        raise next((e for e in errors if isinstance(e, Interrupted)), errors[0])
+    moves = []
+    for shard in ckpt.state["shards"]:
+        moves.append((shard_write_key(shard), shard["key"]))
+        if sidecar:
+            moves.append((delta_index.sidecar_key(shard_write_key(shard)), delta_index.sidecar_key(shard["key"])))
+        if expiry.has_column(ckpt.state["header"]):
+            moves.append((expiry.pending_key(shard_write_key(shard)), expiry.pending_key(shard["key"])))
+    with profiling.stage("publish", inp_key):
+        s3_rate.publish(s3, out_bucket, moves)
+    for shard in ckpt.state["shards"]:
+        # shards done before the manifest was turned on have no description
+        if shard.get("manifest"):
+            manifest.record(s3, out_bucket, shard["key"], shard["manifest"])
+    ckpt.delete()
+    return [s["key"] for s in ckpt.state["shards"]]
+
+class KeyProgress:
+    """
+    Finished input keys of a prefix run, a resumed run skips them
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str) -> None:
+        self.ckpt = Checkpoint.load(s3, bucket, checkpoint_key(prefix)) or \
+            Checkpoint(s3, bucket, checkpoint_key(prefix), {"done_keys": []})
+        self.done = set(self.ckpt.state["done_keys"])
+
+    def record(self, key: str) -> None:
+        with self.ckpt.lock:
+            self.done.add(key)
+            self.ckpt.state["done_keys"] = sorted(self.done)
+        self.ckpt.save()
+
+    def finish(self) -> None:
+        self.ckpt.delete()
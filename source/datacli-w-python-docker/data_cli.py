@@ -0,0 +1,22 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Builds the data cli command lines used by the loader and the other tools in this folder
+# DATA_CLI_PATH can point to a different binary, e.g. a stand-in when running outside the container
+import os
+
+DATA_CLI_PATH = os.getenv("DATA_CLI_PATH", "/tools/data_cli/data_cli")
+
+def format_data_cmd(input_file: str, output_file: str, input_format: str = "CSV", output_format: str = "DELTA") -> list:
+    """
+    Returns the data cli format_data command as an argument list
+    """
+    return [DATA_CLI_PATH, "format_data",
+            f"--input_file={input_file}",
+            f"--input_format={input_format}",
+            f"--output_file={output_file}",
+            f"--output_format={output_format}"]
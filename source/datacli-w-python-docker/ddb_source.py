@@ -0,0 +1,270 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# DynamoDB table as the loader source, a full reload without the csv export to the input bucket
+# SOURCE_SEGMENTS (default 8) threads each scan one segment of the table (Scan with Segment and TotalSegments),
+# SOURCE_READ_CAPACITY (default 0, no limit) is the read capacity units per second shared by all segments,
+# measured from the ConsumedCapacity of every page.
+# An item is an UPDATE of SOURCE_KEY_ATTRIBUTE (default key) to SOURCE_VALUE_ATTRIBUTE (default value), items without
+# them, or with a null or binary value, are skipped and counted. A string set or a list of strings is a string_set, other types are strings.
+# logical_commit_time is SOURCE_COMMIT_TIME_ATTRIBUTE (epoch microseconds) when set and present, else the scan start.
+# Every segment streams its rows to csv parts of up to SOURCE_PART_MB (default 64). A full part is converted,
+# verified and published as <out key>/DELTA_<scan start>_<table>_s<segment>_p<part>.csv_DELTA while the scan goes on.
+# A key deleted from the table since the last reload is not deleted in the KV service, the reload only has updates.
+# SOURCE_TABLE_FILE=<json lines file> scans the items of the file instead of DynamoDB, for local runs without AWS.
+import csv
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import delta_compression
+import delta_index
+import delta_verify
+import manifest
+import profiling
+import replication
+import s3_rate
+from data_cli import format_data_cmd
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS = int(os.getenv("SOURCE_SEGMENTS", "8"))
+READ_CAPACITY = float(os.getenv("SOURCE_READ_CAPACITY", "0"))
+KEY_ATTRIBUTE = os.getenv("SOURCE_KEY_ATTRIBUTE", "key")
+VALUE_ATTRIBUTE = os.getenv("SOURCE_VALUE_ATTRIBUTE", "value")
+COMMIT_TIME_ATTRIBUTE = os.getenv("SOURCE_COMMIT_TIME_ATTRIBUTE", "")
+PART_BYTES = int(float(os.getenv("SOURCE_PART_MB", "64")) * 1024 * 1024)
+CSV_HEADER = ["key", "mutation_type", "logical_commit_time", "value", "value_type"]
+
+class CapacityBudget:
+    """
+    Read capacity units per second shared by the segments, a segment waits before its next page
+    while the units consumed so far are ahead of the budget
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.start = time.monotonic()
+        self.consumed = 0.0
+        self.lock = threading.Lock()
+
+    def spend(self, units: float) -> None:
+        with self.lock:
+            self.consumed += units
+
+    def wait(self) -> float:
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            ahead = self.consumed / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+        return max(ahead, 0.0)
+
+class LocalTable:
+    """
+    Stand-in for the DynamoDB client Scan over a json lines file of plain json items
+    An item is in segment crc32(key) % TotalSegments, pages hold up to 1 MB of items like DynamoDB
+    """
+
+    def __init__(self, path: str, key_attribute: str) -> None:
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+        self.items = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line, parse_float=Decimal)
+                    self.items.append(({k: serializer.serialize(v) for k, v in item.items()}, str(item.get(key_attribute, ""))))
+
+    def scan(self, TableName: str, Segment: int = 0, TotalSegments: int = 1, ExclusiveStartKey: dict = None,
+             ReturnConsumedCapacity: str = "NONE", **kwargs) -> dict:
+        start = int(ExclusiveStartKey["offset"]["N"]) if ExclusiveStartKey else 0
+        page, size, offset = [], 0, start
+        while offset < len(self.items) and size < 1024 * 1024:
+            item, key = self.items[offset]
+            offset += 1
+            if zlib.crc32(key.encode()) % TotalSegments == Segment:
+                page.append(item)
+                size += len(json.dumps(item))
+        resp = {"Items": page, "Count": len(page),
+                # eventually consistent reads, half a unit per 4 KB read
+                "ConsumedCapacity": {"TableName": TableName, "CapacityUnits": max(1, -(-size // 4096)) * 0.5}}
+        if offset < len(self.items):
+            resp["LastEvaluatedKey"] = {"offset": {"N": str(offset)}}
+        return resp
+
+def get_client(table: str):
+    table_file = os.getenv("SOURCE_TABLE_FILE")
+    if table_file:
+        return LocalTable(table_file, KEY_ATTRIBUTE)
+    import boto3
+    from botocore.config import Config
+    return boto3.client("dynamodb", config=Config(retries={"mode": "standard", "max_attempts": s3_rate.MAX_ATTEMPTS}))
+
+def json_default(value):
+    # DynamoDB numbers are Decimal, sets have no json type
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return sorted(value) if isinstance(value, set) else str(value)
+
+def to_row(item: dict, deserializer, start_us: int) -> list:
+    """
+    csv row of a DynamoDB item, None when it has no key or value, or a null or binary value
+    """
+    if KEY_ATTRIBUTE not in item or VALUE_ATTRIBUTE not in item:
+        return None
+    key = deserializer.deserialize(item[KEY_ATTRIBUTE])
+    value = deserializer.deserialize(item[VALUE_ATTRIBUTE])
+    lct = start_us
+    if COMMIT_TIME_ATTRIBUTE and COMMIT_TIME_ATTRIBUTE in item:
+        lct = int(deserializer.deserialize(item[COMMIT_TIME_ATTRIBUTE]))
+    if value is None:
+        return None
+    if isinstance(value, (set, list)) and all(isinstance(v, str) for v in value):
+        return [str(key), "UPDATE", lct, "|".join(sorted(value) if isinstance(value, set) else value), "string_set"]
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    elif isinstance(value, (dict, list, set)):
+        value = json.dumps(value, default=json_default, sort_keys=True)
+    elif isinstance(value, bytes) or hasattr(value, "value"):
+        # binary attributes are not served as text
+        return None
+    return [str(key), "UPDATE", lct, str(value), "string"]
+
+def publish_csv(s3, bucket: str, csv_path: str, delta_key: str, work_dir: str, expected: dict, source: str) -> None:
+    """
+    Converts a csv of rows to a DELTA file and publishes it to delta_key like the loader does, removes both files
+    """
+    delta_path = os.path.join(work_dir, os.path.basename(delta_key))
+    try:
+        with profiling.stage("convert", delta_key):
+            out = subprocess.run(profiling.wrap(format_data_cmd(csv_path, delta_path), delta_key),
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if out.returncode != 0:
+                raise RuntimeError(f"data cli exited with {out.returncode}: {out.stdout.decode(errors='replace')}")
+            delta_compression.recompress(delta_path)
+        with profiling.stage("upload", delta_key):
+            s3_rate.upload_file(s3, delta_path, bucket, delta_key, delta_verify.start(delta_path, csv_path, expected, delta_key),
+                                delta_compression.object_metadata())
+        keys, sidecar = [delta_key], None
+        if os.getenv("DELTA_INDEX", "1") == "1":
+            keys.append(delta_index.sidecar_key(delta_key))
+            sidecar = delta_index.build_sidecar(csv_path, source=source)
+            s3.put_object(Bucket=bucket, Key=keys[-1], Body=delta_index.dumps(sidecar))
+        manifest.record_file(s3, bucket, delta_key, delta_path, csv_path, sidecar)
+        replication.replicate(s3, bucket, keys)
+        logger.info(f"published {expected['row_count']} rows: s3://{bucket}/{delta_key}")
+    finally:
+        for path in (csv_path, delta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class Publisher:
+    """
+    Converts and publishes the csv parts of the segments, at most workers at a time
+    """
+
+    def __init__(self, s3, bucket: str, out_key: str, base_name: str, work_dir: str, workers: int) -> None:
+        self.s3, self.bucket, self.out_key, self.base_name, self.work_dir = s3, bucket, out_key, base_name, work_dir
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="publish")
+        # a segment blocks once this many parts wait for a worker, so the scan does not fill the disk
+        self.pending = threading.Semaphore(workers * 2)
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def submit(self, csv_path: str, rows: int, segment: int, part: int) -> None:
+        self.pending.acquire()
+        future = self.pool.submit(self.publish, csv_path, rows, segment, part)
+        future.add_done_callback(lambda _: self.pending.release())
+        with self.lock:
+            self.futures.append(future)
+
+    def publish(self, csv_path: str, rows: int, segment: int, part: int) -> str:
+        delta_key = f"{self.out_key}/{self.base_name}_s{segment:04d}_p{part:05d}.csv_DELTA"
+        publish_csv(self.s3, self.bucket, csv_path, delta_key, self.work_dir,
+                    {"row_count": rows, "mutation_types": {"UPDATE": rows}}, f"dynamodb:{self.base_name}")
+        return delta_key
+
+    def result(self) -> list:
+        self.pool.shutdown(wait=True)
+        errors = [e for e in (f.exception() for f in self.futures) if e is not None]
+        if errors:
+            raise errors[0]
+        return sorted(f.result() for f in self.futures)
+
+def scan_segment(client, table: str, segment: int, budget: CapacityBudget, publisher: Publisher, start_us: int,
+                 stats: dict, lock: threading.Lock) -> None:
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    part, rows, skipped, f, writer, csv_path = 0, 0, 0, None, None, None
+    kwargs = {"TableName": table, "Segment": segment, "TotalSegments": SEGMENTS, "ReturnConsumedCapacity": "TOTAL"}
+    try:
+        while True:
+            budget.wait()
+            with profiling.stage("scan", f"{table}#{segment}"):
+                resp = client.scan(**kwargs)
+            budget.spend(resp.get("ConsumedCapacity", {}).get("CapacityUnits", 0))
+            for item in resp.get("Items", []):
+                row = to_row(item, deserializer, start_us)
+                if row is None:
+                    skipped += 1
+                    continue
+                if f is None:
+                    csv_path = os.path.join(publisher.work_dir, f"{publisher.base_name}_s{segment:04d}_p{part:05d}.csv")
+                    f = open(csv_path, "w", newline="")
+                    writer = csv.writer(f)
+                    writer.writerow(CSV_HEADER)
+                writer.writerow(row)
+                rows += 1
+                if f.tell() >= PART_BYTES:
+                    f.close()
+                    publisher.submit(csv_path, rows, segment, part)
+                    with lock:
+                        stats["rows"] += rows
+                    f, part, rows = None, part + 1, 0
+            if "LastEvaluatedKey" not in resp:
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        if f is not None:
+            f.close()
+            f = None
+            publisher.submit(csv_path, rows, segment, part)
+            with lock:
+                stats["rows"] += rows
+    finally:
+        if f is not None:
+            f.close()
+            os.remove(csv_path)
+        with lock:
+            stats["skipped"] += skipped
+
+def reload(s3, table: str, out_bucket: str, out_key: str, work_dir: str, workers: int) -> dict:
+    """
+    Scans the table and publishes its items as DELTA files, returns the row counts and the published keys
+    """
+    start_us = int(time.time() * 1_000_000)
+    client = get_client(table)
+    budget = CapacityBudget(READ_CAPACITY)
+    publisher = Publisher(s3, out_bucket, out_key, f"DELTA_{start_us:016d}_{table}", work_dir, workers)
+    stats, lock = {"rows": 0, "skipped": 0}, threading.Lock()
+    with ThreadPoolExecutor(max_workers=SEGMENTS, thread_name_prefix="scan") as pool:
+        futures = [pool.submit(scan_segment, client, table, segment, budget, publisher, start_us, stats, lock)
+                   for segment in range(SEGMENTS)]
+        errors = [e for e in (f.exception() for f in futures) if e is not None]
+    keys = publisher.result()
+    if errors:
+        raise errors[0]
+    stats["keys"] = keys
+    stats["capacity_units"] = budget.consumed
+    return stats
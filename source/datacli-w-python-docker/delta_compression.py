@@ -0,0 +1,96 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Record compression of the generated DELTA files
+# data cli has no compression option, so DELTA_COMPRESSION rewrites the riegeli file it wrote with another
+# compression before the file is verified and uploaded: uncompressed, snappy, brotli[:level] (0-11, default 6)
+# or zstd[:level] (-32-22, default 3). Empty (default) keeps the file as data cli wrote it. Riegeli readers find
+# the compression in every chunk, so the KV servers read the files whatever the setting is.
+# The setting is kept in the delta-compression metadata of the output object, "data-cli" for an unchanged file.
+# Needs riegeli: pip install -r requirements-compression.txt, or build the slim image with
+# --build-arg EXTRA_REQUIREMENTS=requirements-compression.txt. The default image does not have it,
+# the entry points call check() at startup and exit when the setting is invalid or riegeli is missing.
+import importlib.util
+import os
+
+METADATA_KEY = "delta-compression"
+UNCHANGED = "data-cli"
+# valid levels and the default level of each compression, None for the ones without levels
+LEVELS = {"uncompressed": None, "snappy": None, "brotli": (range(0, 12), 6), "zstd": (range(-32, 23), 3)}
+
+def parse(setting: str) -> str:
+    """
+    Riegeli writer options of a DELTA_COMPRESSION value, empty for the data cli output as is
+    Raises ValueError for an unknown compression or level
+    """
+    setting = setting.strip().lower()
+    if setting in ("", UNCHANGED):
+        return ""
+    name, sep, level = setting.partition(":")
+    if name not in LEVELS:
+        raise ValueError(f"Invalid DELTA_COMPRESSION {setting!r}, use {', '.join(LEVELS)} or {UNCHANGED}")
+    if LEVELS[name] is None:
+        if sep:
+            raise ValueError(f"Invalid DELTA_COMPRESSION {setting!r}, {name} has no level")
+        return name
+    levels, default = LEVELS[name]
+    try:
+        level = int(level) if sep else default
+    except ValueError:
+        level = None
+    if level not in levels:
+        raise ValueError(f"Invalid DELTA_COMPRESSION {setting!r}, {name} levels are {levels.start} to {levels.stop - 1}")
+    return f"{name}:{level}"
+
+# an invalid value is kept for check(), importing the module never fails
+try:
+    COMPRESSION, SETTING_ERROR = parse(os.getenv("DELTA_COMPRESSION", "")), ""
+except ValueError as e:
+    COMPRESSION, SETTING_ERROR = "", str(e)
+
+def riegeli_installed() -> bool:
+    return importlib.util.find_spec("riegeli") is not None
+
+def check() -> None:
+    """
+    Raises ValueError for an invalid DELTA_COMPRESSION, or a compression set in an image without riegeli
+    """
+    if SETTING_ERROR:
+        raise ValueError(SETTING_ERROR)
+    if COMPRESSION and not riegeli_installed():
+        raise ValueError(f"DELTA_COMPRESSION {COMPRESSION} needs riegeli, build the slim image with "
+                         f"--build-arg EXTRA_REQUIREMENTS=requirements-compression.txt")
+
+def object_metadata(setting: str = None) -> dict:
+    return {METADATA_KEY: (COMPRESSION if setting is None else setting) or UNCHANGED}
+
+def recompress(path: str, setting: str = None) -> None:
+    """
+    Rewrites the DELTA file at path in place with the records and file metadata of the original
+    """
+    if setting is None:
+        if SETTING_ERROR:
+            raise ValueError(SETTING_ERROR)
+        setting = COMPRESSION
+    if not setting:
+        return
+    import riegeli
+    tmp = f"{path}.{setting.replace(':', '')}"
+    with riegeli.RecordReader(open(path, "rb")) as reader, \
+            riegeli.RecordWriter(open(tmp, "wb"), options=setting,
+                                 serialized_metadata=reader.read_serialized_metadata()) as writer:
+        for record in reader.read_records():
+            writer.write_record(record)
+    os.replace(tmp, path)
+
+def count_records(path: str) -> int:
+    """
+    Reads and decompresses every record of a DELTA file
+    """
+    import riegeli
+    with riegeli.RecordReader(open(path, "rb")) as reader:
+        return sum(1 for _ in reader.read_records())
@@ -0,0 +1,122 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Sidecar index written next to every DELTA file: <delta key>.index.json
+# It has the row count, logical_commit_time range, mutation type counts, an estimate of the distinct keys and a bloom
+# filter of the keys, so key lookups only have to download the DELTA files that may contain the key.
+# The csv is read twice, once for the statistics and once for the bloom filter sized from them, in fixed memory.
+import base64
+import csv
+import hashlib
+import json
+import math
+import zlib
+
+SIDECAR_SUFFIX = ".index.json"
+SIDECAR_VERSION = 1
+
+class BloomFilter:
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None) -> None:
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(num_hashes, 1)
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float = 0.01) -> "BloomFilter":
+        # standard sizing: m = -n ln(p) / ln(2)^2, k = m/n ln(2)
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = int(round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key: str):
+        # double hashing over two 64 bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def to_dict(self) -> dict:
+        return {"num_bits": self.num_bits, "num_hashes": self.num_hashes,
+                "bits": base64.b64encode(zlib.compress(bytes(self.bits))).decode()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "BloomFilter":
+        return cls(d["num_bits"], d["num_hashes"], bytearray(zlib.decompress(base64.b64decode(d["bits"]))))
+
+class HyperLogLog:
+    """
+    Distinct count estimate in a fixed 2^precision bytes, about 1.04 / sqrt(2^precision) relative error
+    """
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key: str) -> None:
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+def csv_stats(csv_path: str) -> dict:
+    """
+    Reads the data cli input csv once and returns the row statistics, the distinct key count is an estimate
+    so memory stays fixed whatever the size of the file
+    """
+    distinct = HyperLogLog()
+    mutation_types = {}
+    rows = 0
+    min_lct = max_lct = None
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            rows += 1
+            distinct.add(row["key"])
+            mutation_types[row["mutation_type"]] = mutation_types.get(row["mutation_type"], 0) + 1
+            lct = int(row["logical_commit_time"])
+            min_lct = lct if min_lct is None else min(min_lct, lct)
+            max_lct = lct if max_lct is None else max(max_lct, lct)
+    return {"row_count": rows, "min_logical_commit_time": min_lct, "max_logical_commit_time": max_lct,
+            "mutation_types": mutation_types, "distinct_keys": min(distinct.count(), rows)}
+
+def build_sidecar(csv_path: str, source: str = "", fp_rate: float = 0.01) -> dict:
+    # a second pass adds the keys to a bloom filter sized from the first, with room for the estimate error
+    stats = csv_stats(csv_path)
+    bloom = BloomFilter.for_capacity(min(int(stats["distinct_keys"] * 1.05) + 1, stats["row_count"]), fp_rate)
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            bloom.add(row["key"])
+    return {"version": SIDECAR_VERSION, "source": source, **stats, "bloom": bloom.to_dict()}
+
+def sidecar_key(delta_key: str) -> str:
+    return f"{delta_key}{SIDECAR_SUFFIX}"
+
+def dumps(sidecar: dict) -> bytes:
+    return json.dumps(sidecar, separators=(",", ":")).encode()
+
+def may_contain(sidecar: dict, key: str) -> bool:
+    return key in BloomFilter.from_dict(sidecar["bloom"])
@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Verification of a DELTA file before it is published, so a truncated or partial file never reaches the servers
+# The DELTA file is read back with data cli (DELTA to csv), which fails on broken record framing, and the records
+# and mutation types read back are counted against the rows of the input csv. The check runs in a thread while
+# the DELTA file is sent with a multipart upload, and the upload is only completed once the check passed;
+# a failed check aborts the upload. Files of one part go up as a multipart upload of that one part, a single PUT
+# could not be held back, so the check never adds to the upload time.
+# DELTA_VERIFY=0 turns the check off. It costs about one more data cli run per file.
+import base64
+import csv
+import hashlib
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from data_cli import format_data_cmd
+
+logger = logging.getLogger(__name__)
+
+MIB = 1 << 20
+VERIFY = os.getenv("DELTA_VERIFY", "1") == "1"
+# S3 parts must be at least 5 MiB, memory per upload is about parts in flight times the part size
+UPLOAD_PART_BYTES = max(5, int(os.getenv("UPLOAD_PART_MB", "16"))) * MIB
+UPLOAD_PART_CONCURRENCY = int(os.getenv("UPLOAD_PART_CONCURRENCY", "4"))
+
+class VerificationError(RuntimeError):
+    pass
+
+def count_rows(csv_path: str) -> dict:
+    """
+    Row count and rows per mutation type of a data cli csv, mutation types upper case
+    """
+    rows = 0
+    mutation_types = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            rows += 1
+            mutation_type = (row.get("mutation_type") or "").upper()
+            mutation_types[mutation_type] = mutation_types.get(mutation_type, 0) + 1
+    return {"row_count": rows, "mutation_types": mutation_types}
+
+def _upper(counts: dict) -> dict:
+    upper = {}
+    for mutation_type, count in counts.items():
+        upper[mutation_type.upper()] = upper.get(mutation_type.upper(), 0) + count
+    return upper
+
+def verify(delta_path: str, csv_path: str, expected: dict = None, item: str = "") -> dict:
+    """
+    Reads delta_path back with data cli and compares it to the input csv, raises VerificationError on a mismatch
+    expected is the row_count and mutation_types of the input, e.g. from the sidecar, else csv_path is read
+    """
+    with profiling.stage("verify", item):
+        if os.path.getsize(delta_path) == 0:
+            raise VerificationError(f"{delta_path} is empty")
+        readback = f"{delta_path}.verify.csv"
+        try:
+            out = subprocess.run(profiling.wrap(format_data_cmd(delta_path, readback, input_format="DELTA", output_format="CSV"), item),
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if out.returncode != 0:
+                raise VerificationError(f"data cli could not read the DELTA file back, exit code {out.returncode}: "
+                                        f"{out.stdout.decode(errors='replace')[-500:]}")
+            actual = count_rows(readback)
+        finally:
+            if os.path.exists(readback):
+                os.remove(readback)
+        expected = count_rows(csv_path) if expected is None else expected
+        expected = {"row_count": expected["row_count"], "mutation_types": _upper(expected["mutation_types"])}
+        if actual != expected:
+            raise VerificationError(f"DELTA file has {actual['row_count']} records {actual['mutation_types']}, "
+                                    f"the input has {expected['row_count']} rows {expected['mutation_types']}")
+    logger.info(f"verified {item or delta_path}: {actual['row_count']} records")
+    return actual
+
+class Verification:
+    """
+    verify() running in its own thread, result() waits for it and raises its error
+    """
+
+    def __init__(self, delta_path: str, csv_path: str, expected: dict = None, item: str = "") -> None:
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verify")
+        self.future = self.pool.submit(verify, delta_path, csv_path, expected, item)
+        self.pool.shutdown(wait=False)
+
+    def result(self) -> dict:
+        return self.future.result()
+
+    def failed(self) -> bool:
+        return self.future.done() and self.future.exception() is not None
+
+    def wait(self) -> None:
+        # lets the check finish before its files are removed, its error is raised by result()
+        self.future.exception()
+
+def start(delta_path: str, csv_path: str, expected: dict = None, item: str = ""):
+    """
+    Starts the verification of delta_path, None when DELTA_VERIFY=0
+    """
+    return Verification(delta_path, csv_path, expected, item) if VERIFY else None
+
+def upload_verified(s3, path: str, bucket: str, key: str, verification: Verification, metadata: dict = None) -> None:
+    """
+    Uploads path while the verification runs and completes the upload only if it passed
+    """
+    size = os.path.getsize(path)
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **({"Metadata": metadata} if metadata else {}))["UploadId"]
+
+    def upload_part(part_number: int) -> dict:
+        if verification.failed():
+            # no need to send the rest of a file that is not going to be published
+            verification.result()
+        with open(path, "rb") as f:
+            f.seek((part_number - 1) * UPLOAD_PART_BYTES)
+            body = f.read(UPLOAD_PART_BYTES)
+        resp = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body,
+                              ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode())
+        return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=UPLOAD_PART_CONCURRENCY) as pool:
+            parts = list(pool.map(upload_part, range(1, max(1, (size + UPLOAD_PART_BYTES - 1) // UPLOAD_PART_BYTES) + 1)))
+        verification.result()
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        verification.wait()
+        raise
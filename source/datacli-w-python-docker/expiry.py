@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Expiry of keys, an optional EXPIRY_COLUMN (default expires_at) in the input csv
+# The loader removes the column before data cli sees the file and writes one entry per row,
+# key,expires_at,logical_commit_time, to <EXPIRY_PREFIX>/pending/<DELTA key>.csv.gz in the output bucket
+# once the DELTA file is published. expires_at is epoch seconds, epoch microseconds like logical_commit_time,
+# or ISO 8601, and is kept in microseconds. An UPDATE with an empty expiry and a DELETE cancel the expiry of the key.
+# papi-expiry-sweep.py merges the pending entries in to <EXPIRY_PREFIX>/index.csv.gz, one row per key with the
+# entry of the latest logical_commit_time, and publishes a DELETE-only DELTA file for the keys that expired.
+import csv
+import gzip
+import io
+import os
+from datetime import datetime
+
+EXPIRY_COLUMN = os.getenv("EXPIRY_COLUMN", "expires_at")
+EXPIRY_PREFIX = os.getenv("EXPIRY_PREFIX", "expiry")
+PENDING_PREFIX = f"{EXPIRY_PREFIX}/pending/"
+INDEX_KEY = f"{EXPIRY_PREFIX}/index.csv.gz"
+# epoch values above this are microseconds, below it seconds
+MICROS_THRESHOLD = 10 ** 11
+ENTRY_HEADER = ["key", "expires_at", "logical_commit_time"]
+
+def has_column(header: str) -> bool:
+    return EXPIRY_COLUMN in next(csv.reader([header]), [])
+
+def parse_expiry(value: str) -> int:
+    """
+    Expiry in epoch microseconds, raises ValueError for a value that is not a time
+    """
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number if number >= MICROS_THRESHOLD else number * 1_000_000
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1_000_000)
+
+def pending_key(delta_key: str) -> str:
+    return f"{PENDING_PREFIX}{delta_key}.csv.gz"
+
+def strip_column(csv_path: str) -> str:
+    """
+    Removes the expiry column from csv_path in place and writes its entries to a file next to it
+    Returns the path of the entries, None when the csv has no expiry column
+    """
+    with open(csv_path, newline="") as f:
+        header = next(csv.reader(f), [])
+    if EXPIRY_COLUMN not in header:
+        return None
+    column = header.index(EXPIRY_COLUMN)
+    stripped, entries_path = f"{csv_path}.stripped", f"{csv_path}.expiry.csv"
+    with open(csv_path, newline="") as inp, open(stripped, "w", newline="") as out, open(entries_path, "w", newline="") as entries:
+        reader, writer, entry_writer = csv.reader(inp), csv.writer(out), csv.writer(entries)
+        next(reader)
+        writer.writerow(header[:column] + header[column + 1:])
+        entry_writer.writerow(ENTRY_HEADER)
+        fields = {name: i for i, name in enumerate(header)}
+        for line, row in enumerate(reader, start=2):
+            value = row[column] if column < len(row) else ""
+            writer.writerow(row[:column] + row[column + 1:])
+            try:
+                expires = parse_expiry(value) if value.strip() and row[fields["mutation_type"]].upper() != "DELETE" else ""
+            except ValueError:
+                raise ValueError(f"{EXPIRY_COLUMN} {value!r} in line {line} is not a time")
+            entry_writer.writerow([row[fields["key"]], expires, row[fields["logical_commit_time"]]])
+    os.replace(stripped, csv_path)
+    return entries_path
+
+def put_entries(s3, bucket: str, key: str, entries_path: str) -> None:
+    with open(entries_path, "rb") as f:
+        s3.put_object(Bucket=bucket, Key=key, Body=gzip.compress(f.read()))
+
+def read_entries(body: bytes) -> list:
+    """
+    (key, expires_at or None, logical_commit_time) of a gzip compressed entries or index object
+    """
+    rows = csv.reader(io.StringIO(gzip.decompress(body).decode()))
+    next(rows, None)
+    return [(key, int(expires) if expires else None, int(lct)) for key, expires, lct in rows]
+
+def merge(index: dict, entries: list) -> None:
+    """
+    Keeps the entry of the latest logical_commit_time per key, a cancel (expires_at None) stays as a tombstone
+    so an older entry read later does not bring the expiry back
+    """
+    for key, expires, lct in entries:
+        current = index.get(key)
+        if current is None or lct >= current[1]:
+            index[key] = (expires, lct)
+
+def dumps_index(index: dict) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(ENTRY_HEADER)
+    for key, (expires, lct) in sorted(index.items(), key=lambda item: (item[1][0] or 0, item[0])):
+        writer.writerow([key, "" if expires is None else expires, lct])
+    return gzip.compress(out.getvalue().encode())
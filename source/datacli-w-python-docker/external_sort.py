@@ -0,0 +1,59 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# External merge sort for row streams larger than memory
+# Rows are lists of strings. The input is cut in runs of run_rows rows, each run is sorted in memory and written
+# to a csv file in work_dir; the merge of the runs yields the rows in order with one row per run in memory.
+# More runs than MAX_FAN_IN are merged in passes so the number of open files stays bounded.
+import csv
+import heapq
+import itertools
+import os
+
+MAX_FAN_IN = 256
+_sort_ids = itertools.count()
+# values of a DELTA row can be large string sets
+csv.field_size_limit(1 << 30)
+
+def _write_run(rows, path: str) -> str:
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+def _read_run(path: str):
+    with open(path, newline="") as f:
+        yield from csv.reader(f)
+    os.remove(path)
+
+def _merge(paths: list, key):
+    return heapq.merge(*[_read_run(path) for path in paths], key=key)
+
+def sort_rows(rows, key, work_dir: str, run_rows: int = 1_000_000, reduce=None):
+    """
+    Returns an iterator over rows sorted by key, runs that do not fit in memory are spilled to work_dir
+    reduce, if given, is applied to every sorted run before it is kept, e.g. to drop rows a later step drops anyway
+    """
+    reduce = reduce or (lambda run: run)
+    rows = iter(rows)
+    sort_id = next(_sort_ids)
+    runs = []
+    while True:
+        run = list(itertools.islice(rows, run_rows))
+        if not runs and len(run) < run_rows:
+            # everything fit in one run, no need to touch the disk
+            return iter(reduce(sorted(run, key=key)))
+        if run:
+            runs.append(_write_run(reduce(sorted(run, key=key)), os.path.join(work_dir, f"run-{sort_id}-{len(runs):06d}.csv")))
+        if len(run) < run_rows:
+            break
+    merge_pass = 0
+    while len(runs) > MAX_FAN_IN:
+        merge_pass += 1
+        runs = [_write_run(_merge(runs[i:i + MAX_FAN_IN], key),
+                           os.path.join(work_dir, f"run-{sort_id}-p{merge_pass}-{i // MAX_FAN_IN:06d}.csv"))
+                for i in range(0, len(runs), MAX_FAN_IN)]
+    return _merge(runs, key)
@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Job history for tuning, the input size, the settings and the stage timings of every loader run
+# JOB_HISTORY=1 (default) writes one json object per run of a single input object to
+# s3://<output bucket>/<JOB_HISTORY_PREFIX>/<yyyy-mm-dd>/<run id>.json (default prefix history) when the run ends.
+# The settings are the task size (TASK_CPU, TASK_MEMORY, set by the stack and the dispatcher) and the transfer,
+# part and shard settings in effect, the stages are the seconds per stage recorded with profiling.stage.
+# papi-loader-tune.py fits a cost and latency model per input size band from these records.
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import profiling
+import startup
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("JOB_HISTORY", "1") == "1"
+HISTORY_PREFIX = os.getenv("JOB_HISTORY_PREFIX", "history")
+# input size bands of the job reports and the tuner, a recommendation applies to one band
+SIZE_BANDS_MB = [16, 256, 1024, 4096]
+BAND_NAMES = [f"< {limit} MB" for limit in SIZE_BANDS_MB] + [f">= {SIZE_BANDS_MB[-1]} MB"]
+
+def size_band(nbytes: float) -> str:
+    for limit, name in zip(SIZE_BANDS_MB, BAND_NAMES):
+        if nbytes < limit * 1e6:
+            return name
+    return BAND_NAMES[-1]
+
+def band_limit_mb(band: str):
+    """
+    Upper input size limit of a band in MB, None for the last band
+    """
+    index = BAND_NAMES.index(band)
+    return SIZE_BANDS_MB[index] if index < len(SIZE_BANDS_MB) else None
+
+class Recorder:
+    """
+    Seconds per stage of one run, summed over the stages of the same name
+    """
+
+    def __init__(self) -> None:
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def stage(self, stage: str, item: str, start: float, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+_recorder = None
+
+def start() -> None:
+    global _recorder
+    if ENABLED and _recorder is None:
+        _recorder = Recorder()
+        profiling.listeners.append(_recorder.stage)
+
+def finish(s3, bucket: str, inp_bucket: str, inp_key: str, settings: dict, error: str) -> None:
+    """
+    Writes the history record of the run, errors are logged and do not fail the run
+    """
+    global _recorder
+    recorder = _recorder
+    if recorder is None:
+        return
+    _recorder = None
+    profiling.listeners.remove(recorder.stage)
+    if inp_key.endswith("/") or not recorder.stages:
+        # the tuner models one input object per task, prefix reloads and tasks that lost the job claim are left out
+        return
+    now = time.time()
+    try:
+        input_bytes = s3.head_object(Bucket=inp_bucket, Key=inp_key)["ContentLength"]
+        record = {"job": f"{inp_bucket}/{inp_key}", "finished_at": round(now, 3), "input_bytes": input_bytes,
+                  "seconds": round(now - startup.PROCESS_START, 3), "error": error, "settings": settings,
+                  "stages": {stage: round(seconds, 3) for stage, seconds in recorder.stages.items()}}
+        run_id = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))}-{socket.gethostname()}-{os.getpid()}"
+        key = f"{HISTORY_PREFIX}/{time.strftime('%Y-%m-%d', time.gmtime(now))}/{run_id}.json"
+        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(record).encode())
+        logger.info(f"job history: s3://{bucket}/{key}")
+    except ClientError as e:
+        logger.error(f"job history not written: {e}")
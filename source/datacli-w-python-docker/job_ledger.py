@@ -0,0 +1,196 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Job ledger that lets only one loader task convert an input object version
+# EventBridge delivers S3 events at least once and one upload can emit several Object Created events,
+# every event starts a loader task. A task claims the job <bucket>/<key>@<etag> with a conditional write
+# before it downloads anything; a task that loses the claim exits. The claim is a lease renewed while the
+# task runs, so the job of a task that died without updating the ledger can be claimed again after it expires.
+# job states: RUNNING -> SUCCEEDED | FAILED | INTERRUPTED, a FAILED or INTERRUPTED job can be claimed again
+# LEDGER_TABLE is the DynamoDB table (partition key job_id), LEDGER_TABLE=memory uses the in-process stand-in
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+INTERRUPTED = "INTERRUPTED"
+# seconds a claim stays valid without a heartbeat
+LEASE_SECONDS = int(os.getenv("LEDGER_LEASE_SECONDS", "300"))
+# finished jobs are removed by the table TTL after this many days
+TTL_DAYS = int(os.getenv("LEDGER_TTL_DAYS", "30"))
+
+def job_id(bucket: str, key: str, etag: str) -> str:
+    return f"{bucket}/{key}@{etag.strip(chr(34))}"
+
+def owner_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class MemoryLedger:
+    """
+    In-process stand-in for the DynamoDB ledger with the same conditions, for local runs and benchmarks
+    """
+
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def claim(self, job: str, owner: str, now: float, attrs: dict) -> bool:
+        with self.lock:
+            item = self.jobs.get(job)
+            if item and not claimable(item, now):
+                return False
+            item = dict(item or {"job_id": job, "attempts": 0})
+            for name in ("error", "finished_at", "duration_s", "expires_at"):
+                item.pop(name, None)
+            item.update(attrs, state=RUNNING, owner=owner, started_at=now, lease_expires=now + LEASE_SECONDS,
+                        attempts=item["attempts"] + 1)
+            self.jobs[job] = item
+            return True
+
+    def update(self, job: str, owner: str, attrs: dict) -> bool:
+        with self.lock:
+            item = self.jobs.get(job)
+            if not item or item["owner"] != owner or item["state"] != RUNNING:
+                return False
+            item.update(attrs)
+            return True
+
+    def get(self, job: str) -> dict:
+        with self.lock:
+            return dict(self.jobs[job]) if job in self.jobs else None
+
+    def scan(self) -> list:
+        with self.lock:
+            return [dict(item) for item in self.jobs.values()]
+
+class DynamoLedger:
+    """
+    Ledger items in a DynamoDB table, every state change is a conditional update
+    """
+
+    def __init__(self, client, table: str) -> None:
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        self.client = client
+        self.table = table
+        self.serializer = TypeSerializer()
+        self.deserializer = TypeDeserializer()
+
+    def _value(self, value):
+        if isinstance(value, float):
+            value = Decimal(str(round(value, 3)))
+        return self.serializer.serialize(value)
+
+    def _item(self, raw: dict) -> dict:
+        item = {k: self.deserializer.deserialize(v) for k, v in raw.items()}
+        return {k: float(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+    def _update(self, job: str, attrs: dict, condition: str, names: dict, values: dict, remove: tuple = (), add: dict = None) -> bool:
+        names = {**names, **{f"#a{i}": name for i, name in enumerate(attrs)}}
+        values = {**values, **{f":a{i}": self._value(value) for i, value in enumerate(attrs.values())}}
+        expression = "SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(attrs)))
+        if remove:
+            names.update({f"#r{i}": name for i, name in enumerate(remove)})
+            expression += " REMOVE " + ", ".join(f"#r{i}" for i in range(len(remove)))
+        if add:
+            names.update({f"#n{i}": name for i, name in enumerate(add)})
+            values.update({f":n{i}": self._value(value) for i, value in enumerate(add.values())})
+            expression += " ADD " + ", ".join(f"#n{i} :n{i}" for i in range(len(add)))
+        try:
+            self.client.update_item(TableName=self.table, Key={"job_id": {"S": job}}, UpdateExpression=expression,
+                                    ConditionExpression=condition, ExpressionAttributeNames=names,
+                                    ExpressionAttributeValues=values)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def claim(self, job: str, owner: str, now: float, attrs: dict) -> bool:
+        attrs = {**attrs, "state": RUNNING, "owner": owner, "started_at": now, "lease_expires": now + LEASE_SECONDS}
+        # state and owner are DynamoDB reserved words, the conditions use the #s and #o placeholders
+        return self._update(job, attrs,
+                            "attribute_not_exists(job_id) OR #s IN (:failed, :interrupted) OR (#s = :running AND lease_expires < :now)",
+                            {"#s": "state"},
+                            {":failed": {"S": FAILED}, ":interrupted": {"S": INTERRUPTED}, ":running": {"S": RUNNING},
+                             ":now": self._value(now)},
+                            remove=("error", "finished_at", "duration_s", "expires_at"), add={"attempts": 1})
+
+    def update(self, job: str, owner: str, attrs: dict) -> bool:
+        return self._update(job, attrs, "#o = :owner AND #s = :running", {"#s": "state", "#o": "owner"},
+                            {":owner": {"S": owner}, ":running": {"S": RUNNING}})
+
+    def get(self, job: str) -> dict:
+        raw = self.client.get_item(TableName=self.table, Key={"job_id": {"S": job}}, ConsistentRead=True).get("Item")
+        return self._item(raw) if raw else None
+
+    def scan(self) -> list:
+        items = []
+        for page in self.client.get_paginator("scan").paginate(TableName=self.table):
+            items.extend(self._item(raw) for raw in page["Items"])
+        return items
+
+def claimable(item: dict, now: float) -> bool:
+    return item["state"] in (FAILED, INTERRUPTED) or (item["state"] == RUNNING and item["lease_expires"] < now)
+
+def get_ledger(table: str = None):
+    """
+    Ledger named by LEDGER_TABLE, None when the ledger is not configured
+    """
+    table = table or os.getenv("LEDGER_TABLE")
+    if not table:
+        return None
+    if table == "memory":
+        return MemoryLedger()
+    import boto3
+    return DynamoLedger(boto3.client("dynamodb"), table)
+
+class Claim:
+    """
+    One task's claim on a job, renews the lease in the background until it is finished
+    """
+
+    def __init__(self, ledger, job: str, owner: str = None) -> None:
+        self.ledger = ledger
+        self.job = job
+        self.owner = owner or owner_id()
+        self.started = 0.0
+        self.done = threading.Event()
+
+    def acquire(self, **attrs) -> bool:
+        self.started = time.time()
+        if not self.ledger.claim(self.job, self.owner, self.started, attrs):
+            return False
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        logger.info(f"claimed job {self.job}")
+        return True
+
+    def _heartbeat(self) -> None:
+        while not self.done.wait(LEASE_SECONDS / 3):
+            if not self.ledger.update(self.job, self.owner, {"lease_expires": time.time() + LEASE_SECONDS}):
+                logger.warning(f"lost the claim on job {self.job}")
+                return
+
+    def finish(self, state: str, **attrs) -> None:
+        self.done.set()
+        now = time.time()
+        attrs.update(state=state, finished_at=now, duration_s=now - self.started, expires_at=int(now) + TTL_DAYS * 86400)
+        try:
+            if not self.ledger.update(self.job, self.owner, attrs):
+                logger.warning(f"job {self.job} is no longer claimed by this task, {state} not recorded")
+        except ClientError as e:
+            logger.error(f"could not record {state} for job {self.job}: {e}")
+        logger.info(f"job {self.job} {state} after {now - self.started:.1f}s")
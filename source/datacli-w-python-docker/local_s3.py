@@ -0,0 +1,283 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Local stand-in for the S3 client used by the loader. Objects are files under <root>/<bucket>/<key>.
+# Only the subset of the boto3 S3 client API used by the loader is implemented.
+# latency and bandwidth can be set to simulate the cost of real S3 requests in benchmarks, prefix_rps answers SlowDown
+# above that many requests per second and prefix like S3 does before it scales a prefix out.
+# With a rate controller set, every request takes a token of its prefix and throttled requests are retried with
+# backoff up to s3_rate.MAX_ATTEMPTS times, the same way the controller works with the boto3 client.
+# put_object takes IfMatch and IfNoneMatch="*" like S3 conditional writes, atomic within one process.
+# User metadata (Metadata) is kept as json under <root>/.metadata/<bucket>/<key> and copied with the object.
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+import s3_rate
+
+
+class LocalS3Client:
+    # conditional puts are checked and applied under one lock for every client of the process, like one bucket
+    write_lock = threading.Lock()
+
+    def __init__(self, root: str, latency: float = 0.0, bandwidth: float = 0.0, prefix_rps: float = 0.0,
+                 rate=None) -> None:
+        self.root = Path(root)
+        # seconds added to every request
+        self.latency = latency
+        # bytes per second per transfer, 0 means unlimited
+        self.bandwidth = bandwidth
+        # requests per second and prefix before SlowDown, 0 means unlimited
+        self.prefix_rps = prefix_rps
+        self.prefix_capacity = {}
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.throttle_count = 0
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def _over_capacity(self, prefix: str) -> bool:
+        if not self.prefix_rps:
+            return False
+        with self.lock:
+            if prefix not in self.prefix_capacity:
+                self.prefix_capacity[prefix] = s3_rate.TokenBucket(self.prefix_rps)
+            bucket = self.prefix_capacity[prefix]
+        return bucket.try_take() > 0
+
+    def _simulate(self, operation: str, bucket: str, key: str, nbytes: int = 0) -> None:
+        prefix = s3_rate.prefix_of(bucket, key)
+        attempt = 1
+        while True:
+            if self.rate:
+                self.rate.acquire(prefix)
+            with self.lock:
+                self.request_count += 1
+            throttled = self._over_capacity(prefix)
+            if self.rate:
+                self.rate.record(prefix, throttled)
+            if not throttled:
+                break
+            with self.lock:
+                self.throttle_count += 1
+            if not self.rate or attempt >= s3_rate.MAX_ATTEMPTS:
+                raise self._error("SlowDown", operation, "Please reduce your request rate.")
+            # full jitter exponential backoff like the botocore standard retry mode
+            time.sleep(random.uniform(0, min(20.0, 2 ** attempt * 0.05)))
+            attempt += 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes / self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def _error(self, code: str, operation: str, message: str = "") -> ClientError:
+        return ClientError({"Error": {"Code": code, "Message": message or code}}, operation)
+
+    def _existing(self, bucket: str, key: str, operation: str) -> Path:
+        path = self._path(bucket, key)
+        if not path.is_file():
+            raise self._error("NoSuchKey" if operation != "HeadObject" else "404", operation, f"{bucket}/{key}")
+        return path
+
+    def _set_metadata(self, bucket: str, key: str, metadata: dict) -> None:
+        path = self.root / ".metadata" / bucket / key
+        if metadata:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(metadata))
+        elif path.is_file():
+            path.unlink()
+
+    def _metadata(self, bucket: str, key: str) -> dict:
+        path = self.root / ".metadata" / bucket / key
+        return json.loads(path.read_text()) if path.is_file() else {}
+
+    @staticmethod
+    def _etag(path: Path) -> str:
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                md5.update(block)
+        return f'"{md5.hexdigest()}"'
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, ExtraArgs=None, Callback=None, Config=None) -> None:
+        path = self._existing(Bucket, Key, "GetObject")
+        self._simulate("GetObject", Bucket, Key, path.stat().st_size)
+        shutil.copyfile(path, Filename)
+        if Callback:
+            Callback(path.stat().st_size)
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, ExtraArgs=None, Callback=None, Config=None) -> None:
+        size = os.path.getsize(Filename)
+        self._simulate("PutObject", Bucket, Key, size)
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp name first so readers never see a partial object
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        shutil.copyfile(Filename, tmp)
+        os.replace(tmp, path)
+        self._set_metadata(Bucket, Key, (ExtraArgs or {}).get("Metadata"))
+        if Callback:
+            Callback(size)
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **kwargs) -> dict:
+        path = self._existing(Bucket, Key, "GetObject")
+        data = path.read_bytes()
+        # the ETag of the bytes read, a put in between must not pair old data with the new ETag
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if Range:
+            # only "bytes=start-end" and "bytes=start-" are supported
+            start, _, end = Range.split("=", 1)[1].partition("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        self._simulate("GetObject", Bucket, Key, len(data))
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ETag": etag,
+                "Metadata": self._metadata(Bucket, Key)}
+
+    def _check_md5(self, body: bytes, content_md5: str, operation: str) -> None:
+        if content_md5 and base64.b64encode(hashlib.md5(body).digest()).decode() != content_md5:
+            raise self._error("BadDigest", operation, "The Content-MD5 you specified did not match what we received.")
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", ContentMD5: str = None, **kwargs) -> dict:
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        self._simulate("PutObject", Bucket, Key, len(Body))
+        self._check_md5(Body, ContentMD5, "PutObject")
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(Body)
+        with self.write_lock:
+            if_match, if_none_match = kwargs.get("IfMatch"), kwargs.get("IfNoneMatch")
+            if (if_none_match == "*" and path.is_file()) or (if_match and (not path.is_file() or self._etag(path) != if_match)):
+                tmp.unlink()
+                raise self._error("PreconditionFailed", "PutObject", "At least one of the pre-conditions you specified did not hold")
+            os.replace(tmp, path)
+        self._set_metadata(Bucket, Key, kwargs.get("Metadata"))
+        return {"ETag": self._etag(path)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        path = self._existing(Bucket, Key, "HeadObject")
+        self._simulate("HeadObject", Bucket, Key)
+        return {"ContentLength": path.stat().st_size, "ETag": self._etag(path), "Metadata": self._metadata(Bucket, Key)}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._simulate("DeleteObject", Bucket, Key)
+        path = self._path(Bucket, Key)
+        if path.is_file():
+            path.unlink()
+        self._set_metadata(Bucket, Key, None)
+        return {}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, **kwargs) -> dict:
+        src = self._existing(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        self._simulate("CopyObject", Bucket, Key)
+        dst = self._path(Bucket, Key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dst)
+        self._set_metadata(Bucket, Key, kwargs.get("Metadata") if kwargs.get("MetadataDirective") == "REPLACE"
+                           else self._metadata(CopySource["Bucket"], CopySource["Key"]))
+        return {"CopyObjectResult": {"ETag": self._etag(dst)}}
+
+    def copy(self, CopySource: dict, Bucket: str, Key: str, ExtraArgs=None, Callback=None, SourceClient=None,
+             Config=None) -> None:
+        if SourceClient is None or SourceClient.root == self.root:
+            self.copy_object(Bucket=Bucket, Key=Key, CopySource=CopySource)
+            return
+        # a stand-in of another region, S3 copies across regions server side
+        src = SourceClient._existing(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        self._simulate("CopyObject", Bucket, Key)
+        self.put_object(Bucket, Key, src.read_bytes(),
+                        Metadata=SourceClient._metadata(CopySource["Bucket"], CopySource["Key"]))
+
+    # multipart uploads keep their parts under <root>/.multipart/<upload id>/ until they are completed
+    def _upload_dir(self, upload_id: str, operation: str) -> Path:
+        path = self.root / ".multipart" / upload_id
+        if not path.is_dir():
+            raise self._error("NoSuchUpload", operation, upload_id)
+        return path
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._simulate("CreateMultipartUpload", Bucket, Key)
+        upload_id = uuid.uuid4().hex
+        (self.root / ".multipart" / upload_id).mkdir(parents=True)
+        (self.root / ".multipart" / f"{upload_id}.json").write_text(json.dumps(kwargs.get("Metadata") or {}))
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body=b"", ContentMD5: str = None,
+                    **kwargs) -> dict:
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        self._simulate("UploadPart", Bucket, Key, len(Body))
+        self._check_md5(Body, ContentMD5, "UploadPart")
+        path = self._upload_dir(UploadId, "UploadPart") / f"{PartNumber:05d}"
+        path.write_bytes(Body)
+        return {"ETag": self._etag(path)}
+
+    def list_parts(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._simulate("ListParts", Bucket, Key)
+        parts = [{"PartNumber": int(p.name), "ETag": self._etag(p), "Size": p.stat().st_size}
+                 for p in sorted(self._upload_dir(UploadId, "ListParts").iterdir())]
+        return {"Parts": parts, "IsTruncated": False}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs) -> dict:
+        upload_dir = self._upload_dir(UploadId, "CompleteMultipartUpload")
+        md5s = b""
+        body = b""
+        for part in MultipartUpload["Parts"]:
+            path = upload_dir / f"{part['PartNumber']:05d}"
+            if not path.is_file() or self._etag(path) != part["ETag"]:
+                raise self._error("InvalidPart", "CompleteMultipartUpload", str(part["PartNumber"]))
+            data = path.read_bytes()
+            md5s += hashlib.md5(data).digest()
+            body += data
+        metadata_path = upload_dir.with_name(f"{UploadId}.json")
+        self.put_object(Bucket, Key, body, Metadata=json.loads(metadata_path.read_text()) if metadata_path.is_file() else None)
+        shutil.rmtree(upload_dir)
+        metadata_path.unlink(missing_ok=True)
+        return {"Bucket": Bucket, "Key": Key, "ETag": f'"{hashlib.md5(md5s).hexdigest()}-{len(MultipartUpload["Parts"])}"'}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._simulate("AbortMultipartUpload", Bucket, Key)
+        shutil.rmtree(self._upload_dir(UploadId, "AbortMultipartUpload"))
+        (self.root / ".multipart" / f"{UploadId}.json").unlink(missing_ok=True)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", StartAfter: str = "", ContinuationToken: str = None,
+                        MaxKeys: int = 1000, **kwargs) -> dict:
+        self._simulate("ListObjectsV2", Bucket, Prefix)
+        base = self.root / Bucket
+        keys = []
+        if base.is_dir():
+            for path in base.rglob("*"):
+                if path.is_file() and not path.name.startswith("."):
+                    key = path.relative_to(base).as_posix()
+                    if key.startswith(Prefix):
+                        keys.append(key)
+        keys.sort()
+        after = ContinuationToken or StartAfter
+        if after:
+            keys = [k for k in keys if k > after]
+        page = keys[:MaxKeys]
+        resp = {"KeyCount": len(page), "IsTruncated": len(keys) > MaxKeys,
+                "Contents": [{"Key": k, "Size": self._path(Bucket, k).stat().st_size} for k in page]}
+        if resp["IsTruncated"]:
+            resp["NextContinuationToken"] = page[-1]
+        return resp
@@ -0,0 +1,185 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Manifest of the DELTA files published to an output prefix, the latest state with one GET instead of a listing
+# s3://<output bucket>/<MANIFEST_PREFIX>/<output prefix>/latest.json (default prefix manifest) has
+# - latest: the DELTA file with the greatest name, its logical_commit_time range, row count, size and sha256
+# - last: the file recorded last, count: the files recorded, and the row count and logical_commit_time range of all of them
+# It is written with a conditional put after every publish, so tasks publishing at the same time never lose an update.
+# Every recorded file also gets a line in the append-only index <MANIFEST_PREFIX>/<output prefix>/index/<segment>.jsonl,
+# INDEX_SEGMENT_ENTRIES (1000) files per segment in sequence order. The index line is written after the manifest,
+# the next record adds the line of the last file when a task stopped in between. A file recorded again with the same
+# sha256 while it is still the last or the latest one, a retried publish, is not counted twice; a file published again
+# with other content, or after other files were recorded, gets a new entry. MANIFEST=0 turns it off.
+# papi-delta-manifest.py prints the manifest and the index, and rebuilds both from a listing of the prefix.
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+import delta_index
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("MANIFEST", "1") == "1"
+MANIFEST_PREFIX = os.getenv("MANIFEST_PREFIX", "manifest")
+MANIFEST_VERSION = 1
+INDEX_SEGMENT_ENTRIES = 1000
+# conditional writes that lost to another task before giving up, with a random wait growing by BACKOFF_SECONDS
+ATTEMPTS = 20
+BACKOFF_SECONDS = 0.05
+HASH_BLOCK_BYTES = 1 << 20
+
+def manifest_key(out_prefix: str) -> str:
+    return f"{MANIFEST_PREFIX}/{out_prefix}/latest.json"
+
+def segment_key(out_prefix: str, segment: int) -> str:
+    return f"{MANIFEST_PREFIX}/{out_prefix}/index/{segment:08d}.jsonl"
+
+def is_conflict(e: ClientError) -> bool:
+    return e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict")
+
+def describe(delta_path: str, csv_path: str = None, sidecar: dict = None) -> dict:
+    """
+    Manifest entry of a DELTA file before it is published, the row statistics come from the sidecar or the input csv
+    """
+    stats = sidecar if sidecar is not None else delta_index.csv_stats(csv_path)
+    digest = hashlib.sha256()
+    with open(delta_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return {"row_count": stats["row_count"], "min_logical_commit_time": stats["min_logical_commit_time"],
+            "max_logical_commit_time": stats["max_logical_commit_time"], "bytes": os.path.getsize(delta_path),
+            "sha256": digest.hexdigest()}
+
+def read(s3, bucket: str, key: str) -> tuple:
+    """
+    (object, ETag), ({}, None) when it does not exist yet
+    """
+    try:
+        resp = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}, None
+    return json.loads(resp["Body"].read()), resp["ETag"]
+
+def read_manifest(s3, bucket: str, out_prefix: str) -> dict:
+    return read(s3, bucket, manifest_key(out_prefix))[0]
+
+def backoff(attempt: int) -> None:
+    # spreads the next attempts of the tasks that lost
+    time.sleep(random.uniform(0, BACKOFF_SECONDS * (attempt + 1)))
+
+def put_if(s3, bucket: str, key: str, body: bytes, etag: str) -> None:
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    s3.put_object(Bucket=bucket, Key=key, Body=body, **condition)
+
+def read_segment(s3, bucket: str, key: str) -> tuple:
+    try:
+        resp = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return [], None
+    return [json.loads(line) for line in resp["Body"].read().decode().splitlines() if line], resp["ETag"]
+
+def append_index(s3, bucket: str, out_prefix: str, entry: dict) -> None:
+    """
+    Adds the entry to its index segment unless it is there already
+    """
+    key = segment_key(out_prefix, (entry["sequence"] - 1) // INDEX_SEGMENT_ENTRIES)
+    for attempt in range(ATTEMPTS):
+        entries, etag = read_segment(s3, bucket, key)
+        if any(e["sequence"] == entry["sequence"] for e in entries):
+            return
+        entries = sorted(entries + [entry], key=lambda e: e["sequence"])
+        body = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries).encode()
+        try:
+            put_if(s3, bucket, key, body, etag)
+        except ClientError as e:
+            if not is_conflict(e):
+                raise
+            backoff(attempt)
+            continue
+        return
+    raise RuntimeError(f"index segment {key} kept changing, entry {entry['sequence']} not added")
+
+def updated(manifest: dict, entry: dict) -> dict:
+    latest = manifest.get("latest")
+    # a file published again replaces its own entry as the latest
+    if latest is None or entry["key"] >= latest["key"]:
+        latest = entry
+    times = [t for t in (manifest.get("min_logical_commit_time"), entry["min_logical_commit_time"]) if t is not None]
+    max_times = [t for t in (manifest.get("max_logical_commit_time"), entry["max_logical_commit_time"]) if t is not None]
+    return {"version": MANIFEST_VERSION, "count": entry["sequence"], "latest": latest, "last": entry,
+            "row_count": manifest.get("row_count", 0) + entry["row_count"],
+            "min_logical_commit_time": min(times) if times else None,
+            "max_logical_commit_time": max(max_times) if max_times else None,
+            "index_segment_entries": INDEX_SEGMENT_ENTRIES, "updated_at": entry["published_at"]}
+
+def recorded(manifest: dict, delta_key: str, description: dict) -> bool:
+    return any(manifest.get(field) and manifest[field]["key"] == delta_key
+               and manifest[field].get("sha256") == description.get("sha256") for field in ("last", "latest"))
+
+def record(s3, bucket: str, delta_key: str, description: dict) -> dict:
+    """
+    Records a published DELTA file (description from describe) in the manifest and the index of its prefix
+    Returns the new manifest, raises RuntimeError when other tasks kept winning the conditional write
+    """
+    if not ENABLED:
+        return {}
+    out_prefix = delta_key.rsplit("/", 1)[0]
+    key = manifest_key(out_prefix)
+    for attempt in range(ATTEMPTS):
+        manifest, etag = read(s3, bucket, key)
+        if manifest.get("last"):
+            # the task that wrote it may have stopped before its index line
+            append_index(s3, bucket, out_prefix, manifest["last"])
+        if recorded(manifest, delta_key, description):
+            logger.info(f"manifest: {delta_key} is recorded already with the same sha256")
+            return manifest
+        entry = {"sequence": manifest.get("count", 0) + 1, "key": delta_key, **description, "published_at": round(time.time(), 3)}
+        manifest = updated(manifest, entry)
+        try:
+            put_if(s3, bucket, key, json.dumps(manifest, separators=(",", ":")).encode(), etag)
+        except ClientError as e:
+            # another task recorded a file since it was read, read it again
+            if not is_conflict(e):
+                raise
+            backoff(attempt)
+            continue
+        append_index(s3, bucket, out_prefix, entry)
+        logger.info(f"manifest: {delta_key} is file {entry['sequence']}, latest {manifest['latest']['key']}")
+        return manifest
+    raise RuntimeError(f"manifest {key} kept changing, {delta_key} not recorded")
+
+def record_file(s3, bucket: str, delta_key: str, delta_path: str, csv_path: str = None, sidecar: dict = None) -> dict:
+    """
+    record of a DELTA file still on the local disk, nothing is read when the manifest is off
+    """
+    if not ENABLED:
+        return {}
+    return record(s3, bucket, delta_key, describe(delta_path, csv_path, sidecar))
+
+def read_index(s3, bucket: str, out_prefix: str) -> list:
+    """
+    Entries of every recorded file in sequence order
+    """
+    manifest = read_manifest(s3, bucket, out_prefix)
+    count = manifest.get("count", 0)
+    entries = []
+    for segment in range((count + INDEX_SEGMENT_ENTRIES - 1) // INDEX_SEGMENT_ENTRIES):
+        entries.extend(read_segment(s3, bucket, segment_key(out_prefix, segment))[0])
+    entries = [e for e in entries if e["sequence"] <= count]
+    if count and (not entries or entries[-1]["sequence"] != count):
+        entries.append(manifest["last"])
+    return entries
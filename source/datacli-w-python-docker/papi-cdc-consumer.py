@@ -0,0 +1,37 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Change data capture consumer, publishes the changes of a stream as DELTA files, see cdc_source.py
+# Runs as a service of the loader image with the command /app/papi-cdc-consumer.py.
+# CDC_STREAM is the stream, OUT_BUCKET and OUT_KEY the output of the loader, CDC_RUN_SECONDS (default 0, until
+# SIGTERM) how long it runs. On SIGTERM the buffered changes are published and the checkpoint saved before it exits.
+# example: CDC_STREAM=kinesis:kv-changes OUT_BUCKET=<output bucket> OUT_KEY=<output prefix> CDC_WINDOW_SECONDS=30 python papi-cdc-consumer.py
+import logging
+import os
+from sys import exit
+
+from botocore.exceptions import ClientError
+
+import cdc_source
+import checkpoint
+from s3_client import get_s3_client
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    spec = os.getenv("CDC_STREAM")
+    if not spec:
+        logging.error("CDC_STREAM is not set")
+        exit(1)
+    checkpoint.install_sigterm_handler()
+    try:
+        consumer = cdc_source.Consumer(cdc_source.open_stream(spec), get_s3_client(), os.getenv("OUT_BUCKET"),
+                                       os.getenv("OUT_KEY"), os.getenv("WORK_DIR", "/tools"))
+        consumer.run(checkpoint.stop, float(os.getenv("CDC_RUN_SECONDS", "0")))
+    except (ClientError, RuntimeError, ValueError) as e:
+        logging.error(f"consumer of {spec} failed: {e}")
+        exit(1)
+    logging.info(f"consumer of {spec} stopped, positions saved to {cdc_source.CHECKPOINT_KEY}")
@@ -0,0 +1,39 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Full reload of the KV data from a DynamoDB table, see ddb_source.py
+# Runs as a task of the loader image with the command overridden to /app/papi-ddb-source.py.
+# SOURCE_TABLE is the table, OUT_BUCKET and OUT_KEY the output of the loader,
+# CONVERT_CONCURRENCY (default the cpu count) the csv parts converted and published at a time.
+# example: SOURCE_TABLE=kv-source OUT_BUCKET=<output bucket> OUT_KEY=<output prefix> SOURCE_SEGMENTS=16 SOURCE_READ_CAPACITY=2000 python papi-ddb-source.py
+import logging
+import os
+from sys import exit
+
+from botocore.exceptions import ClientError
+
+import ddb_source
+import delta_compression
+from s3_client import get_s3_client
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    table = os.getenv("SOURCE_TABLE")
+    if not table:
+        logging.error("SOURCE_TABLE is not set")
+        exit(1)
+    workers = int(os.getenv("CONVERT_CONCURRENCY", "0")) or os.cpu_count() or 1
+    try:
+        delta_compression.check()
+        stats = ddb_source.reload(get_s3_client(), table, os.getenv("OUT_BUCKET"), os.getenv("OUT_KEY"),
+                                  os.getenv("WORK_DIR", "/tools"), workers)
+    except (ClientError, RuntimeError, ValueError) as e:
+        logging.error(f"reload of {table} failed: {e}")
+        exit(1)
+    logging.info(f"reloaded {stats['rows']} rows of {table} in to {len(stats['keys'])} DELTA files, "
+                 f"{stats['skipped']} items without {ddb_source.KEY_ATTRIBUTE} or {ddb_source.VALUE_ATTRIBUTE} skipped, "
+                 f"{stats['capacity_units']:.0f} read capacity units")
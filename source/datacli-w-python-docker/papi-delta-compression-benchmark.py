@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Compares DELTA_COMPRESSION settings on synthetic datasets, see delta_compression.py
+# Every --dataset (rows:value size in bytes) is generated with synthetic_data and converted once by data cli.
+# For every --setting the DELTA file is rewritten with that compression and the report shows per dataset and setting
+# - the file size and its ratio to the data cli output
+# - the encode seconds, the data cli conversion plus the rewrite, what the loader spends on a file
+# - the decode seconds, reading every record back, what every KV server spends on a file when it loads
+# - the transfer seconds of the file at --transfer-mbps, to S3 and from S3 to every server
+# The times are the median of --repeat runs. Needs data cli (--data-cli or DATA_CLI_PATH) and riegeli.
+# example: python papi-delta-compression-benchmark.py --dataset 200000:64 --dataset 20000:2048 --out compression.json
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_SETTINGS = ["data-cli", "uncompressed", "snappy", "brotli:1", "brotli:6", "brotli:9", "zstd:1", "zstd:3", "zstd:9"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DELTA file compression benchmark")
+    parser.add_argument("--dataset", action="append", help="rows:value size in bytes, default 100000:64 and 20000:1024")
+    parser.add_argument("--setting", action="append", help=f"DELTA_COMPRESSION values, default {' '.join(DEFAULT_SETTINGS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per setting, the median is reported")
+    parser.add_argument("--transfer-mbps", type=float, default=500, help="network throughput for the transfer estimate")
+    parser.add_argument("--data-cli", default="", help="path of the data cli binary, default DATA_CLI_PATH")
+    parser.add_argument("--out", help="write the results to this json file")
+    return parser.parse_args()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main() -> None:
+    args = parse_args()
+    if args.data_cli:
+        # data_cli reads it at import time
+        os.environ["DATA_CLI_PATH"] = args.data_cli
+    sys.path.insert(0, str(Path(__file__).parent))
+    import delta_compression
+    from data_cli import format_data_cmd
+    from synthetic_data import generate_csv
+
+    if not delta_compression.riegeli_installed():
+        raise SystemExit("riegeli is not installed, pip install -r requirements-compression.txt")
+    settings = [delta_compression.parse(setting) for setting in args.setting or DEFAULT_SETTINGS]
+    tmp = Path(tempfile.mkdtemp(prefix="papi-delta-compression-bench-"))
+    results = []
+    try:
+        for dataset in args.dataset or ["100000:64", "20000:1024"]:
+            rows, value_size = (int(part) for part in dataset.split(":"))
+            csv_path, delta_path = tmp / f"{dataset.replace(':', '-')}.csv", tmp / f"{dataset.replace(':', '-')}.csv_DELTA"
+            generate_csv(str(csv_path), rows, value_size=value_size)
+            convert_seconds = []
+            for _ in range(args.repeat):
+                seconds, out = timed(lambda: subprocess.run(format_data_cmd(str(csv_path), str(delta_path)),
+                                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+                if out.returncode != 0:
+                    raise SystemExit(f"data cli exited with {out.returncode}: {out.stdout.decode(errors='replace')}")
+                convert_seconds.append(seconds)
+            base_size = delta_path.stat().st_size
+            records = delta_compression.count_records(str(delta_path))
+            print(f"\n{dataset}: {rows} rows of {value_size} byte values, csv {csv_path.stat().st_size / 1e6:.1f} MB, "
+                  f"{records} records")
+            print(f"  {'setting':<14}{'MB':>9}{'ratio':>7}{'encode s':>10}{'decode s':>10}{'transfer s':>12}")
+            for setting in settings:
+                encode_seconds, decode_seconds = [], []
+                path = tmp / "rewritten_DELTA"
+                for base in convert_seconds:
+                    shutil.copyfile(delta_path, path)
+                    encode_seconds.append(base + timed(delta_compression.recompress, str(path), setting)[0])
+                    seconds, count = timed(delta_compression.count_records, str(path))
+                    if count != records:
+                        raise SystemExit(f"{setting or delta_compression.UNCHANGED}: {count} records read back, {records} written")
+                    decode_seconds.append(seconds)
+                size = path.stat().st_size
+                result = {"dataset": dataset, "rows": rows, "value_size": value_size,
+                          "setting": setting or delta_compression.UNCHANGED, "bytes": size,
+                          "ratio": round(size / base_size, 4),
+                          "encode_seconds": round(statistics.median(encode_seconds), 4),
+                          "decode_seconds": round(statistics.median(decode_seconds), 4),
+                          "transfer_seconds": round(size * 8 / (args.transfer_mbps * 1e6), 4)}
+                results.append(result)
+                print(f"  {result['setting']:<14}{size / 1e6:>9.2f}{result['ratio']:>7.2f}{result['encode_seconds']:>10.3f}"
+                      f"{result['decode_seconds']:>10.3f}{result['transfer_seconds']:>12.3f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print("\nratio is the size over the data cli output, a server pays decode plus transfer once per file and restart")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"transfer_mbps": args.transfer_mbps, "repeat": args.repeat, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
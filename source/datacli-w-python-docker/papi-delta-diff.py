@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Diffs the key/value state served from two DELTA prefixes, e.g. a staging output prefix before it is promoted
+# Each prefix is resolved to its latest state per key: the DELTA files are converted to csv with data cli,
+# the rows are sorted by key and newest logical_commit_time first with an external sort, and the first row of
+# each key is kept unless it is a delete. The two sorted streams are then merged to find the keys that were
+# added, removed or changed in --prefix-b compared to --prefix-a.
+# Memory is bounded by --run-rows rows per prefix; the sort spills to --work-dir, which needs about the size
+# of the csv of one prefix.
+# Exits 0 when the states are the same and 1 when they differ, --out writes the differences as csv.
+# example: python papi-delta-diff.py --bucket mybucket --prefix-a output --prefix-b staging/output --out diff.csv
+import argparse
+import csv
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import delta_index
+import external_sort
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+# row layout in the sort
+KEY, COMMIT_TIME, MUTATION_TYPE, VALUE, VALUE_TYPE = range(5)
+DIFF_HEADER = ["change", "key", "old_value", "new_value", "old_value_type", "new_value_type",
+               "old_logical_commit_time", "new_logical_commit_time"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="diff of the latest key state of two DELTA prefixes")
+    parser.add_argument("--bucket", help="bucket of both prefixes")
+    parser.add_argument("--bucket-a", help="bucket of --prefix-a, default --bucket")
+    parser.add_argument("--bucket-b", help="bucket of --prefix-b, default --bucket")
+    parser.add_argument("--prefix-a", required=True, help="current state, e.g. the production output prefix")
+    parser.add_argument("--prefix-b", required=True, help="new state, e.g. the staging output prefix")
+    parser.add_argument("--out", help="csv file for the added, removed and changed keys")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="files downloaded and converted ahead")
+    parser.add_argument("--run-rows", type=int, default=1_000_000, help="rows sorted in memory at a time")
+    parser.add_argument("--work-dir", default=None, help="local scratch space, default a temp folder")
+    return parser.parse_args()
+
+def list_delta_keys(s3, bucket: str, prefix: str) -> list:
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in resp.get("Contents", []) if "DELTA" in obj["Key"].split("/")[-1]
+                    and not obj["Key"].endswith(delta_index.SIDECAR_SUFFIX))
+        if not resp.get("IsTruncated"):
+            return sorted(keys)
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+def to_csv(s3, bucket: str, key: str, tmp: str) -> str:
+    local_delta = os.path.join(tmp, f"{bucket}_{key}".replace("/", "_"))
+    local_csv = f"{local_delta}.csv"
+    s3.download_file(bucket, key, local_delta)
+    subprocess.run(format_data_cmd(local_delta, local_csv, input_format="DELTA", output_format="CSV"),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    os.remove(local_delta)
+    return local_csv
+
+def prefix_rows(s3, bucket: str, prefix: str, tmp: str, workers: int):
+    """
+    Yields the rows of every DELTA file under prefix, converting at most workers files ahead of the reader
+    """
+    keys = list_delta_keys(s3, bucket, prefix)
+    logger.info(f"{len(keys)} DELTA files under s3://{bucket}/{prefix}")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(keys)
+        pending = deque(pool.submit(to_csv, s3, bucket, key, tmp) for key in itertools.islice(remaining, workers))
+        while pending:
+            local_csv = pending.popleft().result()
+            for key in itertools.islice(remaining, 1):
+                pending.append(pool.submit(to_csv, s3, bucket, key, tmp))
+            with open(local_csv, newline="") as f:
+                for row in csv.DictReader(f):
+                    yield [row["key"], row["logical_commit_time"], row["mutation_type"], row.get("value", ""),
+                           row.get("value_type", "")]
+            os.remove(local_csv)
+
+def sort_key(row: list) -> tuple:
+    return row[KEY], -int(row[COMMIT_TIME])
+
+def newest_per_key(rows):
+    # rows sorted by sort_key, the first row of a key is its newest mutation
+    for _, group in itertools.groupby(rows, key=lambda row: row[KEY]):
+        yield next(group)
+
+def latest_state(s3, bucket: str, prefix: str, tmp: str, args):
+    """
+    Yields the served row of every key under prefix in key order, keys whose newest mutation is a delete are left out
+    """
+    work_dir = tempfile.mkdtemp(dir=tmp, prefix="sort-")
+    rows = external_sort.sort_rows(prefix_rows(s3, bucket, prefix, tmp, args.workers), sort_key, work_dir,
+                                   run_rows=args.run_rows, reduce=lambda run: list(newest_per_key(run)))
+    for row in newest_per_key(rows):
+        if row[MUTATION_TYPE].upper() != "DELETE":
+            yield row
+
+def diff(a, b):
+    """
+    Merges two key ordered latest states, yields (change, row a, row b) for every key in either
+    """
+    row_a, row_b = next(a, None), next(b, None)
+    while row_a is not None or row_b is not None:
+        if row_b is None or (row_a is not None and row_a[KEY] < row_b[KEY]):
+            yield "removed", row_a, None
+            row_a = next(a, None)
+        elif row_a is None or row_b[KEY] < row_a[KEY]:
+            yield "added", None, row_b
+            row_b = next(b, None)
+        else:
+            same = (row_a[VALUE], row_a[VALUE_TYPE]) == (row_b[VALUE], row_b[VALUE_TYPE])
+            yield "unchanged" if same else "changed", row_a, row_b
+            row_a, row_b = next(a, None), next(b, None)
+
+def diff_row(change: str, row_a: list, row_b: list) -> list:
+    a = row_a or [""] * 5
+    b = row_b or [""] * 5
+    return [change, (row_a or row_b)[KEY], a[VALUE], b[VALUE], a[VALUE_TYPE], b[VALUE_TYPE], a[COMMIT_TIME], b[COMMIT_TIME]]
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    bucket_a, bucket_b = args.bucket_a or args.bucket, args.bucket_b or args.bucket
+    if not bucket_a or not bucket_b:
+        sys.exit("give --bucket or --bucket-a and --bucket-b")
+    s3 = get_s3_client()
+    counts = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+    out = open(args.out, "w", newline="") if args.out else None
+    try:
+        writer = csv.writer(out) if out else None
+        if writer:
+            writer.writerow(DIFF_HEADER)
+        with tempfile.TemporaryDirectory(dir=args.work_dir, prefix="papi-diff-") as tmp:
+            state_a = latest_state(s3, bucket_a, args.prefix_a.rstrip("/") + "/", tmp, args)
+            state_b = latest_state(s3, bucket_b, args.prefix_b.rstrip("/") + "/", tmp, args)
+            for change, row_a, row_b in diff(state_a, state_b):
+                counts[change] += 1
+                if writer and change != "unchanged":
+                    writer.writerow(diff_row(change, row_a, row_b))
+    finally:
+        if out:
+            out.close()
+    print(" ".join(f"{change}={count}" for change, count in counts.items()))
+    sys.exit(1 if counts["added"] or counts["removed"] or counts["changed"] else 0)
+
+if __name__ == "__main__":
+    main()
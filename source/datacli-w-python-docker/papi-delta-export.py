@@ -0,0 +1,190 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Exports the DELTA files under an output prefix to Parquet, to reconcile what the KV servers serve with warehouse data
+# Every DELTA file is downloaded, converted back to csv with data cli and streamed in batches to
+# - <out prefix>/mutations/date=YYYY-MM-DD/<delta file>.parquet, every mutation partitioned by the UTC date of logical_commit_time
+# - <out prefix>/latest/part-NNNNN.parquet, the last mutation of every key that is not a delete, i.e. what the server serves
+# Files are processed by --workers threads with at most --convert-concurrency data cli processes, memory stays bounded by
+# the csv block size per worker. For the latest view every batch is reduced to the last mutation per key and spilled to
+# --latest-partitions local files by key hash, each is then reduced on its own.
+# needs pyarrow: pip install -r requirements-export.txt
+# example: python papi-delta-export.py --bucket mybucket --prefix output --out-prefix export
+import argparse
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import delta_index
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([("key", pa.string()), ("mutation_type", pa.string()), ("logical_commit_time", pa.int64()),
+                    ("value", pa.string()), ("value_type", pa.string())])
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DELTA to Parquet export")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="output", help="prefix of the DELTA files")
+    parser.add_argument("--out-bucket", help="default --bucket")
+    parser.add_argument("--out-prefix", default="export")
+    parser.add_argument("--workers", type=int, default=64, help="files processed concurrently")
+    parser.add_argument("--convert-concurrency", type=int, default=os.cpu_count() or 1, help="concurrent data cli processes")
+    parser.add_argument("--block-mb", type=int, default=16, help="csv bytes read per batch and worker")
+    parser.add_argument("--latest-partitions", type=int, default=64, help="key hash partitions of the latest view")
+    parser.add_argument("--work-dir", default=None, help="local scratch space, default a temp folder")
+    return parser.parse_args()
+
+def list_keys(s3, bucket: str, prefix: str) -> list:
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in resp.get("Contents", []))
+        if not resp.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+def is_delta_file(key: str) -> bool:
+    return "DELTA" in key.split("/")[-1] and not key.endswith(delta_index.SIDECAR_SUFFIX)
+
+def last_per_key(table: pa.Table) -> pa.Table:
+    """
+    Keeps the row with the highest logical_commit_time of every key
+    """
+    if table.num_rows == 0:
+        return table
+    table = table.sort_by([("key", "ascending"), ("logical_commit_time", "descending")])
+    keys = table["key"]
+    changed = pc.not_equal(keys.slice(1), keys.slice(0, len(keys) - 1))
+    return table.filter(pa.chunked_array([pa.array([True]), *changed.chunks]))
+
+class LatestSpill:
+    """
+    Local parquet files of last-per-key candidates, one per key hash partition
+    """
+
+    def __init__(self, work_dir: str, partitions: int) -> None:
+        self.paths = [os.path.join(work_dir, f"latest-{i:05d}.parquet") for i in range(partitions)]
+        self.writers = [None] * partitions
+        self.locks = [threading.Lock() for _ in range(partitions)]
+
+    def add(self, table: pa.Table) -> None:
+        # crc32 is stable across processes, pyarrow has no hash kernel for rows
+        parts = [zlib.crc32(k.encode()) % len(self.paths) for k in table["key"].to_pylist()]
+        part_array = pa.array(parts, pa.int32())
+        for i in set(parts):
+            with self.locks[i]:
+                if self.writers[i] is None:
+                    self.writers[i] = pq.ParquetWriter(self.paths[i], table.schema)
+                self.writers[i].write_table(table.filter(pc.equal(part_array, i)))
+
+    def close(self) -> list:
+        for writer in self.writers:
+            if writer:
+                writer.close()
+        return [path for path, writer in zip(self.paths, self.writers) if writer]
+
+def export_file(s3, args, key: str, work_dir: str, convert_slots: threading.Semaphore, spill: LatestSpill) -> int:
+    name = key[len(args.prefix):].strip("/").replace("/", "_")
+    local_delta = os.path.join(work_dir, name)
+    local_csv = f"{local_delta}.csv"
+    parquet_files = {}
+    try:
+        s3.download_file(args.bucket, key, local_delta)
+        with convert_slots:
+            subprocess.run(format_data_cmd(local_delta, local_csv, input_format="DELTA", output_format="CSV"),
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        os.remove(local_delta)
+        writers = {}
+        rows = 0
+        reader = pacsv.open_csv(local_csv, read_options=pacsv.ReadOptions(block_size=args.block_mb << 20),
+                                convert_options=pacsv.ConvertOptions(column_types=SCHEMA, include_columns=SCHEMA.names,
+                                                                     include_missing_columns=True))
+        for batch in reader:
+            table = pa.Table.from_batches([batch]).cast(SCHEMA)
+            rows += table.num_rows
+            dates = pc.strftime(table["logical_commit_time"].cast(pa.timestamp("us", tz="UTC")), format="%Y-%m-%d")
+            for date in pc.unique(dates).to_pylist():
+                if date not in writers:
+                    parquet_files[date] = f"{local_delta}.{date}.parquet"
+                    writers[date] = pq.ParquetWriter(parquet_files[date], SCHEMA)
+                writers[date].write_table(table.filter(pc.equal(dates, date)))
+            spill.add(last_per_key(table))
+        for date, writer in writers.items():
+            writer.close()
+            s3.upload_file(parquet_files[date], args.out_bucket, f"{args.out_prefix}/mutations/date={date}/{name}.parquet")
+        logger.info(f"{key}: {rows} rows in {len(writers)} date partitions")
+        return rows
+    finally:
+        for path in [local_delta, local_csv, *parquet_files.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+def write_latest(s3, args, spill_paths: list) -> int:
+    keys = 0
+    written = set()
+    for path in spill_paths:
+        latest = last_per_key(pq.read_table(path))
+        latest = latest.filter(pc.not_equal(pc.utf8_upper(latest["mutation_type"]), "DELETE"))
+        pq.write_table(latest, path)
+        part_key = f"{args.out_prefix}/latest/part-{os.path.basename(path).split('-')[1]}"
+        s3.upload_file(path, args.out_bucket, part_key)
+        written.add(part_key)
+        os.remove(path)
+        keys += latest.num_rows
+    # parts of an earlier export that this one did not write would add stale keys to the view
+    for stale in set(list_keys(s3, args.out_bucket, f"{args.out_prefix}/latest/")) - written:
+        s3.delete_object(Bucket=args.out_bucket, Key=stale)
+    return keys
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    args.out_bucket = args.out_bucket or args.bucket
+    args.prefix = args.prefix.rstrip("/") + "/"
+    s3 = get_s3_client()
+    out_prefix = f"{args.out_prefix.rstrip('/')}/"
+    keys = [key for key in list_keys(s3, args.bucket, args.prefix) if is_delta_file(key)
+            and not (args.out_bucket == args.bucket and key.startswith(out_prefix))]
+    logger.info(f"{len(keys)} DELTA files under {args.prefix}")
+    convert_slots = threading.Semaphore(args.convert_concurrency)
+    with tempfile.TemporaryDirectory(dir=args.work_dir, prefix="papi-export-") as work_dir:
+        files_dir = os.path.join(work_dir, "files")
+        os.makedirs(files_dir)
+        spill = LatestSpill(work_dir, args.latest_partitions)
+
+        def run(key: str) -> int:
+            try:
+                return export_file(s3, args, key, files_dir, convert_slots, spill)
+            except Exception as e:
+                logger.error(f"{key}: export failed: {e}")
+                return -1
+
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(run, keys))
+        spill_paths = spill.close()
+        failed = [key for key, rows in zip(keys, results) if rows < 0]
+        if failed:
+            # the latest view of a partial export would show stale values, it is only written when every file made it
+            raise SystemExit(f"{len(failed)} of {len(keys)} files failed, the latest view is not written")
+        latest_keys = write_latest(s3, args, spill_paths)
+    logger.info(f"exported {sum(results)} mutations of {len(keys)} files, {latest_keys} keys in the latest view")
+
+if __name__ == "__main__":
+    main()
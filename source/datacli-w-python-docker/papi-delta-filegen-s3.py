@@ -9,28 +9,179 @@
 # app takes four parameters
 # 1 s3 input bucket 2 key with file name for input
 # 3 s3 output bucket 4 key *without* file name for output
-import boto3
+# If the input key ends with "/" every .csv object under that prefix is converted
+# LOADER_MODE=async (default) runs downloads, conversions and uploads concurrently, LOADER_MODE=sync runs them one at a time
+# LEDGER_TABLE claims the input object version in the job ledger first, a duplicate task for the same object exits, see job_ledger.py
+# CHECKPOINT=1 saves progress to S3 so a run stopped by SIGTERM (Fargate Spot) resumes where it stopped, see checkpoint.py
+# PROFILE=1 records a profile of the run and data cli resource usage to the output bucket, see profiling.py
+# TRACE_EXPORTER traces the run from the S3 event to the published output and logs the data freshness, see tracing.py
+# EXPIRY_COLUMN in the input csv registers keys for the expiry sweep, see expiry.py
+# MANIFEST=1 (default) records every published DELTA file in the manifest of the output prefix, see manifest.py
+# JOB_HISTORY=1 (default) records the input size, settings and stage timings of the run for the tuner, see job_history.py
 import os
 import logging
 from pathlib import Path
 import datetime
 from botocore.exceptions import ClientError, ParamValidationError
 import subprocess
-from shlex import split
 from sys import exit
 
+import async_core
+import checkpoint
+import delta_compression
+import delta_index
+import delta_verify
+import expiry
+import job_history
+import job_ledger
+import manifest
+import profiling
+import replication
+import s3_rate
+import startup
+import tracing
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
 logger = logging.getLogger(__name__)
 
+# local scratch space for input and output files
+work_dir = os.getenv("WORK_DIR", "/tools")
+# number of concurrent S3 transfers per stage and data cli processes in async mode, 0 means one per cpu
+transfer_concurrency = int(os.getenv("TRANSFER_CONCURRENCY", "4"))
+convert_concurrency = int(os.getenv("CONVERT_CONCURRENCY", "0"))
+# max files waiting between two stages
+stage_queue_size = int(os.getenv("STAGE_QUEUE_SIZE", "2"))
+# write the <file>_DELTA.index.json sidecar with row stats and a key bloom filter next to each output
+write_sidecar = os.getenv("DELTA_INDEX", "1") == "1"
+# checkpoint and resume in async mode, inputs larger than SHARD_MB are converted in shards
+checkpoint_enabled = os.getenv("CHECKPOINT", "0") == "1"
+
+def tuned_settings() -> dict:
+    # the settings papi-loader-tune.py compares, as configured for this run
+    return {"TASK_CPU": int(os.getenv("TASK_CPU", "0")), "TASK_MEMORY": int(os.getenv("TASK_MEMORY", "0")),
+            "LOADER_MODE": os.getenv("LOADER_MODE", "async"), "TRANSFER_CONCURRENCY": transfer_concurrency,
+            "CONVERT_CONCURRENCY": convert_concurrency, "UPLOAD_PART_MB": delta_verify.UPLOAD_PART_BYTES // delta_verify.MIB,
+            "UPLOAD_PART_CONCURRENCY": delta_verify.UPLOAD_PART_CONCURRENCY,
+            "DELTA_COMPRESSION": delta_compression.COMPRESSION or delta_compression.UNCHANGED,
+            **({"SHARD_MB": checkpoint.SHARD_BYTES // checkpoint.MIB, "MULTIPART_PART_MB": checkpoint.PART_BYTES // checkpoint.MIB}
+               if checkpoint_enabled else {})}
+
 def app(inps3bucket: str,inps3key: str,outs3bucket: str,outs3key: str) -> None:
-    inpfile = s32local(inps3bucket, inps3key)
+    with profiling.stage("download", inps3key):
+        inpfile = s32local(inps3bucket, inps3key)
+        entries = strip_expiry(inpfile)
     ifname = get_file_name(inpfile)
-    outfile = f"/tools/{ifname}_DELTA"
-    # cmd = f'cp "{inpfile}" "{outfile}"'
-    cmd_str = f"/tools/data_cli/data_cli format_data --input_file={inpfile} --input_format=CSV --output_file={outfile} --output_format=DELTA"
-    cmd = split(cmd_str)
-    # cmd = ["/tools/data_cli/data_cli", "format_data", f"--input_file={inpfile}", "--input_format=CSV", f"--output_file={outfile}", "--output_format=DELTA"]
-    run_command(cmd)
-    local2s3(outs3bucket, outs3key, outfile)
+    outfile = f"{work_dir}/{ifname}_DELTA"
+    cmd = format_data_cmd(inpfile, outfile)
+    with profiling.stage("convert", inps3key):
+        run_command(profiling.wrap(cmd, inps3key))
+        delta_compression.recompress(outfile)
+    with profiling.stage("upload", inps3key):
+        local2s3(outs3bucket, outs3key, outfile, inpfile)
+    sidecar = None
+    if write_sidecar:
+        with profiling.stage("index", inps3key):
+            sidecar = delta_index.build_sidecar(inpfile, source=f"s3://{inps3bucket}/{inps3key}")
+            put_sidecar(outs3bucket, f"{outs3key}/{get_file_name(outfile)}", sidecar)
+    if entries:
+        put_expiry_entries(outs3bucket, f"{outs3key}/{get_file_name(outfile)}", entries)
+    record_manifest(outs3bucket, f"{outs3key}/{get_file_name(outfile)}", outfile, inpfile, sidecar)
+    replicate(outs3bucket, async_core.published_keys(f"{outs3key}/{get_file_name(outfile)}", write_sidecar))
+
+def app_async(inps3bucket: str,inps3key: str,outs3bucket: str,outs3key: str) -> None:
+    inp_keys = list_input_keys(inps3bucket, inps3key)
+    progress = None
+    if checkpoint_enabled:
+        if not inps3key.endswith("/") and get_object_head(inps3bucket, inps3key)["ContentLength"] > checkpoint.SHARD_BYTES:
+            app_sharded(inps3bucket, inps3key, outs3bucket, outs3key)
+            return
+        if inps3key.endswith("/"):
+            progress = checkpoint.KeyProgress(get_s3_client(), inps3bucket, inps3key)
+            logger.info(f"{len(progress.done)} input files done by an earlier run")
+            inp_keys = [key for key in inp_keys if key not in progress.done]
+    jobs = [async_core.Job(inps3bucket, key, outs3bucket, outs3key) for key in inp_keys]
+    async_core.run(jobs, get_s3_client(), work_dir, transfer_concurrency, convert_concurrency, stage_queue_size, write_sidecar,
+                   on_done=(lambda job: progress.record(job.inp_key)) if progress else None, stop_event=checkpoint.stop)
+    failed = [job for job in jobs if job.error]
+    logger.info(f"converted {len(jobs) - len(failed)} of {len(jobs)} files")
+    if failed:
+        exit(1)
+    if progress:
+        progress.finish()
+
+def app_sharded(inps3bucket: str,inps3key: str,outs3bucket: str,outs3key: str) -> None:
+    output_key = f"{outs3key}/{get_file_name(inps3key)}_DELTA"
+    try:
+        keys = checkpoint.run_sharded(get_s3_client(), inps3bucket, inps3key, outs3bucket, output_key, work_dir,
+                                      workers=convert_concurrency or os.cpu_count() or 1, sidecar=write_sidecar)
+    except checkpoint.Interrupted:
+        logger.warning("interrupted, progress is saved in the checkpoint and the next run resumes from it")
+        exit(1)
+    except (ClientError, RuntimeError, ValueError) as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+    logger.info(f"converted {inps3key} in to {len(keys)} DELTA files")
+    replicate(outs3bucket, [key for delta_key in keys for key in async_core.published_keys(delta_key, write_sidecar)])
+
+def get_object_head(s3bucket: str, s3key: str) -> dict:
+    try:
+        return get_s3_client().head_object(Bucket=s3bucket, Key=s3key)
+    except ClientError as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+
+def claim_job(ledger, inps3bucket: str,inps3key: str,outs3bucket: str,outs3key: str) -> job_ledger.Claim:
+    # the job is the object version, a new upload of the same key is a new job
+    head = get_object_head(inps3bucket, inps3key)
+    claim = job_ledger.Claim(ledger, job_ledger.job_id(inps3bucket, inps3key, head["ETag"]))
+    try:
+        claimed = claim.acquire(input_bytes=head["ContentLength"],
+                                output=f"s3://{outs3bucket}/{outs3key}/{get_file_name(inps3key)}_DELTA")
+        if not claimed:
+            job = ledger.get(claim.job) or {}
+            logger.info(f"job {claim.job} is {job.get('state')} in task {job.get('owner')}, nothing to do")
+            exit(0)
+    except ClientError as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+    return claim
+
+def run_claimed(claim: job_ledger.Claim, run, *args) -> None:
+    # records the outcome of the run in the ledger, exit(1) of the app functions or any other exception is a failed
+    # or interrupted job, so the job can be claimed again right away instead of after the lease expired
+    try:
+        run(*args)
+    except SystemExit as e:
+        if e.code:
+            claim.finish(job_ledger.INTERRUPTED if checkpoint.stop.is_set() else job_ledger.FAILED, error=f"exit code {e.code}")
+        else:
+            claim.finish(job_ledger.SUCCEEDED)
+        raise
+    except Exception as e:
+        claim.finish(job_ledger.INTERRUPTED if checkpoint.stop.is_set() else job_ledger.FAILED, error=f"{type(e).__name__}: {e}")
+        raise
+    claim.finish(job_ledger.SUCCEEDED)
+
+def list_input_keys(s3bucket: str, s3key: str) -> list:
+    # a single object key is used as is, a prefix is expanded to the csv files under it
+    if not s3key.endswith("/"):
+        return [s3key]
+    s3 = get_s3_client()
+    keys = []
+    kwargs = {"Bucket": s3bucket, "Prefix": s3key}
+    try:
+        while True:
+            resp = s3.list_objects_v2(**kwargs)
+            keys.extend(obj["Key"] for obj in resp.get("Contents", []) if obj["Key"].endswith(".csv"))
+            if not resp.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+    except ClientError as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+    logger.info(f"found {len(keys)} input files under {s3key}")
+    return keys
 
 def run_command(cmd: list) -> None:
     try:
@@ -51,10 +202,10 @@ def get_file_name(fullpath: str) -> str:
 def s32local(s3bucket: str, s3key) -> str:
     logging.info("S3 to local")
     ifname = get_file_name(s3key)
-    inpfile = f"/tools/{ifname}"
-    s3 = boto3.client('s3')
+    inpfile = f"{work_dir}/{ifname}"
+    s3 = get_s3_client()
     try:
-        s3.download_file(s3bucket, s3key, inpfile)
+        s3.download_file(s3bucket, s3key, inpfile, Callback=startup.first_byte)
     except ParamValidationError as e:
         logging.error(f"Parameter validation error: {e}")
         exit(1)
@@ -65,15 +216,20 @@ def s32local(s3bucket: str, s3key) -> str:
     filecheck(inpfile)
     return inpfile
 
-def local2s3(s3bucket: str, s3key:str, localfile: str) -> int:
+def local2s3(s3bucket: str, s3key:str, localfile: str, inpfile: str = None) -> int:
     logging.info("Local to S3")
     ofname = get_file_name(localfile)
     key = f'{s3key}/{ofname}'
     logger.info(f"Output key: {key}")
     filecheck(localfile)
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
+    # the DELTA file is read back and counted against the input csv while it is uploaded
+    verification = delta_verify.start(localfile, inpfile, item=key) if inpfile else None
     try:
-        s3.upload_file(localfile, s3bucket, key)
+        s3_rate.upload_file(s3, localfile, s3bucket, key, verification, delta_compression.object_metadata())
+    except delta_verify.VerificationError as e:
+        logging.error(f"DELTA file verification failed, nothing was published: {e}")
+        exit(1)
     except ParamValidationError as e:
         logging.error(f"Parameter validation error: {e}")
         exit(1)
@@ -83,6 +239,48 @@ def local2s3(s3bucket: str, s3key:str, localfile: str) -> int:
     logger.info("upload complete")
     return 0
 
+def put_sidecar(s3bucket: str, delta_key: str, sidecar: dict) -> None:
+    key = delta_index.sidecar_key(delta_key)
+    try:
+        get_s3_client().put_object(Bucket=s3bucket, Key=key, Body=delta_index.dumps(sidecar))
+    except ClientError as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+    logger.info(f"sidecar index: {key}")
+
+def record_manifest(s3bucket: str, delta_key: str, outfile: str, inpfile: str, sidecar: dict) -> None:
+    try:
+        manifest.record_file(get_s3_client(), s3bucket, delta_key, outfile, inpfile, sidecar)
+    except (ClientError, RuntimeError) as e:
+        logging.error(f"Manifest update failed: {e}")
+        exit(1)
+
+def replicate(s3bucket: str, keys: list) -> None:
+    try:
+        with profiling.stage("replicate", keys[0]):
+            replication.replicate(get_s3_client(), s3bucket, keys)
+    except (ClientError, RuntimeError, ValueError) as e:
+        # the output bucket has the files, papi-replicate.py or the retried job copies them
+        logging.error(f"Replication failed: {e}")
+        exit(1)
+
+def strip_expiry(inpfile: str) -> str:
+    try:
+        return expiry.strip_column(inpfile)
+    except (KeyError, ValueError) as e:
+        logging.error(f"Invalid expiry column: {e}")
+        exit(1)
+
+def put_expiry_entries(s3bucket: str, delta_key: str, entries: str) -> None:
+    # registered after the DELTA file is published, the sweep never deletes keys of a file that did not load
+    key = expiry.pending_key(delta_key)
+    try:
+        expiry.put_entries(get_s3_client(), s3bucket, key, entries)
+    except ClientError as e:
+        logging.error(f"Unexpected error: {e}")
+        exit(1)
+    logger.info(f"expiry entries: {key}")
+
 def filecheck(localfile: str) -> None:
     try:
         fstat=Path(localfile).stat()
@@ -100,4 +298,41 @@ if __name__ == "__main__":
     out_s3_bucket = os.getenv("OUT_BUCKET")
     out_s3_key = os.getenv("OUT_KEY")
     logger.info(f"inputs: {inp_s3_bucket} {inp_s3_key} {out_s3_bucket} {out_s3_key}")
-    app(inp_s3_bucket, inp_s3_key, out_s3_bucket, out_s3_key)
\ No newline at end of file
+    missing = [name for name, value in (("INP_BUCKET", inp_s3_bucket), ("INP_KEY", inp_s3_key),
+                                        ("OUT_BUCKET", out_s3_bucket), ("OUT_KEY", out_s3_key)) if not value]
+    if missing:
+        logging.error(f"{', '.join(missing)} not set")
+        exit(1)
+    try:
+        delta_compression.check()
+    except ValueError as e:
+        logging.error(f"{e}")
+        exit(1)
+    startup.mark("imports done")
+    get_s3_client()
+    startup.mark("s3 client ready")
+    if checkpoint_enabled:
+        checkpoint.install_sigterm_handler()
+    profiling.start()
+    tracing.start(inp_s3_bucket, inp_s3_key)
+    job_history.start()
+    run = app if os.getenv("LOADER_MODE", "async") == "sync" else app_async
+    # a prefix run is a manual reload, only single objects from S3 events go through the ledger
+    ledger = job_ledger.get_ledger() if not inp_s3_key.endswith("/") else None
+    error = "exception"
+    try:
+        if ledger:
+            run_claimed(claim_job(ledger, inp_s3_bucket, inp_s3_key, out_s3_bucket, out_s3_key),
+                        run, inp_s3_bucket, inp_s3_key, out_s3_bucket, out_s3_key)
+        else:
+            run(inp_s3_bucket, inp_s3_key, out_s3_bucket, out_s3_key)
+        error = ""
+        tracing.published(inp_s3_bucket, inp_s3_key)
+    except SystemExit as e:
+        error = f"exit code {e.code}" if e.code else ""
+        raise
+    finally:
+        # failed runs are the ones worth a look, the profile is uploaded either way
+        profiling.finish(get_s3_client(), out_s3_bucket, inp_s3_key)
+        tracing.finish(error)
+        job_history.finish(get_s3_client(), out_s3_bucket, inp_s3_bucket, inp_s3_key, tuned_settings(), error)
\ No newline at end of file
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Finds which DELTA files under an output prefix carry a key, using the sidecar indexes written by the loader
+# Only the sidecars are read for every file. The DELTA files whose bloom filter matches are downloaded,
+# converted back to csv with data cli and searched; the matching rows are printed in logical_commit_time order,
+# so the last row is the mutation the server applies.
+# DELTA files without a sidecar are listed, and scanned too with --scan-unindexed.
+# example: python papi-delta-key-lookup.py --bucket mybucket --prefix output key1 key2
+import argparse
+import csv
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import delta_index
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="key provenance lookup over DELTA files")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="output", help="output prefix the loader writes to")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent S3 reads")
+    parser.add_argument("--candidates-only", action="store_true", help="list candidate files without downloading them")
+    parser.add_argument("--scan-unindexed", action="store_true", help="also scan DELTA files that have no sidecar")
+    parser.add_argument("keys", nargs="+")
+    return parser.parse_args()
+
+def list_keys(s3, bucket: str, prefix: str) -> list:
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in resp.get("Contents", []))
+        if not resp.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+def read_sidecar(s3, bucket: str, key: str) -> dict:
+    return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+def scan_delta(s3, bucket: str, delta_key: str, lookup: set, tmp: str) -> list:
+    local_delta = os.path.join(tmp, delta_key.replace("/", "_"))
+    local_csv = f"{local_delta}.csv"
+    s3.download_file(bucket, delta_key, local_delta)
+    subprocess.run(format_data_cmd(local_delta, local_csv, input_format="DELTA", output_format="CSV"),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    with open(local_csv, newline="") as f:
+        rows = [dict(row, file=delta_key) for row in csv.DictReader(f) if row["key"] in lookup]
+    os.remove(local_delta)
+    os.remove(local_csv)
+    return rows
+
+def main() -> None:
+    args = parse_args()
+    s3 = get_s3_client()
+    lookup = set(args.keys)
+    prefix = args.prefix.rstrip("/") + "/"
+    objects = set(list_keys(s3, args.bucket, prefix))
+    sidecars = sorted(k for k in objects if k.endswith(delta_index.SIDECAR_SUFFIX))
+    indexed = {k[:-len(delta_index.SIDECAR_SUFFIX)] for k in sidecars}
+    unindexed = sorted(k for k in objects if "DELTA" in k.split("/")[-1] and not k.endswith(delta_index.SIDECAR_SUFFIX)
+                       and k not in indexed)
+
+    candidates = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for sidecar_key, sidecar in zip(sidecars, pool.map(lambda k: read_sidecar(s3, args.bucket, k), sidecars)):
+            delta_key = sidecar_key[:-len(delta_index.SIDECAR_SUFFIX)]
+            if delta_key in objects and any(delta_index.may_contain(sidecar, k) for k in lookup):
+                candidates.append(delta_key)
+                print(f"candidate {delta_key}: {sidecar['row_count']} rows, logical_commit_time "
+                      f"{sidecar['min_logical_commit_time']}..{sidecar['max_logical_commit_time']}, source {sidecar['source']}")
+    print(f"{len(sidecars)} sidecars read, {len(candidates)} candidate files, {len(unindexed)} files without sidecar")
+    for key in unindexed:
+        print(f"unindexed {key}")
+    if args.candidates_only:
+        return
+
+    to_scan = candidates + (unindexed if args.scan_unindexed else [])
+    with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = pool.map(lambda k: scan_delta(s3, args.bucket, k, lookup, tmp), to_scan)
+        rows = [row for file_rows in results for row in file_rows]
+    rows.sort(key=lambda r: (r["key"], int(r["logical_commit_time"])))
+    for row in rows:
+        print(f"{row['key']} {row['mutation_type']} {row['logical_commit_time']} {row.get('value', '')!r} {row['file']}")
+    for key in sorted(lookup - {r["key"] for r in rows}):
+        print(f"{key} not found")
+
+if __name__ == "__main__":
+    main()
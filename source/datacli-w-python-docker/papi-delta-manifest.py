@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Reads the manifest of an output prefix, see manifest.py
+# Prints latest.json (one GET), with --index every recorded file in sequence order.
+# --backfill records the DELTA files of the prefix that are not in the index yet, in name order, e.g. the files
+# published before the manifest was turned on. It lists the prefix and downloads every such file for its sha256,
+# the row statistics come from the sidecar, or from a data cli conversion of files without one. Safe to run while
+# loaders publish, the records go through the same conditional writes.
+# example: python papi-delta-manifest.py --bucket mybucket --prefix output --index
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+from sys import exit
+
+from botocore.exceptions import ClientError
+
+import delta_index
+import manifest
+import replication
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="manifest of the DELTA files of an output prefix")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="output", help="output prefix the loader writes to")
+    parser.add_argument("--index", action="store_true", help="print the index entry of every recorded file")
+    parser.add_argument("--backfill", action="store_true", help="record the DELTA files that are not in the index")
+    return parser.parse_args()
+
+def read_sidecar(s3, bucket: str, delta_key: str) -> dict:
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=delta_index.sidecar_key(delta_key))["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return None
+
+def backfill(s3, bucket: str, prefix: str) -> int:
+    recorded = {entry["key"] for entry in manifest.read_index(s3, bucket, prefix)}
+    missing = [key for key in replication.list_deltas(s3, bucket, prefix) if key not in recorded]
+    with tempfile.TemporaryDirectory() as tmp:
+        for delta_key in missing:
+            local_delta = os.path.join(tmp, "backfill_DELTA")
+            local_csv = f"{local_delta}.csv"
+            s3.download_file(bucket, delta_key, local_delta)
+            sidecar = read_sidecar(s3, bucket, delta_key)
+            if sidecar is None:
+                subprocess.run(format_data_cmd(local_delta, local_csv, input_format="DELTA", output_format="CSV"),
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+            manifest.record(s3, bucket, delta_key, manifest.describe(local_delta, local_csv, sidecar))
+            for path in (local_delta, local_csv):
+                if os.path.exists(path):
+                    os.remove(path)
+    return len(missing)
+
+def main() -> None:
+    args = parse_args()
+    s3 = get_s3_client()
+    prefix = args.prefix.rstrip("/")
+    try:
+        if args.backfill:
+            print(f"recorded {backfill(s3, args.bucket, prefix)} DELTA files")
+        latest = manifest.read_manifest(s3, args.bucket, prefix)
+        if not latest:
+            print(f"no manifest at s3://{args.bucket}/{manifest.manifest_key(prefix)}")
+            return
+        print(json.dumps(latest, indent=2))
+        if args.index:
+            for entry in manifest.read_index(s3, args.bucket, prefix):
+                print(json.dumps(entry, separators=(",", ":")))
+    except (ClientError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"manifest of s3://{args.bucket}/{prefix} failed: {e}")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
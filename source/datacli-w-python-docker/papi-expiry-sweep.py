@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Expiry sweep, publishes a DELETE-only DELTA file for the keys whose expiry has passed, see expiry.py
+# Started on a schedule by the stack (loader-expiry-sweep-minutes) with the loader image, one run at a time.
+# 1. merges the pending entries written by the loader in to the expiry index
+# 2. converts a DELETE row per expired key, at logical_commit_time = expiry, to
+#    <OUT_KEY>/DELTA_<sweep time in microseconds>_expired.csv_DELTA, named like the CDC and table export files so it sorts
+#    by time with the loader output, verifies and publishes it like the loader does
+# 3. writes the index without the expired keys and deletes the merged pending entries
+# A run stopped between two steps is safe to repeat, the next run publishes the same DELETE rows again.
+# A cancel, a DELETE or an UPDATE without expiry, stays in the index while its logical_commit_time is less than
+# EXPIRY_TOMBSTONE_DAYS (default 7) old, so entries of an older update that arrive late cannot bring the expiry back,
+# even when the key had no expiry in the index yet.
+# OUT_BUCKET and OUT_KEY are the output bucket and key of the loader, EXPIRY_NOW (epoch seconds) sweeps as of that time.
+import csv
+import logging
+import os
+import subprocess
+import time
+from sys import exit
+
+from botocore.exceptions import ClientError
+
+import delta_compression
+import delta_index
+import delta_verify
+import expiry
+import manifest
+import replication
+import s3_rate
+from data_cli import format_data_cmd
+from s3_client import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+work_dir = os.getenv("WORK_DIR", "/tools")
+TOMBSTONE_DAYS = float(os.getenv("EXPIRY_TOMBSTONE_DAYS", "7"))
+
+def list_pending(s3, bucket: str) -> list:
+    # entries under the staging prefix belong to outputs that are not published yet
+    staging = f"{expiry.PENDING_PREFIX}{s3_rate.STAGING_PREFIX}/"
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": expiry.PENDING_PREFIX}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in resp.get("Contents", []) if not obj["Key"].startswith(staging))
+        if not resp.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+    return keys
+
+def load_index(s3, bucket: str) -> dict:
+    try:
+        body = s3.get_object(Bucket=bucket, Key=expiry.INDEX_KEY)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}
+    index = {}
+    expiry.merge(index, expiry.read_entries(body))
+    return index
+
+def write_deletes(path: str, expired: list) -> dict:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["key", "mutation_type", "logical_commit_time", "value", "value_type"])
+        for key, (expires, lct) in expired:
+            # the delete must win over the update that set the expiry
+            writer.writerow([key, "DELETE", max(expires, lct + 1), "", "string"])
+    return {"row_count": len(expired), "mutation_types": {"DELETE": len(expired)}}
+
+def sweep(s3, bucket: str, out_key: str, now_us: int) -> int:
+    index = load_index(s3, bucket)
+    pending = list_pending(s3, bucket)
+    batch = {}
+    for key in pending:
+        expiry.merge(batch, expiry.read_entries(s3.get_object(Bucket=bucket, Key=key)["Body"].read()))
+    # a cancel is kept even for a key without an expiry yet, the entry of an older update may only arrive later
+    expiry.merge(index, [(key, expires, lct) for key, (expires, lct) in batch.items()])
+    expired = sorted((key, entry) for key, entry in index.items() if entry[0] is not None and entry[0] <= now_us)
+    logger.info(f"{len(index)} keys in the expiry index, {len(pending)} pending entry files merged, {len(expired)} expired")
+    if expired:
+        name = f"DELTA_{now_us:016d}_expired.csv"
+        csv_path, delta_path = os.path.join(work_dir, name), os.path.join(work_dir, f"{name}_DELTA")
+        expected = write_deletes(csv_path, expired)
+        try:
+            out = subprocess.run(format_data_cmd(csv_path, delta_path), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if out.returncode != 0:
+                raise RuntimeError(f"data cli exited with {out.returncode}: {out.stdout.decode(errors='replace')}")
+            delta_compression.recompress(delta_path)
+            delta_key = f"{out_key}/{name}_DELTA"
+            s3_rate.upload_file(s3, delta_path, bucket, delta_key, delta_verify.start(delta_path, csv_path, expected, delta_key),
+                                delta_compression.object_metadata())
+            sidecar = None
+            if os.getenv("DELTA_INDEX", "1") == "1":
+                sidecar = delta_index.build_sidecar(csv_path, source="expiry sweep")
+                s3.put_object(Bucket=bucket, Key=delta_index.sidecar_key(delta_key), Body=delta_index.dumps(sidecar))
+            logger.info(f"published {len(expired)} DELETE mutations: s3://{bucket}/{delta_key}")
+            manifest.record_file(s3, bucket, delta_key, delta_path, csv_path, sidecar)
+            replication.replicate(s3, bucket, [delta_key] + ([delta_index.sidecar_key(delta_key)] if os.getenv("DELTA_INDEX", "1") == "1" else []))
+        finally:
+            for path in (csv_path, delta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        for key, _ in expired:
+            del index[key]
+    tombstone_us = now_us - int(TOMBSTONE_DAYS * 86400 * 1_000_000)
+    index = {key: entry for key, entry in index.items() if entry[0] is not None or entry[1] >= tombstone_us}
+    s3.put_object(Bucket=bucket, Key=expiry.INDEX_KEY, Body=expiry.dumps_index(index))
+    for key in pending:
+        s3.delete_object(Bucket=bucket, Key=key)
+    return len(expired)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    out_s3_bucket = os.getenv("OUT_BUCKET")
+    out_s3_key = os.getenv("OUT_KEY")
+    now_us = int(float(os.getenv("EXPIRY_NOW") or time.time()) * 1_000_000)
+    try:
+        delta_compression.check()
+        sweep(get_s3_client(), out_s3_bucket, out_s3_key, now_us)
+    except (ClientError, RuntimeError, ValueError) as e:
+        logging.error(f"expiry sweep failed: {e}")
+        exit(1)
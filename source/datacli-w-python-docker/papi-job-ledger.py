@@ -0,0 +1,68 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Reports the loader jobs recorded in the job ledger, for capacity planning
+# Prints the job count per state, the retried jobs, and the duration and throughput percentiles
+# of the succeeded jobs per input size band. --jobs lists every job.
+# example: python papi-job-ledger.py --table papi-kv-loader-jobs --since-hours 24
+import argparse
+import statistics
+import time
+
+import job_ledger
+from job_history import BAND_NAMES, size_band
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="loader job ledger report")
+    parser.add_argument("--table", help="ledger table, default LEDGER_TABLE")
+    parser.add_argument("--since-hours", type=float, default=0, help="only jobs started in the last hours, 0 for all")
+    parser.add_argument("--jobs", action="store_true", help="list every job")
+    return parser.parse_args()
+
+def percentile(values: list, pct: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+def report(jobs: list) -> None:
+    states = {}
+    for job in jobs:
+        states[job["state"]] = states.get(job["state"], 0) + 1
+    print(f"jobs: {len(jobs)}  " + "  ".join(f"{state}: {count}" for state, count in sorted(states.items())))
+    retried = [job for job in jobs if job.get("attempts", 1) > 1]
+    print(f"claimed more than once: {len(retried)}")
+    bands = {}
+    for job in jobs:
+        if job["state"] == job_ledger.SUCCEEDED and job.get("duration_s"):
+            bands.setdefault(size_band(job.get("input_bytes", 0)), []).append(job)
+    print(f"\n{'input size':<12}{'jobs':>6}{'p50 s':>10}{'p90 s':>10}{'max s':>10}{'p50 MB/s':>10}")
+    for band in sorted(bands, key=BAND_NAMES.index):
+        durations = sorted(job["duration_s"] for job in bands[band])
+        rates = sorted(job.get("input_bytes", 0) / 1e6 / job["duration_s"] for job in bands[band])
+        print(f"{band:<12}{len(durations):>6}{percentile(durations, 50):>10.1f}{percentile(durations, 90):>10.1f}"
+              f"{durations[-1]:>10.1f}{percentile(rates, 50):>10.1f}")
+
+def main() -> None:
+    args = parse_args()
+    ledger = job_ledger.get_ledger(args.table)
+    if not ledger:
+        raise SystemExit("give --table or set LEDGER_TABLE")
+    jobs = ledger.scan()
+    if args.since_hours:
+        since = time.time() - args.since_hours * 3600
+        jobs = [job for job in jobs if job.get("started_at", 0) >= since]
+    jobs.sort(key=lambda job: job.get("started_at", 0))
+    if args.jobs:
+        for job in jobs:
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(job.get("started_at", 0)))
+            duration = f"{job['duration_s']:.1f}s" if "duration_s" in job else "-"
+            print(f"{started}  {job['state']:<11} {duration:>9}  attempts={int(job.get('attempts', 1))}  {job['job_id']}")
+        print()
+    report(jobs)
+
+if __name__ == "__main__":
+    main()
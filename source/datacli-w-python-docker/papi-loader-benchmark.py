@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Compares the throughput of the sync and async loader paths against the local S3 stand-in
+# A synthetic dataset is generated into the stand-in and converted by both paths.
+# Without --data-cli a stand-in converter that copies the file after --convert-ms is used,
+# so the benchmark runs on a laptop without the data cli binary.
+# example: python papi-loader-benchmark.py --files 32 --rows 20000 --latency-ms 30 --bandwidth-mbps 200
+import argparse
+import importlib.util
+import os
+import stat
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+STANDIN_CONVERTER = """#!{python}
+import shutil, sys, time
+args = dict(a[2:].split("=", 1) for a in sys.argv[2:] if a.startswith("--") and "=" in a)
+time.sleep({convert_ms} / 1000)
+shutil.copyfile(args["input_file"], args["output_file"])
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="sync vs async loader throughput benchmark")
+    parser.add_argument("--files", type=int, default=32, help="number of input csv files")
+    parser.add_argument("--rows", type=int, default=20000, help="rows per input file")
+    parser.add_argument("--latency-ms", type=float, default=30, help="simulated latency per S3 request")
+    parser.add_argument("--bandwidth-mbps", type=float, default=200, help="simulated bandwidth per S3 transfer")
+    parser.add_argument("--convert-ms", type=float, default=100, help="stand-in conversion time per file")
+    parser.add_argument("--data-cli", default="", help="path of a real data cli binary, replaces the stand-in")
+    parser.add_argument("--transfer-concurrency", type=int, default=8)
+    parser.add_argument("--convert-concurrency", type=int, default=0)
+    parser.add_argument("--queue-size", type=int, default=4)
+    return parser.parse_args()
+
+def load_loader_module():
+    # the entry point script has a dash in its name so it can not be imported the usual way
+    path = Path(__file__).with_name("papi-delta-filegen-s3.py")
+    spec = importlib.util.spec_from_file_location("papi_delta_filegen_s3", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def report(name: str, elapsed: float, files: int, nbytes: int) -> None:
+    print(f"{name:>6}: {elapsed:8.2f}s  {files / elapsed:8.2f} files/s  {nbytes / elapsed / 1e6:8.2f} MB/s")
+
+def main() -> None:
+    args = parse_args()
+    tmp = Path(tempfile.mkdtemp(prefix="papi-loader-bench-"))
+    s3_root = tmp / "s3"
+    converter = args.data_cli
+    if not converter:
+        converter = str(tmp / "data_cli")
+        Path(converter).write_text(STANDIN_CONVERTER.format(python=sys.executable, convert_ms=args.convert_ms))
+        os.chmod(converter, os.stat(converter).st_mode | stat.S_IEXEC)
+    # the loader modules read these at import time
+    os.environ["DATA_CLI_PATH"] = converter
+    os.environ["LOCAL_S3_ROOT"] = str(s3_root)
+    os.environ["LOCAL_S3_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["LOCAL_S3_BANDWIDTH_MBPS"] = str(args.bandwidth_mbps)
+    sys.path.insert(0, str(Path(__file__).parent))
+
+    import async_core
+    from s3_client import get_s3_client
+    from synthetic_data import generate_csv
+
+    bucket = "bench"
+    (s3_root / bucket / "input").mkdir(parents=True)
+    keys = []
+    for i in range(args.files):
+        key = f"input/data-{i:05d}.csv"
+        generate_csv(str(s3_root / bucket / key), args.rows, seed=i)
+        keys.append(key)
+    nbytes = sum((s3_root / bucket / k).stat().st_size for k in keys)
+    print(f"dataset: {args.files} files, {nbytes / 1e6:.1f} MB, s3 latency {args.latency_ms}ms, "
+          f"bandwidth {args.bandwidth_mbps}Mbps, converter {converter}")
+
+    loader = load_loader_module()
+    s3 = get_s3_client()
+
+    loader.work_dir = str(tmp / "work-sync")
+    os.makedirs(loader.work_dir)
+    start = time.monotonic()
+    for key in keys:
+        loader.app(bucket, key, bucket, "output-sync")
+    sync_elapsed = time.monotonic() - start
+
+    work_async = tmp / "work-async"
+    os.makedirs(work_async)
+    jobs = [async_core.Job(bucket, key, bucket, "output-async") for key in keys]
+    start = time.monotonic()
+    async_core.run(jobs, s3, str(work_async), args.transfer_concurrency, args.convert_concurrency, args.queue_size)
+    async_elapsed = time.monotonic() - start
+
+    failed = [job for job in jobs if job.error]
+    # the sidecars are listed next to the DELTA files
+    produced = sum(1 for obj in s3.list_objects_v2(Bucket=bucket, Prefix="output-async/").get("Contents", [])
+                   if obj["Key"].endswith("_DELTA"))
+    report("sync", sync_elapsed, args.files, nbytes)
+    report("async", async_elapsed, args.files, nbytes)
+    print(f"speedup: {sync_elapsed / async_elapsed:.2f}x, async outputs {produced}/{args.files}, failed {len(failed)}")
+    print(f"scratch data left in {tmp}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Measures the cold start of loader images: image size, boto3 import + client creation, and the time
+# from `docker run` to the first byte downloaded for one small input file
+# The input is served by the local S3 stand-in mounted in to the container, so no AWS access is needed.
+# --pull removes the image before every run and pulls it again, to include the pull in the measurement.
+# --local runs the loader from this folder with the local python instead of an image,
+# add --cold-bytecode to start every run without cached bytecode like an image built without it.
+# examples:
+#   python papi-loader-startup-benchmark.py --image papi-datacli-with-python --image papi-datacli-with-python-slim
+#   python papi-loader-startup-benchmark.py --local --cold-bytecode
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from startup import STARTUP_LOG_PREFIX
+from synthetic_data import generate_csv
+
+BOTO3_PROBE = ("import time; t = time.perf_counter(); import boto3; boto3.client('s3', region_name='us-west-2'); "
+               "print(round((time.perf_counter() - t) * 1000))")
+STANDIN_CONVERTER = """#!{python}
+import shutil, sys
+args = dict(a[2:].split("=", 1) for a in sys.argv[2:] if a.startswith("--") and "=" in a)
+shutil.copyfile(args["input_file"], args["output_file"])
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="loader container startup benchmark")
+    parser.add_argument("--image", action="append", default=[], help="loader image to measure, repeatable")
+    parser.add_argument("--local", action="store_true", help="measure the loader in this folder with the local python")
+    parser.add_argument("--cold-bytecode", action="store_true", help="with --local, ignore cached bytecode")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=100, help="rows of the input csv")
+    parser.add_argument("--pull", action="store_true", help="remove and pull the image before every run")
+    return parser.parse_args()
+
+def image_size(image: str) -> int:
+    out = subprocess.run(["docker", "image", "inspect", "-f", "{{.Size}}", image], capture_output=True, text=True, check=True)
+    return int(out.stdout.strip())
+
+def timed_run(cmd: list, env: dict = None) -> dict:
+    """
+    Runs one loader and returns the wall clock ms to the first byte and to exit, plus the startup marks it logged
+    """
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+    result = {"marks": {}}
+    for line in proc.stdout:
+        match = re.search(rf"{STARTUP_LOG_PREFIX} (.+) (\d+) ms after process start", line)
+        if match:
+            result["marks"][match.group(1)] = int(match.group(2))
+            if match.group(1) == "first byte downloaded":
+                result["first_byte"] = (time.monotonic() - start) * 1000
+    if proc.wait() != 0:
+        raise RuntimeError(f"loader run failed: {' '.join(cmd)}")
+    result["total"] = (time.monotonic() - start) * 1000
+    return result
+
+def summary(name: str, runs: list, size: int = None, boto3_ms: list = None) -> None:
+    def median(values):
+        return f"{statistics.median(values):.0f}" if values else "-"
+    print(f"\n{name}")
+    if size is not None:
+        print(f"  image size              {size / 1e6:8.1f} MB")
+    if boto3_ms:
+        print(f"  boto3 import + client   {median(boto3_ms):>8} ms")
+    print(f"  run to first byte       {median([r['first_byte'] for r in runs if 'first_byte' in r]):>8} ms")
+    print(f"  run to exit             {median([r['total'] for r in runs]):>8} ms")
+    for mark in runs[0]["marks"]:
+        print(f"  in process {mark:<20} {median([r['marks'][mark] for r in runs if mark in r['marks']]):>8} ms")
+
+def bench_image(args, image: str, s3_root: Path) -> None:
+    loader_env = ["-e", "LOCAL_S3_ROOT=/s3", "-e", "INP_BUCKET=bench", "-e", "INP_KEY=input/data.csv",
+                  "-e", "OUT_BUCKET=bench", "-e", "OUT_KEY=output"]
+    runs, boto3_ms = [], []
+    for _ in range(args.runs):
+        if args.pull:
+            subprocess.run(["docker", "rmi", "-f", image], capture_output=True)
+            subprocess.run(["docker", "pull", "-q", image], check=True, capture_output=True)
+        runs.append(timed_run(["docker", "run", "--rm", "-v", f"{s3_root}:/s3"] + loader_env + [image]))
+        probe = subprocess.run(["docker", "run", "--rm", "--entrypoint", "python3", image, "-c", BOTO3_PROBE],
+                               capture_output=True, text=True, check=True)
+        boto3_ms.append(int(probe.stdout.split()[-1]))
+    summary(image, runs, image_size(image), boto3_ms)
+
+def bench_local(args, s3_root: Path, tmp: Path) -> None:
+    converter = tmp / "data_cli"
+    converter.write_text(STANDIN_CONVERTER.format(python=sys.executable))
+    converter.chmod(0o755)
+    env = dict(os.environ, LOCAL_S3_ROOT=str(s3_root), INP_BUCKET="bench", INP_KEY="input/data.csv", OUT_BUCKET="bench",
+               OUT_KEY="output", WORK_DIR=str(tmp), DATA_CLI_PATH=str(converter))
+    script = str(Path(__file__).with_name("papi-delta-filegen-s3.py"))
+    runs, boto3_ms = [], []
+    for i in range(args.runs):
+        if args.cold_bytecode:
+            env["PYTHONPYCACHEPREFIX"] = str(tmp / f"pycache-{i}")
+        runs.append(timed_run([sys.executable, script], env))
+        probe = subprocess.run([sys.executable, "-c", BOTO3_PROBE], capture_output=True, text=True, check=True, env=env)
+        boto3_ms.append(int(probe.stdout.split()[-1]))
+    summary(f"local python{' without cached bytecode' if args.cold_bytecode else ''}", runs, boto3_ms=boto3_ms)
+
+def main() -> None:
+    args = parse_args()
+    if not args.image and not args.local:
+        sys.exit("give at least one --image or --local")
+    with tempfile.TemporaryDirectory(prefix="papi-startup-bench-") as tmp:
+        tmp = Path(tmp)
+        s3_root = tmp / "s3"
+        (s3_root / "bench" / "input").mkdir(parents=True)
+        generate_csv(str(s3_root / "bench" / "input" / "data.csv"), args.rows)
+        for image in args.image:
+            bench_image(args, image, s3_root)
+        if args.local:
+            bench_local(args, s3_root, tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Recommends the task size and loader settings per input size band from the job history, see job_history.py
+# For every band and every settings combination that ran at least --min-jobs times, the run seconds are fitted
+# as a fixed time plus seconds per MB and predicted for the median input size of the band. The cost of a run is
+# its seconds times the Fargate price of the task size. The recommendation of a band is the cheapest settings
+# whose predicted seconds are at most --latency-slack above the fastest ones, --latency-slack 0 picks the fastest.
+# --bucket reads the history from S3 and --save keeps it as a json lines file, --history reads such a file,
+# the same file and options always give the same recommendations. --publish uploads them to the object the
+# dispatcher applies with loader-tuning apply.
+# example: python papi-loader-tune.py --bucket <output bucket> --since-days 14 --save history.jsonl --out recommendations.json
+import argparse
+import hashlib
+import json
+import statistics
+import time
+
+import job_history
+from s3_client import get_s3_client
+
+# Fargate Linux/ARM on-demand prices in us-east-1, per vCPU hour and GB hour
+VCPU_HOUR = 0.03238
+GB_HOUR = 0.00356
+TUNING_KEY = "tuning/recommendations.json"
+# settings that are the task size, the rest are passed to the loader as environment variables
+TASK_SIZE = ("TASK_CPU", "TASK_MEMORY")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="loader settings tuner")
+    parser.add_argument("--history", help="history json lines file, written with --save")
+    parser.add_argument("--bucket", help="output bucket to read the history from")
+    parser.add_argument("--prefix", default=job_history.HISTORY_PREFIX)
+    parser.add_argument("--since-days", type=float, default=0, help="only runs of the last days, 0 for all")
+    parser.add_argument("--save", help="write the history read from S3 to this file")
+    parser.add_argument("--min-jobs", type=int, default=3, help="runs a settings combination needs to be considered")
+    parser.add_argument("--latency-slack", type=float, default=0.2, help="share above the fastest predicted seconds allowed for a cheaper choice")
+    parser.add_argument("--vcpu-hour", type=float, default=VCPU_HOUR)
+    parser.add_argument("--gb-hour", type=float, default=GB_HOUR)
+    parser.add_argument("--out", help="write the recommendations to this json file")
+    parser.add_argument("--publish", action="store_true", help=f"upload the recommendations to s3://<bucket>/{TUNING_KEY}")
+    return parser.parse_args()
+
+def read_s3_history(bucket: str, prefix: str, since_days: float) -> list:
+    s3 = get_s3_client()
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - since_days * 86400)) if since_days else ""
+    records = []
+    kwargs = {"Bucket": bucket, "Prefix": f"{prefix}/"}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        for obj in resp.get("Contents", []):
+            # keys are <prefix>/<yyyy-mm-dd>/<run id>.json
+            if obj["Key"][len(prefix) + 1:][:10] >= since:
+                records.append(json.loads(s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()))
+        if not resp.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+    return sorted(records, key=lambda record: (record["finished_at"], record["job"]))
+
+def settings_key(settings: dict) -> str:
+    return json.dumps(settings, sort_keys=True)
+
+def task_price(settings: dict, vcpu_hour: float, gb_hour: float) -> float:
+    # price per second of the task size, TASK_CPU in cpu units (1024 per vCPU) and TASK_MEMORY in MiB
+    return (settings["TASK_CPU"] / 1024 * vcpu_hour + settings["TASK_MEMORY"] / 1024 * gb_hour) / 3600
+
+def predict(runs: list, size_mb: float) -> float:
+    sizes = [run["input_bytes"] / 1e6 for run in runs]
+    seconds = [run["seconds"] for run in runs]
+    if len(set(sizes)) < 2:
+        return statistics.median(seconds)
+    slope, intercept = statistics.linear_regression(sizes, seconds)
+    # a fit of few runs can go below what was ever measured
+    return max(min(seconds), intercept + max(slope, 0.0) * size_mb)
+
+def fit(records: list, min_jobs: int, latency_slack: float, vcpu_hour: float, gb_hour: float) -> list:
+    """
+    Candidates per band with their predicted seconds and cost, and the recommended one
+    """
+    bands = {}
+    for record in records:
+        if record["error"] or not all(record["settings"].get(name) for name in TASK_SIZE):
+            continue
+        bands.setdefault(job_history.size_band(record["input_bytes"]), []).append(record)
+    results = []
+    for band in sorted(bands, key=job_history.BAND_NAMES.index):
+        size_mb = statistics.median(record["input_bytes"] / 1e6 for record in bands[band])
+        by_settings = {}
+        for record in bands[band]:
+            by_settings.setdefault(settings_key(record["settings"]), []).append(record)
+        candidates = []
+        for key in sorted(by_settings):
+            runs = by_settings[key]
+            settings = json.loads(key)
+            seconds = predict(runs, size_mb)
+            candidates.append({"settings": settings, "jobs": len(runs), "predicted_seconds": round(seconds, 3),
+                               "cost_per_job": round(seconds * task_price(settings, vcpu_hour, gb_hour), 6),
+                               "eligible": len(runs) >= min_jobs})
+        eligible = [c for c in candidates if c["eligible"]]
+        choice = None
+        if eligible:
+            fastest = min(c["predicted_seconds"] for c in eligible)
+            within = [c for c in eligible if c["predicted_seconds"] <= fastest * (1 + latency_slack)]
+            choice = min(within, key=lambda c: (c["cost_per_job"], c["predicted_seconds"], settings_key(c["settings"])))
+        results.append({"band": band, "size_mb": round(size_mb, 3), "candidates": candidates, "choice": choice})
+    return results
+
+def recommendations(results: list, history_sha256: str, args) -> dict:
+    bands = []
+    for result in results:
+        choice = result["choice"]
+        if not choice:
+            continue
+        settings = choice["settings"]
+        bands.append({"band": result["band"], "max_mb": job_history.band_limit_mb(result["band"]),
+                      "cpu": settings["TASK_CPU"], "memory": settings["TASK_MEMORY"],
+                      "environment": {name: str(value) for name, value in sorted(settings.items()) if name not in TASK_SIZE},
+                      "jobs": choice["jobs"], "predicted_seconds": choice["predicted_seconds"],
+                      "cost_per_job": choice["cost_per_job"]})
+    return {"history_sha256": history_sha256,
+            "model": {"min_jobs": args.min_jobs, "latency_slack": args.latency_slack,
+                      "vcpu_hour": args.vcpu_hour, "gb_hour": args.gb_hour},
+            "bands": bands}
+
+def report(results: list) -> None:
+    for result in results:
+        print(f"\n{result['band']} (median {result['size_mb']:.1f} MB)")
+        print(f"  {'':2}{'cpu':>6}{'memory':>8}{'jobs':>6}{'pred s':>9}{'$/job':>10}  settings")
+        for c in result["candidates"]:
+            settings = c["settings"]
+            mark = "*" if c is result["choice"] else (" " if c["eligible"] else "-")
+            rest = " ".join(f"{k}={v}" for k, v in sorted(settings.items()) if k not in TASK_SIZE)
+            print(f"  {mark:2}{settings['TASK_CPU']:>6}{settings['TASK_MEMORY']:>8}{c['jobs']:>6}"
+                  f"{c['predicted_seconds']:>9.1f}{c['cost_per_job']:>10.6f}  {rest}")
+    print("\n* recommended, - fewer runs than --min-jobs")
+
+def main() -> None:
+    args = parse_args()
+    if args.history:
+        with open(args.history) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    elif args.bucket:
+        records = read_s3_history(args.bucket, args.prefix, args.since_days)
+    else:
+        raise SystemExit("give --history or --bucket")
+    lines = "".join(json.dumps(record, sort_keys=True) + "\n" for record in records)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(lines)
+    print(f"{len(records)} runs in the history")
+    results = fit(records, args.min_jobs, args.latency_slack, args.vcpu_hour, args.gb_hour)
+    report(results)
+    recommended = recommendations(results, hashlib.sha256(lines.encode()).hexdigest(), args)
+    body = json.dumps(recommended, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(body + "\n")
+    if args.publish:
+        if not args.bucket:
+            raise SystemExit("--publish needs --bucket")
+        get_s3_client().put_object(Bucket=args.bucket, Key=TUNING_KEY, Body=body.encode())
+        print(f"published to s3://{args.bucket}/{TUNING_KEY}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Brings the regional buckets of REPLICA_BUCKETS up to date with the output prefix, see replication.py
+# Copies the DELTA files after the pointer of each region that the region does not have and advances the pointer,
+# for a region added later or after a loader run that failed while replicating. Safe to run at any time.
+# example: OUT_BUCKET=<output bucket> OUT_KEY=<output prefix> REPLICA_BUCKETS=eu-west-1=<bucket> python papi-replicate.py
+import logging
+import os
+from sys import exit
+
+from botocore.exceptions import ClientError
+
+import replication
+from s3_client import get_s3_client
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        copied = replication.catch_up(get_s3_client(), os.getenv("OUT_BUCKET"), os.getenv("OUT_KEY"))
+    except (ClientError, RuntimeError, ValueError) as e:
+        logging.error(f"replication catch up failed: {e}")
+        exit(1)
+    for region, count in sorted(copied.items()):
+        logging.info(f"{region}: copied {count} DELTA files")
@@ -0,0 +1,252 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Opt-in profiling of a loader run, to tell whether a slow conversion spends its time in S3, python or data cli
+# PROFILE=1 records
+# - timeline.json, the start and duration of every stage (download, convert, upload, ...) per input file
+# - children.json, getrusage of every data cli process: cpu time, max rss, block I/O, page faults, context switches
+# - stacks.folded, sampled stacks of every python thread every PROFILE_SAMPLE_MS (default 10), flame graph input;
+#   PROFILE_PYTHON=cprofile records profile.pstats of the main thread with cProfile instead
+# - summary.txt, the time per stage, python and data cli cpu time and the hottest python functions
+# and uploads them to s3://<output bucket>/<PROFILE_PREFIX>/<input key>/<run id>/ when the run ends.
+# data cli is started through this file (python profiling.py --rusage <file> -- <cmd>), which waits for it with
+# wait4 to get the usage of that one child. Without PROFILE=1 nothing is wrapped, sampled or recorded.
+import io
+import json
+import logging
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("PROFILE", "0") == "1"
+PYTHON_PROFILER = os.getenv("PROFILE_PYTHON", "sample")
+SAMPLE_SECONDS = float(os.getenv("PROFILE_SAMPLE_MS", "10")) / 1000
+PROFILE_PREFIX = os.getenv("PROFILE_PREFIX", "diagnostics")
+TOP_FUNCTIONS = 30
+
+_NULL = nullcontext()
+# record(stage, item, start, seconds) callbacks that get the stages with or without a profile, e.g. tracing spans
+listeners = []
+# innermost frames of threads that wait for work, left out of the hottest functions in the summary
+IDLE_FRAMES = ("wait (threading.py", "select (selectors.py", "get (queue.py", "_worker (thread.py",
+               "_do_waitpid (unix_events.py")
+
+class Sampler(threading.Thread):
+    """
+    Counts the stacks of every other thread, root frame first, in folded format
+    """
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # thread pool workers are told apart by their number only, group them by name prefix
+                thread = names.get(ident, "thread").rsplit("_", 1)[0]
+                self.stacks[";".join([thread, *reversed(stack)])] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+class Session:
+    """
+    Profile data of one run, kept in a local folder until it is uploaded
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.dir = tempfile.mkdtemp(prefix="papi-profile-")
+        self.events = []
+        self.lock = threading.Lock()
+        self.children = 0
+        self.sampler = None
+        self.profiler = None
+        if PYTHON_PROFILER == "cprofile":
+            # imported here so the loader startup does not pay for it when profiling is off
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif PYTHON_PROFILER == "sample":
+            self.sampler = Sampler(SAMPLE_SECONDS)
+            self.sampler.start()
+
+    def record(self, stage: str, item: str, start: float, seconds: float) -> None:
+        with self.lock:
+            self.events.append({"stage": stage, "item": item, "start": round(start - self.started, 6),
+                                "seconds": round(seconds, 6), "thread": threading.current_thread().name})
+
+    def child_path(self) -> str:
+        with self.lock:
+            self.children += 1
+            return os.path.join(self.dir, f"child-{self.children:06d}.json")
+
+_session = None
+
+def start() -> None:
+    global _session
+    if ENABLED and _session is None:
+        _session = Session()
+        logger.info(f"profiling on, python profiler: {PYTHON_PROFILER}")
+
+def record(stage: str, item: str, start: float, seconds: float) -> None:
+    """
+    Adds a stage that started at start (time.time()) and took seconds to the timeline
+    """
+    if _session is not None:
+        _session.record(stage, item, start, seconds)
+    for listener in listeners:
+        listener(stage, item, start, seconds)
+
+@contextmanager
+def _stage(stage: str, item: str):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(stage, item, start, time.time() - start)
+
+def stage(stage: str, item: str = ""):
+    """
+    Context manager that records the time spent in the block as a stage of item
+    """
+    return _NULL if _session is None and not listeners else _stage(stage, item)
+
+def wrap(cmd: list, item: str = "") -> list:
+    """
+    Returns cmd started through the rusage recorder when profiling is on, else cmd unchanged
+    """
+    if _session is None:
+        return cmd
+    return [sys.executable, os.path.abspath(__file__), "--rusage", _session.child_path(), "--item", item, "--", *cmd]
+
+def _children() -> list:
+    children = []
+    for name in sorted(os.listdir(_session.dir)):
+        if name.startswith("child-"):
+            with open(os.path.join(_session.dir, name)) as f:
+                child = json.load(f)
+            child["start"] = round(child["start"] - _session.started, 6)
+            children.append(child)
+            os.remove(os.path.join(_session.dir, name))
+    return children
+
+def _summary(children: list, wall: float, top: str) -> str:
+    lines = [f"wall time {wall:.1f}s"]
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    lines.append(f"python process cpu: user {usage.ru_utime:.1f}s sys {usage.ru_stime:.1f}s max rss {usage.ru_maxrss / 1024:.0f} MB")
+    if children:
+        lines.append(f"data cli: {len(children)} processes, cpu user {sum(c['user_s'] for c in children):.1f}s "
+                     f"sys {sum(c['sys_s'] for c in children):.1f}s, wall {sum(c['seconds'] for c in children):.1f}s, "
+                     f"max rss {max(c['max_rss_kb'] for c in children) / 1024:.0f} MB, "
+                     f"blocks in {sum(c['in_blocks'] for c in children)} out {sum(c['out_blocks'] for c in children)}")
+    stages = {}
+    for event in _session.events:
+        stages.setdefault(event["stage"], []).append(event["seconds"])
+    lines.append(f"\n{'stage':<12}{'count':>7}{'total s':>10}{'p50 s':>10}{'max s':>10}")
+    for name, seconds in stages.items():
+        lines.append(f"{name:<12}{len(seconds):>7}{sum(seconds):>10.1f}{statistics.median(seconds):>10.2f}{max(seconds):>10.2f}")
+    return "\n".join(lines) + "\n\n" + top
+
+def _top_sampled(stacks: Counter) -> str:
+    # share of the busy samples in which a function is on the stack and at the top of it
+    stacks = {stack: count for stack, count in stacks.items() if not stack.rsplit(";", 1)[-1].startswith(IDLE_FRAMES)}
+    total = sum(stacks.values()) or 1
+    inclusive, own = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        for frame in set(frames):
+            inclusive[frame] += count
+        if frames:
+            own[frames[-1]] += count
+    lines = [f"{'own %':>7}{'total %':>9}  function ({total} busy samples)"]
+    for frame, count in own.most_common(TOP_FUNCTIONS):
+        lines.append(f"{100 * count / total:>7.1f}{100 * inclusive[frame] / total:>9.1f}  {frame}")
+    return "\n".join(lines) + "\n"
+
+def finish(s3, bucket: str, inp_key: str) -> None:
+    """
+    Stops the profilers and uploads the bundle, errors are logged and do not fail the run
+    """
+    global _session
+    session = _session
+    if session is None:
+        return
+    wall = time.time() - session.started
+    top = ""
+    if session.profiler:
+        import pstats
+        session.profiler.disable()
+        session.profiler.dump_stats(os.path.join(session.dir, "profile.pstats"))
+        out = io.StringIO()
+        pstats.Stats(session.profiler, stream=out).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        top = out.getvalue()
+    if session.sampler:
+        session.sampler.stop()
+        with open(os.path.join(session.dir, "stacks.folded"), "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in session.sampler.stacks.most_common())
+        top = _top_sampled(session.sampler.stacks)
+    children = _children()
+    with open(os.path.join(session.dir, "timeline.json"), "w") as f:
+        json.dump({"started": session.started, "events": session.events}, f)
+    with open(os.path.join(session.dir, "children.json"), "w") as f:
+        json.dump(children, f)
+    with open(os.path.join(session.dir, "summary.txt"), "w") as f:
+        f.write(_summary(children, wall, top))
+    run_id = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(session.started))}-{socket.gethostname()}-{os.getpid()}"
+    prefix = f"{PROFILE_PREFIX}/{inp_key.strip('/')}/{run_id}"
+    try:
+        for name in sorted(os.listdir(session.dir)):
+            s3.upload_file(os.path.join(session.dir, name), bucket, f"{prefix}/{name}")
+        logger.info(f"profile uploaded to s3://{bucket}/{prefix}/")
+    except Exception as e:
+        logger.error(f"profile upload failed, the files are in {session.dir}: {e}")
+    _session = None
+
+def _run_child(path: str, item: str, cmd: list) -> int:
+    start = time.time()
+    proc = subprocess.Popen(cmd)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    with open(path, "w") as f:
+        json.dump({"item": item, "cmd": cmd[0], "start": start, "seconds": round(time.time() - start, 6),
+                   "returncode": proc.returncode, "user_s": usage.ru_utime, "sys_s": usage.ru_stime,
+                   "max_rss_kb": usage.ru_maxrss, "in_blocks": usage.ru_inblock, "out_blocks": usage.ru_oublock,
+                   "minor_faults": usage.ru_minflt, "major_faults": usage.ru_majflt,
+                   "voluntary_switches": usage.ru_nvcsw, "involuntary_switches": usage.ru_nivcsw}, f)
+    return proc.returncode
+
+if __name__ == "__main__":
+    # python profiling.py --rusage <file> --item <input> -- <cmd>
+    args = sys.argv[1:]
+    split = args.index("--")
+    options = dict(zip(args[:split:2], args[1:split:2]))
+    sys.exit(_run_child(options["--rusage"], options.get("--item", ""), args[split + 1:]))
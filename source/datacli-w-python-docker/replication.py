@@ -0,0 +1,179 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Cross region replication of the published DELTA files
+# REPLICA_BUCKETS=<region>=<bucket>,... (set by the stack from loader-replica-buckets) copies every DELTA file
+# and its sidecar, once published in the output bucket, to the same key in the bucket of each region.
+# The copies run in parallel, REPLICATION_CONCURRENCY (default 8) at a time, so they finish in any order.
+# What a regional server may read is the pointer s3://<regional bucket>/<REPLICATION_PREFIX>/<output prefix>/published_up_to.json
+# (default prefix replication): every DELTA file of the output prefix up to and including its key, in name order,
+# is present in the region. It only moves forward, up to the first DELTA file of the output bucket the region
+# does not have yet, and is written with a conditional put so tasks advancing it at the same time do not go back.
+# papi-replicate.py copies what is missing and advances the pointers, after a failed run or for a new region.
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import delta_index
+import s3_rate
+from s3_client import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+REPLICATION_PREFIX = os.getenv("REPLICATION_PREFIX", "replication")
+CONCURRENCY = int(os.getenv("REPLICATION_CONCURRENCY", "8"))
+# conditional writes of the pointer that lost to another task before giving up
+POINTER_ATTEMPTS = 10
+
+def replica_buckets() -> dict:
+    """
+    {region: bucket} of REPLICA_BUCKETS, empty when replication is off
+    """
+    buckets = {}
+    for item in os.getenv("REPLICA_BUCKETS", "").split(","):
+        if not item.strip():
+            continue
+        region, sep, bucket = item.strip().partition("=")
+        if not sep or not region or not bucket:
+            raise ValueError(f"Invalid REPLICA_BUCKETS entry {item!r}, use <region>=<bucket>")
+        buckets[region] = bucket
+    return buckets
+
+def is_delta(key: str) -> bool:
+    name = key.rsplit("/", 1)[-1]
+    return "DELTA" in name and not name.endswith(delta_index.SIDECAR_SUFFIX)
+
+def pointer_key(out_prefix: str) -> str:
+    return f"{REPLICATION_PREFIX}/{out_prefix}/published_up_to.json"
+
+def list_deltas(s3, bucket: str, out_prefix: str, after: str = "") -> list:
+    """
+    DELTA keys directly under out_prefix after the given key, in name order
+    """
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": f"{out_prefix}/", "StartAfter": after or ""}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in resp.get("Contents", [])
+                    if "/" not in obj["Key"][len(out_prefix) + 1:] and is_delta(obj["Key"]))
+        if not resp.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+    return keys
+
+def read_pointer(s3, bucket: str, key: str) -> tuple:
+    """
+    (pointer, ETag), ({}, None) when the region has no pointer yet
+    """
+    try:
+        resp = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}, None
+    return json.loads(resp["Body"].read()), resp["ETag"]
+
+def copy(home, bucket: str, region: str, replica_bucket: str, keys: list) -> None:
+    from boto3.s3.transfer import TransferConfig
+    config = TransferConfig(multipart_threshold=s3_rate.COPY_PART_BYTES, multipart_chunksize=s3_rate.COPY_PART_BYTES)
+    client = get_s3_client(region)
+    # in order, the sidecar of a DELTA file is only copied after it
+    for key in keys:
+        client.copy({"Bucket": bucket, "Key": key}, replica_bucket, key, SourceClient=home, Config=config)
+
+def advance(home, bucket: str, out_prefix: str, region: str, replica_bucket: str) -> str:
+    """
+    Moves the pointer of the region over the DELTA files it has, stops at the first missing one
+    Returns the key the pointer is at, None when the region has none of the files
+    """
+    client = get_s3_client(region)
+    key = pointer_key(out_prefix)
+    for _ in range(POINTER_ATTEMPTS):
+        pointer, etag = read_pointer(client, replica_bucket, key)
+        current = pointer.get("key")
+        present = set(list_deltas(client, replica_bucket, out_prefix, after=current))
+        last = current
+        for delta_key in list_deltas(home, bucket, out_prefix, after=current):
+            if delta_key not in present:
+                break
+            last = delta_key
+        if last == current:
+            return current
+        body = json.dumps({"key": last, "source": f"s3://{bucket}/{out_prefix}/", "updated_at": round(time.time(), 3)}).encode()
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            client.put_object(Bucket=replica_bucket, Key=key, Body=body, **condition)
+        except ClientError as e:
+            # another task wrote the pointer since it was read, read it again
+            if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            continue
+        logger.info(f"{region}: published up to {last}")
+        return last
+    raise RuntimeError(f"{region}: pointer {key} kept changing, not advanced")
+
+def by_delta(keys: list) -> list:
+    # a DELTA file with the keys that follow it, its sidecar
+    groups = []
+    for key in keys:
+        if is_delta(key) or not groups:
+            groups.append([key])
+        else:
+            groups[-1].append(key)
+    return groups
+
+def replicate(home, bucket: str, keys: list) -> None:
+    """
+    Copies the published keys (DELTA files, each followed by its sidecar) to every region in parallel
+    and advances the pointer of each region, raises when a copy failed
+    The pointers advance after a failed copy too, up to the first file missing in the region
+    """
+    buckets = replica_buckets()
+    if not buckets or not keys:
+        return
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        futures = [pool.submit(copy, home, bucket, region, replica_bucket, group)
+                   for region, replica_bucket in buckets.items() for group in by_delta(keys)]
+        errors = [e for e in (f.exception() for f in futures) if e is not None]
+        out_prefixes = sorted({key.rsplit("/", 1)[0] for key in keys if is_delta(key)})
+        for future in [pool.submit(advance, home, bucket, prefix, region, replica_bucket)
+                       for region, replica_bucket in buckets.items() for prefix in out_prefixes]:
+            future.result()
+    if errors:
+        raise errors[0]
+    logger.info(f"replicated {len(keys)} objects to {', '.join(sorted(buckets))}")
+
+def catch_up(home, bucket: str, out_prefix: str) -> dict:
+    """
+    Copies the DELTA files (and sidecars) after the pointer of each region that the region does not have,
+    then advances the pointers, returns {region: number of DELTA files copied}
+    """
+    copied = {}
+    for region, replica_bucket in replica_buckets().items():
+        client = get_s3_client(region)
+        current = read_pointer(client, replica_bucket, pointer_key(out_prefix))[0].get("key")
+        present = set(list_deltas(client, replica_bucket, out_prefix, after=current))
+        missing = [key for key in list_deltas(home, bucket, out_prefix, after=current) if key not in present]
+        keys = []
+        for key in missing:
+            keys.append(key)
+            try:
+                home.head_object(Bucket=bucket, Key=delta_index.sidecar_key(key))
+                keys.append(delta_index.sidecar_key(key))
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                    raise
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            for future in [pool.submit(copy, home, bucket, region, replica_bucket, group) for group in by_delta(keys)]:
+                future.result()
+        advance(home, bucket, out_prefix, region, replica_bucket)
+        copied[region] = len(missing)
+    return copied
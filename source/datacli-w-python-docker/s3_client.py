@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Single S3 client shared by every stage of the loader
+# boto3 clients are thread safe, so the sync path and the async worker threads use the same instance
+# Set LOCAL_S3_ROOT to run against the local S3 stand-in instead of AWS,
+# LOCAL_S3_LATENCY_MS and LOCAL_S3_BANDWIDTH_MBPS make the stand-in behave more like the real service,
+# LOCAL_S3_PREFIX_RPS makes it answer SlowDown above that many requests per second and prefix
+# Both clients share the request rate controller of s3_rate
+# A client for another region (replication) uses <LOCAL_S3_ROOT>/<region> as its own local S3
+import os
+from functools import lru_cache
+
+import s3_rate
+
+# the async path runs several transfers at once, keep enough pooled connections for them
+MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+
+@lru_cache(maxsize=None)
+def get_s3_client(region_name: str = None):
+    local_root = os.getenv("LOCAL_S3_ROOT")
+    if local_root:
+        from local_s3 import LocalS3Client
+        return LocalS3Client(os.path.join(local_root, region_name) if region_name else local_root,
+                             latency=float(os.getenv("LOCAL_S3_LATENCY_MS", "0")) / 1000,
+                             bandwidth=float(os.getenv("LOCAL_S3_BANDWIDTH_MBPS", "0")) * 1e6 / 8,
+                             prefix_rps=float(os.getenv("LOCAL_S3_PREFIX_RPS", "0")),
+                             rate=s3_rate.get_controller())
+    import boto3
+    from botocore.config import Config
+    client = boto3.client("s3", region_name=region_name,
+                          config=Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                                        retries={"mode": "standard", "max_attempts": s3_rate.MAX_ATTEMPTS}))
+    controller = s3_rate.get_controller()
+    if controller:
+        s3_rate.attach(client, controller)
+    return client
@@ -0,0 +1,274 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Client side request rate control for S3, so a fan-out of loader tasks slows down instead of failing on SlowDown
+# S3 scales its request rate per key prefix. Every prefix (bucket and key up to the last /) gets a token bucket whose
+# rate follows AIMD: it is halved when S3 answers with a throttling error, at most once per second so a burst of
+# throttled requests in flight counts once, and raised by S3_RATE_STEP req/s for every throttle-free second.
+# Every attempt, retries included, takes a token. The same controller is attached to the boto3 client and to the
+# local S3 stand-in, request and throttle counts with the effective request rate are logged every S3_RATE_LOG_SECONDS.
+# OUTPUT_LAYOUT=hashed writes output objects to <OUTPUT_STAGING_PREFIX>/<hash>/<key> first, spreading multipart
+# uploads over 256 prefixes, and then publishes them to the output key in order with one copy request each.
+# The files of one run are published together once all of them are uploaded, in name order (async_core) or shard
+# order (checkpoint), so a reader never sees a file before another file of the run with a smaller name.
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import delta_verify
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = os.getenv("S3_RATE_LIMIT", "1") == "1"
+# requests per second and prefix; S3 supports at least 3500 writes and 5500 reads per second and prefix
+START_RPS = float(os.getenv("S3_RATE_START", "500"))
+MIN_RPS = float(os.getenv("S3_RATE_MIN", "1"))
+MAX_RPS = float(os.getenv("S3_RATE_MAX", "5500"))
+STEP_RPS = float(os.getenv("S3_RATE_STEP", "10"))
+LOG_SECONDS = float(os.getenv("S3_RATE_LOG_SECONDS", "30"))
+# attempts per request including the first one, throttled requests are retried with backoff
+MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "10"))
+THROTTLE_CODES = {"SlowDown", "ServiceUnavailable", "Throttling", "ThrottlingException", "RequestLimitExceeded",
+                  "TooManyRequestsException"}
+
+OUTPUT_LAYOUT = os.getenv("OUTPUT_LAYOUT", "direct")
+STAGING_PREFIX = os.getenv("OUTPUT_STAGING_PREFIX", "_staging")
+# copies up to this size are a single CopyObject request
+COPY_PART_BYTES = 1 << 30
+
+def prefix_of(bucket: str, key: str) -> str:
+    return f"{bucket}/{key.rpartition('/')[0]}/" if "/" in key else f"{bucket}/"
+
+def is_throttle(e: Exception) -> bool:
+    return isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in THROTTLE_CODES
+
+class TokenBucket:
+    """
+    Token bucket with a rate that can change, holds at most one second of tokens
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """
+        Blocks until a token is available, returns the seconds waited
+        """
+        waited = 0.0
+        while wait := self.try_take():
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+class PrefixLimiter(TokenBucket):
+    """
+    Token bucket of one prefix with an AIMD rate
+    """
+
+    def __init__(self) -> None:
+        super().__init__(START_RPS)
+        self.last_throttle = 0.0
+        self.last_increase = time.monotonic()
+
+    def throttled(self) -> bool:
+        """
+        Halves the rate, returns False when it was already halved in the last second
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_throttle < 1:
+                return False
+            self._refill(now)
+            self.rate = max(MIN_RPS, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_throttle = self.last_increase = now
+            return True
+
+    def succeeded(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            seconds = int(now - self.last_increase)
+            if seconds >= 1 and self.rate < MAX_RPS:
+                self.rate = min(MAX_RPS, self.rate + STEP_RPS * seconds)
+                self.last_increase += seconds
+
+class RateController:
+    """
+    Per prefix limiters plus the request and throttle counts of the process
+    """
+
+    def __init__(self) -> None:
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.started = self.logged = time.monotonic()
+        self.requests = self.throttles = 0
+        self.window_requests = self.window_throttles = 0
+        self.waited = 0.0
+
+    def limiter(self, prefix: str) -> PrefixLimiter:
+        with self.lock:
+            if prefix not in self.limiters:
+                self.limiters[prefix] = PrefixLimiter()
+            return self.limiters[prefix]
+
+    def acquire(self, prefix: str) -> None:
+        waited = self.limiter(prefix).take()
+        with self.lock:
+            self.requests += 1
+            self.window_requests += 1
+            self.waited += waited
+
+    def record(self, prefix: str, throttled: bool) -> None:
+        limiter = self.limiter(prefix)
+        if throttled:
+            with self.lock:
+                self.throttles += 1
+                self.window_throttles += 1
+            if limiter.throttled():
+                logger.warning(f"s3 throttled on {prefix}, request rate lowered to {limiter.rate:.0f} req/s")
+        else:
+            limiter.succeeded()
+        if time.monotonic() - self.logged >= LOG_SECONDS:
+            self.log_window()
+
+    def log_window(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            seconds = max(now - self.logged, 1e-9)
+            requests, throttles = self.window_requests, self.window_throttles
+            self.window_requests = self.window_throttles = 0
+            self.logged = now
+            limited = sorted((limiter.rate, prefix) for prefix, limiter in self.limiters.items() if limiter.rate < START_RPS)
+        logger.info(f"s3 requests: {requests / seconds:.1f} req/s over {seconds:.0f}s, {throttles} throttled"
+                    + (", limited prefixes: " + ", ".join(f"{p} {r:.0f} req/s" for r, p in limited[:5]) if limited else ""))
+
+    def log_total(self) -> None:
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        if self.requests:
+            logger.info(f"s3 requests total: {self.requests} in {seconds:.0f}s ({self.requests / seconds:.1f} req/s), "
+                        f"{self.throttles} throttled, {self.waited:.1f}s waited for the rate limit")
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_controller():
+    """
+    Returns the controller shared by every S3 client of the process, None when S3_RATE_LIMIT=0
+    """
+    global _controller
+    if not RATE_LIMIT:
+        return None
+    with _controller_lock:
+        if _controller is None:
+            _controller = RateController()
+            atexit.register(_controller.log_total)
+        return _controller
+
+def _params_prefix(params: dict) -> str:
+    return prefix_of(params.get("Bucket", ""), params.get("Key", params.get("Prefix", "")))
+
+def attach(client, controller: RateController) -> None:
+    """
+    Registers the controller on the botocore events of a boto3 S3 client
+    """
+
+    def before_parameter_build(params, context, **kwargs) -> None:
+        context["rate_prefix"] = _params_prefix(params)
+
+    def before_sign(request, **kwargs) -> None:
+        # called for every attempt, retries included
+        prefix = getattr(request, "context", {}).get("rate_prefix")
+        if prefix:
+            controller.acquire(prefix)
+
+    def needs_retry(response, request_dict, caught_exception=None, **kwargs) -> None:
+        prefix = request_dict.get("context", {}).get("rate_prefix")
+        if not prefix or response is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get("Error", {}).get("Code")
+        controller.record(prefix, code in THROTTLE_CODES or http_response.status_code == 503)
+        # the retry decision stays with the botocore retry handler
+        return None
+
+    events = client.meta.events
+    events.register("before-parameter-build.s3", before_parameter_build)
+    events.register("before-sign.s3", before_sign)
+    events.register("needs-retry.s3", needs_retry)
+
+def staging_key(key: str) -> str:
+    digest = hashlib.md5(key.encode()).hexdigest()[:2]
+    return f"{STAGING_PREFIX}/{digest}/{key}"
+
+def write_key(key: str) -> str:
+    """
+    Key an output object is first written to with the configured OUTPUT_LAYOUT
+    """
+    return staging_key(key) if OUTPUT_LAYOUT == "hashed" else key
+
+def publish(s3, bucket: str, moves: list) -> None:
+    """
+    Copies (staging key, output key) pairs to the output keys in the given order, then deletes the staging objects
+    Copying again after a failure is safe, the staging objects are only deleted once every copy is done
+    """
+    from boto3.s3.transfer import TransferConfig
+    config = TransferConfig(multipart_threshold=COPY_PART_BYTES, multipart_chunksize=COPY_PART_BYTES)
+    for staged, key in moves:
+        if staged == key:
+            continue
+        try:
+            s3.copy({"Bucket": bucket, "Key": staged}, bucket, key, Config=config)
+        except ClientError as e:
+            # a run stopped while deleting the staging objects left them partly deleted, their copies are done
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            s3.head_object(Bucket=bucket, Key=key)
+    for staged, key in moves:
+        if staged != key:
+            s3.delete_object(Bucket=bucket, Key=staged)
+
+def stage_file(s3, path: str, bucket: str, key: str, verification=None, metadata: dict = None) -> str:
+    """
+    Uploads a local file to the write key of the output key and returns the write key, publish moves it
+    With a delta_verify.Verification the upload is only completed once it passed
+    """
+    staged = write_key(key)
+    if verification:
+        delta_verify.upload_verified(s3, path, bucket, staged, verification, metadata)
+    else:
+        s3.upload_file(path, bucket, staged, ExtraArgs={"Metadata": metadata} if metadata else None)
+    return staged
+
+def upload_file(s3, path: str, bucket: str, key: str, verification=None, metadata: dict = None) -> None:
+    """
+    Uploads a local file to the output key through the configured OUTPUT_LAYOUT and publishes it right away
+    The user metadata is kept by the copy to the output key
+    """
+    publish(s3, bucket, [(stage_file(s3, path, bucket, key, verification, metadata), key)])
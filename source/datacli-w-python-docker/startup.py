@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Startup timing of the loader process
+# For small input files the task start dominates, so the loader logs how long after process start
+# the imports finished, the S3 client was ready and the first byte was downloaded.
+# papi-loader-startup-benchmark.py reads these lines.
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STARTUP_LOG_PREFIX = "startup:"
+
+def process_age() -> float:
+    """
+    Seconds since this process started, from /proc so the interpreter start and imports are included
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the command name, starttime is field 22 of the whole line
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return max(0.0, time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+PROCESS_START = time.time() - process_age()
+
+def since_start_ms() -> float:
+    return (time.time() - PROCESS_START) * 1000
+
+def mark(event: str) -> None:
+    logger.info(f"{STARTUP_LOG_PREFIX} {event} {since_start_ms():.0f} ms after process start")
+
+class FirstByte:
+    """
+    download_file Callback that marks the first downloaded bytes once per process
+    """
+
+    def __init__(self) -> None:
+        self.seen = False
+        self.lock = threading.Lock()
+
+    def __call__(self, nbytes: int) -> None:
+        if self.seen:
+            return
+        with self.lock:
+            if not self.seen:
+                self.seen = True
+                mark("first byte downloaded")
+
+first_byte = FirstByte()
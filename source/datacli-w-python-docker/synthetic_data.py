@@ -0,0 +1,32 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Generates synthetic input csv files in the format data cli expects, used by the benchmarks
+# Same seed gives the same file so benchmark runs are comparable
+import csv
+import random
+
+CSV_HEADER = ["key", "mutation_type", "logical_commit_time", "value", "value_type"]
+# logical_commit_time of the sample data in assets/input/data.csv
+BASE_COMMIT_TIME = 1680815895468055
+
+def generate_csv(path: str, rows: int, seed: int = 0, num_keys: int = 0, value_size: int = 64,
+                 delete_ratio: float = 0.05) -> None:
+    """
+    Writes rows mutations over num_keys keys (defaults to rows) to path
+    """
+    rnd = random.Random(seed)
+    num_keys = num_keys or rows
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for i in range(rows):
+            key = f"key{rnd.randrange(num_keys)}"
+            mutation_type = "DELETE" if rnd.random() < delete_ratio else "UPDATE"
+            value = "".join(rnd.choices(alphabet, k=value_size))
+            writer.writerow([key, mutation_type, BASE_COMMIT_TIME + seed * rows + i, value, "string"])
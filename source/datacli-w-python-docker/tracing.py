@@ -0,0 +1,170 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Traces a loader run from the S3 upload to the published DELTA file, and logs the data freshness
+# The EventBridge rule and the dispatcher pass the event time and id as EVENT_TIME and EVENT_ID. The trace id is
+# derived from them, so a task restarted for the same event, e.g. after a Spot interruption, joins the same trace.
+# Spans follow the OpenTelemetry layout (trace id, span id, parent, start, end, attributes, status):
+# - s3-event, from the event time to the process start: EventBridge, the dispatcher queue and the ECS task start
+# - loader, the run of this process, with a child span for every stage of every input file, see profiling.stage
+# TRACE_EXPORTER=xray sends them to AWS X-Ray as segments, TRACE_EXPORTER=file appends them as json lines
+# to TRACE_FILE. A successful event driven run also logs a json line with FreshnessSeconds, the time from
+# the event to the published output, which the stack turns into a CloudWatch metric with a metric filter.
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+import profiling
+import startup
+
+logger = logging.getLogger(__name__)
+
+EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "papi-trace.jsonl")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "papi-kv-loader")
+# X-Ray takes at most 500 KB per PutTraceSegments call
+XRAY_BATCH = 50
+
+def event_time() -> float:
+    """
+    Epoch seconds of EVENT_TIME (ISO 8601, as in EventBridge events), 0 when it is not set
+    """
+    value = os.getenv("EVENT_TIME", "")
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        logger.warning(f"EVENT_TIME {value} is not an ISO 8601 time")
+        return 0.0
+
+def trace_id(seed: str, start: float) -> str:
+    # X-Ray format, the epoch of the trace start followed by 96 bits that are unique per trace
+    return f"1-{int(start):08x}-{hashlib.sha1(seed.encode()).hexdigest()[:24]}"
+
+def span_id() -> str:
+    return os.urandom(8).hex()
+
+class Tracer:
+    """
+    Spans of one loader run, exported when the run ends
+    """
+
+    def __init__(self, bucket: str, key: str) -> None:
+        self.event_time = event_time()
+        self.started = startup.PROCESS_START
+        seed = os.getenv("EVENT_ID") or f"{bucket}/{key}@{self.event_time or self.started}"
+        self.trace_id = os.getenv("TRACE_ID") or trace_id(seed, self.event_time or self.started)
+        self.root = span_id()
+        self.attributes = {"s3.bucket": bucket, "s3.key": key, "event.id": os.getenv("EVENT_ID", ""),
+                           "event.time": os.getenv("EVENT_TIME", ""), "host.name": socket.gethostname(),
+                           "resume.attempt": os.getenv("RESUME_ATTEMPT", "0")}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def span(self, name: str, start: float, end: float, parent: str = None, attributes: dict = None,
+             error: str = "", span: str = None) -> None:
+        with self.lock:
+            self.spans.append({"trace_id": self.trace_id, "span_id": span or span_id(), "parent_id": parent,
+                               "name": name, "start": start, "end": end, "attributes": attributes or {},
+                               "status": "ERROR" if error else "OK", "error": error})
+
+    def stage(self, stage: str, item: str, start: float, seconds: float) -> None:
+        self.span(stage, start, start + seconds, parent=self.root, attributes={"s3.key": item})
+
+    def end(self, error: str) -> None:
+        now = time.time()
+        if self.event_time:
+            self.span("s3-event", self.event_time, self.started, attributes=dict(self.attributes))
+        self.span("loader", self.started, now, attributes=dict(self.attributes), error=error, span=self.root)
+
+_tracer = None
+
+def start(bucket: str, key: str) -> None:
+    """
+    Starts the trace of the run and records the loader stages as spans
+    """
+    global _tracer
+    if EXPORTER and _tracer is None:
+        _tracer = Tracer(bucket, key)
+        profiling.listeners.append(_tracer.stage)
+        logger.info(f"tracing to {EXPORTER}, trace id {_tracer.trace_id}")
+
+def published(bucket: str, key: str) -> None:
+    """
+    Logs the time from the S3 event to now, called once the output of an event driven run is published
+    """
+    start_time = event_time()
+    if not start_time:
+        return
+    seconds = time.time() - start_time
+    # a json line on its own, the metric filter of the stack reads FreshnessSeconds from it
+    print(json.dumps({"FreshnessSeconds": round(seconds, 3), "bucket": bucket, "key": key,
+                      "trace_id": _tracer.trace_id if _tracer else ""}), file=sys.stdout, flush=True)
+    logger.info(f"s3://{bucket}/{key} published {seconds:.1f}s after the upload event")
+
+def _xray_documents(spans: list) -> list:
+    documents = []
+    for span in spans:
+        if span["parent_id"]:
+            name = span["name"]
+        elif span["name"] == "loader":
+            name = SERVICE_NAME
+        else:
+            name = f"{SERVICE_NAME}-{span['name']}"
+        doc = {"name": name, "id": span["span_id"],
+               "trace_id": span["trace_id"], "start_time": span["start"], "end_time": span["end"],
+               # annotations are indexed for filter expressions, their keys allow letters, digits and _ only
+               "annotations": {k.replace(".", "_"): v for k, v in span["attributes"].items() if v != ""}}
+        if span["parent_id"]:
+            doc.update(type="subsegment", parent_id=span["parent_id"])
+        if span["error"]:
+            doc.update(fault=True, cause={"exceptions": [{"message": span["error"]}]})
+        documents.append(json.dumps(doc))
+    return documents
+
+def _export_xray(spans: list) -> None:
+    import boto3
+    xray = boto3.client("xray")
+    documents = _xray_documents(spans)
+    for i in range(0, len(documents), XRAY_BATCH):
+        resp = xray.put_trace_segments(TraceSegmentDocuments=documents[i:i + XRAY_BATCH])
+        if resp.get("UnprocessedTraceSegments"):
+            logger.warning(f"x-ray did not take {len(resp['UnprocessedTraceSegments'])} segments")
+
+def _export_file(spans: list) -> None:
+    with open(TRACE_FILE, "a") as f:
+        f.writelines(json.dumps(span) + "\n" for span in spans)
+
+def finish(error: str = "") -> None:
+    """
+    Ends the loader span and exports the spans, export errors are logged and do not fail the run
+    """
+    global _tracer
+    tracer = _tracer
+    if tracer is None:
+        return
+    _tracer = None
+    profiling.listeners.remove(tracer.stage)
+    tracer.end(error)
+    try:
+        if EXPORTER == "xray":
+            _export_xray(tracer.spans)
+        elif EXPORTER == "file":
+            _export_file(tracer.spans)
+        else:
+            logger.warning(f"unknown TRACE_EXPORTER {EXPORTER}, use xray or file")
+            return
+        logger.info(f"exported {len(tracer.spans)} spans of trace {tracer.trace_id}")
+    except Exception as e:
+        logger.error(f"trace export failed: {e}")
@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Reads the key set of a loader input csv or of a DELTA file produced by the loader
+# DELTA files are converted back to csv with data cli first, so the load test uses exactly the keys the server has
+import bisect
+import csv
+import itertools
+import os
+import random
+import subprocess
+import tempfile
+
+DATA_CLI_PATH = os.getenv("DATA_CLI_PATH", "/tools/data_cli/data_cli")
+
+def read_state(path: str) -> dict:
+    """
+    Returns key -> value of the latest mutation per key, deleted keys are left out
+    """
+    if "DELTA" in os.path.basename(path):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "keys.csv")
+            subprocess.run([DATA_CLI_PATH, "format_data", f"--input_file={path}", "--input_format=DELTA",
+                            f"--output_file={csv_path}", "--output_format=CSV"], check=True, stdout=subprocess.DEVNULL)
+            return read_state(csv_path)
+    latest = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            lct = int(row["logical_commit_time"])
+            if row["key"] not in latest or latest[row["key"]][0] <= lct:
+                latest[row["key"]] = (lct, row["mutation_type"], row.get("value", ""))
+    return {k: v for k, (_, mutation, v) in latest.items() if mutation.upper() != "DELETE"}
+
+class KeySampler:
+    """
+    Draws keys uniformly or with a zipf distribution, where the first keys in the file are the hottest
+    """
+
+    def __init__(self, keys: list, distribution: str = "uniform", zipf_s: float = 1.1, seed: int = 0) -> None:
+        if not keys:
+            raise ValueError("key set is empty")
+        self.keys = keys
+        self.rnd = random.Random(seed)
+        self.cum_weights = None
+        if distribution == "zipf":
+            self.cum_weights = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, len(keys) + 1)))
+        elif distribution != "uniform":
+            raise ValueError(f"unknown distribution {distribution}")
+
+    def sample(self, n: int) -> list:
+        if self.cum_weights is None:
+            return [self.keys[self.rnd.randrange(len(self.keys))] for _ in range(n)]
+        total = self.cum_weights[-1]
+        return [self.keys[bisect.bisect_left(self.cum_weights, self.rnd.random() * total)] for _ in range(n)]
@@ -0,0 +1,179 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Open-loop load generator for the Key/Value server lookup API (GET /v1/getvalues?keys=...)
+# Requests are sent on a fixed schedule whatever the response time, and latency is measured from the
+# scheduled send time, so a slow server shows up as latency instead of a lower request rate.
+# --ramp-to increases the rate linearly during the run and the per interval report shows
+# at which rate the WAF rate based rule starts blocking (403).
+# example against the stub server:
+#   python papi-kv-stub-server.py --keys ../../assets/input/data.csv --port 8080 &
+#   python papi-kv-loadtest.py --url http://127.0.0.1:8080 --keys ../../assets/input/data.csv --qps 200 --duration 30
+import argparse
+import asyncio
+import random
+import ssl
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+from keyset import KeySampler, read_state
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="open-loop load test for the KV server lookup API")
+    parser.add_argument("--url", required=True, help="base url of the ALB or the stub server")
+    parser.add_argument("--path", default="/v1/getvalues")
+    parser.add_argument("--keys", required=True, help="loader input csv or DELTA file with the keys to query")
+    parser.add_argument("--qps", type=float, default=50, help="requests per second (start rate when ramping)")
+    parser.add_argument("--ramp-to", type=float, default=0, help="requests per second at the end of the run")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--arrivals", choices=["constant", "poisson"], default="poisson")
+    parser.add_argument("--batch-size", type=int, default=1, help="keys per request")
+    parser.add_argument("--batch-size-max", type=int, default=0, help="draw the batch size from batch-size..max")
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=5, help="seconds per line of the time series report")
+    parser.add_argument("--header", action="append", default=[], help="extra request header 'name: value'")
+    parser.add_argument("--insecure", action="store_true", help="skip tls certificate verification")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections to one host, at most max_connections open at a time
+    """
+
+    def __init__(self, url: str, max_connections: int, insecure: bool = False) -> None:
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.tls = parts.scheme == "https"
+        self.port = parts.port or (443 if self.tls else 80)
+        self.ssl_context = None
+        if self.tls:
+            self.ssl_context = ssl.create_default_context()
+            if insecure:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.idle = []
+        self.slots = asyncio.Semaphore(max_connections)
+
+    async def get(self, target: str, headers: dict, timeout: float) -> tuple:
+        """
+        Returns (status, body), a connection that fails is dropped and not reused
+        """
+        async with self.slots:
+            conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), timeout)
+            reader, writer = conn
+            try:
+                lines = [f"GET {target} HTTP/1.1", f"Host: {self.host}"] + [f"{k}: {v}" for k, v in headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+                status, body, keep_alive = await asyncio.wait_for(self.read_response(reader), timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.append(conn)
+            else:
+                writer.close()
+            return status, body
+
+    @staticmethod
+    async def read_response(reader: asyncio.StreamReader) -> tuple:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while (size := int((await reader.readline()).split(b";")[0], 16)) > 0:
+                body += await reader.readexactly(size)
+                await reader.readline()
+            await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", "0")))
+        return status, body, headers.get("connection", "").lower() != "close"
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+async def run(args) -> None:
+    state = read_state(args.keys)
+    sampler = KeySampler(sorted(state) if args.distribution == "uniform" else list(state),
+                         args.distribution, args.zipf_s, args.seed)
+    rnd = random.Random(args.seed)
+    pool = ConnectionPool(args.url, args.max_connections, args.insecure)
+    headers = dict(h.split(":", 1) for h in args.header)
+    headers = {k.strip(): v.strip() for k, v in headers.items()}
+    # (scheduled offset, latency seconds, outcome) per request
+    results = []
+    tasks = set()
+
+    async def one(scheduled: float, offset: float) -> None:
+        size = rnd.randint(args.batch_size, args.batch_size_max) if args.batch_size_max else args.batch_size
+        target = f"{args.path}?keys={','.join(quote(k, safe='') for k in sampler.sample(size))}"
+        try:
+            status, _ = await pool.get(target, headers, args.timeout)
+            outcome = str(status)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+            outcome = "conn-error"
+        results.append((offset, time.monotonic() - scheduled, outcome))
+
+    print(f"{len(state)} keys, {args.distribution} distribution, batch size {args.batch_size}"
+          f"{'-' + str(args.batch_size_max) if args.batch_size_max else ''}, target {args.qps} qps"
+          f"{' ramping to ' + str(args.ramp_to) if args.ramp_to else ''} for {args.duration}s")
+    start = time.monotonic()
+    offset = 0.0
+    while offset < args.duration:
+        rate = args.qps + (args.ramp_to - args.qps) * offset / args.duration if args.ramp_to else args.qps
+        scheduled = start + offset
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(one(scheduled, offset))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        offset += rnd.expovariate(rate) if args.arrivals == "poisson" else 1 / rate
+    if tasks:
+        await asyncio.wait(tasks)
+    report(results, time.monotonic() - start, args.interval)
+
+def report(results: list, elapsed: float, interval: float) -> None:
+    print(f"\n{'t(s)':>6} {'sent/s':>8} {'ok':>7} {'err%':>6} {'p50ms':>8} {'p99ms':>8}  errors")
+    buckets = {}
+    for offset, latency, outcome in results:
+        buckets.setdefault(int(offset // interval), []).append((latency, outcome))
+    for b in sorted(buckets):
+        rows = buckets[b]
+        ok = sorted(lat for lat, o in rows if o.startswith("2"))
+        errors = Counter(o for _, o in rows if not o.startswith("2"))
+        print(f"{b * interval:6.0f} {len(rows) / interval:8.1f} {len(ok):7d} {100 * (len(rows) - len(ok)) / len(rows):6.1f} "
+              f"{percentile(ok, 50) * 1000:8.1f} {percentile(ok, 99) * 1000:8.1f}  {dict(errors) if errors else ''}")
+    ok = sorted(lat for _, lat, o in results if o.startswith("2"))
+    outcomes = Counter(o for _, _, o in results)
+    print(f"\nrequests {len(results)} in {elapsed:.1f}s ({len(results) / elapsed:.1f}/s), "
+          f"success {len(ok)}, error rate {100 * (len(results) - len(ok)) / max(len(results), 1):.2f}%")
+    print(f"outcomes {dict(outcomes)}")
+    print(f"latency ms p50 {percentile(ok, 50) * 1000:.1f} p95 {percentile(ok, 95) * 1000:.1f} "
+          f"p99 {percentile(ok, 99) * 1000:.1f} max {(ok[-1] if ok else float('nan')) * 1000:.1f}")
+    if outcomes.get("403"):
+        first = min(offset for offset, _, o in results if o == "403")
+        print(f"first 403 (WAF block) at {first:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,95 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Local stand-in for the Key/Value server lookup API, used to validate papi-kv-loadtest.py offline
+# Serves GET /v1/getvalues?keys=k1,k2 from a loader input csv or DELTA file.
+# --rate-limit emulates the WAF rate based rule: a caller that sends more than the limit within the
+# window gets 403 until its request count drops, aggregated per source ip or per --aggregate-header.
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from keyset import read_state
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="stub KV server lookup API")
+    parser.add_argument("--keys", required=True, help="loader input csv or DELTA file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every response")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per window per caller, 0 disables")
+    parser.add_argument("--window", type=float, default=300, help="rate limit evaluation window in seconds")
+    parser.add_argument("--aggregate-header", default="", help="aggregate the rate limit on this header instead of ip")
+    return parser.parse_args()
+
+class RateLimiter:
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def allow(self, caller: str) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            seen = self.requests.setdefault(caller, deque())
+            while seen and seen[0] <= now - self.window:
+                seen.popleft()
+            seen.append(now)
+            return len(seen) <= self.limit
+
+def make_handler(state: dict, args, limiter: RateLimiter):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, without this the latency includes delayed acks
+        disable_nagle_algorithm = True
+
+        def send(self, status: int, body: dict) -> None:
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if limiter:
+                caller = self.headers.get(args.aggregate_header, "") if args.aggregate_header else self.client_address[0]
+                if not limiter.allow(caller):
+                    self.send(403, {"message": "blocked by rate limit"})
+                    return
+            if url.path != "/v1/getvalues":
+                self.send(404, {"message": "not found"})
+                return
+            if args.latency_ms:
+                time.sleep(args.latency_ms / 1000)
+            keys = [k for v in parse_qs(url.query).get("keys", []) for k in v.split(",") if k]
+            self.send(200, {"keys": {k: {"value": state[k]} for k in keys if k in state}})
+
+        def log_message(self, format, *log_args) -> None:
+            pass
+
+    return Handler
+
+def main() -> None:
+    args = parse_args()
+    state = read_state(args.keys)
+    limiter = RateLimiter(args.rate_limit, args.window) if args.rate_limit else None
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state, args, limiter))
+    server.daemon_threads = True
+    print(f"serving {len(state)} keys on http://{args.host}:{args.port}/v1/getvalues")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/bin/bash
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Build cache helpers for the data cli build, sourced by papi-data-cli-build.sh and the imagebuilder component
+# Run the functions from the protected-auction-key-value-service checkout.
+# - Bazel disk cache: a tarball in S3 keyed by toolchain version and upstream commit.
+#   The exact commit is restored when available, otherwise the latest cache of the same toolchain,
+#   which still has every action that did not change upstream.
+# - builders images: the bazel-debian toolchain images, saved to S3 per toolchain version
+# - Docker BuildKit layer cache: kept as a cache manifest in the ECR repo
+# BUILD_CACHE_S3_URL must be set, e.g. s3://mybucket/build-cache
+
+BAZEL_DISK_CACHE_DIR=".bazel-disk-cache"
+BUILD_CACHE_STATUS="miss"
+BUILD_START_SECONDS=${SECONDS}
+
+# toolchain key changes when bazel or the builders toolchain images change
+build_cache_keys() {
+  UPSTREAM_COMMIT=$(git rev-parse HEAD)
+  TOOLCHAIN_KEY=$( (cat .bazelversion 2>/dev/null; git rev-parse HEAD:builders 2>/dev/null) | sha256sum | cut -c1-16)
+  BAZEL_CACHE_PREFIX="${BUILD_CACHE_S3_URL}/bazel/${TOOLCHAIN_KEY}"
+  echo "build cache toolchain key ${TOOLCHAIN_KEY}, upstream commit ${UPSTREAM_COMMIT}"
+}
+
+restore_build_cache() {
+  build_cache_keys
+  mkdir -p "${BAZEL_DISK_CACHE_DIR}"
+  # keep bazel from treating the cache folder as part of the source tree
+  grep -qx "${BAZEL_DISK_CACHE_DIR}" .bazelignore 2>/dev/null || echo "${BAZEL_DISK_CACHE_DIR}" >> .bazelignore
+  if aws s3 cp "${BAZEL_CACHE_PREFIX}/${UPSTREAM_COMMIT}.tar.gz" /tmp/bazel-disk-cache.tar.gz --only-show-errors; then
+    BUILD_CACHE_STATUS="exact"
+  elif aws s3 cp "${BAZEL_CACHE_PREFIX}/latest.tar.gz" /tmp/bazel-disk-cache.tar.gz --only-show-errors; then
+    BUILD_CACHE_STATUS="toolchain"
+  fi
+  if [ "${BUILD_CACHE_STATUS}" != "miss" ]; then
+    tar -xzf /tmp/bazel-disk-cache.tar.gz -C "${BAZEL_DISK_CACHE_DIR}"
+    rm -f /tmp/bazel-disk-cache.tar.gz
+  fi
+  if aws s3 cp "${BAZEL_CACHE_PREFIX}/builders-images.tar.gz" /tmp/builders-images.tar.gz --only-show-errors; then
+    docker load -i /tmp/builders-images.tar.gz
+    rm -f /tmp/builders-images.tar.gz
+  fi
+  echo "bazel disk cache restore: ${BUILD_CACHE_STATUS}"
+}
+
+# flags to add to the bazel command line
+bazel_cache_flags() {
+  echo "--disk_cache=${BAZEL_DISK_CACHE_DIR}"
+}
+
+save_build_cache() {
+  tar -czf /tmp/bazel-disk-cache.tar.gz -C "${BAZEL_DISK_CACHE_DIR}" .
+  aws s3 cp /tmp/bazel-disk-cache.tar.gz "${BAZEL_CACHE_PREFIX}/${UPSTREAM_COMMIT}.tar.gz" --only-show-errors
+  aws s3 cp "${BAZEL_CACHE_PREFIX}/${UPSTREAM_COMMIT}.tar.gz" "${BAZEL_CACHE_PREFIX}/latest.tar.gz" --only-show-errors
+  rm -f /tmp/bazel-disk-cache.tar.gz
+  if ! aws s3 ls "${BAZEL_CACHE_PREFIX}/builders-images.tar.gz" > /dev/null; then
+    BUILDERS_IMAGES=$(docker images --format '{{.Repository}}:{{.Tag}}' | grep '^privacysandbox/builders/' || true)
+    if [ -n "${BUILDERS_IMAGES}" ]; then
+      docker save ${BUILDERS_IMAGES} | gzip > /tmp/builders-images.tar.gz
+      aws s3 cp /tmp/builders-images.tar.gz "${BAZEL_CACHE_PREFIX}/builders-images.tar.gz" --only-show-errors
+      rm -f /tmp/builders-images.tar.gz
+    fi
+  fi
+}
+
+# docker build with the BuildKit layer cache stored in ECR next to the image
+# usage: cached_docker_build <image path> <cache tag> <docker build args...>
+cached_docker_build() {
+  local image_path=$1
+  local cache_ref="${image_path%:*}:$2"
+  shift 2
+  docker buildx inspect papi-cache-builder > /dev/null 2>&1 || docker buildx create --name papi-cache-builder --driver docker-container > /dev/null
+  docker buildx build --builder papi-cache-builder --load -t "${image_path}" \
+    --cache-from "type=registry,ref=${cache_ref}" \
+    --cache-to "type=registry,ref=${cache_ref},mode=max,image-manifest=true,oci-mediatypes=true" \
+    "$@"
+}
+
+# prints the cache hit rate from the bazel log and the build duration
+# bazel logs "INFO: 5000 processes: 4800 disk cache hit, 150 internal, 50 linux-sandbox."
+report_build_cache() {
+  local log_file=$1
+  local summary
+  summary=$(grep -oE '[0-9]+ processes: [^.]*' "${log_file}" | tail -1)
+  local total hits internal
+  total=$(echo "${summary}" | grep -oE '^[0-9]+')
+  hits=$(echo "${summary}" | grep -oE '[0-9]+ (disk|remote) cache hit' | awk '{ sum += $1 } END { print sum + 0 }')
+  internal=$(echo "${summary}" | grep -oE '[0-9]+ internal' | grep -oE '^[0-9]+')
+  total=${total:-0}; hits=${hits:-0}; internal=${internal:-0}
+  local actions=$((total - internal))
+  local rate=0
+  if [ "${actions}" -gt 0 ]; then rate=$((100 * hits / actions)); fi
+  echo "BUILD CACHE REPORT: restore=${BUILD_CACHE_STATUS} actions=${actions} cache_hits=${hits} hit_rate=${rate}% duration=$((SECONDS - BUILD_START_SECONDS))s"
+}
@@ -17,48 +17,70 @@ cd /home/ec2-user/data-cli
 echo "${PWD}"
 ls -ltr
 
-# if the folder protected-auction-key-value-service exists continue else run git clone
-if [ -d "protected-auction-key-value-service" ]
-then
-    echo "protected-auction-key-value-service directory exists.Skipping git clone"
-else
-    echo "Cloning git repo"
-    git clone "https://github.com/privacysandbox/protected-auction-key-value-service"
-    git config --global --add safe.directory /home/ec2-user/data-cli/protected-auction-key-value-service
-fi
-cd protected-auction-key-value-service
-# echo "Starting test riegeli data. This step takes longer on first execution"
-# ./tools/serving_data_generator/generate_test_riegeli_data
-
-echo "Starting docker image build"
-builders/tools/bazel-debian run //production/packaging/tools:copy_to_dist --//:instance=local --//:platform=local
-
-# read the two input parameters and assign them to account and region variables
-echo "Pushing docker image to ECR"
+# read the input parameters: account, region and the optional s3 url of the build cache
 export AWS_ACCOUNT_ID=${1}
 export AWS_DEFAULT_REGION=${2}
+export BUILD_CACHE_S3_URL=${3}
 ECR_REPO="${AWS_ACCOUNT_ID}.dkr.ecr.${AWS_DEFAULT_REGION}.amazonaws.com"
 IMAGE_REPO_NAME="papi-kv-ecr-repo"
-IMAGE_REPO_TAG="tools_binaries_docker_image"
-REPO_PATH="${ECR_REPO}/${IMAGE_REPO_NAME}:${IMAGE_REPO_TAG}"
-echo "REPO_PATH: ${REPO_PATH}"
-echo "Pushing docker image to ECR"
 aws ecr get-login-password --region ${AWS_DEFAULT_REGION} | docker login --username AWS --password-stdin ${ECR_REPO}
-docker load -i dist/tools_binaries_docker_image.tar
-docker tag bazel/production/packaging/tools:tools_binaries_docker_image $REPO_PATH
-docker push $REPO_PATH
-echo "data cli container build done"
+
+# images are tagged by upstream commit and content, see papi-image-tags.sh
+source /home/ec2-user/data-cli/papi-image-tags.sh
+resolve_upstream_commit refresh
+
+if image_tag_exists "${TOOLS_CONTENT_TAG}"
+then
+    echo "${IMAGE_REPO_NAME}:${TOOLS_CONTENT_TAG} exists, skipping the data cli build"
+    point_tag "${TOOLS_CONTENT_TAG}" "${TOOLS_POINTER_TAG}"
+else
+    # if the folder protected-auction-key-value-service exists continue else run git clone
+    if [ -d "protected-auction-key-value-service" ]
+    then
+        echo "protected-auction-key-value-service directory exists.Skipping git clone"
+    else
+        echo "Cloning git repo"
+        git clone "${PAPI_REPO_URL}"
+        git config --global --add safe.directory /home/ec2-user/data-cli/protected-auction-key-value-service
+    fi
+    cd protected-auction-key-value-service
+    # build the commit the tag was derived from
+    git fetch --quiet origin
+    git checkout --quiet --detach "${UPSTREAM_COMMIT}"
+
+    BAZEL_CACHE_FLAGS=""
+    if [ -n "${BUILD_CACHE_S3_URL}" ]
+    then
+        source /home/ec2-user/data-cli/papi-build-cache.sh
+        restore_build_cache
+        BAZEL_CACHE_FLAGS=$(bazel_cache_flags)
+    fi
+    # echo "Starting test riegeli data. This step takes longer on first execution"
+    # ./tools/serving_data_generator/generate_test_riegeli_data
+
+    echo "Starting docker image build"
+    set -o pipefail
+    builders/tools/bazel-debian run //production/packaging/tools:copy_to_dist --//:instance=local --//:platform=local ${BAZEL_CACHE_FLAGS} 2>&1 | tee /home/ec2-user/data-cli/bazel-build.log
+    if [ -n "${BUILD_CACHE_S3_URL}" ]
+    then
+        save_build_cache
+        report_build_cache /home/ec2-user/data-cli/bazel-build.log
+    fi
+
+    echo "Pushing docker image to ECR"
+    docker load -i dist/tools_binaries_docker_image.tar
+    publish_image ${TOOLS_LOCAL_IMAGE} ${TOOLS_CONTENT_TAG} ${TOOLS_POINTER_TAG}
+    echo "data cli container build done"
+    cd /home/ec2-user/data-cli
+fi
 
 # build and publish docker image with data cli and aws cli
 echo "Building the data cli + aws cli"
-IMAGE_REPO_NAME="papi-kv-ecr-repo"
+if [ -n "${BUILD_CACHE_S3_URL}" ]
+then
+    # layer cache is kept in the ECR repo next to the image
+    source /home/ec2-user/data-cli/papi-build-cache.sh
+fi
 IMAGE_REPO_TAG="papi-datacli-with-awscli"
-docker build -t $IMAGE_REPO_NAME:$IMAGE_REPO_TAG .
-ECR_REPO="${AWS_ACCOUNT_ID}.dkr.ecr.${AWS_DEFAULT_REGION}.amazonaws.com"
-REPO_PATH="${ECR_REPO}/${IMAGE_REPO_NAME}:${IMAGE_REPO_TAG}"
-echo "REPO_PATH: ${REPO_PATH}"
-echo "Pushing data cli + aws cli docker image to ECR"
-aws ecr get-login-password --region ${AWS_DEFAULT_REGION} | docker login --username AWS --password-stdin ${ECR_REPO}
-docker tag $IMAGE_REPO_NAME:$IMAGE_REPO_TAG $REPO_PATH
-docker push $REPO_PATH
-echo "Done"
\ No newline at end of file
+build_datacli_image ${IMAGE_REPO_TAG} $(content_tag awscli Dockerfile papi-delta-filegen-s3.sh)
+echo "Done"
@@ -0,0 +1,108 @@
+#!/bin/bash
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Content addressed image tags for the data cli images, sourced by papi-data-cli-build.sh and the imagebuilder components
+# - tools-<upstream commit> for the data cli tools image
+# - awscli-, python- and slim-<upstream commit>-<files hash> for the loader images,
+#   the hash covers the Dockerfile and the scripts copied in to the image
+# An image is only built when its content tag is not in the ECR repo yet. The mutable tags used by the
+# loader stack (tools_binaries_docker_image, papi-datacli-with-awscli, papi-datacli-with-python) are pointers
+# that are moved to the new image after it is pushed, or retagged to the existing image when the build is skipped,
+# e.g. after a Dockerfile is reverted to a content tag that is still in the repo.
+# ECR_REPO, IMAGE_REPO_NAME and AWS_DEFAULT_REGION must be set.
+
+PAPI_REPO_URL=${PAPI_REPO_URL:-"https://github.com/privacysandbox/protected-auction-key-value-service"}
+UPSTREAM_COMMIT_FILE=${UPSTREAM_COMMIT_FILE:-"${HOME}/data-cli/upstream-commit"}
+TOOLS_POINTER_TAG="tools_binaries_docker_image"
+TOOLS_LOCAL_IMAGE="bazel/production/packaging/tools:tools_binaries_docker_image"
+
+# resolves the upstream HEAD commit once per build, later components read it back from UPSTREAM_COMMIT_FILE
+# usage: resolve_upstream_commit [refresh]
+resolve_upstream_commit() {
+  if [ "$1" == "refresh" ] || [ ! -s "${UPSTREAM_COMMIT_FILE}" ]; then
+    mkdir -p "$(dirname "${UPSTREAM_COMMIT_FILE}")"
+    git ls-remote "${PAPI_REPO_URL}" HEAD | cut -f1 > "${UPSTREAM_COMMIT_FILE}"
+  fi
+  UPSTREAM_COMMIT=$(cat "${UPSTREAM_COMMIT_FILE}")
+  TOOLS_CONTENT_TAG="tools-${UPSTREAM_COMMIT:0:12}"
+  echo "upstream commit ${UPSTREAM_COMMIT}"
+}
+
+# usage: content_tag <name> <files...>
+content_tag() {
+  local name=$1
+  shift
+  echo "${name}-${UPSTREAM_COMMIT:0:12}-$(cat "$@" | sha256sum | cut -c1-12)"
+}
+
+image_tag_exists() {
+  aws ecr describe-images --repository-name "${IMAGE_REPO_NAME}" --image-ids imageTag="$1" \
+    --region "${AWS_DEFAULT_REGION}" > /dev/null 2>&1
+}
+
+# pushes the content tag first, the pointer tag only moves once the image is in ECR
+# usage: publish_image <local image> <content tag> <pointer tag>
+publish_image() {
+  docker tag "$1" "${ECR_REPO}/${IMAGE_REPO_NAME}:$2"
+  docker push "${ECR_REPO}/${IMAGE_REPO_NAME}:$2"
+  docker tag "$1" "${ECR_REPO}/${IMAGE_REPO_NAME}:$3"
+  docker push "${ECR_REPO}/${IMAGE_REPO_NAME}:$3"
+  echo "published ${IMAGE_REPO_NAME}:$2 as $3"
+}
+
+image_digest() {
+  aws ecr describe-images --repository-name "${IMAGE_REPO_NAME}" --image-ids imageTag="$1" \
+    --region "${AWS_DEFAULT_REGION}" --query 'imageDetails[0].imageDigest' --output text 2> /dev/null
+}
+
+# moves the pointer tag to the image of an existing content tag without pulling it
+# usage: point_tag <content tag> <pointer tag>
+point_tag() {
+  local digest
+  digest=$(image_digest "$1")
+  if [ "$(image_digest "$2")" == "${digest}" ]; then
+    echo "${IMAGE_REPO_NAME}:$2 already points to $1"
+    return 0
+  fi
+  local manifest media_type
+  manifest=$(aws ecr batch-get-image --repository-name "${IMAGE_REPO_NAME}" --image-ids imageDigest="${digest}" \
+    --region "${AWS_DEFAULT_REGION}" --query 'images[0].imageManifest' --output text) || return 1
+  media_type=$(aws ecr batch-get-image --repository-name "${IMAGE_REPO_NAME}" --image-ids imageDigest="${digest}" \
+    --region "${AWS_DEFAULT_REGION}" --query 'images[0].imageManifestMediaType' --output text) || return 1
+  aws ecr put-image --repository-name "${IMAGE_REPO_NAME}" --image-tag "$2" --image-manifest "${manifest}" \
+    --image-manifest-media-type "${media_type}" --region "${AWS_DEFAULT_REGION}" > /dev/null || return 1
+  echo "moved ${IMAGE_REPO_NAME}:$2 to $1"
+}
+
+# the tools image is needed locally by the test component, pull it when the build was skipped
+pull_tools_image() {
+  docker pull "${ECR_REPO}/${IMAGE_REPO_NAME}:${TOOLS_CONTENT_TAG}"
+  docker tag "${ECR_REPO}/${IMAGE_REPO_NAME}:${TOOLS_CONTENT_TAG}" "${TOOLS_LOCAL_IMAGE}"
+}
+
+# builds the Dockerfile in the current folder on top of the tools image of the same upstream commit
+# usage: build_datacli_image <pointer tag> <content tag> [dockerfile]
+build_datacli_image() {
+  local pointer_tag=$1
+  local content_tag=$2
+  local dockerfile=${3:-Dockerfile}
+  if image_tag_exists "${content_tag}"; then
+    echo "${IMAGE_REPO_NAME}:${content_tag} exists, skipping the build of ${pointer_tag}"
+    point_tag "${content_tag}" "${pointer_tag}"
+    return
+  fi
+  local image_path="${ECR_REPO}/${IMAGE_REPO_NAME}:${content_tag}"
+  local build_args=(-f "${dockerfile}" --build-arg AWS_ACCOUNT_ID="${AWS_ACCOUNT_ID}" --build-arg AWS_DEFAULT_REGION="${AWS_DEFAULT_REGION}"
+                    --build-arg IMAGE_REPO_TAG="${TOOLS_CONTENT_TAG}")
+  if declare -F cached_docker_build > /dev/null; then
+    cached_docker_build "${image_path}" "buildcache-${pointer_tag}" "${build_args[@]}" .
+  else
+    docker build -t "${image_path}" "${build_args[@]}" .
+  fi
+  publish_image "${image_path}" "${content_tag}" "${pointer_tag}"
+}
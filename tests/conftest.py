@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# The stacks import as deployment.*, the loader modules from their folder like in the image
+# Lambda handlers are all index.py, load_source loads one of them under its own name
+# fake_data_cli stands in for the data cli binary, format_data copies the input file to the output file
+import importlib.util
+import os
+import stat
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOADER_DIR = os.path.join(ROOT, "source", "datacli-w-python-docker")
+for path in (ROOT, LOADER_DIR, os.path.join(ROOT, "source", "_lambda_dispatch")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION", "1")
+os.environ.setdefault("CDK_DEFAULT_ACCOUNT", "123456789012")
+os.environ.setdefault("CDK_DEFAULT_REGION", "us-west-2")
+
+@pytest.fixture
+def load_source():
+    def load(relative_path: str, name: str):
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+@pytest.fixture
+def fake_data_cli(tmp_path, monkeypatch):
+    import data_cli
+    path = tmp_path / "data_cli"
+    path.write_text("#!" + sys.executable + "\n"
+                    "import shutil, sys\n"
+                    "args = dict(a[2:].split('=', 1) for a in sys.argv[2:] if a.startswith('--') and '=' in a)\n"
+                    "shutil.copyfile(args['input_file'], args['output_file'])\n")
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(data_cli, "DATA_CLI_PATH", str(path))
+    return str(path)
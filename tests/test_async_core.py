@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# The asyncio loader core against the local S3 stand-in, with a failure in each stage of one job
+import sys
+import threading
+
+import pytest
+
+import async_core
+import data_cli
+from local_s3 import LocalS3Client
+
+CSV = "key,mutation_type,logical_commit_time,value_type,value\nk1,UPDATE,1,string,a\nk2,DELETE,2,string,\n"
+
+class StageS3(LocalS3Client):
+    """
+    Local S3 whose writes of keys containing one of fail_writes raise, and that sets stop_after_download once an
+    object was downloaded
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.fail_writes = set()
+        self.stop_after_download = None
+
+    def _simulate(self, operation: str, bucket: str, key: str, nbytes: int = 0) -> None:
+        if operation in ("PutObject", "CreateMultipartUpload", "UploadPart") and any(f in key for f in self.fail_writes):
+            raise self._error("InternalError", operation)
+        super()._simulate(operation, bucket, key, nbytes)
+
+    def download_file(self, *args, **kwargs) -> None:
+        super().download_file(*args, **kwargs)
+        if self.stop_after_download is not None:
+            self.stop_after_download.set()
+
+@pytest.fixture
+def failing_data_cli(fake_data_cli, tmp_path, monkeypatch):
+    # the data cli stand-in, failing for inputs named convert-fails
+    path = tmp_path / "failing_data_cli"
+    path.write_text("#!" + sys.executable + "\n"
+                    "import subprocess, sys\n"
+                    "if any('convert-fails' in a for a in sys.argv if a.startswith('--input_file')):\n"
+                    "    sys.exit('broken input')\n"
+                    f"sys.exit(subprocess.call([{fake_data_cli!r}, *sys.argv[1:]]))\n")
+    path.chmod(0o755)
+    monkeypatch.setattr(data_cli, "DATA_CLI_PATH", str(path))
+    return str(path)
+
+@pytest.fixture
+def s3(tmp_path):
+    s3 = StageS3(str(tmp_path / "s3"))
+    for name in ("a", "b", "c", "convert-fails", "upload-fails"):
+        s3.put_object(Bucket="inb", Key=f"input/{name}.csv", Body=CSV)
+    return s3
+
+def jobs(*names) -> list:
+    return [async_core.Job("inb", f"input/{name}.csv", "outb", "output") for name in names]
+
+def published(s3) -> list:
+    return [obj["Key"] for obj in s3.list_objects_v2(Bucket="outb", Prefix="output/").get("Contents", [])
+            if obj["Key"].endswith("_DELTA")]
+
+def test_a_failed_stage_leaves_the_other_jobs_done(tmp_path, s3, failing_data_cli):
+    s3.fail_writes.add("upload-fails")
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    done = []
+    result = async_core.run(jobs("a", "missing", "b", "convert-fails", "upload-fails", "c"), s3, str(work_dir),
+                            transfer_concurrency=2, convert_concurrency=2, queue_size=1, on_done=done.append)
+    errors = {job.ifname: job.error.split(":")[0] for job in result}
+    assert errors == {"a.csv": "", "missing.csv": "download", "b.csv": "", "convert-fails.csv": "convert",
+                      "upload-fails.csv": "upload", "c.csv": ""}
+    assert published(s3) == ["output/a.csv_DELTA", "output/b.csv_DELTA", "output/c.csv_DELTA"]
+    assert sorted(job.ifname for job in done) == ["a.csv", "b.csv", "c.csv"]
+    assert all(set(job.timings) == {"download", "convert", "upload"} for job in done)
+    assert s3.get_object(Bucket="outb", Key="output/a.csv_DELTA")["Body"].read().decode() == CSV
+    s3.head_object(Bucket="outb", Key="output/a.csv_DELTA.index.json")
+    # failed jobs clean up their files too
+    assert not list(work_dir.iterdir())
+
+def test_jobs_not_started_after_stop_event_are_interrupted(tmp_path, s3, failing_data_cli):
+    stop_event = threading.Event()
+    s3.stop_after_download = stop_event
+    result = async_core.run(jobs("a", "b", "c"), s3, str(tmp_path), transfer_concurrency=1, stop_event=stop_event)
+    # the job in flight when the event was set still finishes
+    assert [job.error for job in result] == ["", "interrupted", "interrupted"]
+    assert published(s3) == ["output/a.csv_DELTA"]
+
+def test_stop_event_set_before_the_run_starts_nothing(tmp_path, s3, failing_data_cli):
+    stop_event = threading.Event()
+    stop_event.set()
+    result = async_core.run(jobs("a", "b"), s3, str(tmp_path), stop_event=stop_event)
+    assert [job.error for job in result] == ["interrupted", "interrupted"]
+    assert not published(s3)
@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Change data capture from the in-process FakeStream to time windowed DELTA files on the local S3 stand-in
+import csv
+import io
+import json
+import threading
+
+import pytest
+
+import cdc_source
+from local_s3 import LocalS3Client
+
+class Clock:
+    """
+    time module of cdc_source with a monotonic clock the test moves
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cdc_source, "time", clock)
+    monkeypatch.setattr(cdc_source, "WINDOW_SECONDS", 60)
+    monkeypatch.setattr(cdc_source, "WINDOW_RECORDS", 1000)
+    return clock
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path / "s3"))
+
+def consumer(stream, s3, tmp_path) -> cdc_source.Consumer:
+    work_dir = tmp_path / "work"
+    work_dir.mkdir(exist_ok=True)
+    c = cdc_source.Consumer(stream, s3, "outb", "output", str(work_dir))
+    c.refresh()
+    return c
+
+def rows(s3, key: str) -> list:
+    body = s3.get_object(Bucket="outb", Key=key)["Body"].read().decode()
+    return list(csv.reader(io.StringIO(body)))[1:]
+
+def test_window_is_published_after_window_seconds(tmp_path, clock, s3, fake_data_cli):
+    stream = cdc_source.FakeStream()
+    stream.put("s1", "a", value="1", time_us=10)
+    stream.put("s1", "b", value="1", time_us=20)
+    c = consumer(stream, s3, tmp_path)
+    assert c.poll() == 2 and not c.due()
+    clock.now += 30
+    stream.put("s1", "a", value="2", time_us=30)
+    stream.put("s1", "b", "DELETE", time_us=40)
+    assert c.poll() == 2 and not c.due()
+    clock.now += 30
+    # the window is timed from its first change, not the last one
+    assert c.due()
+    first = c.flush()
+    assert first == "output/DELTA_0000000000000040_cdc.csv_DELTA"
+    assert rows(s3, first) == [["a", "UPDATE", "30", "2", "string"], ["b", "DELETE", "40", "", "string"]]
+    assert s3.head_object(Bucket="outb", Key=f"{first}.index.json")
+    # a new window starts with the next change
+    assert c.poll() == 0 and not c.due()
+    clock.now += 120
+    assert not c.due()
+    stream.put("s1", "c", value="1", time_us=35)
+    c.poll()
+    clock.now += 60
+    second = c.flush()
+    # a change time before the previous change of the shard is raised past it, the file name sorts after the first
+    assert second == "output/DELTA_0000000000000041_cdc.csv_DELTA" and second > first
+    assert rows(s3, second) == [["c", "UPDATE", "41", "1", "string"]]
+
+def test_window_is_published_after_window_records(tmp_path, clock, s3, fake_data_cli, monkeypatch):
+    monkeypatch.setattr(cdc_source, "WINDOW_RECORDS", 5)
+    stream = cdc_source.FakeStream()
+    for i in range(12):
+        stream.put("s1", f"k{i:02d}", value=str(i), time_us=100 + i)
+    c = consumer(stream, s3, tmp_path)
+    published = []
+    # a window stops reading at WINDOW_RECORDS changes
+    for due in (True, True, False):
+        c.poll()
+        assert c.due() is due
+        published.append(rows(s3, c.flush()))
+    assert [len(window) for window in published] == [5, 5, 2]
+    assert [row[0] for window in published for row in window] == [f"k{i:02d}" for i in range(12)]
+
+def test_equal_change_times_get_increasing_commit_times(tmp_path, clock, s3, fake_data_cli):
+    stream = cdc_source.FakeStream()
+    for value in ("1", "2", "3"):
+        stream.put("s1", "a", value=value, time_us=500)
+    stream.put("s1", "b", value="x", time_us=500, lct=7)
+    c = consumer(stream, s3, tmp_path)
+    c.poll()
+    # the last change of a key wins, a logical_commit_time of the record is used as is
+    assert rows(s3, c.flush()) == [["b", "UPDATE", "7", "x", "string"], ["a", "UPDATE", "502", "3", "string"]]
+
+def test_child_shard_is_read_after_its_parent(tmp_path, clock, s3, fake_data_cli):
+    stream = cdc_source.FakeStream()
+    stream.add_shard("shard-1")
+    stream.add_shard("shard-2", parent="shard-1")
+    stream.put("shard-1", "a", value="old", time_us=1000)
+    stream.put("shard-2", "a", value="new", time_us=900)
+    c = consumer(stream, s3, tmp_path)
+    assert c.poll() == 1
+    stream.close_shard("shard-1")
+    assert c.poll() == 1
+    # the child change continues from the parent clock, so it wins although its own time is earlier
+    assert rows(s3, c.flush()) == [["a", "UPDATE", "1001", "new", "string"]]
+
+def test_restarted_consumer_resumes_after_the_checkpoint(tmp_path, clock, s3, fake_data_cli):
+    stream = cdc_source.FakeStream()
+    stream.put("s1", "a", value="1", time_us=10)
+    c = consumer(stream, s3, tmp_path)
+    c.poll()
+    first = c.flush()
+    stream.put("s1", "b", value="1", time_us=20)
+    stream.put("s1", "c", value="1", time_us=30)
+    c.poll()
+    # stopped before the window was published, its changes are read again
+    restarted = consumer(stream, s3, tmp_path)
+    assert restarted.poll() == 2
+    second = restarted.flush()
+    assert rows(s3, second) == [["b", "UPDATE", "20", "1", "string"], ["c", "UPDATE", "30", "1", "string"]]
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="outb", Prefix="output/")["Contents"]]
+    assert [key for key in keys if key.endswith("_DELTA")] == [first, second]
+
+def test_run_publishes_the_stream_file(tmp_path, s3, fake_data_cli, monkeypatch):
+    monkeypatch.setattr(cdc_source, "POLL_SECONDS", 0.01)
+    path = tmp_path / "stream.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in [
+        {"shard": "s1", "key": "a", "value": "1", "time_us": 1},
+        {"shard": "s2", "key": "b", "mutation_type": "DELETE", "time_us": 2},
+        {"shard": "s1", "key": "a", "value": "2", "time_us": 3},
+        {"shard": "s1", "close": True},
+    ]) + "\n")
+    stream = cdc_source.open_stream(f"fake:{path}")
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    c = cdc_source.Consumer(stream, s3, "outb", "output", str(work_dir))
+    c.run(threading.Event(), run_seconds=0.1)
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="outb", Prefix="output/")["Contents"] if obj["Key"].endswith("_DELTA")]
+    assert len(keys) == 1
+    assert rows(s3, keys[0]) == [["b", "DELETE", "2", "", "string"], ["a", "UPDATE", "3", "2", "string"]]
+    state = json.loads(s3.get_object(Bucket="outb", Key=cdc_source.CHECKPOINT_KEY)["Body"].read())
+    assert state["shards"]["s1"]["closed"] and state["shards"]["s2"]["sequence"] == f"{1:020d}"
+
+def test_open_stream_rejects_an_unknown_kind():
+    with pytest.raises(ValueError, match="Invalid CDC_STREAM"):
+        cdc_source.open_stream("kafka:topic")
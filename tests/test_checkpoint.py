@@ -0,0 +1,68 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Sharded runs against the local S3 stand-in, the output keys must appear in shard order with either layout
+import random
+import time
+
+import pytest
+
+import checkpoint
+import s3_rate
+from local_s3 import LocalS3Client
+
+HEADER = "key,mutation_type,logical_commit_time,value_type,value\n"
+
+class RecordingS3(LocalS3Client):
+    """
+    Local S3 that records the order objects appear under the output prefix, with random delays so shards finish
+    out of order, completed multipart uploads are written with put_object
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.created = []
+
+    def _created(self, key: str) -> None:
+        if key.startswith("output/"):
+            with self.lock:
+                self.created.append(key)
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", ContentMD5: str = None, **kwargs) -> dict:
+        time.sleep(random.uniform(0, 0.02))
+        resp = super().put_object(Bucket, Key, Body, ContentMD5, **kwargs)
+        self._created(Key)
+        return resp
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, **kwargs) -> dict:
+        resp = super().copy_object(Bucket, Key, CopySource, **kwargs)
+        self._created(Key)
+        return resp
+
+@pytest.mark.parametrize("layout", ["direct", "hashed"])
+def test_sharded_output_published_in_shard_order(tmp_path, fake_data_cli, monkeypatch, layout):
+    monkeypatch.setattr(s3_rate, "OUTPUT_LAYOUT", layout)
+    s3 = RecordingS3(str(tmp_path / "s3"))
+    rows = "".join(f"key{i},Update,{1700000000 + i},string,value{i}\n" for i in range(400))
+    s3.put_object("inb", "input.csv", (HEADER + rows).encode())
+    keys = checkpoint.run_sharded(s3, "inb", "input.csv", "outb", "output/input_DELTA", str(tmp_path / "work"),
+                                  workers=4, sidecar=True, shard_bytes=1024)
+    assert len(keys) > 4
+    deltas = [key for key in s3.created if not key.endswith(".index.json")]
+    assert deltas == keys == sorted(keys)
+    assert [key for key in s3.created if key.endswith(".index.json")] == [f"{key}.index.json" for key in keys]
+    published = "".join(s3.get_object(Bucket="outb", Key=key)["Body"].read().decode().split("\n", 1)[1]
+                        for key in keys)
+    assert published == rows
+    assert not s3.list_objects_v2(Bucket="outb", Prefix=s3_rate.STAGING_PREFIX).get("Contents")
+
+def test_single_shard_is_written_straight_to_the_output_key(tmp_path, fake_data_cli):
+    s3 = RecordingS3(str(tmp_path / "s3"))
+    s3.put_object("inb", "input.csv", (HEADER + "key0,Update,1700000000,string,value0\n").encode())
+    keys = checkpoint.run_sharded(s3, "inb", "input.csv", "outb", "output/input_DELTA", str(tmp_path / "work"),
+                                  workers=4, sidecar=False, shard_bytes=1024)
+    assert s3.created == keys == ["output/input_DELTA_00000"]
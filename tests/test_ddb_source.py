@@ -0,0 +1,113 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# DynamoDB reload from a json lines table file (LocalTable) to the local S3 stand-in with the data cli stand-in
+import csv
+import io
+import json
+import re
+import zlib
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+import ddb_source
+from local_s3 import LocalS3Client
+
+START_US = 1_700_000_000_000_000
+
+def row_of(item: dict) -> list:
+    serializer = TypeSerializer()
+    return ddb_source.to_row({k: serializer.serialize(v) for k, v in item.items()}, TypeDeserializer(), START_US)
+
+@pytest.mark.parametrize("item, row", [
+    ({"key": "a", "value": "x"}, ["a", "UPDATE", START_US, "x", "string"]),
+    ({"key": 7, "value": 1.5}, ["7", "UPDATE", START_US, "1.5", "string"]),
+    ({"key": "b", "value": True}, ["b", "UPDATE", START_US, "true", "string"]),
+    ({"key": "c", "value": {"y", "x"}}, ["c", "UPDATE", START_US, "x|y", "string_set"]),
+    ({"key": "d", "value": ["z", "x"]}, ["d", "UPDATE", START_US, "z|x", "string_set"]),
+    ({"key": "e", "value": {"n": 1, "s": {1, 2}}}, ["e", "UPDATE", START_US, '{"n": 1, "s": [1, 2]}', "string"]),
+    ({"key": "f", "value": b"\x00"}, None),
+    ({"key": "f", "value": None}, None),
+    ({"key": "g"}, None),
+    ({"value": "h"}, None),
+])
+def test_to_row(item, row):
+    item = {k: Decimal(str(v)) if isinstance(v, float) else v for k, v in item.items()}
+    assert row_of(item) == row
+
+def test_commit_time_attribute(monkeypatch):
+    monkeypatch.setattr(ddb_source, "COMMIT_TIME_ATTRIBUTE", "updated_us")
+    assert row_of({"key": "a", "value": "x", "updated_us": 42})[2] == 42
+    assert row_of({"key": "a", "value": "x"})[2] == START_US
+
+@pytest.fixture
+def table_file(tmp_path):
+    items = [{"key": f"key{i:03d}", "value": f"value {i}" * (i % 4 + 1)} for i in range(120)]
+    items += [{"key": f"set{i}", "value": ["b", "a"]} for i in range(5)]
+    items += [{"key": "no-value"}, {"value": "no key"}, {"key": "null-value", "value": None}]
+    path = tmp_path / "table.jsonl"
+    path.write_text("\n".join(json.dumps(item) for item in items) + "\n\n")
+    return str(path), items
+
+def test_local_table_scans_each_item_in_one_segment(table_file):
+    path, items = table_file
+    table = ddb_source.LocalTable(path, "key")
+    deserializer = TypeDeserializer()
+    seen = []
+    for segment in range(3):
+        resp = table.scan(TableName="t", Segment=segment, TotalSegments=3)
+        assert "LastEvaluatedKey" not in resp and resp["ConsumedCapacity"]["CapacityUnits"] >= 0.5
+        for item in resp["Items"]:
+            key = str(deserializer.deserialize(item["key"])) if "key" in item else ""
+            assert zlib.crc32(key.encode()) % 3 == segment
+            seen.append(item)
+    assert len(seen) == len(items)
+
+def test_local_table_pages_hold_up_to_1_mb(tmp_path):
+    path = tmp_path / "table.jsonl"
+    path.write_text("".join(json.dumps({"key": f"big{i}", "value": "x" * 600_000}) + "\n" for i in range(3)))
+    table = ddb_source.LocalTable(str(path), "key")
+    first = table.scan(TableName="t")
+    assert first["Count"] == 2 and first["LastEvaluatedKey"] == {"offset": {"N": "2"}}
+    second = table.scan(TableName="t", ExclusiveStartKey=first["LastEvaluatedKey"])
+    assert second["Count"] == 1 and "LastEvaluatedKey" not in second
+
+def test_reload_publishes_every_segment_in_parts(tmp_path, table_file, fake_data_cli, monkeypatch):
+    path, items = table_file
+    monkeypatch.setenv("SOURCE_TABLE_FILE", path)
+    monkeypatch.setattr(ddb_source, "SEGMENTS", 3)
+    monkeypatch.setattr(ddb_source, "PART_BYTES", 1024)
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    stats = ddb_source.reload(s3, "papi", "outb", "output", str(work_dir), workers=2)
+    assert stats["rows"] == len(items) - 3 and stats["skipped"] == 3
+    assert stats["capacity_units"] > 0
+    names = [re.fullmatch(r"output/DELTA_\d{16}_papi_s(\d{4})_p(\d{5})\.csv_DELTA", key) for key in stats["keys"]]
+    assert all(names)
+    segments = {}
+    for name in names:
+        segments.setdefault(int(name.group(1)), []).append(int(name.group(2)))
+    # every segment is split in to consecutive parts of about PART_BYTES
+    assert sorted(segments) == [0, 1, 2]
+    assert all(parts == list(range(len(parts))) and len(parts) > 1 for parts in segments.values())
+    published = {}
+    for key in stats["keys"]:
+        body = s3.get_object(Bucket="outb", Key=key)["Body"].read().decode()
+        rows = list(csv.reader(io.StringIO(body)))
+        assert rows[0] == ddb_source.CSV_HEADER
+        assert len(body.encode()) < 1024 + 200
+        for row in rows[1:]:
+            assert row[0] not in published
+            published[row[0]] = row
+        s3.head_object(Bucket="outb", Key=f"{key}.index.json")
+    assert published["key005"][1:] == ["UPDATE", published["key005"][2], "value 5" * 2, "string"]
+    assert published["set3"][3:] == ["b|a", "string_set"]
+    assert len(published) == len(items) - 3
+    assert not list(work_dir.iterdir())
@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# DELTA_COMPRESSION settings, the startup check of the loader, and with riegeli installed the rewrite and the benchmark
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import delta_compression
+from conftest import LOADER_DIR
+
+SETTINGS = ["uncompressed", "snappy", "brotli:1", "zstd:3"]
+
+def run_script(name: str, env: dict, *args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, os.path.join(LOADER_DIR, name), *args], env={**os.environ, **env},
+                          cwd=LOADER_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+
+@pytest.mark.parametrize("setting, parsed", [("", ""), ("data-cli", ""), (" ZSTD ", "zstd:3"), ("zstd:-5", "zstd:-5"),
+                                             ("brotli", "brotli:6"), ("brotli:11", "brotli:11"), ("snappy", "snappy")])
+def test_parse(setting, parsed):
+    assert delta_compression.parse(setting) == parsed
+
+@pytest.mark.parametrize("setting", ["gzip", "snappy:1", "zstd:23", "brotli:x", "brotli:-1"])
+def test_parse_rejects(setting):
+    with pytest.raises(ValueError, match="Invalid DELTA_COMPRESSION"):
+        delta_compression.parse(setting)
+
+def test_invalid_setting_is_reported_by_check_not_on_import(tmp_path):
+    out = subprocess.run([sys.executable, "-c", "import delta_compression; delta_compression.check()"],
+                         env={**os.environ, "DELTA_COMPRESSION": "zstd:99"}, cwd=LOADER_DIR,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert out.returncode == 1
+    assert out.stdout.decode().splitlines()[-1].startswith("ValueError: Invalid DELTA_COMPRESSION 'zstd:99'")
+
+def test_recompress_raises_for_an_invalid_setting(monkeypatch, tmp_path):
+    monkeypatch.setattr(delta_compression, "SETTING_ERROR", "Invalid DELTA_COMPRESSION 'gzip'")
+    with pytest.raises(ValueError, match="gzip"):
+        delta_compression.recompress(str(tmp_path / "output_DELTA"))
+
+def test_object_metadata(monkeypatch):
+    assert delta_compression.object_metadata("zstd:3") == {"delta-compression": "zstd:3"}
+    monkeypatch.setattr(delta_compression, "COMPRESSION", "")
+    assert delta_compression.object_metadata() == {"delta-compression": "data-cli"}
+
+@pytest.mark.parametrize("setting, error", [("gzip", "Invalid DELTA_COMPRESSION 'gzip'"), ("zstd", "needs riegeli")])
+def test_loader_exits_at_startup(tmp_path, setting, error):
+    if setting == "zstd" and delta_compression.riegeli_installed():
+        pytest.skip("riegeli is installed")
+    env = {"DELTA_COMPRESSION": setting, "LOCAL_S3_ROOT": str(tmp_path / "s3"), "INP_BUCKET": "inb",
+           "INP_KEY": "input/a.csv", "OUT_BUCKET": "outb", "OUT_KEY": "output", "WORK_DIR": str(tmp_path)}
+    out = run_script("papi-delta-filegen-s3.py", env)
+    assert out.returncode == 1
+    assert error in out.stdout.decode()
+    assert "Traceback" not in out.stdout.decode()
+
+def test_benchmark_needs_riegeli():
+    if delta_compression.riegeli_installed():
+        pytest.skip("riegeli is installed")
+    out = run_script("papi-delta-compression-benchmark.py", {}, "--dataset", "10:8")
+    assert out.returncode == 1
+    assert "riegeli is not installed" in out.stdout.decode()
+
+@pytest.fixture
+def riegeli_data_cli(tmp_path):
+    # writes every csv line after the header as one record, with file metadata like data cli
+    pytest.importorskip("riegeli")
+    path = tmp_path / "data_cli"
+    path.write_text("#!" + sys.executable + "\n"
+                    "import sys, riegeli\n"
+                    "args = dict(a[2:].split('=', 1) for a in sys.argv[2:] if a.startswith('--') and '=' in a)\n"
+                    "with open(args['input_file'], 'rb') as f:\n"
+                    "    lines = f.read().splitlines()[1:]\n"
+                    "with riegeli.RecordWriter(open(args['output_file'], 'wb'), serialized_metadata=b'metadata') as w:\n"
+                    "    for line in lines:\n"
+                    "        w.write_record(line)\n")
+    path.chmod(0o755)
+    return str(path)
+
+def test_recompress_keeps_records_and_metadata(tmp_path, riegeli_data_cli):
+    import riegeli
+    csv_path = tmp_path / "input.csv"
+    rows = [f"key{i},Update,{i},string,{'v' * (i % 50)}".encode() for i in range(2000)]
+    csv_path.write_bytes(b"key,mutation_type,logical_commit_time,value_type,value\n" + b"\n".join(rows) + b"\n")
+    original = tmp_path / "original_DELTA"
+    subprocess.run([riegeli_data_cli, "format_data", f"--input_file={csv_path}", f"--output_file={original}"], check=True)
+    for setting in SETTINGS:
+        path = tmp_path / "output_DELTA"
+        path.write_bytes(original.read_bytes())
+        delta_compression.recompress(str(path), delta_compression.parse(setting))
+        with riegeli.RecordReader(open(path, "rb")) as reader:
+            assert reader.read_serialized_metadata() == b"metadata"
+            assert list(reader.read_records()) == rows
+        assert delta_compression.count_records(str(path)) == len(rows)
+
+def test_benchmark_reports_every_setting(tmp_path, riegeli_data_cli):
+    out_path = tmp_path / "compression.json"
+    out = run_script("papi-delta-compression-benchmark.py", {}, "--dataset", "500:64", "--repeat", "1",
+                     "--data-cli", riegeli_data_cli, "--out", str(out_path),
+                     *[arg for setting in ["data-cli", *SETTINGS] for arg in ("--setting", setting)])
+    assert out.returncode == 0, out.stdout.decode()
+    results = json.loads(out_path.read_text())["results"]
+    assert [r["setting"] for r in results] == ["data-cli", *[delta_compression.parse(s) for s in SETTINGS]]
+    assert results[0]["ratio"] == 1.0
+    assert all(r["bytes"] > 0 and r["decode_seconds"] >= 0 for r in results)
@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Sidecar index sketches, and the key lookup over sidecars on the local S3 stand-in with the data cli stand-in
+import sys
+
+import pytest
+
+import delta_index
+from local_s3 import LocalS3Client
+
+HEADER = "key,mutation_type,logical_commit_time,value_type,value\n"
+
+def test_bloom_filter_has_no_false_negatives_and_its_target_false_positive_rate():
+    keys = [f"key-{i}" for i in range(20_000)]
+    bloom = delta_index.BloomFilter.for_capacity(len(keys), 0.01)
+    for key in keys:
+        bloom.add(key)
+    bloom = delta_index.BloomFilter.from_dict(bloom.to_dict())
+    assert all(key in bloom for key in keys)
+    absent = 50_000
+    false_positives = sum(f"absent-{i}" in bloom for i in range(absent))
+    assert 0.005 < false_positives / absent < 0.015
+
+@pytest.mark.parametrize("count", [10, 1_000, 100_000])
+def test_hyperloglog_estimate_is_within_a_few_percent(count):
+    hll = delta_index.HyperLogLog()
+    for i in range(count):
+        # every key twice, duplicates do not count
+        hll.add(f"key-{i}")
+        hll.add(f"key-{i}")
+    assert abs(hll.count() - count) <= max(1, 0.03 * count)
+
+def test_sidecar_stats(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text(HEADER + "".join(f"k{i % 40},{'DELETE' if i % 10 == 0 else 'UPDATE'},{100 + i},string,v\n"
+                                     for i in range(100)))
+    sidecar = delta_index.build_sidecar(str(path), source="s3://inb/input.csv")
+    assert {k: sidecar[k] for k in ("row_count", "min_logical_commit_time", "max_logical_commit_time",
+                                    "mutation_types", "distinct_keys")} == \
+        {"row_count": 100, "min_logical_commit_time": 100, "max_logical_commit_time": 199,
+         "mutation_types": {"DELETE": 10, "UPDATE": 90}, "distinct_keys": 40}
+    assert all(delta_index.may_contain(sidecar, f"k{i}") for i in range(40))
+
+class RecordingS3(LocalS3Client):
+    """
+    Local S3 that records the downloaded keys
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.downloaded = []
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **kwargs) -> None:
+        self.downloaded.append(Key)
+        super().download_file(Bucket, Key, Filename, **kwargs)
+
+def test_lookup_downloads_only_candidates_and_unindexed_files(tmp_path, load_source, fake_data_cli, monkeypatch,
+                                                              capsys):
+    lookup = load_source("source/datacli-w-python-docker/papi-delta-key-lookup.py", "delta_key_lookup")
+    s3 = RecordingS3(str(tmp_path / "s3"))
+    monkeypatch.setattr(lookup, "get_s3_client", lambda: s3)
+    # the data cli stand-in copies, the DELTA files are the csv itself
+    has_key = {3: 30, 11: 10}
+    for i in range(20):
+        rows = [f"k{i}-{j},UPDATE,{j},string,v\n" for j in range(200)]
+        if i in has_key:
+            rows.append(f"wanted,UPDATE,{has_key[i]},string,file {i}\n")
+        path = tmp_path / f"file{i}.csv"
+        path.write_text(HEADER + "".join(rows))
+        key = f"output/DELTA_{i:016d}"
+        s3.upload_file(str(path), "outb", key)
+        s3.put_object(Bucket="outb", Key=delta_index.sidecar_key(key),
+                      Body=delta_index.dumps(delta_index.build_sidecar(str(path))))
+    # written before sidecars existed, scanned only with --scan-unindexed
+    s3.put_object(Bucket="outb", Key="output/DELTA_0000000000000099", Body=HEADER + "wanted,DELETE,40,string,\n")
+    monkeypatch.setattr(sys, "argv", ["lookup", "--bucket", "outb", "--prefix", "output", "--workers", "4",
+                                      "--scan-unindexed", "wanted"])
+    lookup.main()
+    lines = capsys.readouterr().out.splitlines()
+    candidates = {line.split()[1].rstrip(":") for line in lines if line.startswith("candidate ")}
+    assert {"output/DELTA_0000000000000003", "output/DELTA_0000000000000011"} <= candidates
+    assert len(candidates) <= 3
+    assert sorted(s3.downloaded) == sorted(candidates | {"output/DELTA_0000000000000099"})
+    assert "20 sidecars read" in "\n".join(lines)
+    rows = [line for line in lines if line.startswith("wanted ")]
+    # in logical_commit_time order, the last row is the one the server applies
+    assert [row.split()[1:3] for row in rows] == [["UPDATE", "10"], ["UPDATE", "30"], ["DELETE", "40"]]
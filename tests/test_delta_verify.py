@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# DELTA file verification with the data cli stand-in, and verified uploads to the local S3 stand-in
+import threading
+
+import pytest
+
+import delta_verify
+from local_s3 import LocalS3Client
+
+CSV = "key,mutation_type,logical_commit_time,value_type,value\nk1,Update,1,string,a\nk2,delete,2,string,b\nk3,UPDATE,3,string,c\n"
+
+class SlowVerification:
+    """
+    Verification that passes or fails once released, records what was uploaded before that
+    """
+
+    def __init__(self, s3, error: Exception = None) -> None:
+        self.s3 = s3
+        self.error = error
+        self.released = threading.Event()
+        self.parts_before_result = None
+
+    def result(self) -> dict:
+        self.parts_before_result = len(list((self.s3.root / ".multipart").glob("*/*")))
+        self.released.set()
+        if self.error:
+            raise self.error
+        return {}
+
+    def failed(self) -> bool:
+        return False
+
+    def wait(self) -> None:
+        pass
+
+@pytest.fixture
+def files(tmp_path):
+    csv_path = tmp_path / "input.csv"
+    csv_path.write_text(CSV)
+    delta_path = tmp_path / "output_DELTA"
+    delta_path.write_text(CSV)
+    return str(delta_path), str(csv_path)
+
+def test_count_rows_upper_cases_mutation_types(files):
+    assert delta_verify.count_rows(files[1]) == {"row_count": 3, "mutation_types": {"UPDATE": 2, "DELETE": 1}}
+
+def test_verify_reads_the_delta_file_back(files, fake_data_cli):
+    delta_path, csv_path = files
+    assert delta_verify.verify(delta_path, csv_path)["row_count"] == 3
+    assert delta_verify.verify(delta_path, csv_path, expected={"row_count": 3, "mutation_types": {"update": 2, "Delete": 1}})
+
+def test_verify_fails_on_a_truncated_file(files, fake_data_cli):
+    delta_path, csv_path = files
+    with open(delta_path, "w") as f:
+        f.write(CSV.rsplit("k3", 1)[0])
+    with pytest.raises(delta_verify.VerificationError, match="2 records"):
+        delta_verify.verify(delta_path, csv_path)
+
+def test_small_file_is_sent_while_the_check_runs(tmp_path, files):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    verification = SlowVerification(s3)
+    delta_verify.upload_verified(s3, files[0], "outb", "output/a_DELTA", verification, {"delta-compression": "data-cli"})
+    # the one part was uploaded before the result was awaited, completing the upload waited for it
+    assert verification.parts_before_result == 1
+    resp = s3.get_object(Bucket="outb", Key="output/a_DELTA")
+    assert resp["Body"].read().decode() == CSV
+    assert resp["ETag"] and s3.head_object(Bucket="outb", Key="output/a_DELTA")["ContentLength"] == len(CSV)
+
+def test_failed_check_publishes_nothing(tmp_path, files):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    verification = SlowVerification(s3, delta_verify.VerificationError("broken"))
+    with pytest.raises(delta_verify.VerificationError):
+        delta_verify.upload_verified(s3, files[0], "outb", "output/a_DELTA", verification)
+    assert not s3.list_objects_v2(Bucket="outb", Prefix="output/").get("Contents")
+    assert not list((s3.root / ".multipart").iterdir())
+
+def test_large_file_is_sent_in_parts(tmp_path, fake_data_cli, monkeypatch):
+    monkeypatch.setattr(delta_verify, "UPLOAD_PART_BYTES", 64)
+    csv_path = tmp_path / "input.csv"
+    csv_path.write_text(CSV * 10)
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    verification = delta_verify.start(str(csv_path), str(csv_path.with_name("expected.csv")),
+                                      expected=delta_verify.count_rows(str(csv_path)))
+    delta_verify.upload_verified(s3, str(csv_path), "outb", "output/b_DELTA", verification)
+    assert s3.get_object(Bucket="outb", Key="output/b_DELTA")["Body"].read().decode() == CSV * 10
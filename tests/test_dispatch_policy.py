@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# The dispatcher scheduling policy, one round at a time and through the papi-dispatch-simulate.py backlog simulation
+from collections import deque
+
+import pytest
+
+from dispatch_policy import dispatch_round, minute_window
+
+LANES = [{"name": "urgent", "max_tasks": 0}, {"name": "bulk", "max_tasks": 3}]
+
+@pytest.fixture
+def simulation(load_source):
+    return load_source("source/_lambda_dispatch/papi-dispatch-simulate.py", "papi_dispatch_simulate")
+
+def queue_take(queues: dict):
+    def take(lane: dict, n: int) -> int:
+        started = min(n, queues[lane["name"]])
+        queues[lane["name"]] -= started
+        return started
+    return take
+
+def test_minute_window():
+    assert minute_window(0) == minute_window(59.9) == 0
+    assert minute_window(60) == 1
+
+def test_lanes_are_served_in_priority_order():
+    queues = {"urgent": 4, "bulk": 10}
+    started = dispatch_round(LANES, {"urgent": 0, "bulk": 0}, 6, 100, queue_take(queues))
+    assert started == {"urgent": 4, "bulk": 2}
+
+def test_lane_cap_counts_its_running_tasks():
+    queues = {"urgent": 0, "bulk": 10}
+    started = dispatch_round(LANES, {"urgent": 0, "bulk": 2}, 20, 100, queue_take(queues))
+    assert started == {"urgent": 0, "bulk": 1}
+    assert dispatch_round(LANES, {"urgent": 0, "bulk": 3}, 20, 100, queue_take(queues)) == {"urgent": 0}
+
+def test_starts_left_caps_every_lane():
+    queues = {"urgent": 5, "bulk": 5}
+    assert dispatch_round(LANES, {}, 20, 3, queue_take(queues)) == {"urgent": 3}
+    assert dispatch_round(LANES, {}, 20, 0, queue_take(queues)) == {}
+
+def test_no_starts_when_every_task_slot_is_taken():
+    queues = {"urgent": 5, "bulk": 5}
+    assert dispatch_round(LANES, {"urgent": 4, "bulk": 2}, 6, 100, queue_take(queues)) == {}
+
+def test_backlog_respects_the_caps_in_every_round():
+    # a bulk reload queued up front next to a trickle of urgent files, tasks take 3 rounds
+    queues = {"urgent": deque(), "bulk": deque(range(50))}
+    running = []  # (round the task ends, lane)
+    starts = []
+
+    def take(lane: dict, n: int) -> int:
+        started = 0
+        while started < n and queues[lane["name"]]:
+            queues[lane["name"]].popleft()
+            running.append((round_no + 3, lane["name"]))
+            started += 1
+        return started
+
+    round_no = 0
+    while any(queues.values()) or running or round_no < 30:
+        if round_no < 30 and round_no % 2 == 0:
+            queues["urgent"].append(round_no)
+        running = [task for task in running if task[0] > round_no]
+        counts = {lane["name"]: sum(1 for task in running if task[1] == lane["name"]) for lane in LANES}
+        started = dispatch_round(LANES, counts, 5, 4, take)
+        starts.append(sum(started.values()))
+        assert len(running) <= 5
+        assert sum(1 for task in running if task[1] == "bulk") <= 3
+        # an urgent file never waits while the bulk lane holds back capacity
+        assert not queues["urgent"]
+        round_no += 1
+    assert max(starts) <= 4
+    assert not queues["bulk"]
+
+def test_simulation_keeps_urgent_files_moving_during_a_bulk_reload(simulation):
+    args = dict(max_tasks=20, max_starts_per_minute=60, interval=5, seed=0)
+    lanes = simulation.simulate(simulation.DEFAULT_SCENARIO, fifo=False, **args)
+    fifo = simulation.simulate(simulation.DEFAULT_SCENARIO, fifo=True, **args)
+    for result in (lanes, fifo):
+        assert result["peak_running"] <= 20
+        assert result["max_starts_per_minute"] <= 60
+        assert len(result["waits"]["bulk"]) == 600 and len(result["waits"]["urgent"]) == 90
+    # with lanes the urgent files start in the round they arrive, in one queue they wait behind the reload
+    assert max(lanes["waits"]["urgent"]) <= 5
+    assert min(fifo["waits"]["urgent"][1:]) > 60
+    # the bulk lane cap of 15 leaves room for the urgent tasks
+    assert lanes["peak_running"] < fifo["peak_running"]
+
+def test_simulation_with_a_scenario_file_layout(simulation):
+    scenario = {"lanes": [{"name": "a", "max_tasks": 2, "task_seconds": 10}, {"name": "b", "max_tasks": 0, "task_seconds": 10}],
+                "arrivals": [{"lane": "a", "start": 0, "end": 10, "count": 10}, {"lane": "b", "start": 0, "end": 10, "count": 10}]}
+    result = simulation.simulate(scenario, max_tasks=4, max_starts_per_minute=100, interval=1, fifo=False, seed=1)
+    assert result["peak_running"] <= 4
+    assert len(result["waits"]["a"]) == len(result["waits"]["b"]) == 10
+    # lane a is capped at 2 tasks, lane b gets the rest once the a tasks fill their cap
+    assert max(result["waits"]["a"]) >= 10
@@ -0,0 +1,164 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Expiry entries of the loader, their merge in to the index, and the sweep on the local S3 stand-in with the data cli
+# stand-in
+import csv
+import gzip
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+
+import expiry
+from local_s3 import LocalS3Client
+
+SECOND = 1_000_000
+# the time of the sweeps, 2023-11-14T22:13:20Z
+NOW = 1_700_000_000 * SECOND
+
+@pytest.fixture
+def sweep(load_source, fake_data_cli, tmp_path, monkeypatch):
+    module = load_source("source/datacli-w-python-docker/papi-expiry-sweep.py", "expiry_sweep")
+    monkeypatch.setattr(module, "work_dir", str(tmp_path))
+    return module
+
+def entries(*rows) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(expiry.ENTRY_HEADER)
+    writer.writerows(["" if value is None else value for value in row] for row in rows)
+    return gzip.compress(out.getvalue().encode())
+
+def put_pending(s3, delta_name: str, *rows) -> str:
+    key = expiry.pending_key(f"output/{delta_name}")
+    s3.put_object(Bucket="outb", Key=key, Body=entries(*rows))
+    return key
+
+def read_index(s3) -> dict:
+    index = {}
+    expiry.merge(index, expiry.read_entries(s3.get_object(Bucket="outb", Key=expiry.INDEX_KEY)["Body"].read()))
+    return index
+
+def published_deletes(s3) -> list:
+    # the data cli stand-in copies, the DELTA file is the csv of DELETE rows itself
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="outb", Prefix="output/").get("Contents", [])
+            if obj["Key"].endswith("_DELTA")]
+    rows = []
+    for key in keys:
+        rows.extend(csv.DictReader(io.StringIO(s3.get_object(Bucket="outb", Key=key)["Body"].read().decode())))
+    return [(row["key"], row["mutation_type"], int(row["logical_commit_time"])) for row in rows]
+
+@pytest.mark.parametrize("value", ["1700000000", "1700000000000000", "2023-11-14T22:13:20Z",
+                                   "2023-11-14T22:13:20+00:00", " 1700000000 "])
+def test_parse_expiry_of_seconds_microseconds_and_iso(value):
+    assert expiry.parse_expiry(value) == NOW
+
+def test_parse_expiry_rejects_a_value_that_is_not_a_time():
+    with pytest.raises(ValueError):
+        expiry.parse_expiry("tomorrow")
+
+def test_strip_column(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("key,mutation_type,expires_at,logical_commit_time,value_type,value\n"
+                    "k1,UPDATE,1700000000,10,string,a\n"
+                    "k2,DELETE,1700000000,11,string,\n"
+                    "k3,UPDATE,,12,string,c\n"
+                    "k4,update,2023-11-14T22:13:20Z,13,string,d\n")
+    entries_path = expiry.strip_column(str(path))
+    assert path.read_text() == ("key,mutation_type,logical_commit_time,value_type,value\n"
+                                "k1,UPDATE,10,string,a\nk2,DELETE,11,string,\nk3,UPDATE,12,string,c\n"
+                                "k4,update,13,string,d\n")
+    with open(entries_path, "rb") as f:
+        # a DELETE and an empty expiry are written as cancels
+        assert expiry.read_entries(gzip.compress(f.read())) == [("k1", NOW, 10), ("k2", None, 11), ("k3", None, 12),
+                                                                ("k4", NOW, 13)]
+
+def test_strip_column_without_the_column_leaves_the_csv(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("key,mutation_type,logical_commit_time,value_type,value\nk1,UPDATE,10,string,a\n")
+    assert expiry.strip_column(str(path)) is None
+    assert path.read_text() == "key,mutation_type,logical_commit_time,value_type,value\nk1,UPDATE,10,string,a\n"
+
+def test_strip_column_names_the_line_of_a_bad_value(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("key,mutation_type,logical_commit_time,value_type,value,expires_at\n"
+                    "k1,UPDATE,10,string,a,1700000000\nk2,UPDATE,11,string,b,soon\n")
+    with pytest.raises(ValueError, match="'soon' in line 3"):
+        expiry.strip_column(str(path))
+
+def test_merge_keeps_a_cancel_as_a_tombstone():
+    index = {}
+    expiry.merge(index, [("k1", NOW, 10), ("k2", NOW, 10)])
+    # a DELETE and an UPDATE without expiry cancel the expiry
+    expiry.merge(index, [("k1", None, 20), ("k2", None, 30)])
+    assert index == {"k1": (None, 20), "k2": (None, 30)}
+    # entries of older updates that arrive late do not bring it back
+    expiry.merge(index, [("k1", NOW, 15), ("k2", NOW, 29)])
+    assert index == {"k1": (None, 20), "k2": (None, 30)}
+    expiry.merge(index, [("k1", NOW + 1, 21)])
+    assert index["k1"] == (NOW + 1, 21)
+
+def test_dumps_index_reads_back_in_expiry_order():
+    index = {"late": (NOW + 5, 1), "cancelled": (None, 2), "early": (NOW, 3), "also-early": (NOW, 4)}
+    body = expiry.dumps_index(index)
+    assert expiry.read_entries(body) == [("cancelled", None, 2), ("also-early", NOW, 4), ("early", NOW, 3),
+                                         ("late", NOW + 5, 1)]
+
+def test_sweep_publishes_the_expired_keys(tmp_path, sweep):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    s3.put_object(Bucket="outb", Key=expiry.INDEX_KEY, Body=entries(("indexed", NOW - SECOND, 100)))
+    pending = [
+        put_pending(s3, "DELTA_1", ("expired", NOW - 10 * SECOND, 200), ("future", NOW + SECOND, 200),
+                    ("cancelled", NOW - SECOND, 300), ("deleted", NOW - SECOND, 300),
+                    # expiry before the update, the DELETE has to come after it
+                    ("set-late", NOW - 10 * SECOND, NOW - 5 * SECOND), ("never-expires", None, 400)),
+        put_pending(s3, "DELTA_2", ("cancelled", None, 301), ("deleted", None, NOW - 60 * SECOND)),
+    ]
+    assert sweep.sweep(s3, "outb", "output", NOW) == 3
+    assert sorted(published_deletes(s3)) == [("expired", "DELETE", NOW - 10 * SECOND),
+                                             ("indexed", "DELETE", NOW - SECOND),
+                                             ("set-late", "DELETE", NOW - 5 * SECOND + 1)]
+    # cancels older than EXPIRY_TOMBSTONE_DAYS are dropped, keys that never had an expiry are not added
+    assert read_index(s3) == {"future": (NOW + SECOND, 200), "deleted": (None, NOW - 60 * SECOND)}
+    assert not any(s3.list_objects_v2(Bucket="outb", Prefix=key).get("Contents") for key in pending)
+
+def test_a_late_older_entry_does_not_revive_a_cancelled_expiry(tmp_path, sweep):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    put_pending(s3, "DELTA_2", ("k1", None, NOW - 20 * SECOND))
+    assert sweep.sweep(s3, "outb", "output", NOW) == 0
+    # the entry file of an older update is only listed after the cancel was merged
+    put_pending(s3, "DELTA_1", ("k1", NOW - SECOND, NOW - 30 * SECOND))
+    assert sweep.sweep(s3, "outb", "output", NOW) == 0
+    assert published_deletes(s3) == []
+    assert read_index(s3) == {"k1": (None, NOW - 20 * SECOND)}
+
+def test_sweep_skips_pending_entries_of_staged_outputs(tmp_path, sweep):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    staged = expiry.pending_key(f"{sweep.s3_rate.STAGING_PREFIX}/ab/output/DELTA_1")
+    s3.put_object(Bucket="outb", Key=staged, Body=entries(("k1", NOW - SECOND, 1)))
+    assert sweep.sweep(s3, "outb", "output", NOW) == 0
+    assert s3.get_object(Bucket="outb", Key=staged)
+
+class IndexWriteFailsS3(LocalS3Client):
+    """
+    Local S3 whose writes of the expiry index fail
+    """
+
+    def _simulate(self, operation: str, bucket: str, key: str, nbytes: int = 0) -> None:
+        if operation == "PutObject" and key == expiry.INDEX_KEY:
+            raise self._error("InternalError", operation)
+        super()._simulate(operation, bucket, key, nbytes)
+
+def test_pending_entries_are_deleted_only_after_the_index_is_written(tmp_path, sweep):
+    s3 = IndexWriteFailsS3(str(tmp_path / "s3"))
+    key = put_pending(s3, "DELTA_1", ("k1", NOW - SECOND, 1))
+    with pytest.raises(ClientError):
+        sweep.sweep(s3, "outb", "output", NOW)
+    # the next run merges them again and publishes the same DELETE rows
+    assert s3.get_object(Bucket="outb", Key=key)
+    assert published_deletes(s3) == [("k1", "DELETE", NOW - SECOND)]
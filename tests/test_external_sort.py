@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# External sort with small runs and a small fan-in, and the DELTA prefix diff checked against a pure python reduction
+import csv
+import random
+import sys
+
+import pytest
+
+import external_sort
+from local_s3 import LocalS3Client
+
+HEADER = "key,mutation_type,logical_commit_time,value_type,value\n"
+
+@pytest.fixture
+def diff(load_source):
+    return load_source("source/datacli-w-python-docker/papi-delta-diff.py", "delta_diff")
+
+@pytest.fixture
+def written_runs(monkeypatch):
+    paths = []
+    write_run = external_sort._write_run
+
+    def recording_write_run(rows, path: str) -> str:
+        paths.append(path)
+        return write_run(rows, path)
+    monkeypatch.setattr(external_sort, "_write_run", recording_write_run)
+    return paths
+
+def mutations(seed: int, count: int) -> list:
+    # [key, logical_commit_time, mutation_type, value, value_type] with unique commit times
+    rng = random.Random(seed)
+    times = rng.sample(range(1, count * 10), count)
+    return [[f"key{rng.randrange(count // 4):05d}", str(t), rng.choice(["UPDATE", "UPDATE", "DELETE"]),
+             f"value {rng.randrange(1000)}", "string"] for t in times]
+
+def latest(rows: list) -> dict:
+    # {key: served row}, the pure python reduction the diff has to match
+    newest = {}
+    for row in rows:
+        if row[0] not in newest or int(row[1]) > int(newest[row[0]][1]):
+            newest[row[0]] = row
+    return {k: row for k, row in newest.items() if row[2] != "DELETE"}
+
+def test_one_run_stays_in_memory(tmp_path, written_runs):
+    rows = [[str(i)] for i in (3, 1, 2)]
+    assert list(external_sort.sort_rows(rows, lambda r: r[0], str(tmp_path), run_rows=10)) == [["1"], ["2"], ["3"]]
+    assert not written_runs
+
+def test_spilled_runs_merge_in_several_passes(tmp_path, written_runs, monkeypatch):
+    monkeypatch.setattr(external_sort, "MAX_FAN_IN", 4)
+    rng = random.Random(1)
+    rows = [[f"{rng.randrange(10 ** 6):07d}", str(i)] for i in range(1000)]
+    result = list(external_sort.sort_rows(iter(rows), lambda r: r[0], str(tmp_path), run_rows=37))
+    assert result == sorted(rows, key=lambda r: r[0])
+    # 28 runs are merged to 7, then to 2, then streamed
+    assert sum("-p" not in p for p in written_runs) == 28
+    assert sum("-p1-" in p for p in written_runs) == 7 and sum("-p2-" in p for p in written_runs) == 2
+    # every run file is removed once it was read
+    assert not list(tmp_path.iterdir())
+
+def test_newest_per_key_across_runs(tmp_path, diff, monkeypatch):
+    monkeypatch.setattr(external_sort, "MAX_FAN_IN", 3)
+    rows = mutations(2, 2000)
+    state = diff.newest_per_key(external_sort.sort_rows(iter(rows), diff.sort_key, str(tmp_path), run_rows=50,
+                                                        reduce=lambda run: list(diff.newest_per_key(run))))
+    newest = {}
+    for row in rows:
+        newest[row[0]] = max(newest.get(row[0], row), row, key=lambda r: int(r[1]))
+    assert list(state) == [newest[k] for k in sorted(newest)]
+
+def test_diff_of_two_prefixes(tmp_path, diff, fake_data_cli, monkeypatch, capsys):
+    monkeypatch.setattr(external_sort, "MAX_FAN_IN", 3)
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    monkeypatch.setattr(diff, "get_s3_client", lambda: s3)
+    rows_a = mutations(3, 600)
+    # b replays a and adds newer mutations on top
+    rows_b = rows_a + [[row[0], str(int(row[1]) + 10_000), *row[2:]] for row in mutations(4, 300)]
+    for prefix, rows in (("output", rows_a), ("staging/output", rows_b)):
+        # the data cli stand-in copies, the DELTA files are the csv itself
+        for i in range(0, len(rows), 100):
+            body = HEADER + "".join(f"{k},{m},{t},{vt},{v}\n" for k, t, m, v, vt in rows[i:i + 100])
+            s3.put_object(Bucket="outb", Key=f"{prefix}/DELTA_{i:016d}", Body=body)
+    out = tmp_path / "diff.csv"
+    monkeypatch.setattr(sys, "argv", ["diff", "--bucket", "outb", "--prefix-a", "output", "--prefix-b", "staging/output",
+                                      "--run-rows", "40", "--workers", "2", "--work-dir", str(tmp_path),
+                                      "--out", str(out)])
+    with pytest.raises(SystemExit) as exit_info:
+        diff.main()
+    assert exit_info.value.code == 1
+    a, b = latest(rows_a), latest(rows_b)
+    expected = {"added": sorted(b.keys() - a.keys()), "removed": sorted(a.keys() - b.keys()),
+                "changed": sorted(k for k in a.keys() & b.keys() if a[k][3] != b[k][3])}
+    with open(out, newline="") as f:
+        written = list(csv.DictReader(f))
+    assert {change: [r["key"] for r in written if r["change"] == change] for change in expected} == expected
+    unchanged = len(a.keys() & b.keys()) - len(expected["changed"])
+    assert all(expected.values())
+    assert capsys.readouterr().out.split() == [f"added={len(expected['added'])}", f"removed={len(expected['removed'])}",
+                                               f"changed={len(expected['changed'])}", f"unchanged={unchanged}"]
+    changed = next(r for r in written if r["change"] == "changed")
+    assert [changed["old_value"], changed["new_value"]] == [a[changed["key"]][3], b[changed["key"]][3]]
+    # the sort spilled to the work dir and cleaned up after itself
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith("papi-diff-")] == []
+
+def test_same_state_exits_0(tmp_path, diff, fake_data_cli, monkeypatch):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    monkeypatch.setattr(diff, "get_s3_client", lambda: s3)
+    # the same state written as different files, an older update under a delete is not served
+    s3.put_object(Bucket="outb", Key="a/DELTA_1", Body=HEADER + "k1,UPDATE,1,string,x\nk2,UPDATE,1,string,y\n")
+    s3.put_object(Bucket="outb", Key="a/DELTA_2", Body=HEADER + "k2,DELETE,2,string,\n")
+    s3.put_object(Bucket="outb", Key="b/DELTA_1", Body=HEADER + "k1,UPDATE,5,string,x\n")
+    monkeypatch.setattr(sys, "argv", ["diff", "--bucket", "outb", "--prefix-a", "a", "--prefix-b", "b"])
+    with pytest.raises(SystemExit) as exit_info:
+        diff.main()
+    assert exit_info.value.code == 0
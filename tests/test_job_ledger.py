@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Job ledger claims against the in-process stand-in, and the outcomes the loader records with run_claimed
+import threading
+import time
+
+import pytest
+
+import checkpoint
+import job_ledger
+
+JOB = job_ledger.job_id("inb", "input/a.csv", '"abc"')
+
+@pytest.fixture
+def loader(load_source):
+    return load_source("source/datacli-w-python-docker/papi-delta-filegen-s3.py", "papi_delta_filegen_s3")
+
+def test_job_id_strips_the_etag_quotes():
+    assert JOB == "inb/input/a.csv@abc"
+
+def test_only_one_of_the_concurrent_claims_wins():
+    ledger = job_ledger.MemoryLedger()
+    barrier = threading.Barrier(8)
+    results = []
+
+    def claim(owner: str) -> None:
+        barrier.wait()
+        results.append((owner, ledger.claim(JOB, owner, time.time(), {})))
+
+    threads = [threading.Thread(target=claim, args=(f"task-{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    winners = [owner for owner, claimed in results if claimed]
+    assert len(winners) == 1
+    item = ledger.get(JOB)
+    assert item["owner"] == winners[0] and item["state"] == job_ledger.RUNNING and item["attempts"] == 1
+
+def test_a_running_claim_can_be_taken_over_once_its_lease_expired():
+    ledger = job_ledger.MemoryLedger()
+    assert ledger.claim(JOB, "first", 1000.0, {})
+    assert not ledger.claim(JOB, "second", 1000.0 + job_ledger.LEASE_SECONDS, {})
+    assert ledger.claim(JOB, "second", 1000.0 + job_ledger.LEASE_SECONDS + 1, {})
+    item = ledger.get(JOB)
+    assert item["owner"] == "second" and item["attempts"] == 2
+    # the first task lost its claim and can no longer update the job
+    assert not ledger.update(JOB, "first", {"state": job_ledger.SUCCEEDED})
+
+@pytest.mark.parametrize("state, claimable", [(job_ledger.SUCCEEDED, False), (job_ledger.FAILED, True),
+                                              (job_ledger.INTERRUPTED, True)])
+def test_finished_jobs_are_claimed_again_unless_they_succeeded(state, claimable):
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB, "first")
+    assert claim.acquire()
+    claim.finish(state, error="boom")
+    assert ledger.get(JOB)["state"] == state
+    assert ledger.claim(JOB, "second", time.time(), {}) is claimable
+    if claimable:
+        assert "error" not in ledger.get(JOB)
+
+def test_heartbeat_renews_the_lease_until_the_claim_is_finished(monkeypatch):
+    monkeypatch.setattr(job_ledger, "LEASE_SECONDS", 0.3)
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB, "first")
+    assert claim.acquire()
+    first_lease = ledger.get(JOB)["lease_expires"]
+    time.sleep(0.5)
+    # past the first lease, but the heartbeat kept the claim
+    assert ledger.get(JOB)["lease_expires"] > first_lease
+    assert not ledger.claim(JOB, "second", time.time(), {})
+    claim.finish(job_ledger.INTERRUPTED)
+    lease = ledger.get(JOB)["lease_expires"]
+    time.sleep(0.3)
+    assert ledger.get(JOB)["lease_expires"] == lease
+
+def test_run_claimed_records_success(loader):
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB)
+    assert claim.acquire()
+    loader.run_claimed(claim, lambda: None)
+    assert ledger.get(JOB)["state"] == job_ledger.SUCCEEDED
+
+def test_run_claimed_records_an_exit_code_as_failed(loader):
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB)
+    assert claim.acquire()
+    with pytest.raises(SystemExit):
+        loader.run_claimed(claim, loader.exit, 1)
+    item = ledger.get(JOB)
+    assert item["state"] == job_ledger.FAILED and item["error"] == "exit code 1"
+
+def test_run_claimed_records_an_exception_as_failed(loader):
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB)
+    assert claim.acquire()
+
+    def run() -> None:
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        loader.run_claimed(claim, run)
+    item = ledger.get(JOB)
+    assert item["state"] == job_ledger.FAILED and item["error"] == "OSError: disk full"
+    assert ledger.claim(JOB, "retry", time.time(), {})
+
+def test_run_claimed_records_an_exception_after_sigterm_as_interrupted(loader, monkeypatch):
+    monkeypatch.setattr(checkpoint, "stop", threading.Event())
+    checkpoint.stop.set()
+    ledger = job_ledger.MemoryLedger()
+    claim = job_ledger.Claim(ledger, JOB)
+    assert claim.acquire()
+    with pytest.raises(checkpoint.Interrupted):
+        loader.run_claimed(claim, checkpoint.check_stop)
+    assert ledger.get(JOB)["state"] == job_ledger.INTERRUPTED
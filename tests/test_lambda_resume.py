@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# A right-sized task started by the dispatcher and restarted by the resume function after a Spot interruption
+import pytest
+
+# task size of the loader task definition
+DEFAULT_CPU, DEFAULT_MEMORY = "1024", "2048"
+BANDS = [{"max_mb": 100, "cpu": 1024, "memory": 2048, "environment": {}},
+         {"max_mb": None, "cpu": 4096, "memory": 16384, "environment": {"CONVERT_CONCURRENCY": "4"}}]
+
+class FakeEcs:
+    """
+    Records run_task calls and rejects container sizes that do not fit in the task, like RunTask
+    """
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def run_task(self, **kwargs) -> dict:
+        overrides = kwargs["overrides"]
+        cpu, memory = int(overrides.get("cpu", DEFAULT_CPU)), int(overrides.get("memory", DEFAULT_MEMORY))
+        for container in overrides["containerOverrides"]:
+            if container.get("cpu", 0) > cpu or container.get("memory", 0) > memory:
+                raise AssertionError(f"container {container['name']} is larger than the task {cpu}/{memory}")
+        self.calls.append(kwargs)
+        return {"tasks": [{"taskArn": f"arn:aws:ecs:us-west-2:123456789012:task/papi/{len(self.calls)}"}], "failures": []}
+
+@pytest.fixture
+def lambdas(load_source, monkeypatch):
+    for name, value in {"AWS_DEFAULT_REGION": "us-west-2", "CONTAINER_NAME": "loader", "CLUSTER_ARN": "cluster",
+                        "SUBNETS": "subnet-a,subnet-b", "SECURITY_GROUPS": "sg-a", "OUT_BUCKET": "outb",
+                        "OUT_KEY": "output"}.items():
+        monkeypatch.setenv(name, value)
+    dispatch = load_source("source/_lambda_dispatch/index.py", "dispatch_index")
+    resume = load_source("source/_lambda_resume/index.py", "resume_index")
+    ecs = FakeEcs()
+    dispatch.ecs = resume.ecs = ecs
+    dispatch.tuning["bands"] = BANDS
+    return dispatch, resume, ecs
+
+def s3_event(size: int) -> dict:
+    return {"id": "event-1", "time": "2026-01-01T00:00:00Z",
+            "detail": {"bucket": {"name": "inb"}, "object": {"key": "input/big.csv", "size": size}}}
+
+def stopped_task(call: dict, arn: str, with_size: bool = True) -> dict:
+    # the Task State Change event of the interrupted task, the size at the top level is the one it ran with
+    overrides = call["overrides"]
+    task = {"taskArn": arn, "taskDefinitionArn": call["taskDefinition"], "stopCode": "SpotInterruption",
+            "cpu": overrides.get("cpu", DEFAULT_CPU), "memory": overrides.get("memory", DEFAULT_MEMORY),
+            "overrides": dict(overrides)}
+    if not with_size:
+        task["overrides"].pop("cpu", None)
+        task["overrides"].pop("memory", None)
+    return {"detail": task}
+
+def environment(call: dict) -> dict:
+    return {e["name"]: e["value"] for e in call["overrides"]["containerOverrides"][0]["environment"]}
+
+@pytest.mark.parametrize("with_size", [True, False])
+def test_resumed_task_keeps_the_tuned_size(lambdas, with_size):
+    dispatch, resume, ecs = lambdas
+    assert dispatch.run_task({"task_definition": "papi-loader"}, s3_event(500 * 10 ** 6))
+    dispatched = ecs.calls[0]
+    assert dispatched["overrides"]["cpu"] == "4096" and dispatched["overrides"]["memory"] == "16384"
+    resumed = resume.lambda_handler(stopped_task(dispatched, "task/1", with_size), None)
+    assert resumed["started"]
+    call = ecs.calls[1]
+    assert call["overrides"]["cpu"] == "4096" and call["overrides"]["memory"] == "16384"
+    assert call["overrides"]["containerOverrides"][0]["memory"] == 16384
+    env = environment(call)
+    assert env["TASK_CPU"] == "4096" and env["TASK_MEMORY"] == "16384" and env["CONVERT_CONCURRENCY"] == "4"
+    assert env["RESUME_ATTEMPT"] == "1" and env["INP_KEY"] == "input/big.csv"
+    assert call["capacityProviderStrategy"] == [{"capacityProvider": "FARGATE_SPOT", "weight": 1}]
+
+def test_resumed_task_counts_the_attempts(lambdas, monkeypatch):
+    dispatch, resume, ecs = lambdas
+    monkeypatch.setattr(resume, "SPOT_ATTEMPTS", 1)
+    monkeypatch.setattr(resume, "MAX_RESUME_ATTEMPTS", 2)
+    assert dispatch.run_task({"task_definition": "papi-loader"}, s3_event(500 * 10 ** 6))
+    for attempt in (1, 2):
+        assert resume.lambda_handler(stopped_task(ecs.calls[-1], f"task/{attempt}"), None)["started"]
+        assert environment(ecs.calls[-1])["RESUME_ATTEMPT"] == str(attempt)
+    assert ecs.calls[-1]["capacityProviderStrategy"] == [{"capacityProvider": "FARGATE", "weight": 1}]
+    assert resume.lambda_handler(stopped_task(ecs.calls[-1], "task/3"), None) == {"started": None}
+    assert len(ecs.calls) == 3
+
+def test_untuned_task_resumes_with_the_task_definition_size(lambdas):
+    dispatch, resume, ecs = lambdas
+    dispatch.tuning["bands"] = []
+    assert dispatch.run_task({"task_definition": "papi-loader"}, s3_event(10))
+    assert "cpu" not in ecs.calls[0]["overrides"]
+    assert resume.lambda_handler(stopped_task(ecs.calls[0], "task/1", with_size=False), None)["started"]
+    call = ecs.calls[1]
+    assert call["overrides"]["cpu"] == DEFAULT_CPU and call["overrides"]["memory"] == DEFAULT_MEMORY
@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Manifest and index of an output prefix on the local S3 stand-in, with tasks recording at the same time, a task
+# stopped between the manifest and its index line, a conditional write lost to another task and a retried publish;
+# the expiry sweep output among the loader files
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+import expiry
+import manifest
+from local_s3 import LocalS3Client
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(manifest, "BACKOFF_SECONDS", 0.001)
+
+def description(rows: int = 1, sha256: str = "0" * 64) -> dict:
+    return {"row_count": rows, "min_logical_commit_time": 1, "max_logical_commit_time": 2, "bytes": 10,
+            "sha256": sha256}
+
+def test_concurrent_records_get_every_sequence_once(tmp_path):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    keys = [f"output/DELTA_{i:016d}" for i in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda key: manifest.record(s3, "outb", key, description(sha256=key)), keys))
+    index = manifest.read_index(s3, "outb", "output")
+    assert [entry["sequence"] for entry in index] == list(range(1, 41))
+    assert sorted(entry["key"] for entry in index) == keys
+    latest = manifest.read_manifest(s3, "outb", "output")
+    assert latest["count"] == latest["row_count"] == 40
+    assert latest["latest"]["key"] == keys[-1]
+
+class IndexWriteFailsS3(LocalS3Client):
+    """
+    Local S3 whose writes of index segments fail while fail_index is set, like a task stopped after the manifest put
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.fail_index = False
+
+    def _simulate(self, operation: str, bucket: str, key: str, nbytes: int = 0) -> None:
+        if self.fail_index and operation == "PutObject" and "/index/" in key:
+            raise self._error("InternalError", operation)
+        super()._simulate(operation, bucket, key, nbytes)
+
+def test_index_line_of_a_stopped_task_is_recovered(tmp_path):
+    s3 = IndexWriteFailsS3(str(tmp_path / "s3"))
+    manifest.record(s3, "outb", "output/DELTA_1", description(sha256="a"))
+    s3.fail_index = True
+    with pytest.raises(ClientError):
+        manifest.record(s3, "outb", "output/DELTA_2", description(sha256="b"))
+    s3.fail_index = False
+    segment, _ = manifest.read_segment(s3, "outb", manifest.segment_key("output", 0))
+    assert [entry["key"] for entry in segment] == ["output/DELTA_1"]
+    # readers fill in the line from the manifest
+    assert [entry["key"] for entry in manifest.read_index(s3, "outb", "output")] == ["output/DELTA_1", "output/DELTA_2"]
+    # the next record writes it
+    manifest.record(s3, "outb", "output/DELTA_3", description(sha256="c"))
+    segment, _ = manifest.read_segment(s3, "outb", manifest.segment_key("output", 0))
+    assert [(entry["sequence"], entry["key"]) for entry in segment] == \
+        [(1, "output/DELTA_1"), (2, "output/DELTA_2"), (3, "output/DELTA_3")]
+
+class InterleavingS3(LocalS3Client):
+    """
+    Local S3 where another task records a file right after the first read of the manifest
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.conflicts = 0
+        self.interleaved = False
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        resp = super().get_object(Bucket=Bucket, Key=Key, **kwargs)
+        if Key == manifest.manifest_key("output") and not self.interleaved:
+            self.interleaved = True
+            manifest.record(self, Bucket, "output/DELTA_2", description(sha256="other"))
+        return resp
+
+    def put_object(self, **kwargs) -> dict:
+        try:
+            return super().put_object(**kwargs)
+        except ClientError as e:
+            self.conflicts += manifest.is_conflict(e)
+            raise
+
+def test_lost_conditional_write_is_retried(tmp_path):
+    s3 = InterleavingS3(str(tmp_path / "s3"))
+    manifest.record(s3, "outb", "output/DELTA_0", description(sha256="first"))
+    s3.interleaved = False
+    result = manifest.record(s3, "outb", "output/DELTA_1", description(rows=5, sha256="mine"))
+    assert s3.conflicts == 1
+    assert result["count"] == 3 and result["row_count"] == 7
+    # the file of the other task stays the latest, it has the greater name
+    assert result["latest"]["key"] == "output/DELTA_2" and result["last"]["key"] == "output/DELTA_1"
+    assert [entry["key"] for entry in manifest.read_index(s3, "outb", "output")] == \
+        ["output/DELTA_0", "output/DELTA_2", "output/DELTA_1"]
+
+def test_a_retried_publish_is_not_counted_twice(tmp_path):
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    manifest.record(s3, "outb", "output/DELTA_2", description(rows=3, sha256="b"))
+    manifest.record(s3, "outb", "output/DELTA_1", description(rows=4, sha256="a"))
+    # the latest and the last file with the same content
+    manifest.record(s3, "outb", "output/DELTA_2", description(rows=3, sha256="b"))
+    manifest.record(s3, "outb", "output/DELTA_1", description(rows=4, sha256="a"))
+    assert manifest.read_manifest(s3, "outb", "output")["row_count"] == 7
+    assert len(manifest.read_index(s3, "outb", "output")) == 2
+    # other content is a new entry
+    result = manifest.record(s3, "outb", "output/DELTA_1", description(rows=4, sha256="c"))
+    assert result["count"] == 3 and result["row_count"] == 11
+
+def test_expiry_sweep_output_sorts_by_time_with_the_loader_output(tmp_path, load_source, fake_data_cli, monkeypatch):
+    sweep = load_source("source/datacli-w-python-docker/papi-expiry-sweep.py", "expiry_sweep")
+    monkeypatch.setattr(sweep, "work_dir", str(tmp_path))
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    now = 1_700_000_000_000_000
+    manifest.record(s3, "outb", f"output/DELTA_{now - 1:016d}", description(sha256="before"))
+    s3.put_object(Bucket="outb", Key=expiry.pending_key("output/DELTA_1"),
+                  Body=gzip.compress(f"key,expires_at,logical_commit_time\nk1,{now - 1},1\n".encode()))
+    assert sweep.sweep(s3, "outb", "output", now) == 1
+    assert manifest.read_manifest(s3, "outb", "output")["latest"]["key"] == f"output/DELTA_{now:016d}_expired.csv_DELTA"
+    # a file the loader publishes later is the latest again
+    manifest.record(s3, "outb", f"output/DELTA_{now + 1:016d}", description(sha256="after"))
+    assert manifest.read_manifest(s3, "outb", "output")["latest"]["key"] == f"output/DELTA_{now + 1:016d}"
@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Profiling off changes nothing, profiling on records the rusage of data cli and uploads the bundle to the local S3
+# stand-in
+import json
+import subprocess
+import sys
+
+import pytest
+
+import profiling
+from local_s3 import LocalS3Client
+
+# a data cli stand-in that holds 64 MB and fails
+CHILD = [sys.executable, "-c", "import sys; x = bytearray(64 << 20); x[::4096] = b'1' * len(x[::4096]); sys.exit(3)"]
+
+@pytest.fixture(autouse=True)
+def no_session(monkeypatch):
+    monkeypatch.setattr(profiling, "_session", None)
+    monkeypatch.setattr(profiling, "listeners", [])
+
+def test_profiling_off_wraps_and_records_nothing(monkeypatch):
+    monkeypatch.setattr(profiling, "ENABLED", False)
+    profiling.start()
+    assert profiling._session is None
+    assert profiling.wrap(["data_cli", "format_data"], "input/a.csv") == ["data_cli", "format_data"]
+    assert profiling.stage("download", "input/a.csv") is profiling._NULL
+    profiling.record("download", "input/a.csv", 0.0, 1.0)
+
+def test_stage_reaches_the_listeners_without_a_profile():
+    recorded = []
+    profiling.listeners.append(lambda *args: recorded.append(args))
+    with profiling.stage("upload", "input/a.csv"):
+        pass
+    assert [(stage, item) for stage, item, _, _ in recorded] == [("upload", "input/a.csv")]
+
+def test_run_child_records_the_rusage_of_the_child(tmp_path):
+    path = tmp_path / "child.json"
+    assert profiling._run_child(str(path), "input/a.csv", CHILD) == 3
+    child = json.loads(path.read_text())
+    assert child["item"] == "input/a.csv" and child["cmd"] == sys.executable and child["returncode"] == 3
+    # the usage of that child alone, not of the test process
+    assert 64 * 1024 <= child["max_rss_kb"] < 1024 * 1024
+    assert child["seconds"] > 0 and child["user_s"] + child["sys_s"] > 0 and child["minor_faults"] > 0
+
+@pytest.mark.parametrize("python_profiler", ["sample", "cprofile"])
+def test_profiled_run_uploads_the_bundle(tmp_path, monkeypatch, python_profiler):
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(profiling, "PYTHON_PROFILER", python_profiler)
+    monkeypatch.setattr(profiling, "SAMPLE_SECONDS", 0.001)
+    profiling.start()
+    with profiling.stage("convert", "input/a.csv"):
+        cmd = profiling.wrap(CHILD, "input/a.csv")
+        assert cmd[:3] == [sys.executable, profiling.__file__, "--rusage"]
+        # the exit code of data cli comes through the wrapper
+        assert subprocess.run(cmd).returncode == 3
+    s3 = LocalS3Client(str(tmp_path / "s3"))
+    profiling.finish(s3, "outb", "input/a.csv")
+    assert profiling._session is None
+    objects = {obj["Key"].rsplit("/", 1)[-1]: obj["Key"]
+               for obj in s3.list_objects_v2(Bucket="outb", Prefix=f"{profiling.PROFILE_PREFIX}/input/a.csv/")["Contents"]}
+    python_file = "stacks.folded" if python_profiler == "sample" else "profile.pstats"
+    assert set(objects) == {"timeline.json", "children.json", "summary.txt", python_file}
+
+    def read(name: str) -> str:
+        return s3.get_object(Bucket="outb", Key=objects[name])["Body"].read().decode()
+    children = json.loads(read("children.json"))
+    assert [(c["item"], c["returncode"]) for c in children] == [("input/a.csv", 3)]
+    assert children[0]["max_rss_kb"] >= 64 * 1024
+    assert [(e["stage"], e["item"]) for e in json.loads(read("timeline.json"))["events"]] == [("convert", "input/a.csv")]
+    summary = read("summary.txt")
+    assert "data cli: 1 processes" in summary and "convert" in summary
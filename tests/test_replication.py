@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Cross region replication between local S3 stand-ins, one per region
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import replication
+from local_s3 import LocalS3Client
+
+DELTAS = [f"output/DELTA_{i:016d}" for i in (1, 2, 3)]
+
+class RegionS3(LocalS3Client):
+    """
+    Local S3 of one region whose copies of the keys in fail raise, like a region that is unavailable
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.fail = set()
+        self.copied = []
+
+    def copy(self, CopySource: dict, Bucket: str, Key: str, ExtraArgs=None, Callback=None, SourceClient=None,
+             Config=None) -> None:
+        if Key in self.fail:
+            raise ClientError({"Error": {"Code": "ServiceUnavailable", "Message": "region down"}}, "CopyObject")
+        super().copy(CopySource, Bucket, Key, SourceClient=SourceClient)
+        self.copied.append(Key)
+
+@pytest.fixture
+def regions(tmp_path, monkeypatch):
+    home = LocalS3Client(str(tmp_path / "home"))
+    clients = {region: RegionS3(str(tmp_path / region)) for region in ("eu-west-1", "ap-south-1")}
+    monkeypatch.setenv("REPLICA_BUCKETS", "eu-west-1=replica-eu,ap-south-1=replica-ap")
+    monkeypatch.setattr(replication, "get_s3_client", lambda region=None: clients[region] if region else home)
+    return home, clients
+
+def publish(home, keys: list) -> list:
+    published = []
+    for key in keys:
+        home.put_object(Bucket="outb", Key=key, Body=f"delta {key}".encode())
+        home.put_object(Bucket="outb", Key=f"{key}.index.json", Body=b"{}")
+        published.extend([key, f"{key}.index.json"])
+    return published
+
+def pointer(client, bucket: str) -> str:
+    return replication.read_pointer(client, bucket, replication.pointer_key("output"))[0].get("key")
+
+def test_replica_buckets(monkeypatch):
+    monkeypatch.setenv("REPLICA_BUCKETS", " eu-west-1=replica-eu, ,ap-south-1=replica-ap")
+    assert replication.replica_buckets() == {"eu-west-1": "replica-eu", "ap-south-1": "replica-ap"}
+    monkeypatch.setenv("REPLICA_BUCKETS", "replica-eu")
+    with pytest.raises(ValueError, match="Invalid REPLICA_BUCKETS"):
+        replication.replica_buckets()
+
+def test_every_region_gets_a_copy_and_the_pointer(regions):
+    home, clients = regions
+    replication.replicate(home, "outb", publish(home, DELTAS))
+    for client, bucket in ((clients["eu-west-1"], "replica-eu"), (clients["ap-south-1"], "replica-ap")):
+        for key in DELTAS:
+            assert client.get_object(Bucket=bucket, Key=key)["Body"].read() == f"delta {key}".encode()
+            # the sidecar is copied after its DELTA file
+            assert client.copied.index(f"{key}.index.json") > client.copied.index(key)
+        assert pointer(client, bucket) == DELTAS[-1]
+        body = json.loads(client.get_object(Bucket=bucket, Key=replication.pointer_key("output"))["Body"].read())
+        assert body["source"] == "s3://outb/output/"
+
+def test_pointer_stops_before_a_file_missing_in_the_region(regions):
+    home, clients = regions
+    clients["ap-south-1"].fail.add(DELTAS[1])
+    with pytest.raises(ClientError):
+        replication.replicate(home, "outb", publish(home, DELTAS))
+    # the healthy region is not held back, the failed one only covers the files it has in order
+    assert pointer(clients["eu-west-1"], "replica-eu") == DELTAS[-1]
+    assert pointer(clients["ap-south-1"], "replica-ap") == DELTAS[0]
+    clients["ap-south-1"].copied.clear()
+    clients["ap-south-1"].fail.clear()
+    assert replication.catch_up(home, "outb", "output") == {"eu-west-1": 0, "ap-south-1": 1}
+    assert clients["ap-south-1"].copied == [DELTAS[1], f"{DELTAS[1]}.index.json"]
+    assert pointer(clients["ap-south-1"], "replica-ap") == DELTAS[-1]
+
+def test_pointer_only_moves_forward(regions):
+    home, clients = regions
+    replication.replicate(home, "outb", publish(home, DELTAS))
+    # a later file fails in one region, an earlier publish replicated again does not move its pointer back
+    later = "output/DELTA_0000000000000004"
+    clients["eu-west-1"].fail.add(later)
+    with pytest.raises(ClientError):
+        replication.replicate(home, "outb", publish(home, [later]))
+    replication.replicate(home, "outb", publish(home, DELTAS[:1]))
+    assert pointer(clients["eu-west-1"], "replica-eu") == DELTAS[-1]
+    assert pointer(clients["ap-south-1"], "replica-ap") == later
+
+def test_nothing_is_copied_without_replica_buckets(regions, monkeypatch):
+    home, clients = regions
+    monkeypatch.delenv("REPLICA_BUCKETS")
+    replication.replicate(home, "outb", publish(home, DELTAS))
+    assert not clients["eu-west-1"].copied and not clients["ap-south-1"].copied
@@ -0,0 +1,209 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Request rate control against a clock the test moves, the local S3 stand-in answering SlowDown, and a boto3 client
+# against a local endpoint; the hashed layout publishing the files of a run in name order
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from botocore.exceptions import ClientError
+
+import async_core
+import manifest
+import s3_rate
+from local_s3 import LocalS3Client
+
+CSV = "key,mutation_type,logical_commit_time,value_type,value\nk1,UPDATE,1,string,a\n"
+
+class Clock:
+    """
+    time module of s3_rate with a monotonic clock the test moves, sleeping moves it too
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(s3_rate, "time", clock)
+    return clock
+
+def test_token_bucket_holds_one_second_of_tokens(clock):
+    bucket = s3_rate.TokenBucket(10)
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == pytest.approx(0.1)
+    clock.now += 0.05
+    assert bucket.try_take() == pytest.approx(0.05)
+    clock.now += 5
+    assert [bucket.try_take() for _ in range(10)] == [0] * 10
+    assert bucket.try_take() > 0
+    # take sleeps until the next token
+    assert bucket.take() == pytest.approx(0.1)
+
+def test_prefix_limiter_halves_at_most_once_per_second(clock, monkeypatch):
+    monkeypatch.setattr(s3_rate, "START_RPS", 100)
+    monkeypatch.setattr(s3_rate, "MIN_RPS", 20)
+    limiter = s3_rate.PrefixLimiter()
+    assert limiter.throttled() and limiter.rate == 50
+    # throttled requests that were in flight together count once
+    clock.now += 0.5
+    assert not limiter.throttled() and limiter.rate == 50
+    clock.now += 0.5
+    assert limiter.throttled() and limiter.rate == 25
+    clock.now += 1
+    assert limiter.throttled() and limiter.rate == 20
+    # the tokens are dropped, the next request waits for the lower rate
+    assert limiter.try_take() == pytest.approx(1 / 20)
+
+def test_prefix_limiter_adds_a_step_per_throttle_free_second(clock, monkeypatch):
+    monkeypatch.setattr(s3_rate, "START_RPS", 100)
+    monkeypatch.setattr(s3_rate, "STEP_RPS", 10)
+    monkeypatch.setattr(s3_rate, "MAX_RPS", 200)
+    limiter = s3_rate.PrefixLimiter()
+    clock.now += 0.9
+    limiter.succeeded()
+    assert limiter.rate == 100
+    clock.now += 2.2
+    limiter.succeeded()
+    assert limiter.rate == 130
+    # the part second left over counts towards the next step
+    clock.now += 0.9
+    limiter.succeeded()
+    assert limiter.rate == 140
+    clock.now += 10
+    limiter.succeeded()
+    assert limiter.rate == 200
+    assert limiter.throttled() and limiter.rate == 100
+    clock.now += 0.5
+    limiter.succeeded()
+    # a step needs a full second without a throttle
+    assert limiter.rate == 100
+
+def put_many(s3, count: int) -> None:
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: s3.put_object(Bucket="outb", Key=f"output/file{i:03d}", Body=b"x"), range(count)))
+
+def test_local_s3_answers_slowdown_above_prefix_rps(tmp_path):
+    s3 = LocalS3Client(str(tmp_path / "s3"), prefix_rps=20)
+    with pytest.raises(ClientError, match="SlowDown"):
+        put_many(s3, 40)
+
+def test_controller_paces_requests_under_prefix_rps(tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_rate, "START_RPS", 80)
+    controller = s3_rate.RateController()
+    s3 = LocalS3Client(str(tmp_path / "s3"), prefix_rps=20, rate=controller)
+    start = time.monotonic()
+    put_many(s3, 60)
+    assert len(s3.list_objects_v2(Bucket="outb", Prefix="output/")["Contents"]) == 60
+    limiter = controller.limiter("outb/output/")
+    assert controller.throttles == s3.throttle_count > 0
+    assert controller.requests == s3.request_count >= 61
+    assert limiter.rate < 80
+    # other prefixes keep their own rate
+    assert controller.limiter("outb/other/").rate == 80
+    assert time.monotonic() - start < 30
+
+class SlowDownHandler(BaseHTTPRequestHandler):
+    """
+    S3 endpoint that answers the first throttle PutObject requests with 503 SlowDown
+    """
+
+    def do_PUT(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            throttle = server.throttle > 0
+            server.throttle -= throttle
+        if throttle:
+            body = b"<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>"
+            self.send_response(503)
+        else:
+            body = b""
+            self.send_response(200)
+            self.send_header("ETag", '"0"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+@pytest.fixture
+def endpoint():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowDownHandler)
+    server.lock, server.requests, server.throttle = threading.Lock(), 0, 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_attach_counts_every_attempt_of_a_boto3_client(endpoint, monkeypatch):
+    import boto3
+    from botocore.config import Config
+    monkeypatch.setattr(s3_rate, "START_RPS", 100)
+    # the retry backoff can take more than a second, no step is added for it
+    monkeypatch.setattr(s3_rate, "STEP_RPS", 0)
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    client = boto3.client("s3", endpoint_url=f"http://127.0.0.1:{endpoint.server_address[1]}", region_name="us-east-1",
+                          aws_access_key_id="test", aws_secret_access_key="test",
+                          config=Config(retries={"mode": "standard", "max_attempts": 3}, s3={"addressing_style": "path"}))
+    controller = s3_rate.RateController()
+    s3_rate.attach(client, controller)
+    client.put_object(Bucket="outb", Key="output/a_DELTA", Body=b"x")
+    # the retry after SlowDown took a token too, and the throttle halved the rate of the prefix
+    assert endpoint.requests == controller.requests == 2
+    assert controller.throttles == 1
+    assert controller.limiter("outb/output/").rate == 50
+
+class OrderS3(LocalS3Client):
+    """
+    Local S3 that records the writes and copies in order, the upload of a.csv_DELTA is slow so it finishes last
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.events = []
+
+    def _simulate(self, operation: str, bucket: str, key: str, nbytes: int = 0) -> None:
+        if operation == "UploadPart" and key.endswith("a.csv_DELTA"):
+            time.sleep(0.3)
+        super()._simulate(operation, bucket, key, nbytes)
+        if operation in ("PutObject", "UploadPart", "CopyObject") and key.startswith(("output/", s3_rate.STAGING_PREFIX)):
+            with self.lock:
+                self.events.append((operation, key))
+
+def test_hashed_layout_publishes_a_run_in_name_order(tmp_path, fake_data_cli, monkeypatch):
+    monkeypatch.setattr(s3_rate, "OUTPUT_LAYOUT", "hashed")
+    s3 = OrderS3(str(tmp_path / "s3"))
+    names = ["a", "b", "c", "d"]
+    for name in names:
+        s3.put_object(Bucket="inb", Key=f"input/{name}.csv", Body=CSV)
+    done = []
+    jobs = [async_core.Job("inb", f"input/{name}.csv", "outb", "output") for name in names]
+    async_core.run(jobs, s3, str(tmp_path), transfer_concurrency=4, on_done=lambda job: done.append(job.ifname))
+    assert not any(job.error for job in jobs)
+    copies = [key for operation, key in s3.events if operation == "CopyObject"]
+    expected = [key for name in names for key in (f"output/{name}.csv_DELTA", f"output/{name}.csv_DELTA.index.json")]
+    assert copies == expected
+    # nothing is published before the slow upload of the first file is done
+    first_copy = s3.events.index(("CopyObject", expected[0]))
+    assert all(operation == "CopyObject" for operation, _ in s3.events[first_copy:])
+    assert done == [f"{name}.csv" for name in names]
+    assert [entry["key"] for entry in manifest.read_index(s3, "outb", "output")] == expected[::2]
+    assert not s3.list_objects_v2(Bucket="outb", Prefix=s3_rate.STAGING_PREFIX).get("Contents")
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+# Trace ids of restarted tasks, the X-Ray documents of the spans, the freshness log line and the file exporter
+import json
+import re
+
+import pytest
+
+import profiling
+import startup
+import tracing
+
+EVENT_TIME = "2024-01-01T00:00:00Z"
+EVENT_EPOCH = 1_704_067_200
+
+@pytest.fixture(autouse=True)
+def event(monkeypatch):
+    monkeypatch.setenv("EVENT_TIME", EVENT_TIME)
+    monkeypatch.setenv("EVENT_ID", "9f1b2c3d-event")
+    monkeypatch.delenv("TRACE_ID", raising=False)
+    monkeypatch.setattr(tracing, "_tracer", None)
+    monkeypatch.setattr(profiling, "listeners", [])
+
+def test_trace_id_is_stable_across_a_resume(monkeypatch):
+    monkeypatch.setattr(startup, "PROCESS_START", EVENT_EPOCH + 20)
+    first = tracing.Tracer("inb", "input/a.csv")
+    # the task restarted after a Spot interruption
+    monkeypatch.setattr(startup, "PROCESS_START", EVENT_EPOCH + 300)
+    monkeypatch.setenv("RESUME_ATTEMPT", "1")
+    resumed = tracing.Tracer("inb", "input/a.csv")
+    assert resumed.trace_id == first.trace_id
+    assert re.fullmatch(rf"1-{EVENT_EPOCH:08x}-[0-9a-f]{{24}}", first.trace_id)
+    assert resumed.root != first.root and resumed.attributes["resume.attempt"] == "1"
+    # another event is another trace
+    monkeypatch.setenv("EVENT_ID", "other-event")
+    assert tracing.Tracer("inb", "input/a.csv").trace_id != first.trace_id
+
+def test_trace_id_without_event_id_comes_from_the_object_and_event_time(monkeypatch):
+    monkeypatch.delenv("EVENT_ID")
+    monkeypatch.setattr(startup, "PROCESS_START", EVENT_EPOCH + 20)
+    first = tracing.Tracer("inb", "input/a.csv").trace_id
+    monkeypatch.setattr(startup, "PROCESS_START", EVENT_EPOCH + 300)
+    assert tracing.Tracer("inb", "input/a.csv").trace_id == first
+    assert tracing.Tracer("inb", "input/b.csv").trace_id != first
+
+def test_xray_documents(monkeypatch):
+    monkeypatch.setattr(startup, "PROCESS_START", EVENT_EPOCH + 20)
+    monkeypatch.setenv("RESUME_ATTEMPT", "0")
+    tracer = tracing.Tracer("inb", "input/a.csv")
+    tracer.stage("convert", "input/a.csv", EVENT_EPOCH + 21, 2.5)
+    tracer.end("convert: data cli exited with 1")
+    docs = {doc["name"]: doc for doc in map(json.loads, tracing._xray_documents(tracer.spans))}
+    assert set(docs) == {"convert", tracing.SERVICE_NAME, f"{tracing.SERVICE_NAME}-s3-event"}
+    assert all(doc["trace_id"] == tracer.trace_id for doc in docs.values())
+    loader, event, stage = docs[tracing.SERVICE_NAME], docs[f"{tracing.SERVICE_NAME}-s3-event"], docs["convert"]
+    # segments for the run and the time before it, a subsegment per stage
+    assert "type" not in loader and "parent_id" not in loader and "type" not in event
+    assert stage["type"] == "subsegment" and stage["parent_id"] == loader["id"] == tracer.root
+    assert (stage["start_time"], stage["end_time"]) == (EVENT_EPOCH + 21, EVENT_EPOCH + 23.5)
+    assert (event["start_time"], event["end_time"]) == (EVENT_EPOCH, EVENT_EPOCH + 20)
+    assert loader["fault"] and loader["cause"] == {"exceptions": [{"message": "convert: data cli exited with 1"}]}
+    assert "fault" not in stage and "fault" not in event
+    # annotation keys without dots, empty values left out
+    assert loader["annotations"]["s3_key"] == "input/a.csv" and loader["annotations"]["event_id"] == "9f1b2c3d-event"
+    assert all(re.fullmatch(r"\w+", key) for key in loader["annotations"])
+    assert stage["annotations"] == {"s3_key": "input/a.csv"}
+
+def test_published_logs_the_freshness_line(monkeypatch, capsys):
+    monkeypatch.setattr(tracing.time, "time", lambda: EVENT_EPOCH + 12.3456)
+    tracing.published("outb", "output/a.csv_DELTA")
+    line = json.loads(capsys.readouterr().out.splitlines()[0])
+    assert line == {"FreshnessSeconds": 12.346, "bucket": "outb", "key": "output/a.csv_DELTA", "trace_id": ""}
+
+def test_published_without_an_event_time_logs_nothing(monkeypatch, capsys):
+    monkeypatch.delenv("EVENT_TIME")
+    tracing.published("outb", "output/a.csv_DELTA")
+    assert capsys.readouterr().out == ""
+
+def test_file_exporter_gets_the_stages_of_the_run(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(tracing, "EXPORTER", "file")
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "trace.jsonl"))
+    tracing.start("inb", "input/a.csv")
+    with profiling.stage("download", "input/a.csv"):
+        pass
+    tracing.published("outb", "output/a.csv_DELTA")
+    trace_id = json.loads(capsys.readouterr().out.splitlines()[0])["trace_id"]
+    tracing.finish()
+    assert profiling.listeners == [] and tracing._tracer is None
+    spans = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["download", "s3-event", "loader"]
+    assert {span["trace_id"] for span in spans} == {trace_id}
+    assert spans[0]["parent_id"] == spans[2]["span_id"] and spans[2]["status"] == "OK"
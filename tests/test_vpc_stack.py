@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Template
+
+from deployment.vpc_stack import vpcStack
+
+ACCOUNT, REGION = "123456789012", "us-west-2"
+# the AZ lookup of an environment stack is answered from the context instead of the account
+AZS = {f"availability-zones:account={ACCOUNT}:region={REGION}": [f"{REGION}{az}" for az in "abcdef"]}
+BASE_ENDPOINTS = {"s3", "ecr.dkr", "events", "imagebuilder", "ssm", "states"}
+LOADER_ENDPOINTS = {"ecr.api", "logs", "ecs", "sts", "dynamodb"}
+
+def synth(**context) -> Template:
+    app = cdk.App(context={**AZS, **context})
+    return Template.from_stack(vpcStack(app, "vpc", env=cdk.Environment(account=ACCOUNT, region=REGION)))
+
+def endpoint_services(template: Template) -> dict:
+    # {service suffix: endpoint type}
+    services = {}
+    for endpoint in template.find_resources("AWS::EC2::VPCEndpoint").values():
+        name = endpoint["Properties"]["ServiceName"]
+        name = name if isinstance(name, str) else "".join(p for p in name["Fn::Join"][1] if isinstance(p, str))
+        services[name.split(f"{REGION}.", 1)[-1].rsplit("com.amazonaws.", 1)[-1].lstrip(".")] = \
+            endpoint["Properties"].get("VpcEndpointType", "Gateway")
+    return services
+
+def subnet_masks(template: Template) -> list:
+    return sorted(int(s["Properties"]["CidrBlock"].split("/")[1]) for s in template.find_resources("AWS::EC2::Subnet").values())
+
+def test_standard_profile():
+    template = synth()
+    assert subnet_masks(template) == [24, 24, 24, 24]
+    template.resource_count_is("AWS::EC2::NatGateway", 1)
+    services = endpoint_services(template)
+    assert set(services) == BASE_ENDPOINTS
+    assert services["s3"] == "Gateway" and services["ecr.dkr"] == "Interface"
+
+def test_high_throughput_profile_defaults_to_3_azs():
+    template = synth(**{"vpc-profile": "high-throughput"})
+    assert subnet_masks(template) == [20, 20, 20, 24, 24, 24]
+    template.resource_count_is("AWS::EC2::NatGateway", 3)
+    services = endpoint_services(template)
+    assert set(services) == BASE_ENDPOINTS | LOADER_ENDPOINTS
+    assert services["dynamodb"] == "Gateway"
+    # Fargate tasks do not call the ECS agent and telemetry endpoints
+    assert not {"ecs-agent", "ecs-telemetry"} & set(services)
+
+@pytest.mark.parametrize("max_azs,expected", [(2, 2), (4, 4), ("5", 5), (6, 6)])
+def test_high_throughput_max_azs(max_azs, expected):
+    template = synth(**{"vpc-profile": "high-throughput", "vpc-max-azs": max_azs})
+    assert subnet_masks(template) == [20] * expected + [24] * expected
+    template.resource_count_is("AWS::EC2::NatGateway", expected)
+    azs = {s["Properties"]["AvailabilityZone"] for s in template.find_resources("AWS::EC2::Subnet").values()}
+    assert len(azs) == expected
+
+@pytest.mark.parametrize("max_azs", [1, 7, 0, -2, "three", 2.5, True])
+def test_invalid_max_azs(max_azs):
+    with pytest.raises(ValueError, match="Invalid vpc-max-azs"):
+        synth(**{"vpc-profile": "high-throughput", "vpc-max-azs": max_azs})
+
+def test_max_azs_needs_high_throughput():
+    with pytest.raises(ValueError, match="only used with vpc-profile high-throughput"):
+        synth(**{"vpc-max-azs": 3})
+
+def test_invalid_profile():
+    with pytest.raises(ValueError, match="Invalid vpc profile"):
+        synth(**{"vpc-profile": "huge"})
+
+def test_endpoints_in_private_subnets():
+    template = synth(**{"vpc-profile": "high-throughput"})
+    private = {key for key, subnet in template.find_resources("AWS::EC2::Subnet").items()
+               if subnet["Properties"]["CidrBlock"].endswith("/20")}
+    interface = template.find_resources("AWS::EC2::VPCEndpoint", {"Properties": {"VpcEndpointType": "Interface"}})
+    assert len(interface) == len(BASE_ENDPOINTS | LOADER_ENDPOINTS) - 2
+    for endpoint in interface.values():
+        assert {ref["Ref"] for ref in endpoint["Properties"]["SubnetIds"]} == private
+        assert endpoint["Properties"]["PrivateDnsEnabled"] is True
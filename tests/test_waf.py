@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# Licensed under the Apache License Version 2.0 (the "License"). You may not use this file except
+# in compliance with the License. A copy of the License is located at http://www.apache.org/licenses/
+# or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Match, Template
+
+from deployment.waf import Waf
+
+ALB_ARN = "arn:aws:elasticloadbalancing:us-west-2:123456789012:loadbalancer/app/x/1"
+
+def synth(**context) -> Template:
+    app = cdk.App(context={"alb-arn": ALB_ARN, **context})
+    return Template.from_stack(Waf(app, "waf"))
+
+def rules(template: Template) -> dict:
+    acl = next(iter(template.find_resources("AWS::WAFv2::WebACL").values()))
+    return {rule["Name"]: rule for rule in acl["Properties"]["Rules"]}
+
+def rate_statement(template: Template, name: str) -> dict:
+    return rules(template)[name]["Statement"]["RateBasedStatement"]
+
+def test_default_rate_limit_is_unchanged():
+    template = synth()
+    rule = rules(template)["LimitRequests100"]
+    assert rule["Priority"] == 1
+    assert rule["Action"] == {"Block": {}}
+    assert rule["Statement"]["RateBasedStatement"] == {"Limit": 100, "AggregateKeyType": "IP"}
+    assert set(rules(template)) == {"GeoMatch", "LimitRequests100", "ChromeUserAgent", "AWSManagedRulesCommonRuleSet",
+                                    "AWSManagedRulesAmazonIpReputationList", "AWSManagedRulesKnownBadInputsRuleSet",
+                                    "AWSManagedRulesSQLiRuleSet", "AWSManagedRulesLinuxRuleSet", "AWSManagedRulesUnixRuleSet"}
+    template.resource_count_is("AWS::WAFv2::IPSet", 0)
+
+def test_window_and_count_action():
+    template = synth(**{"waf-rate-limits": [{"name": "Observe", "limit": 500, "window": 60, "action": "count"}]})
+    rule = rules(template)["Observe"]
+    assert rule["Action"] == {"Count": {}}
+    assert rule["Statement"]["RateBasedStatement"]["EvaluationWindowSec"] == 60
+
+def test_forwarded_ip_aggregate():
+    template = synth(**{"waf-rate-limits": [{"name": "PerClient", "limit": 1000, "aggregate": "forwarded-ip",
+                                             "forwarded-ip-header": "X-Client-IP"}]})
+    statement = rate_statement(template, "PerClient")
+    assert statement["AggregateKeyType"] == "FORWARDED_IP"
+    assert statement["ForwardedIPConfig"] == {"HeaderName": "X-Client-IP", "FallbackBehavior": "NO_MATCH"}
+
+def test_constant_aggregate_scoped_to_paths():
+    template = synth(**{"waf-rate-limits": [{"name": "LookupTotal", "limit": 100000, "aggregate": "constant",
+                                             "paths": ["/v1/getvalues", "/v2/getvalues"]}]})
+    statement = rate_statement(template, "LookupTotal")
+    assert statement["AggregateKeyType"] == "CONSTANT"
+    paths = statement["ScopeDownStatement"]["OrStatement"]["Statements"]
+    assert [p["ByteMatchStatement"]["SearchString"] for p in paths] == ["/v1/getvalues", "/v2/getvalues"]
+
+def test_custom_keys():
+    template = synth(**{"waf-rate-limits": [{"name": "PerCaller", "limit": 20000, "window": 60,
+                                             "aggregate": ["header:x-caller-id", "uri-path", "query-arg:k",
+                                                           "http-method", "ip"]}]})
+    statement = rate_statement(template, "PerCaller")
+    assert statement["AggregateKeyType"] == "CUSTOM_KEYS"
+    assert [list(k) for k in statement["CustomKeys"]] == [["Header"], ["UriPath"], ["QueryArgument"], ["HTTPMethod"], ["IP"]]
+    assert statement["CustomKeys"][0]["Header"]["Name"] == "x-caller-id"
+
+def test_allow_list_is_exempt_unless_opted_out():
+    template = synth(**{"waf-rate-limits": [{"name": "Exempt", "limit": 2000},
+                                            {"name": "Everyone", "limit": 5000, "exempt-allow-list": False}],
+                        "waf-rate-limit-allow-list": {"ipv4": ["203.0.113.0/24"], "ipv6": ["2001:db8::/32"],
+                                                      "forwarded-ip-header": "X-Forwarded-For"}})
+    template.resource_count_is("AWS::WAFv2::IPSet", 2)
+    template.has_resource_properties("AWS::WAFv2::IPSet", {"Addresses": ["203.0.113.0/24"], "IPAddressVersion": "IPV4"})
+    trusted = rate_statement(template, "Exempt")["ScopeDownStatement"]["NotStatement"]["Statement"]["OrStatement"]
+    assert len(trusted["Statements"]) == 2
+    assert trusted["Statements"][0]["IPSetReferenceStatement"]["IPSetForwardedIPConfig"]["HeaderName"] == "X-Forwarded-For"
+    assert "ScopeDownStatement" not in rate_statement(template, "Everyone")
+    assert [rules(template)[n]["Priority"] for n in ("Exempt", "Everyone")] == [1, 2]
+
+def test_paths_and_allow_list_combine():
+    template = synth(**{"waf-rate-limits": [{"name": "Lookups", "limit": 300, "paths": ["/v1/getvalues"]}],
+                        "waf-rate-limit-allow-list": {"ipv4": ["203.0.113.0/24"]}})
+    statements = rate_statement(template, "Lookups")["ScopeDownStatement"]["AndStatement"]["Statements"]
+    assert "ByteMatchStatement" in statements[0] and "NotStatement" in statements[1]
+    template.has_resource_properties("AWS::WAFv2::WebACL", {"Rules": Match.array_with([Match.object_like({"Name": "GeoMatch"})])})
+
+@pytest.mark.parametrize("limit", [9, 2_000_001, "100", 100.5, True, None])
+def test_invalid_limit(limit):
+    with pytest.raises(ValueError, match="Invalid limit"):
+        synth(**{"waf-rate-limits": [{"name": "Bad", "limit": limit}]})
+
+@pytest.mark.parametrize("rule,message", [
+    ({"name": "Bad", "limit": 100, "window": 30}, "Invalid window"),
+    ({"name": "Bad", "limit": 100, "action": "allow"}, "Invalid action"),
+    ({"name": "Bad", "limit": 100, "aggregate": "cookie"}, "Invalid aggregate"),
+    ({"name": "Bad", "limit": 100, "aggregate": ["cookie:x"]}, "Invalid rate limit aggregation key"),
+    ({"name": "Bad", "limit": 100, "aggregate": "constant"}, "needs paths"),
+])
+def test_invalid_rules(rule, message):
+    with pytest.raises(ValueError, match=message):
+        synth(**{"waf-rate-limits": [rule]})
+
+def test_too_many_rules():
+    with pytest.raises(ValueError, match="At most"):
+        synth(**{"waf-rate-limits": [{"name": f"R{i}", "limit": 100} for i in range(10)]})
+
+def test_limit_bounds_are_accepted():
+    template = synth(**{"waf-rate-limits": [{"name": "Low", "limit": 10}, {"name": "High", "limit": 2_000_000}]})
+    assert rate_statement(template, "Low")["Limit"] == 10
+    assert rate_statement(template, "High")["Limit"] == 2_000_000